@@ -60,6 +60,7 @@ public:
     gen_tornado_ = false;
     gen_twisted_ = false;
     gen_dynamic_ = false;
+    gen_fused_messages_ = false;
     coding_ = "";
     gen_dynbaseclass_ = "";
     gen_dynbaseclass_exc_ = "";
@@ -111,6 +112,8 @@ public:
         gen_tornado_ = true;
       } else if( iter->first.compare("coding") == 0) {
         coding_ = iter->second;
+      } else if( iter->first.compare("fused_messages") == 0) {
+        gen_fused_messages_ = true;
       } else {
         throw "unknown option py:" + iter->first;
       }
@@ -120,6 +123,10 @@ public:
       throw "at most one of 'twisted' and 'tornado' are allowed";
     }
 
+    if (gen_fused_messages_ && (gen_twisted_ || gen_tornado_)) {
+      throw "fused_messages is not supported with 'twisted' or 'tornado'";
+    }
+
     copy_options_ = option_string;
 
     if (gen_twisted_) {
@@ -298,6 +305,12 @@ private:
    */
   bool gen_tornado_;
 
+  /**
+   * True if clients and processors should read and write whole messages
+   * through TProtocolBase.readMessage/writeMessage.
+   */
+  bool gen_fused_messages_;
+
   /**
    * True if strings should be encoded using utf-8.
    */
@@ -777,19 +790,21 @@ void t_py_generator::generate_py_struct_definition(ofstream& out,
         << indent() << indent_str() << "raise TypeError(\"can't modify immutable instance\")" << endl
         << endl;
     out << indent() << "def __delattr__(self, *args):" << endl
-        << indent() << indent_str() << "raise TypeError(\"can't modify immutable instance\")" << endl
-        << endl;
+        << indent() << indent_str() << "raise TypeError(\"can't modify immutable instance\")" << endl;
 
-    // Hash all of the members in order, and also hash in the class
-    // to avoid collisions for stuff like single-field structures.
-    out << indent() << "def __hash__(self):" << endl
-        << indent() << indent_str() << "return hash(self.__class__) ^ hash((";
+    // TFrozenBase hashes the members itself, and keeps the result.
+    if (!gen_dynamic_ || gen_dynbaseclass_frozen_ != "TFrozenBase") {
+      // Hash all of the members in order, and also hash in the class
+      // to avoid collisions for stuff like single-field structures.
+      out << endl << indent() << "def __hash__(self):" << endl
+          << indent() << indent_str() << "return hash(self.__class__) ^ hash((";
 
-    for (m_iter = members.begin(); m_iter != members.end(); ++m_iter) {
-      out << "self." << (*m_iter)->get_name() << ", ";
-    }
+      for (m_iter = members.begin(); m_iter != members.end(); ++m_iter) {
+        out << "self." << (*m_iter)->get_name() << ", ";
+      }
 
-    out << "))" << endl;
+      out << "))" << endl;
+    }
   }
 
   if (!gen_dynamic_) {
@@ -1371,7 +1386,9 @@ void t_py_generator::generate_service_client(t_service* tservice) {
     std::string messageType = (*f_iter)->is_oneway() ? "TMessageType.ONEWAY" : "TMessageType.CALL";
 
     // Serialize the request header
-    if (gen_twisted_ || gen_tornado_) {
+    if (gen_fused_messages_) {
+      // the whole message is written at once below
+    } else if (gen_twisted_ || gen_tornado_) {
       f_service_ << indent() << "oprot = self._oprot_factory.getProtocol(self._transport)" << endl
                  << indent() << "oprot.writeMessageBegin('" << (*f_iter)->get_name() << "', "
                  << messageType << ", self._seqid)" << endl;
@@ -1388,7 +1405,11 @@ void t_py_generator::generate_service_client(t_service* tservice) {
     }
 
     // Write to the stream
-    if (gen_twisted_ || gen_tornado_) {
+    if (gen_fused_messages_) {
+      f_service_ << indent() << "self._oprot.writeMessage('" << (*f_iter)->get_name() << "', "
+                 << messageType << ", self._seqid, args)" << endl << indent()
+                 << "self._oprot.trans.flush()" << endl;
+    } else if (gen_twisted_ || gen_tornado_) {
       f_service_ << indent() << "args.write(oprot)" << endl << indent() << "oprot.writeMessageEnd()"
                  << endl << indent() << "oprot.trans.flush()" << endl;
     } else {
@@ -1420,15 +1441,29 @@ void t_py_generator::generate_service_client(t_service* tservice) {
       if (gen_twisted_) {
         f_service_ << indent() << "d = self._reqs.pop(rseqid)" << endl;
       } else if (gen_tornado_) {
+      } else if (gen_fused_messages_) {
+        f_service_ << indent() << "(fname, mtype, rseqid, result) = self._iprot.readMessage({'"
+                   << (*f_iter)->get_name() << "': " << resultname << "})" << endl;
       } else {
         f_service_ << indent() << "iprot = self._iprot" << endl << indent()
                    << "(fname, mtype, rseqid) = iprot.readMessageBegin()" << endl;
       }
 
-      f_service_ << indent() << "if mtype == TMessageType.EXCEPTION:" << endl
-                 << indent() << indent_str() << "x = TApplicationException()" << endl;
+      if (gen_fused_messages_) {
+        f_service_ << indent() << "if mtype == TMessageType.EXCEPTION:" << endl
+                   << indent() << indent_str() << "raise result" << endl
+                   << indent() << "if result is None:" << endl
+                   << indent() << indent_str()
+                   << "raise TApplicationException(TApplicationException.WRONG_METHOD_NAME, \""
+                   << (*f_iter)->get_name() << " failed: unexpected reply %s\" % fname)" << endl;
+      } else {
+        f_service_ << indent() << "if mtype == TMessageType.EXCEPTION:" << endl
+                   << indent() << indent_str() << "x = TApplicationException()" << endl;
+      }
 
-      if (gen_twisted_) {
+      if (gen_fused_messages_) {
+        // the result was read along with the message
+      } else if (gen_twisted_) {
         f_service_ << indent() << indent_str() << "x.read(iprot)" << endl << indent()
                    << indent_str() << "iprot.readMessageEnd()" << endl << indent() << indent_str() << "return d.errback(x)"
                    << endl << indent() << "result = " << resultname << "()" << endl << indent()
@@ -1738,6 +1773,9 @@ void t_py_generator::generate_service_server(t_service* tservice) {
     }
 
     f_service_ << indent() << "self._processMap = {}" << endl;
+    if (gen_fused_messages_) {
+      f_service_ << indent() << "self._argsMap = {}" << endl;
+    }
   } else {
     if (gen_twisted_) {
       f_service_ << indent() << extends << ".Processor.__init__(self, Iface(handler))" << endl;
@@ -1748,6 +1786,10 @@ void t_py_generator::generate_service_server(t_service* tservice) {
   for (f_iter = functions.begin(); f_iter != functions.end(); ++f_iter) {
     f_service_ << indent() << "self._processMap[\"" << (*f_iter)->get_name()
                << "\"] = Processor.process_" << (*f_iter)->get_name() << endl;
+    if (gen_fused_messages_) {
+      f_service_ << indent() << "self._argsMap[\"" << (*f_iter)->get_name() << "\"] = "
+                 << (*f_iter)->get_name() << "_args" << endl;
+    }
   }
   indent_down();
   f_service_ << endl;
@@ -1756,10 +1798,43 @@ void t_py_generator::generate_service_server(t_service* tservice) {
   f_service_ << indent() << "def process(self, iprot, oprot):" << endl;
   indent_up();
 
-  f_service_ << indent() << "(name, type, seqid) = iprot.readMessageBegin()" << endl;
+  if (gen_fused_messages_) {
+    // the args of known functions are read along with the message
+    f_service_ << indent() << "(name, type, seqid, args) = iprot.readMessage(self._argsMap)"
+               << endl;
+  } else {
+    f_service_ << indent() << "(name, type, seqid) = iprot.readMessageBegin()" << endl;
+  }
 
   // TODO(mcslee): validate message
 
+  if (gen_fused_messages_) {
+    f_service_ << indent() << "if args is None:" << endl;
+    indent_up();
+    f_service_ << indent()
+               << "x = TApplicationException(TApplicationException.UNKNOWN_METHOD, 'Unknown "
+                  "function %s' % (name))"
+               << endl
+               << indent() << "oprot.writeMessage(name, TMessageType.EXCEPTION, seqid, x)"
+               << endl
+               << indent() << "oprot.trans.flush()" << endl
+               << indent() << "return" << endl;
+    indent_down();
+    f_service_ << indent() << "else:" << endl
+               << indent() << indent_str()
+               << "self._processMap[name](self, seqid, iprot, oprot, args)" << endl
+               << indent() << "return True" << endl;
+    indent_down();
+
+    for (f_iter = functions.begin(); f_iter != functions.end(); ++f_iter) {
+      f_service_ << endl;
+      generate_process_function(tservice, *f_iter);
+    }
+
+    indent_down();
+    return;
+  }
+
   // HOT: dictionary function lookup
   f_service_ << indent() << "if name not in self._processMap:" << endl;
   indent_up();
@@ -1816,6 +1891,9 @@ void t_py_generator::generate_process_function(t_service* tservice, t_function*
   if (gen_tornado_) {
     f_service_ << indent() << "@gen.coroutine" << endl << indent() << "def process_"
                << tfunction->get_name() << "(self, seqid, iprot, oprot):" << endl;
+  } else if (gen_fused_messages_) {
+    f_service_ << indent() << "def process_" << tfunction->get_name()
+               << "(self, seqid, iprot, oprot, args):" << endl;
   } else {
     f_service_ << indent() << "def process_" << tfunction->get_name()
                << "(self, seqid, iprot, oprot):" << endl;
@@ -1826,8 +1904,10 @@ void t_py_generator::generate_process_function(t_service* tservice, t_function*
   string argsname = tfunction->get_name() + "_args";
   string resultname = tfunction->get_name() + "_result";
 
-  f_service_ << indent() << "args = " << argsname << "()" << endl << indent() << "args.read(iprot)"
-             << endl << indent() << "iprot.readMessageEnd()" << endl;
+  if (!gen_fused_messages_) {
+    f_service_ << indent() << "args = " << argsname << "()" << endl << indent()
+               << "args.read(iprot)" << endl << indent() << "iprot.readMessageEnd()" << endl;
+  }
 
   t_struct* xs = tfunction->get_xceptions();
   const std::vector<t_field*>& xceptions = xs->get_members();
@@ -2028,12 +2108,17 @@ void t_py_generator::generate_process_function(t_service* tservice, t_function*
                  << indent() << indent_str() << "logging.exception(ex)" << endl
                  << indent()
                  << indent_str() << "result = TApplicationException(TApplicationException.INTERNAL_ERROR, "
-                    "'Internal error')" << endl
-                 << indent() << "oprot.writeMessageBegin(\"" << tfunction->get_name()
-                 << "\", msg_type, seqid)" << endl
-                 << indent() << "result.write(oprot)" << endl
-                 << indent() << "oprot.writeMessageEnd()" << endl
-                 << indent() << "oprot.trans.flush()" << endl;
+                    "'Internal error')" << endl;
+      if (gen_fused_messages_) {
+        f_service_ << indent() << "oprot.writeMessage(\"" << tfunction->get_name()
+                   << "\", msg_type, seqid, result)" << endl;
+      } else {
+        f_service_ << indent() << "oprot.writeMessageBegin(\"" << tfunction->get_name()
+                   << "\", msg_type, seqid)" << endl
+                   << indent() << "result.write(oprot)" << endl
+                   << indent() << "oprot.writeMessageEnd()" << endl;
+      }
+      f_service_ << indent() << "oprot.trans.flush()" << endl;
     } else {
       f_service_ << indent() << "except:" << endl
                  << indent() << indent_str() << "pass" << endl;
@@ -2636,6 +2721,8 @@ THRIFT_REGISTER_GENERATOR(
     "    tornado:         Generate code for use with Tornado.\n"
     "    no_utf8strings:  Do not Encode/decode strings using utf8 in the generated code. Basically no effect for Python 3.\n"
     "    coding=CODING:   Add file encoding declare in generated file.\n"
+    "    fused_messages:  Read and write whole RPC messages in one call (C-accelerated when the\n"
+    "                     protocol supports it).\n"
     "    slots:           Generate code using slots for instance members.\n"
     "    dynamic:         Generate dynamic code, less code generated but slower.\n"
     "    dynbase=CLS      Derive generated classes from class CLS instead of TBase.\n"
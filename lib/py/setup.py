@@ -69,6 +69,8 @@ def run_setup(with_binary):
                               'src/ext/types.cpp',
                               'src/ext/binary.cpp',
                               'src/ext/compact.cpp',
+                              'src/ext/json.cpp',
+                              'src/ext/primitive.cpp',
                           ],
                           include_dirs=include_dirs,
                           )
@@ -0,0 +1,233 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Encoding and decoding large batches of structs in a process pool.
+
+A batch is cut into shards of chunk_size structs, which the worker
+processes encode or decode with TSerialization's serialize_many() and
+deserialize_many().  Results are put back together in input order.
+
+Encoded bytes go between processes through blocks of shared memory where
+multiprocessing.shared_memory is available, and through the pool's pipes
+otherwise.  Decoded structs are sent back as rows of field values, in
+thrift_spec order, rather than pickled one object at a time, and rebuilt
+from them by field name.
+"""
+
+import itertools
+import multiprocessing
+from array import array
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    resource_tracker = shared_memory = None
+
+from .TRecordFile import TRecordReader
+from .TSerialization import deserialize_many, serialize_many
+from .protocol.TBinaryProtocol import TBinaryProtocolFactory
+
+# State of a worker process: the protocol factory it was started with and
+# the record file reader of the current read_records() call.
+_factory = None
+_reader = None
+
+
+def _init_worker(protocol_factory):
+    global _factory
+    _factory = protocol_factory
+
+
+def _field_names(cls):
+    return [spec[2] for spec in cls.thrift_spec if spec is not None]
+
+
+def _pack(cls, objs):
+    names = _field_names(cls)
+    return [tuple([getattr(obj, name) for name in names]) for obj in objs]
+
+
+def _share(bufs):
+    """Copies bufs into a new block of shared memory, returning its name and
+    the buffer lengths."""
+    lengths = array('q', [len(buf) for buf in bufs])
+    data = b''.join(bufs)
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return (shm.name, lengths)
+
+
+def _unshare(shared, offset=0, unlink=True):
+    """Returns copies of the buffers of a block made by _share()."""
+    (name, lengths) = shared
+    shm = shared_memory.SharedMemory(name)
+    try:
+        data = shm.buf
+        bufs = []
+        for length in lengths:
+            bufs.append(bytes(data[offset:offset + length]))
+            offset += length
+        del data
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return bufs
+
+
+def _encode(objs):
+    bufs = serialize_many(objs, _factory)
+    if shared_memory is None:
+        return bufs
+    return _share(bufs)
+
+
+def _decode(task):
+    (cls, bufs) = task
+    return _pack(cls, deserialize_many(cls, bufs, _factory))
+
+
+def _decode_shared(task):
+    (cls, name, offset, lengths) = task
+    bufs = _unshare((name, lengths), offset, unlink=False)
+    return _pack(cls, deserialize_many(cls, bufs, _factory))
+
+
+def _decode_records(task):
+    global _reader
+    (key, path, cls, verify, start, stop) = task
+    if _reader is None or _reader[0] != key:
+        if _reader is not None:
+            _reader[1].close()
+        _reader = (key, TRecordReader(path, cls, _factory, verify))
+    reader = _reader[1]
+    return _pack(cls, [reader.decode(reader.record(n)) for n in range(start, stop)])
+
+
+class TParallelCodec(object):
+    """Encodes and decodes batches of structs with protocol_factory in a
+    pool of processes worker processes, chunk_size structs at a time.
+
+    processes defaults to the number of CPUs.  Each shard has a fixed size
+    and results are returned in input order, so output does not depend on
+    the number of processes or on scheduling.  Structs are sent to and from
+    the workers by pickling, so their classes must be importable by name;
+    protocol factories with binary_views are not supported.
+    """
+
+    def __init__(self, protocol_factory=TBinaryProtocolFactory(), processes=None,
+                 chunk_size=1000):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive')
+        if getattr(protocol_factory, 'binary_views', False):
+            raise ValueError('binary_views cannot be sent between processes')
+        self.protocol_factory = protocol_factory
+        self.chunk_size = chunk_size
+        self._calls = itertools.count()
+        if resource_tracker is not None:
+            # Workers register the blocks they create with the tracker of
+            # the parent, which unlinks them.
+            resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(processes, _init_worker, (protocol_factory,))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _chunks(self, seq):
+        size = self.chunk_size
+        return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+    def serialize_many(self, thrift_objects):
+        """Encodes each of thrift_objects, returning a list of their bytes."""
+        result = []
+        error = None
+        results = self._pool.imap(_encode, self._chunks(list(thrift_objects)))
+        while True:
+            # Keep going after an error so that every block gets unlinked.
+            try:
+                encoded = next(results)
+                if shared_memory is None:
+                    result.extend(encoded)
+                elif error is None:
+                    result.extend(_unshare(encoded))
+                else:
+                    _unshare(encoded)
+            except StopIteration:
+                break
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return result
+
+    def deserialize_many(self, cls, bufs):
+        """Decodes each of bufs into a new instance of cls, returning the list
+        of them."""
+        bufs = list(bufs)
+        chunks = self._chunks(bufs)
+        if shared_memory is None:
+            return self._decode(cls, _decode, [(cls, chunk) for chunk in chunks])
+        (name, lengths) = _share(bufs)
+        try:
+            tasks = []
+            offset = 0
+            for (i, chunk) in enumerate(chunks):
+                start = i * self.chunk_size
+                chunk_lengths = lengths[start:start + len(chunk)]
+                tasks.append((cls, name, offset, chunk_lengths))
+                offset += sum(chunk_lengths)
+            return self._decode(cls, _decode_shared, tasks)
+        finally:
+            shm = shared_memory.SharedMemory(name)
+            shm.close()
+            shm.unlink()
+
+    def read_records(self, path, cls, verify=True):
+        """Decodes every record of the record file at path into an instance of
+        cls, returning the list of them.
+
+        Workers open the file themselves and decode records by number, which
+        is cheapest when the file has an index.
+        """
+        with TRecordReader(path, cls, self.protocol_factory, verify) as reader:
+            count = len(reader)
+        key = next(self._calls)
+        size = self.chunk_size
+        tasks = [(key, path, cls, verify, start, min(start + size, count))
+                 for start in range(0, count, size)]
+        return self._decode(cls, _decode_records, tasks)
+
+    def _decode(self, cls, func, tasks):
+        # Constructors take their arguments in declaration order, which
+        # needn't be the thrift_spec order of the rows.
+        names = _field_names(cls)
+        result = []
+        for rows in self._pool.imap(func, tasks):
+            result.extend([cls(**dict(zip(names, row))) for row in rows])
+        return result
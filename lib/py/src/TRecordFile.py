@@ -0,0 +1,341 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Files of length-delimited Thrift records.
+
+A record file starts with a header: the magic ``TREC``, a version byte, a
+flags byte and a big-endian u32 block size.  Each record is an encoded
+struct prefixed with its length, either as a big-endian i32 like
+TFramedTransport frames or, with the VARINT_LENGTHS flag, as a varint like
+the compact protocol's.  With the CHECKSUMS flag, records are grouped in
+blocks of up to block size records, each written as a u32 record count,
+the records and the CRC-32 of the records.
+
+An optional sidecar index, the file name with ``.idx`` appended, holds the
+offset of every record's length prefix as a little-endian u64, for O(1)
+access to a record by number without scanning the file.  The offsets follow
+a header of the magic ``TRIX``, then the record count and the size of the
+record file as little-endian u64s, written once the record file is complete.
+An index whose header does not match its record file is ignored.
+"""
+
+import mmap
+import os
+import zlib
+from struct import pack, unpack_from
+
+import six
+
+from .Thrift import TType
+from .protocol.TBase import TFrozenBase
+from .protocol.TBinaryProtocol import TBinaryProtocolFactory
+from .protocol.TCompactProtocol import writeVarint
+from .protocol.TProtocol import TProtocolException
+from .transport.TTransport import TMemoryBuffer, TTransportException
+
+MAGIC = b'TREC'
+VERSION = 1
+
+VARINT_LENGTHS = 0x01
+CHECKSUMS = 0x02
+
+_HEADER = '!4sBBI'
+_HEADER_SIZE = 10
+_INDEX_SUFFIX = '.idx'
+_INDEX_MAGIC = b'TRIX'
+_INDEX_HEADER = '<4sQQ'
+_INDEX_HEADER_SIZE = 20
+
+
+class TRecordWriter(object):
+    """Appends records to a new record file.
+
+    Objects are encoded with protocol_factory.  With block_size, records
+    are checksummed every block_size records, which are buffered until
+    their block is complete.  With index, the sidecar offset index is
+    written along with the file, otherwise an existing one is removed.
+    """
+
+    def __init__(self, path, protocol_factory=TBinaryProtocolFactory(),
+                 varint_lengths=False, block_size=None, index=False):
+        self.protocol_factory = protocol_factory
+        self.varint_lengths = varint_lengths
+        self.block_size = block_size or 0
+        flags = (VARINT_LENGTHS if varint_lengths else 0) | (CHECKSUMS if block_size else 0)
+        self._file = open(path, 'wb')
+        self._file.write(pack(_HEADER, MAGIC, VERSION, flags, self.block_size))
+        index_path = path + _INDEX_SUFFIX
+        if index:
+            self._index = open(index_path, 'wb')
+            # filled in by close, until then the index matches no file
+            self._index.write(pack(_INDEX_HEADER, _INDEX_MAGIC, 0, 0))
+        else:
+            self._index = None
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        self._offset = _HEADER_SIZE
+        self._block = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def write(self, obj):
+        """Encodes obj and appends it as a record."""
+        trans = TMemoryBuffer()
+        obj.write(self.protocol_factory.getProtocol(trans))
+        self.write_encoded(trans.getvalue())
+
+    def write_encoded(self, buf):
+        """Appends buf, an already encoded struct, as a record."""
+        if self.block_size and not self._block:
+            # room for the record count of the block
+            self._offset += 4
+        if self._index is not None:
+            self._index.write(pack('<Q', self._offset))
+        if self.varint_lengths:
+            prefix = TMemoryBuffer()
+            writeVarint(prefix, len(buf))
+            prefix = prefix.getvalue()
+        else:
+            prefix = pack('!i', len(buf))
+        self._offset += len(prefix) + len(buf)
+        self._count += 1
+        if self.block_size:
+            self._block.append(prefix)
+            self._block.append(buf)
+            if len(self._block) == 2 * self.block_size:
+                self._write_block()
+        else:
+            self._file.write(prefix)
+            self._file.write(buf)
+
+    def _write_block(self):
+        data = b''.join(self._block)
+        self._file.write(pack('!I', len(self._block) // 2))
+        self._file.write(data)
+        self._file.write(pack('!I', zlib.crc32(data) & 0xffffffff))
+        self._offset += 4
+        self._block = []
+
+    def close(self):
+        if self._block:
+            self._write_block()
+        self._file.close()
+        if self._index is not None:
+            self._index.seek(0)
+            self._index.write(pack(_INDEX_HEADER, _INDEX_MAGIC, self._count, self._offset))
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TRecordReader(object):
+    """Reads the records of a record file through a read-only mmap.
+
+    Records are decoded into instances of cls with protocol_factory.  The
+    accelerated protocols decode straight from the mapping, and records()
+    and record() return memoryviews of it, so records are not copied.
+    Those views must be released before the reader is closed.
+
+    With verify, block checksums are checked as records are iterated and
+    before a record of a block is first accessed by number.  Access by
+    number uses the sidecar index when there is one matching the file, or
+    offsets found by scanning the file once otherwise.
+    """
+
+    def __init__(self, path, cls, protocol_factory=TBinaryProtocolFactory(), verify=True):
+        self.cls = cls
+        self.protocol_factory = protocol_factory
+        self.verify = verify
+        self._index = None
+        self._offsets = None
+        self._verified = set()
+        # checked before mapping, since an empty file cannot be mapped at all
+        if os.path.getsize(path) < _HEADER_SIZE:
+            raise TTransportException(TTransportException.END_OF_FILE, 'truncated header')
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._map)
+        try:
+            (magic, version, flags, block_size) = unpack_from(_HEADER, self._map)
+            if magic != MAGIC or version != VERSION:
+                raise TProtocolException(TProtocolException.BAD_VERSION, 'not a record file')
+        except Exception:
+            self.close()
+            raise
+        self.varint_lengths = bool(flags & VARINT_LENGTHS)
+        self.block_size = block_size if flags & CHECKSUMS else 0
+        self._index = self._open_index(path + _INDEX_SUFFIX)
+        self._prot = protocol_factory.getProtocol(TMemoryBuffer())
+
+    def _open_index(self, index_path):
+        """Maps the sidecar index, or returns None when there is none or it
+        was not written for this file."""
+        if not os.path.exists(index_path) or os.path.getsize(index_path) < _INDEX_HEADER_SIZE:
+            return None
+        with open(index_path, 'rb') as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, count, size) = unpack_from(_INDEX_HEADER, index)
+        if (magic != _INDEX_MAGIC or size != len(self._map) or
+                len(index) != _INDEX_HEADER_SIZE + 8 * count):
+            index.close()
+            return None
+        return index
+
+    def close(self):
+        self._data.release()
+        self._map.close()
+        if self._index is not None:
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def decode(self, buf):
+        """Decodes an encoded record into an instance of cls."""
+        cls = self.cls
+        if self._prot._fast_decode_value is not None:
+            return self._prot._fast_decode_value(buf, TType.STRUCT, (cls, cls.thrift_spec))
+        prot = self.protocol_factory.getProtocol(TMemoryBuffer(buf))
+        if issubclass(cls, TFrozenBase):
+            return cls.read(prot)
+        obj = cls()
+        obj.read(prot)
+        return obj
+
+    def records(self):
+        """Iterates over memoryviews of the encoded records."""
+        data = self._data
+        for (_, start, end) in self._spans():
+            yield data[start:end]
+
+    def __iter__(self):
+        decode = self.decode
+        for buf in self.records():
+            yield decode(buf)
+
+    def __len__(self):
+        if self._index is not None:
+            return (len(self._index) - _INDEX_HEADER_SIZE) // 8
+        return len(self._scan_offsets())
+
+    def record(self, n):
+        """Returns a memoryview of the encoded record number n."""
+        size = len(self)
+        if n < 0:
+            n += size
+        if not 0 <= n < size:
+            raise IndexError('record number out of range')
+        if self.verify and self.block_size:
+            self._verify_block(n // self.block_size, size)
+        (start, end) = self._record_at(self._offset(n))
+        return self._data[start:end]
+
+    def __getitem__(self, n):
+        return self.decode(self.record(n))
+
+    def _offset(self, n):
+        if self._index is not None:
+            return unpack_from('<Q', self._index, _INDEX_HEADER_SIZE + 8 * n)[0]
+        return self._scan_offsets()[n]
+
+    def _scan_offsets(self):
+        if self._offsets is None:
+            self._offsets = [pos for (pos, _, _) in self._spans()]
+        return self._offsets
+
+    def _record_at(self, pos):
+        """Returns the (start, end) offsets of the record whose length is
+        prefixed at pos."""
+        data = self._map
+        if self.varint_lengths:
+            size = shift = 0
+            while True:
+                if pos >= len(data):
+                    raise TTransportException(TTransportException.END_OF_FILE,
+                                              'truncated record length')
+                byte = six.indexbytes(data, pos)
+                pos += 1
+                size |= (byte & 0x7f) << shift
+                if not byte & 0x80:
+                    break
+                shift += 7
+        else:
+            if pos + 4 > len(data):
+                raise TTransportException(TTransportException.END_OF_FILE,
+                                          'truncated record length')
+            (size,) = unpack_from('!i', data, pos)
+            pos += 4
+            if size < 0:
+                raise TProtocolException(TProtocolException.NEGATIVE_SIZE,
+                                         'negative record length')
+        if pos + size > len(data):
+            raise TTransportException(TTransportException.END_OF_FILE, 'truncated record')
+        return pos, pos + size
+
+    def _spans(self):
+        """Iterates over the (offset, start, end) of every record, offset
+        being where its length prefix starts."""
+        pos = _HEADER_SIZE
+        size = len(self._map)
+        while pos < size:
+            if not self.block_size:
+                (start, end) = self._record_at(pos)
+                yield pos, start, end
+                pos = end
+                continue
+            if pos + 4 > size:
+                raise TTransportException(TTransportException.END_OF_FILE, 'truncated block')
+            (count,) = unpack_from('!I', self._map, pos)
+            pos = block = pos + 4
+            spans = []
+            for _ in range(count):
+                (start, end) = self._record_at(pos)
+                spans.append((pos, start, end))
+                pos = end
+            if self.verify:
+                self._check_block(block, pos)
+            for span in spans:
+                yield span
+            pos += 4
+
+    def _verify_block(self, b, size):
+        if b in self._verified:
+            return
+        first = b * self.block_size
+        last = min(first + self.block_size, size) - 1
+        self._check_block(self._offset(first), self._record_at(self._offset(last))[1])
+        self._verified.add(b)
+
+    def _check_block(self, start, end):
+        """Checks the checksum of a block of records between start and end."""
+        if end + 4 > len(self._map):
+            raise TTransportException(TTransportException.END_OF_FILE, 'truncated checksum')
+        (checksum,) = unpack_from('!I', self._map, end)
+        if zlib.crc32(self._data[start:end]) & 0xffffffff != checksum:
+            raise TProtocolException(TProtocolException.INVALID_DATA,
+                                     'checksum mismatch in the block at %d' % start)
@@ -17,9 +17,20 @@
 # under the License.
 #
 
-from .protocol import TBinaryProtocol
+import json
+
+import six
+
+from .protocol import TBinaryProtocol, TCodec
+from .protocol.TBase import TFrozenBase
+from .protocol.TLazy import TLazyStruct
 from .transport import TTransport
 
+try:
+    from .protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
 
 def serialize(thrift_object,
               protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
@@ -29,10 +40,160 @@ def serialize(thrift_object,
     return transport.getvalue()
 
 
+def serialized_size(thrift_object,
+                    protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
+    """Returns ``len(serialize(thrift_object, protocol_factory))``, computed
+    from the thrift_spec without encoding the object.
+
+    Tells ahead of encoding whether a struct fits a frame limit or how big
+    a buffer to allocate for it.  The binary and compact protocols support
+    it.
+    """
+    protocol = protocol_factory.getProtocol(TTransport.TMemoryBuffer())
+    return protocol.encodedSize(thrift_object)
+
+
 def deserialize(base,
                 buf,
-                protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
+                protocol_factory=TBinaryProtocol.TBinaryProtocolFactory(),
+                projection=None):
+    """Decodes ``buf`` into ``base`` and returns it.
+
+    ``projection`` is an optional set of dotted field paths, such as
+    ``{'header.ts', 'user_id'}``, to decode; other fields are skipped and
+    left to their defaults.
+
+    A TFrozenBase ``base`` cannot be decoded into, so it is left as it is
+    and a new instance of its class is returned instead, with or without a
+    projection.
+    """
     transport = TTransport.TMemoryBuffer(buf)
     protocol = protocol_factory.getProtocol(transport)
-    base.read(protocol)
+    if projection is None:
+        if isinstance(base, TFrozenBase):
+            return base.read(protocol)
+        base.read(protocol)
+        return base
+    thrift_spec = TCodec.projected_spec(base.thrift_spec, projection)
+    if isinstance(base, TFrozenBase):
+        if protocol._fast_decode is not None:
+            return protocol._fast_decode(None, protocol, (base.__class__, thrift_spec))
+        return protocol.readStruct(base.__class__, thrift_spec, True)
+    if protocol._fast_decode is not None:
+        protocol._fast_decode(base, protocol, (base.__class__, thrift_spec))
+    else:
+        protocol.readStruct(base, thrift_spec)
     return base
+
+
+def serialize_many(thrift_objects,
+                   protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
+    """Encodes each of ``thrift_objects``, returning a list of their bytes.
+
+    A single protocol is used for all of them; the accelerated protocols
+    encode the whole sequence in one call.
+    """
+    protocol = protocol_factory.getProtocol(TTransport.TMemoryBuffer())
+    if protocol._fast_encode_many is not None:
+        return protocol._fast_encode_many(thrift_objects)
+    result = []
+    for thrift_object in thrift_objects:
+        transport = protocol.trans = TTransport.TMemoryBuffer()
+        thrift_object.write(protocol)
+        result.append(transport.getvalue())
+    return result
+
+
+def deserialize_many(cls,
+                     bufs,
+                     protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
+    """Decodes each of ``bufs`` into a new instance of ``cls``, returning
+    the list of them.
+
+    A single protocol is used for all of them; the accelerated protocols
+    decode the whole sequence in one call.
+    """
+    protocol = protocol_factory.getProtocol(TTransport.TMemoryBuffer())
+    if protocol._fast_decode_many is not None:
+        return protocol._fast_decode_many(bufs, (cls, cls.thrift_spec))
+    frozen = issubclass(cls, TFrozenBase)
+    result = []
+    for buf in bufs:
+        protocol.trans = TTransport.TMemoryBuffer(buf)
+        if frozen:
+            result.append(cls.read(protocol))
+        else:
+            obj = cls()
+            obj.read(protocol)
+            result.append(obj)
+    return result
+
+
+def deserialize_lazy(cls,
+                     buf,
+                     protocol_factory=TBinaryProtocol.TBinaryProtocolFactory()):
+    """Returns a TLazyStruct of ``cls`` decoding the fields of ``buf``
+    as they are accessed."""
+    return TLazyStruct(cls, buf, protocol_factory)
+
+
+def to_primitive(thrift_object, simple_json=False):
+    """Converts ``thrift_object`` to a dict of its set fields by name, with
+    nested structs as dicts, lists and sets as lists and maps as dicts.
+
+    With ``simple_json``, json.dumps of the result is what
+    TSimpleJSONProtocol writes: bools are 1 or 0 and binary strings are
+    base64 encoded.  The thrift_spec is walked by the C module when it is
+    available.
+    """
+    cls = thrift_object.__class__
+    if fastbinary is not None:
+        return fastbinary.to_primitive(thrift_object, (cls, cls.thrift_spec), simple_json)
+    return TCodec.struct_to_primitive(cls, cls.thrift_spec, simple_json)(thrift_object)
+
+
+def from_primitive(cls, data, simple_json=False):
+    """Returns a new instance of ``cls`` from the dict ``data``, as
+    to_primitive returns it.
+
+    Keys that are not fields of ``cls`` are ignored.  With ``simple_json``,
+    ``data`` is taken as json.loads returns it for what TSimpleJSONProtocol
+    writes.
+    """
+    if fastbinary is not None:
+        return fastbinary.from_primitive(data, (cls, cls.thrift_spec), simple_json)
+    if issubclass(cls, TFrozenBase):
+        return TCodec.struct_from_primitive(cls, cls.thrift_spec, True, simple_json)(cls, data)
+    obj = cls()
+    TCodec.struct_from_primitive(cls, cls.thrift_spec, False, simple_json)(obj, data)
+    return obj
+
+
+def serialize_simple_json(thrift_object):
+    """Encodes ``thrift_object`` as TSimpleJSONProtocol does, with a single
+    json.dumps call instead of a protocol call per value.
+
+    Unlike TSimpleJSONProtocol, control characters in strings are escaped
+    and non-finite doubles are written as json.dumps writes them.
+    """
+    data = json.dumps(to_primitive(thrift_object, True), ensure_ascii=False,
+                      separators=(',', ':'))
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return data
+
+
+def deserialize_simple_json(cls, buf):
+    """Decodes what TSimpleJSONProtocol or serialize_simple_json wrote into
+    a new instance of ``cls``.
+
+    TSimpleJSONProtocol itself cannot read, as the JSON it writes leaves
+    out the types of the values, taken from the thrift_spec of ``cls`` here.
+    """
+    if isinstance(buf, memoryview):
+        buf = buf.tobytes()
+    elif isinstance(buf, bytearray):
+        buf = bytes(buf)
+    if isinstance(buf, bytes):
+        buf = buf.decode('utf-8')
+    return from_primitive(cls, json.loads(buf, strict=False), True)
@@ -175,13 +175,6 @@ class TApplicationException(TException):
 class TFrozenDict(dict):
     """A dictionary that is "frozen" like a frozenset"""
 
-    def __init__(self, *args, **kwargs):
-        super(TFrozenDict, self).__init__(*args, **kwargs)
-        # Sort the items so they will be in a consistent order.
-        # XOR in the hash of the class so we don't collide with
-        # the hash of a list of tuples.
-        self.__hashval = hash(TFrozenDict) ^ hash(tuple(sorted(self.items())))
-
     def __setitem__(self, *args):
         raise TypeError("Can't modify frozen TFreezableDict")
 
@@ -189,4 +182,114 @@ class TFrozenDict(dict):
         raise TypeError("Can't modify frozen TFreezableDict")
 
     def __hash__(self):
+        try:
+            return self.__hashval
+        except AttributeError:
+            pass
+        # Hash the items as a frozenset, which doesn't depend on their order
+        # and doesn't need the keys to be sortable.  XOR in the hash of the
+        # class so we don't collide with the hash of a set of tuples.
+        self.__hashval = hash(TFrozenDict) ^ hash(frozenset(self.items()))
         return self.__hashval
+
+    def __reduce__(self):
+        # The hash is left out, hashes of strings differ between processes.
+        return (self.__class__, (dict(self),))
+
+
+class TSizedIterable(object):
+    """A list, set or map value whose elements are produced as it is written.
+
+    Assigning one to a container field writes the elements of iterable (as
+    (key, value) pairs for maps) without materializing them, size being the
+    element count written ahead of them.  With chunk_size, the transport is
+    drained (see TTransportBase.drain) every chunk_size elements, so that
+    only that many elements are ever buffered by transports that can send
+    part of a message, like TBufferedTransport.  TFramedTransport can't, as
+    each message must be a single frame, and raises TTransportException.
+    The elements can only be iterated once.
+    """
+
+    __slots__ = ('size', 'iterable', 'chunk_size')
+
+    def __init__(self, size, iterable, chunk_size=None):
+        self.size = size
+        self.iterable = iterable
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        count = 0
+        for item in self.iterable:
+            count += 1
+            if count > self.size:
+                raise ValueError('more than %d elements' % self.size)
+            yield item
+        if count < self.size:
+            raise ValueError('expected %d elements, got %d' % (self.size, count))
+
+
+class TInternTable(object):
+    """A bounded table of decoded strings, so that equal strings share one
+    object.
+
+    Given to a binary or compact protocol (or its factory) as intern_table,
+    string map keys are looked up in the table as they are decoded, and so
+    are string values of up to max_length characters.  A table can be
+    shared by any number of protocols.
+
+    The table holds at most size strings, in two generations: strings are
+    added to the current one and a string found in the previous one moves
+    to the current one.  When the current generation holds size / 2
+    strings it becomes the previous one, dropping the strings that were not
+    used since the last time that happened, the least recently used ones.
+
+    The generations are the current and previous attributes, dicts mapping
+    each string to itself, and rotate() starts a new one.  intern() and the
+    accelerated protocols both work through them, so a table can also be
+    shared between the pure Python and the accelerated protocols.
+    """
+
+    __slots__ = ('size', 'max_length', 'current', 'previous')
+
+    def __init__(self, size=1024, max_length=0):
+        if size < 2:
+            raise ValueError('size must be at least 2')
+        self.size = size
+        self.max_length = max_length
+        self.current = {}
+        self.previous = {}
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def __contains__(self, s):
+        return s in self.current or s in self.previous
+
+    def rotate(self):
+        """Makes the current generation the previous one, dropping the
+        previous one, and starts an empty current one."""
+        self.previous = self.current
+        self.current = {}
+
+    def intern(self, s):
+        """Returns the string of the table equal to s, adding s if there is
+        none."""
+        current = self.current
+        cached = current.get(s)
+        if cached is not None:
+            return cached
+        cached = self.previous.pop(s, s)
+        if len(current) >= self.size // 2:
+            self.rotate()
+            current = self.current
+        current[cached] = cached
+        return cached
+
+    def intern_value(self, s):
+        """Interns s when it is at most max_length characters long."""
+        if len(s) > self.max_length:
+            return s
+        return self.intern(s)
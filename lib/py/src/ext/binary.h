@@ -31,8 +31,63 @@ namespace py {
 
 class BinaryProtocol : public ProtocolBase<BinaryProtocol> {
 public:
+  BinaryProtocol() : strictRead_(false), strictWrite_(true) {}
+
   virtual ~BinaryProtocol() {}
 
+  void setStrict(bool strictRead, bool strictWrite) {
+    strictRead_ = strictRead;
+    strictWrite_ = strictWrite;
+  }
+
+  void writeMessageBegin(PyObject* name, int8_t type, int32_t seqid) {
+    int32_t len = static_cast<int32_t>(PyBytes_GET_SIZE(name));
+    if (strictWrite_) {
+      writeI32(VERSION_1 | type);
+      writeString(PyBytes_AS_STRING(name), len);
+      writeI32(seqid);
+    } else {
+      writeString(PyBytes_AS_STRING(name), len);
+      writeI8(type);
+      writeI32(seqid);
+    }
+  }
+
+  bool readMessageBegin(ScopedPyObject& name, int8_t& type, int32_t& seqid) {
+    int32_t sz;
+    char* buf = NULL;
+    if (!readI32(sz)) {
+      return false;
+    }
+    if (sz < 0) {
+      if ((sz & VERSION_MASK) != VERSION_1) {
+        char message[64];
+        snprintf(message, sizeof(message), "Bad version in readMessageBegin: %d", sz);
+        set_protocol_error(T_BAD_VERSION, message);
+        return false;
+      }
+      type = static_cast<int8_t>(sz & TYPE_MASK);
+      int32_t len = readString(&buf);
+      if (len < 0) {
+        return false;
+      }
+      name.reset(message_name_from_bytes(buf, len));
+    } else {
+      if (strictRead_) {
+        set_protocol_error(T_BAD_VERSION, "No protocol version header");
+        return false;
+      }
+      if (!checkLengthLimit(sz, stringLimit()) || !readBytes(&buf, sz)) {
+        return false;
+      }
+      name.reset(message_name_from_bytes(buf, sz));
+      if (!readI8(type)) {
+        return false;
+      }
+    }
+    return name && readI32(seqid);
+  }
+
   void writeI8(int8_t val) { writeBuffer(reinterpret_cast<char*>(&val), sizeof(int8_t)); }
 
   void writeI16(int16_t val) {
@@ -62,9 +117,9 @@ public:
 
   void writeBool(int v) { writeByte(static_cast<uint8_t>(v)); }
 
-  void writeString(PyObject* value, int32_t len) {
+  void writeString(const char* data, int32_t len) {
     writeI32(len);
-    writeBuffer(PyBytes_AS_STRING(value), len);
+    writeBuffer(const_cast<char*>(data), len);
   }
 
   bool writeListBegin(PyObject* value, const SetListTypeArgs& parsedargs, int32_t len) {
@@ -82,14 +137,16 @@ public:
 
   bool writeStructBegin() { return true; }
   bool writeStructEnd() { return true; }
-  bool writeField(PyObject* value, const StructItemSpec& parsedspec) {
+  bool writeField(PyObject* value, FieldSpec& parsedspec) {
     writeByte(static_cast<uint8_t>(parsedspec.type));
     writeI16(parsedspec.tag);
-    return encodeValue(value, parsedspec.type, parsedspec.typeargs);
+    return encodeValue(value, parsedspec.type, parsedspec.args);
   }
 
   void writeFieldStop() { writeByte(static_cast<uint8_t>(T_STOP)); }
 
+  PyObject* wireFormat() const { return INTERN_STRING(binary); }
+
   bool readBool(bool& val) {
     char* buf;
     if (!readBytes(&buf, 1)) {
@@ -148,6 +205,42 @@ public:
     return true;
   }
 
+  // Reads the big endian values with one readBytes and swaps them in place.
+  bool readArrayData(TType type, int32_t len, char* out) {
+    int width = type == T_BYTE ? 1 : type == T_I16 ? 2 : type == T_I32 ? 4 : 8;
+    char* buf;
+    if (len > std::numeric_limits<int>::max() / width) {
+      PyErr_SetString(PyExc_OverflowError, "list is too large");
+      return false;
+    }
+    if (!readBytes(&buf, len * width)) {
+      return false;
+    }
+    memcpy(out, buf, static_cast<size_t>(len) * width);
+    if (width == 1) {
+      return true;
+    }
+    for (int32_t i = 0; i < len; ++i, out += width) {
+      if (width == 2) {
+        uint16_t val;
+        memcpy(&val, out, 2);
+        val = ntohs(val);
+        memcpy(out, &val, 2);
+      } else if (width == 4) {
+        uint32_t val;
+        memcpy(&val, out, 4);
+        val = ntohl(val);
+        memcpy(out, &val, 4);
+      } else if (width == 8) {
+        uint64_t val;
+        memcpy(&val, out, 8);
+        val = ntohll(val);
+        memcpy(out, &val, 8);
+      }
+    }
+    return true;
+  }
+
   int32_t readString(char** buf) {
     int32_t len = 0;
     if (!readI32(len) || !checkLengthLimit(len, stringLimit()) || !readBytes(buf, len)) {
@@ -205,7 +298,49 @@ public:
   }
 #undef SKIPBYTES
 
+  // Sizes of the values whose size does not depend on the value.
+  static int fixedWidth(TType type) {
+    switch (type) {
+    case T_BOOL:
+    case T_I08:
+      return 1;
+    case T_I16:
+      return 2;
+    case T_I32:
+      return 4;
+    case T_I64:
+    case T_DOUBLE:
+      return 8;
+    default:
+      return 0;
+    }
+  }
+
+  // Containers of fixed width values are skipped with a single read.
+  bool skipValues(TType type, int64_t count) {
+    int width = fixedWidth(type);
+    if (width) {
+      return skipBytes(count * width);
+    }
+    return ProtocolBase<BinaryProtocol>::skipValues(type, count);
+  }
+
+  bool skipPairs(TType ktype, TType vtype, int64_t count) {
+    int kwidth = fixedWidth(ktype);
+    int vwidth = fixedWidth(vtype);
+    if (kwidth && vwidth) {
+      return skipBytes(count * (kwidth + vwidth));
+    }
+    return ProtocolBase<BinaryProtocol>::skipPairs(ktype, vtype, count);
+  }
+
 private:
+  static const int32_t VERSION_MASK = static_cast<int32_t>(0xffff0000);
+  static const int32_t VERSION_1 = static_cast<int32_t>(0x80010000);
+  static const int32_t TYPE_MASK = 0x000000ff;
+
+  bool strictRead_;
+  bool strictWrite_;
   char* dummy_buf_;
 };
 }
@@ -24,6 +24,7 @@
 #include "ext/protocol.h"
 #include "ext/endian.h"
 #include <stdint.h>
+#include <algorithm>
 #include <stack>
 
 namespace apache {
@@ -36,6 +37,52 @@ public:
 
   virtual ~CompactProtocol() {}
 
+  // strictness only applies to the binary protocol
+  void setStrict(bool, bool) {}
+
+  void writeMessageBegin(PyObject* name, int8_t type, int32_t seqid) {
+    writeByte(PROTOCOL_ID);
+    writeByte(static_cast<uint8_t>(VERSION | (type << TYPE_SHIFT_AMOUNT)));
+    writeVarint(static_cast<uint32_t>(seqid));
+    writeString(PyBytes_AS_STRING(name), static_cast<int32_t>(PyBytes_GET_SIZE(name)));
+  }
+
+  bool readMessageBegin(ScopedPyObject& name, int8_t& type, int32_t& seqid) {
+    uint8_t protocolId;
+    uint8_t versionAndType;
+    if (!readByte(protocolId)) {
+      return false;
+    }
+    char message[64];
+    if (protocolId != PROTOCOL_ID) {
+      snprintf(message, sizeof(message), "Bad protocol id in the message: %d", protocolId);
+      set_protocol_error(T_BAD_VERSION, message);
+      return false;
+    }
+    if (!readByte(versionAndType)) {
+      return false;
+    }
+    if ((versionAndType & VERSION_MASK) != VERSION) {
+      snprintf(message, sizeof(message), "Bad version: %d (expect %d)",
+               versionAndType & VERSION_MASK, VERSION);
+      set_protocol_error(T_BAD_VERSION, message);
+      return false;
+    }
+    type = static_cast<int8_t>((versionAndType >> TYPE_SHIFT_AMOUNT) & TYPE_BITS);
+    uint32_t useqid;
+    if (!readVarint<uint32_t, 5>(useqid)) {
+      return false;
+    }
+    seqid = static_cast<int32_t>(useqid);
+    char* buf = NULL;
+    int32_t len = readString(&buf);
+    if (len < 0) {
+      return false;
+    }
+    name.reset(message_name_from_bytes(buf, len));
+    return !!name;
+  }
+
   void writeI8(int8_t val) { writeBuffer(reinterpret_cast<char*>(&val), 1); }
 
   void writeI16(int16_t val) { writeVarint(toZigZag(val)); }
@@ -55,9 +102,9 @@ public:
 
   void writeBool(int v) { writeByte(static_cast<uint8_t>(v ? CT_BOOLEAN_TRUE : CT_BOOLEAN_FALSE)); }
 
-  void writeString(PyObject* value, int32_t len) {
+  void writeString(const char* data, int32_t len) {
     writeVarint(len);
-    writeBuffer(PyBytes_AS_STRING(value), len);
+    writeBuffer(const_cast<char*>(data), len);
   }
 
   bool writeListBegin(PyObject* value, const SetListTypeArgs& args, int32_t len) {
@@ -91,18 +138,20 @@ public:
     return true;
   }
 
-  bool writeField(PyObject* value, const StructItemSpec& spec) {
+  bool writeField(PyObject* value, FieldSpec& spec) {
     if (spec.type == T_BOOL) {
       doWriteFieldBegin(spec, PyObject_IsTrue(value) ? CT_BOOLEAN_TRUE : CT_BOOLEAN_FALSE);
       return true;
     } else {
       doWriteFieldBegin(spec, toCompactType(spec.type));
-      return encodeValue(value, spec.type, spec.typeargs);
+      return encodeValue(value, spec.type, spec.args);
     }
   }
 
   void writeFieldStop() { writeByte(0); }
 
+  PyObject* wireFormat() const { return INTERN_STRING(compact); }
+
   bool readBool(bool& val) {
     if (readBool_.exists) {
       readBool_.exists = false;
@@ -263,7 +312,67 @@ public:
   }
 #undef SKIPBYTES
 
+  // Sizes of the values whose size does not depend on the value.
+  static int fixedWidth(TType type) {
+    switch (type) {
+    case T_BOOL:
+    case T_I08:
+      return 1;
+    case T_DOUBLE:
+      return 8;
+    default:
+      return 0;
+    }
+  }
+
+  // Containers of fixed width values are skipped with a single read, and
+  // runs of varints by counting their last bytes.
+  bool skipValues(TType type, int64_t count) {
+    int width = fixedWidth(type);
+    if (width) {
+      return skipBytes(count * width);
+    }
+    if (type == T_I16 || type == T_I32 || type == T_I64) {
+      return skipVarints(count);
+    }
+    return ProtocolBase<CompactProtocol>::skipValues(type, count);
+  }
+
+  bool skipPairs(TType ktype, TType vtype, int64_t count) {
+    if (ktype == vtype) {
+      return skipValues(ktype, 2 * count);
+    }
+    int kwidth = fixedWidth(ktype);
+    int vwidth = fixedWidth(vtype);
+    if (kwidth && vwidth) {
+      return skipBytes(count * (kwidth + vwidth));
+    }
+    return ProtocolBase<CompactProtocol>::skipPairs(ktype, vtype, count);
+  }
+
 private:
+  // Each varint takes at least one byte, so reading as many bytes as there
+  // are varints left never reads past the last one.
+  bool skipVarints(int64_t count) {
+    while (count > 0) {
+      int len = static_cast<int>(std::min<int64_t>(count, std::numeric_limits<int>::max()));
+      char* buf;
+      if (!readBytes(&buf, len)) {
+        return false;
+      }
+      for (int i = 0; i < len; i++) {
+        count -= !(buf[i] & 0x80);
+      }
+    }
+    return true;
+  }
+
+  static const uint8_t PROTOCOL_ID = 0x82;
+  static const uint8_t VERSION = 1;
+  static const uint8_t VERSION_MASK = 0x1f;
+  static const uint8_t TYPE_BITS = 0x07;
+  static const int TYPE_SHIFT_AMOUNT = 5;
+
   enum Types {
     CT_STOP = 0x00,
     CT_BOOLEAN_TRUE = 0x01,
@@ -0,0 +1,554 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements. See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership. The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License. You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied. See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+
+#include "ext/json.h"
+#include <stdio.h>
+
+namespace apache {
+namespace thrift {
+namespace py {
+
+namespace {
+
+const int32_t VERSION = 1;
+
+// The names of the types, indexed by TType, as in TJSONProtocol's CTYPES.
+const char* const TYPE_NAMES[] = {
+    NULL,  // T_STOP
+    NULL,  // unused
+    "tf",  // T_BOOL
+    "i8",  // T_BYTE
+    "dbl", // T_DOUBLE
+    NULL,  // unused
+    "i16", // T_I16
+    NULL,  // unused
+    "i32", // T_I32
+    NULL,  // unused
+    "i64", // T_I64
+    "str", // T_STRING
+    "rec", // T_STRUCT
+    "map", // T_MAP
+    "set", // T_SET
+    "lst", // T_LIST
+};
+const int TYPE_COUNT = sizeof(TYPE_NAMES) / sizeof(TYPE_NAMES[0]);
+
+inline bool is_numeric(char c) {
+  return (c >= '0' && c <= '9') || c == '-' || c == '+' || c == '.' || c == 'E' || c == 'e';
+}
+
+// The characters TJSONProtocol escapes, and their escapes.
+inline char escape_of(char c) {
+  switch (c) {
+  case '"':
+    return '"';
+  case '\\':
+    return '\\';
+  case '\b':
+    return 'b';
+  case '\f':
+    return 'f';
+  case '\n':
+    return 'n';
+  case '\r':
+    return 'r';
+  case '\t':
+    return 't';
+  default:
+    return 0;
+  }
+}
+
+inline int hex_value(char c) {
+  if (c >= '0' && c <= '9') {
+    return c - '0';
+  } else if (c >= 'a' && c <= 'f') {
+    return c - 'a' + 10;
+  } else if (c >= 'A' && c <= 'F') {
+    return c - 'A' + 10;
+  }
+  return -1;
+}
+
+void append_utf8(std::string& out, uint32_t c) {
+  if (c < 0x80) {
+    out += static_cast<char>(c);
+  } else if (c < 0x800) {
+    out += static_cast<char>(0xc0 | (c >> 6));
+    out += static_cast<char>(0x80 | (c & 0x3f));
+  } else if (c < 0x10000) {
+    out += static_cast<char>(0xe0 | (c >> 12));
+    out += static_cast<char>(0x80 | ((c >> 6) & 0x3f));
+    out += static_cast<char>(0x80 | (c & 0x3f));
+  } else {
+    out += static_cast<char>(0xf0 | (c >> 18));
+    out += static_cast<char>(0x80 | ((c >> 12) & 0x3f));
+    out += static_cast<char>(0x80 | ((c >> 6) & 0x3f));
+    out += static_cast<char>(0x80 | (c & 0x3f));
+  }
+}
+
+// Parses the whole of str as a double, like float() does.
+bool parse_double(const std::string& str, double& val) {
+  if (!str.empty()) {
+    char* end = NULL;
+    val = PyOS_string_to_double(str.c_str(), &end, NULL);
+    if (!PyErr_Occurred() && end == str.c_str() + str.size()) {
+      return true;
+    }
+    PyErr_Clear();
+  }
+  set_protocol_error(T_INVALID_DATA, "Bad data encounted in numeric data");
+  return false;
+}
+}
+
+bool JSONProtocol::setEncodedCache(PyObject* cache, PyObject*) {
+  if (cache && cache != Py_None) {
+    PyErr_SetString(PyExc_TypeError, "the JSON protocol cannot use an encoded cache");
+    return false;
+  }
+  return true;
+}
+
+bool JSONProtocol::prepareEncodeCount() {
+  PyErr_SetString(PyExc_TypeError, "the JSON protocol cannot size structs");
+  return false;
+}
+
+PyObject* JSONProtocol::scanStruct() {
+  PyErr_SetString(PyExc_TypeError, "the JSON protocol cannot scan structs");
+  return NULL;
+}
+
+void JSONProtocol::writeMessageBegin(PyObject* name, int8_t type, int32_t seqid) {
+  contexts_.clear();
+  writeArrayStart();
+  writeI64(VERSION);
+  writeString(PyBytes_AS_STRING(name), static_cast<int32_t>(PyBytes_GET_SIZE(name)));
+  writeI64(type);
+  writeI64(seqid);
+}
+
+bool JSONProtocol::readMessageBegin(ScopedPyObject& name, int8_t& type, int32_t& seqid) {
+  contexts_.clear();
+  int64_t version;
+  if (!readArrayStart() || !readInteger(version)) {
+    return false;
+  }
+  if (version != VERSION) {
+    set_protocol_error(T_BAD_VERSION, "Message contained bad version.");
+    return false;
+  }
+  char* buf;
+  int32_t len = readString(&buf);
+  if (len < 0) {
+    return false;
+  }
+  name.reset(message_name_from_bytes(buf, len));
+  return name && readInteger(type) && readInteger(seqid);
+}
+
+void JSONProtocol::writeI64(int64_t val) {
+  char buf[32];
+  int len = snprintf(buf, sizeof(buf), "%lld", static_cast<long long>(val));
+  writeSeparator();
+  bool quoted = escapeNum();
+  if (quoted) {
+    writeByte('"');
+  }
+  writeBuffer(buf, len);
+  if (quoted) {
+    writeByte('"');
+  }
+}
+
+void JSONProtocol::writeDouble(double dub) {
+  // '{0:.17g}'.format(dub), as TJSONProtocol writes doubles
+  char* repr = PyOS_double_to_string(dub, 'g', 17, 0, NULL);
+  if (!repr) {
+    return;
+  }
+  writeSeparator();
+  bool quoted = escapeNum();
+  if (quoted) {
+    writeByte('"');
+  }
+  writeBuffer(repr, strlen(repr));
+  if (quoted) {
+    writeByte('"');
+  }
+  PyMem_Free(repr);
+}
+
+void JSONProtocol::writeString(const char* data, int32_t len) {
+  writeSeparator();
+  writeByte('"');
+  int32_t start = 0;
+  for (int32_t i = 0; i < len; ++i) {
+    char escape = escape_of(data[i]);
+    if (escape) {
+      char escaped[2] = {'\\', escape};
+      writeBuffer(const_cast<char*>(data) + start, i - start);
+      writeBuffer(escaped, 2);
+      start = i + 1;
+    }
+  }
+  writeBuffer(const_cast<char*>(data) + start, len - start);
+  writeByte('"');
+}
+
+void JSONProtocol::writeBinary(const char* data, int32_t len) {
+  writeSeparator();
+  writeByte('"');
+  binary_.clear();
+  base64_encode(data, len, binary_);
+  writeBuffer(const_cast<char*>(binary_.data()), binary_.size());
+  writeByte('"');
+}
+
+bool JSONProtocol::writeTypeName(TType type) {
+  const char* name = type >= 0 && type < TYPE_COUNT ? TYPE_NAMES[type] : NULL;
+  if (!name) {
+    PyErr_Format(PyExc_TypeError, "Unexpected TType for the JSON protocol: %d", type);
+    return false;
+  }
+  writeString(name, static_cast<int32_t>(strlen(name)));
+  return true;
+}
+
+bool JSONProtocol::writeListBegin(PyObject* value, const SetListTypeArgs& args, int32_t len) {
+  writeArrayStart();
+  if (!writeTypeName(args.element_type)) {
+    return false;
+  }
+  writeI64(len);
+  return true;
+}
+
+bool JSONProtocol::writeMapBegin(PyObject* value, const MapTypeArgs& args, int32_t len) {
+  writeArrayStart();
+  if (!writeTypeName(args.ktag) || !writeTypeName(args.vtag)) {
+    return false;
+  }
+  writeI64(len);
+  writeObjectStart();
+  return true;
+}
+
+bool JSONProtocol::writeField(PyObject* value, FieldSpec& parsedspec) {
+  writeI64(parsedspec.tag);
+  writeObjectStart();
+  if (!writeTypeName(parsedspec.type) || !encodeValue(value, parsedspec.type, parsedspec.args)) {
+    return false;
+  }
+  writeObjectEnd();
+  return true;
+}
+
+bool JSONProtocol::readSyntaxChar(char expected) {
+  char* buf;
+  if (!readBytes(&buf, 1)) {
+    return false;
+  }
+  if (buf[0] != expected) {
+    char message[32];
+    snprintf(message, sizeof(message), "Unexpected character: %c", buf[0]);
+    set_protocol_error(T_INVALID_DATA, message);
+    return false;
+  }
+  return true;
+}
+
+bool JSONProtocol::readTypeName(TType& type) {
+  char* buf;
+  int32_t len = readString(&buf);
+  if (len < 0) {
+    return false;
+  }
+  for (int i = 0; i < TYPE_COUNT; ++i) {
+    const char* name = TYPE_NAMES[i];
+    if (name && static_cast<size_t>(len) == strlen(name) && !memcmp(buf, name, len)) {
+      type = static_cast<TType>(i);
+      return true;
+    }
+  }
+  set_protocol_error(T_INVALID_DATA, "Unrecognized type");
+  return false;
+}
+
+bool JSONProtocol::readNumericChars() {
+  numeric_.clear();
+  while (true) {
+    char* buf;
+    Py_ssize_t avail = peekBytes(&buf);
+    if (avail < 0) {
+      return false;
+    }
+    int len = 0;
+    while (len < avail && is_numeric(buf[len])) {
+      ++len;
+    }
+    numeric_.append(buf, len);
+    if (!readBytes(&buf, len)) {
+      return false;
+    }
+    if (len < avail) {
+      return true;
+    }
+  }
+}
+
+bool JSONProtocol::readInteger(int64_t& val) {
+  if (!readSeparator()) {
+    return false;
+  }
+  bool quoted = escapeNum();
+  if ((quoted && !readSyntaxChar('"')) || !readNumericChars()
+      || (quoted && !readSyntaxChar('"'))) {
+    return false;
+  }
+  // int() of the characters read, which must fit 64 bits
+  const char* p = numeric_.c_str();
+  bool negative = *p == '-';
+  if (*p == '-' || *p == '+') {
+    ++p;
+  }
+  uint64_t limit = negative ? static_cast<uint64_t>(std::numeric_limits<int64_t>::max()) + 1
+                            : static_cast<uint64_t>(std::numeric_limits<int64_t>::max());
+  uint64_t magnitude = 0;
+  bool valid = *p != '\0';
+  for (; *p && valid; ++p) {
+    uint64_t digit = static_cast<uint64_t>(*p - '0');
+    valid = *p >= '0' && *p <= '9' && magnitude <= (limit - digit) / 10;
+    magnitude = magnitude * 10 + digit;
+  }
+  if (!valid) {
+    set_protocol_error(T_INVALID_DATA, "Bad data encounted in numeric data");
+    return false;
+  }
+  val = negative ? static_cast<int64_t>(0 - magnitude) : static_cast<int64_t>(magnitude);
+  return true;
+}
+
+bool JSONProtocol::readDouble(double& val) {
+  if (!readSeparator()) {
+    return false;
+  }
+  char* buf;
+  if (peekBytes(&buf) < 0) {
+    return false;
+  }
+  if (buf[0] == '"') {
+    // quoted, as object keys and special values such as "NaN" are
+    int32_t len = readJSONString(&buf, true);
+    return len >= 0 && parse_double(std::string(buf, len), val);
+  }
+  if (escapeNum() && !readSyntaxChar('"')) {
+    return false;
+  }
+  return readNumericChars() && parse_double(numeric_, val);
+}
+
+int32_t JSONProtocol::readJSONString(char** buf, bool skipContext) {
+  if ((!skipContext && !readSeparator()) || !readSyntaxChar('"')) {
+    return -1;
+  }
+  string_.clear();
+  bool copied = false;
+  uint32_t highSurrogate = 0;
+  while (true) {
+    char* data;
+    Py_ssize_t avail = peekBytes(&data);
+    if (avail < 0) {
+      return -1;
+    }
+    int len = 0;
+    while (len < avail && data[len] != '"' && data[len] != '\\') {
+      ++len;
+    }
+    if (len && highSurrogate) {
+      set_protocol_error(T_INVALID_DATA, "Expected low surrogate char");
+      return -1;
+    }
+    if (len == avail) {
+      // the run goes on past the buffer
+      string_.append(data, len);
+      copied = true;
+      if (!readBytes(&data, len)) {
+        return -1;
+      }
+      continue;
+    }
+    char end = data[len];
+    if (end == '"' && !copied) {
+      // no escapes: the string is taken from the input as is
+      *buf = data;
+      return checkLengthLimit(len, stringLimit()) && readBytes(&data, len + 1) ? len : -1;
+    }
+    string_.append(data, len);
+    copied = true;
+    if (!readBytes(&data, len + 1)) {
+      return -1;
+    }
+    if (end == '"') {
+      break;
+    }
+    if (!readEscape(highSurrogate)) {
+      return -1;
+    }
+  }
+  if (string_.size() > static_cast<size_t>(stringLimit())) {
+    PyErr_Format(PyExc_OverflowError, "size exceeded specified limit: %ld", stringLimit());
+    return -1;
+  }
+  *buf = const_cast<char*>(string_.data());
+  return static_cast<int32_t>(string_.size());
+}
+
+/**
+ * Reads the escape after a backslash into string_.  A high surrogate is
+ * kept in highSurrogate until the low one that must follow it.
+ */
+bool JSONProtocol::readEscape(uint32_t& highSurrogate) {
+  char* buf;
+  if (!readBytes(&buf, 1)) {
+    return false;
+  }
+  if (buf[0] == 'u') {
+    if (!readBytes(&buf, 4)) {
+      return false;
+    }
+    uint32_t codeunit = 0;
+    for (int i = 0; i < 4; ++i) {
+      int digit = hex_value(buf[i]);
+      if (digit < 0) {
+        set_protocol_error(T_INVALID_DATA, "Expected hex digits");
+        return false;
+      }
+      codeunit = codeunit << 4 | digit;
+    }
+    if (codeunit >= 0xd800 && codeunit <= 0xdbff) {
+      if (highSurrogate) {
+        set_protocol_error(T_INVALID_DATA, "Expected low surrogate char");
+        return false;
+      }
+      highSurrogate = codeunit;
+      return true;
+    } else if (codeunit >= 0xdc00 && codeunit <= 0xdfff) {
+      if (!highSurrogate) {
+        set_protocol_error(T_INVALID_DATA, "Expected high surrogate char");
+        return false;
+      }
+      append_utf8(string_, 0x10000 + ((highSurrogate & 0x3ff) << 10) + (codeunit & 0x3ff));
+      highSurrogate = 0;
+      return true;
+    }
+    append_utf8(string_, codeunit);
+  } else {
+    char c;
+    switch (buf[0]) {
+    case '"':
+    case '\\':
+    case '/':
+      c = buf[0];
+      break;
+    case 'b':
+      c = '\b';
+      break;
+    case 'f':
+      c = '\f';
+      break;
+    case 'n':
+      c = '\n';
+      break;
+    case 'r':
+      c = '\r';
+      break;
+    case 't':
+      c = '\t';
+      break;
+    default:
+      set_protocol_error(T_INVALID_DATA, "Expected control char");
+      return false;
+    }
+    string_ += c;
+  }
+  if (highSurrogate) {
+    set_protocol_error(T_INVALID_DATA, "Expected low surrogate char");
+    return false;
+  }
+  return true;
+}
+
+int32_t JSONProtocol::readBinary(char** buf) {
+  char* data;
+  int32_t len = readString(&data);
+  if (len < 0) {
+    return -1;
+  }
+  binary_.clear();
+  if (!base64_decode(data, len, binary_)) {
+    set_protocol_error(T_INVALID_DATA, "Incorrect base64 padding");
+    return -1;
+  }
+  *buf = const_cast<char*>(binary_.data());
+  return static_cast<int32_t>(binary_.size());
+}
+
+int32_t JSONProtocol::readListBegin(TType& etype) {
+  int32_t len;
+  if (!readArrayStart() || !readTypeName(etype) || !readInteger(len)
+      || !checkLengthLimit(len, containerLimit())) {
+    return -1;
+  }
+  return len;
+}
+
+int32_t JSONProtocol::readMapBegin(TType& ktype, TType& vtype) {
+  int32_t len;
+  if (!readArrayStart() || !readTypeName(ktype) || !readTypeName(vtype) || !readInteger(len)
+      || !checkLengthLimit(len, containerLimit()) || !readObjectStart()) {
+    return -1;
+  }
+  return len;
+}
+
+bool JSONProtocol::readFieldBegin(TType& type, int16_t& tag) {
+  if (!contexts_.empty() && contexts_.back().field && !readObjectEnd()) {
+    return false;
+  }
+  char* buf;
+  if (peekBytes(&buf) < 0) {
+    return false;
+  }
+  if (buf[0] == '}') {
+    type = T_STOP;
+    tag = 0;
+    return readObjectEnd();
+  }
+  if (!readInteger(tag) || !readObjectStart()) {
+    return false;
+  }
+  contexts_.back().field = true;
+  return readTypeName(type);
+}
+}
+}
+}
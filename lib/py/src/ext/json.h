@@ -0,0 +1,304 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements. See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership. The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License. You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied. See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+
+#ifndef THRIFT_PY_JSON_H
+#define THRIFT_PY_JSON_H
+
+#include <Python.h>
+#include "ext/protocol.h"
+#include <stdint.h>
+#include <string>
+#include <vector>
+
+namespace apache {
+namespace thrift {
+namespace py {
+
+/**
+ * The encoding of TJSONProtocol: structs are objects of fields keyed by
+ * their tags, fields and containers carry their types as "i32"-style names
+ * and binary strings are base64 encoded.  Reading needs a view of the input,
+ * as values end wherever their characters do.
+ */
+class JSONProtocol : public ProtocolBase<JSONProtocol> {
+public:
+  JSONProtocol() {}
+
+  virtual ~JSONProtocol() {}
+
+  // strictness only applies to the binary protocol
+  void setStrict(bool, bool) {}
+
+  // binary strings are decoded from base64, there is nothing to view
+  void setBinaryViews(bool) {}
+
+  // the bytes of a struct depend on the context it is written in
+  bool setEncodedCache(PyObject* cache, PyObject* key = NULL);
+
+  // the size of a value depends on more than its type
+  bool prepareEncodeCount();
+
+  // values are read along with the separators in front of them, so they
+  // cannot be decoded from the offsets a scan would return
+  PyObject* scanStruct();
+
+  void writeMessageBegin(PyObject* name, int8_t type, int32_t seqid);
+  void writeMessageEnd() { writeArrayEnd(); }
+
+  bool readMessageBegin(ScopedPyObject& name, int8_t& type, int32_t& seqid);
+  bool readMessageEnd() { return readArrayEnd(); }
+
+  void writeI8(int8_t val) { writeI64(val); }
+  void writeI16(int16_t val) { writeI64(val); }
+  void writeI32(int32_t val) { writeI64(val); }
+  void writeI64(int64_t val);
+  void writeDouble(double dub);
+  void writeBool(int v) { writeI64(v ? 1 : 0); }
+  void writeString(const char* data, int32_t len);
+  void writeBinary(const char* data, int32_t len);
+
+  bool writeListBegin(PyObject* value, const SetListTypeArgs& args, int32_t len);
+  void writeListEnd() { writeArrayEnd(); }
+
+  bool writeMapBegin(PyObject* value, const MapTypeArgs& args, int32_t len);
+  void writeMapEnd() {
+    writeObjectEnd();
+    writeArrayEnd();
+  }
+
+  bool writeStructBegin() {
+    writeObjectStart();
+    return true;
+  }
+  bool writeStructEnd() {
+    writeObjectEnd();
+    return true;
+  }
+  bool writeField(PyObject* value, FieldSpec& parsedspec);
+  void writeFieldStop() {}
+
+  PyObject* wireFormat() const { return NULL; }
+
+  bool readBool(bool& val) {
+    int64_t v;
+    if (!readInteger(v)) {
+      return false;
+    }
+    val = v != 0;
+    return true;
+  }
+
+  bool readI8(int8_t& val) { return readInteger(val); }
+  bool readI16(int16_t& val) { return readInteger(val); }
+  bool readI32(int32_t& val) { return readInteger(val); }
+  bool readI64(int64_t& val) { return readInteger(val); }
+  bool readDouble(double& val);
+  int32_t readString(char** buf) { return readJSONString(buf, false); }
+  int32_t readBinary(char** buf);
+
+  int32_t readListBegin(TType& etype);
+  bool readListEnd() { return readArrayEnd(); }
+
+  int32_t readMapBegin(TType& ktype, TType& vtype);
+  bool readMapEnd() { return readObjectEnd() && readArrayEnd(); }
+
+  bool readStructBegin() { return readObjectStart(); }
+  // the closing brace is read by readFieldBegin, which finds it
+  bool readStructEnd() { return true; }
+
+  bool readFieldBegin(TType& type, int16_t& tag);
+
+  bool skipBool() {
+    bool val;
+    return readBool(val);
+  }
+  bool skipByte() { return skipI64(); }
+  bool skipI16() { return skipI64(); }
+  bool skipI32() { return skipI64(); }
+  bool skipI64() {
+    int64_t val;
+    return readInteger(val);
+  }
+  bool skipDouble() {
+    double val;
+    return readDouble(val);
+  }
+  bool skipString() {
+    char* buf;
+    return readString(&buf) >= 0;
+  }
+
+  static int fixedWidth(TType) { return 0; }
+
+private:
+  /**
+   * JSONListContext and JSONPairContext of TJSONProtocol: values after the
+   * first one in an array are separated by commas, the keys and values of
+   * an object by colons and commas in turn.  field marks the object holding
+   * the type and value of a field, which readFieldBegin closes.
+   */
+  struct Context {
+    bool pair;
+    bool first;
+    bool colon;
+    bool field;
+  };
+
+  void pushContext(bool pair) {
+    Context context = {pair, true, true, false};
+    contexts_.push_back(context);
+  }
+
+  void popContext() {
+    if (!contexts_.empty()) {
+      contexts_.pop_back();
+    }
+  }
+
+  /**
+   * Steps the current context to the next value and returns the separator
+   * in front of it, or 0 for none.
+   */
+  char nextSeparator() {
+    if (contexts_.empty()) {
+      return 0;
+    }
+    Context& context = contexts_.back();
+    if (context.first) {
+      context.first = false;
+      context.colon = true;
+      return 0;
+    }
+    if (!context.pair) {
+      return ',';
+    }
+    char separator = context.colon ? ':' : ',';
+    context.colon = !context.colon;
+    return separator;
+  }
+
+  // Numbers used as object keys are quoted.
+  bool escapeNum() const {
+    return !contexts_.empty() && contexts_.back().pair && contexts_.back().colon;
+  }
+
+  void writeSeparator() {
+    char separator = nextSeparator();
+    if (separator) {
+      writeByte(static_cast<uint8_t>(separator));
+    }
+  }
+
+  void writeObjectStart() {
+    writeSeparator();
+    writeByte('{');
+    pushContext(true);
+  }
+
+  void writeObjectEnd() {
+    popContext();
+    writeByte('}');
+  }
+
+  void writeArrayStart() {
+    writeSeparator();
+    writeByte('[');
+    pushContext(false);
+  }
+
+  void writeArrayEnd() {
+    popContext();
+    writeByte(']');
+  }
+
+  bool writeTypeName(TType type);
+
+  bool readSyntaxChar(char expected);
+
+  bool readSeparator() {
+    char separator = nextSeparator();
+    return !separator || readSyntaxChar(separator);
+  }
+
+  bool readObjectStart() {
+    if (!readSeparator() || !readSyntaxChar('{')) {
+      return false;
+    }
+    pushContext(true);
+    return true;
+  }
+
+  bool readObjectEnd() {
+    if (!readSyntaxChar('}')) {
+      return false;
+    }
+    popContext();
+    return true;
+  }
+
+  bool readArrayStart() {
+    if (!readSeparator() || !readSyntaxChar('[')) {
+      return false;
+    }
+    pushContext(false);
+    return true;
+  }
+
+  bool readArrayEnd() {
+    if (!readSyntaxChar(']')) {
+      return false;
+    }
+    popContext();
+    return true;
+  }
+
+  bool readTypeName(TType& type);
+  bool readNumericChars();
+  bool readInteger(int64_t& val);
+
+  template <typename T>
+  bool readInteger(T& val) {
+    int64_t v;
+    if (!readInteger(v)) {
+      return false;
+    }
+    if (!CHECK_RANGE(v, std::numeric_limits<T>::min(), std::numeric_limits<T>::max())) {
+      set_protocol_error(T_INVALID_DATA, "Bad data encounted in numeric data");
+      return false;
+    }
+    val = static_cast<T>(v);
+    return true;
+  }
+
+  /**
+   * Reads a string into string_, or points *buf into the input when it has
+   * no escapes.  skipContext leaves out the separator, already read.
+   */
+  int32_t readJSONString(char** buf, bool skipContext);
+  bool readEscape(uint32_t& highSurrogate);
+
+  std::vector<Context> contexts_;
+  std::string string_;
+  std::string binary_;
+  std::string numeric_;
+};
+}
+}
+}
+#endif // THRIFT_PY_JSON_H
@@ -21,12 +21,12 @@
 #include "types.h"
 #include "binary.h"
 #include "compact.h"
+#include "json.h"
+#include "primitive.h"
 #include <limits>
 #include <stdint.h>
 
 // TODO(dreiss): defval appears to be unused.  Look into removing it.
-// TODO(dreiss): Make parse_spec_args recursive, and cache the output
-//               permanently in the object.  (Malloc and orphan.)
 // TODO(dreiss): Why do we need cStringIO for reading, why not just char*?
 //               Can cStringIO let us work with a BufferedTransport?
 // TODO(dreiss): Don't ignore the rv from cwrite (maybe).
@@ -37,14 +37,122 @@
 PyObject* INTERN_STRING(TFrozenDict);
 PyObject* INTERN_STRING(cstringio_buf);
 PyObject* INTERN_STRING(cstringio_refill);
+PyObject* INTERN_STRING(thrift_spec);
+PyObject* INTERN_STRING(cbuffer_view);
+PyObject* INTERN_STRING(cbuffer_seek);
+static PyObject* INTERN_STRING(cbuffer_output);
+static PyObject* INTERN_STRING(cbuffer_written);
+PyObject* INTERN_STRING(getbuffer);
+PyObject* INTERN_STRING(tell);
+PyObject* INTERN_STRING(seek);
+PyObject* INTERN_STRING(TSizedIterable);
+PyObject* INTERN_STRING(chunk_size);
+PyObject* INTERN_STRING(write);
+PyObject* INTERN_STRING(drain);
+PyObject* INTERN_STRING(size);
+PyObject* INTERN_STRING(max_length);
+PyObject* INTERN_STRING(current);
+PyObject* INTERN_STRING(get);
+PyObject* INTERN_STRING(put);
+PyObject* INTERN_STRING(TFrozenBase);
+PyObject* INTERN_STRING(binary);
+PyObject* INTERN_STRING(compact);
+PyObject* INTERN_STRING(previous);
+PyObject* INTERN_STRING(rotate);
+PyObject* INTERN_STRING(_thrift_compiled_specs);
 static PyObject* INTERN_STRING(string_length_limit);
 static PyObject* INTERN_STRING(container_length_limit);
 static PyObject* INTERN_STRING(trans);
+static PyObject* INTERN_STRING(typed_arrays);
+static PyObject* INTERN_STRING(binary_views);
+static PyObject* INTERN_STRING(intern_table);
+static PyObject* INTERN_STRING(encoded_cache);
 
 namespace apache {
 namespace thrift {
 namespace py {
 
+static bool parse_top_level_args(SpecArgs* dest, PyObject* typeargs) {
+  if (!PyTuple_Check(typeargs)) {
+    PyErr_SetString(PyExc_TypeError, "expecting tuple of size 2 for struct args");
+    return false;
+  }
+  return compile_spec_args(dest, T_STRUCT, typeargs) && nested_struct_spec(*dest);
+}
+
+/**
+ * The header of a whole message to encode in front of the struct.
+ */
+struct MessageHeader {
+  PyObject* name; // UTF-8 encoded bytes
+  int8_t type;
+  int32_t seqid;
+  bool strict_write;
+};
+
+template <typename T>
+static void write_message_begin(T& protocol, const MessageHeader* header) {
+  if (header) {
+    protocol.setStrict(false, header->strict_write);
+    protocol.writeMessageBegin(header->name, header->type, header->seqid);
+  }
+}
+
+template <typename T>
+static void write_message_end(T& protocol, const MessageHeader* header) {
+  if (header) {
+    protocol.writeMessageEnd();
+  }
+}
+
+/**
+ * Returns the number of bytes encoding enc_obj takes, counted without
+ * encoding it, or -1 on error.
+ */
+template <typename T>
+static Py_ssize_t encoded_size(PyObject* enc_obj,
+                               SpecArgs& parsedargs,
+                               PyObject* encoded_cache,
+                               PyObject* encoding_key) {
+  T protocol;
+  if (!protocol.setEncodedCache(encoded_cache, encoding_key) || !protocol.prepareEncodeCount()) {
+    return -1;
+  }
+  if (!protocol.encodeValue(enc_obj, T_STRUCT, parsedargs) || PyErr_Occurred()) {
+    return -1;
+  }
+  return protocol.finishEncodeTarget();
+}
+
+template <typename T>
+static PyObject* encode_struct(PyObject* enc_obj,
+                               PyObject* type_args,
+                               const MessageHeader* header = NULL,
+                               const EncodeSink* sink = NULL,
+                               PyObject* encoded_cache = NULL,
+                               PyObject* encoding_key = NULL) {
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, type_args)) {
+    return NULL;
+  }
+
+  T protocol;
+  if (!protocol.setEncodedCache(encoded_cache, encoding_key) || !protocol.prepareEncodeBuffer()) {
+    return NULL;
+  }
+  protocol.setSink(sink);
+  write_message_begin(protocol, header);
+  if (!protocol.encodeValue(enc_obj, T_STRUCT, parsedargs) || PyErr_Occurred()) {
+    return NULL;
+  }
+  write_message_end(protocol, header);
+  if (PyErr_Occurred()) {
+    return NULL;
+  }
+
+  return protocol.getEncodedValue();
+}
+
 template <typename T>
 static PyObject* encode_impl(PyObject* args) {
   if (!args)
@@ -59,12 +167,90 @@ static PyObject* encode_impl(PyObject* args) {
     return NULL;
   }
 
+  return encode_struct<T>(enc_obj, type_args);
+}
+
+/**
+ * Encodes a struct into the caller owned out buffer starting at offset.
+ * Returns the offset just past the encoded bytes.
+ */
+template <typename T>
+static PyObject* encode_struct_into(PyObject* out,
+                                    Py_ssize_t offset,
+                                    bool framed,
+                                    PyObject* enc_obj,
+                                    PyObject* type_args,
+                                    const MessageHeader* header = NULL,
+                                    const EncodeSink* sink = NULL,
+                                    PyObject* encoded_cache = NULL,
+                                    PyObject* encoding_key = NULL) {
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, type_args)) {
+    return NULL;
+  }
+
   T protocol;
-  if (!protocol.prepareEncodeBuffer() || !protocol.encodeValue(enc_obj, T_STRUCT, type_args)) {
+  if (!protocol.setEncodedCache(encoded_cache, encoding_key)
+      || !protocol.prepareEncodeTarget(out, offset, framed)) {
+    return NULL;
+  }
+  protocol.setSink(sink);
+  write_message_begin(protocol, header);
+  if (!protocol.encodeValue(enc_obj, T_STRUCT, parsedargs) || PyErr_Occurred()) {
     return NULL;
   }
+  write_message_end(protocol, header);
+  Py_ssize_t end = protocol.finishEncodeTarget();
+  if (end < 0) {
+    return NULL;
+  }
+  return PyInt_FromSsize_t(end);
+}
 
-  return protocol.getEncodedValue();
+template <typename T>
+static PyObject* encode_into_impl(PyObject* args, PyObject* kwargs) {
+  static const char* kwlist[] = {"out", "obj", "typeargs", "offset", "framed", NULL};
+  PyObject* out = NULL;
+  PyObject* enc_obj = NULL;
+  PyObject* type_args = NULL;
+  Py_ssize_t offset = 0;
+  PyObject* framed = Py_False;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|nO", const_cast<char**>(kwlist), &out,
+                                   &enc_obj, &type_args, &offset, &framed)) {
+    return NULL;
+  }
+  int is_framed = PyObject_IsTrue(framed);
+  if (is_framed < 0) {
+    return NULL;
+  }
+  return encode_struct_into<T>(out, offset, is_framed != 0, enc_obj, type_args);
+}
+
+/**
+ * Converts value, a struct of the class typeargs describes, to primitives
+ * or back from them.
+ */
+static PyObject* convert_primitive(PyObject* args, PyObject* kwargs, bool to) {
+  static const char* to_kwlist[] = {"obj", "typeargs", "simple_json", NULL};
+  static const char* from_kwlist[] = {"data", "typeargs", "simple_json", NULL};
+  PyObject* value = NULL;
+  PyObject* type_args = NULL;
+  PyObject* simple_json = Py_False;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, to ? "OO|O:to_primitive" : "OO|O:from_primitive",
+                                   const_cast<char**>(to ? to_kwlist : from_kwlist), &value,
+                                   &type_args, &simple_json)) {
+    return NULL;
+  }
+  int is_simple_json = PyObject_IsTrue(simple_json);
+  if (is_simple_json < 0) {
+    return NULL;
+  }
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, type_args)) {
+    return NULL;
+  }
+  return to ? to_primitive(value, T_STRUCT, parsedargs, is_simple_json != 0)
+            : from_primitive(value, T_STRUCT, parsedargs, is_simple_json != 0);
 }
 
 static inline long as_long_then_delete(PyObject* value, long default_value) {
@@ -77,6 +263,92 @@ static inline long as_long_then_delete(PyObject* value, long default_value) {
   return v;
 }
 
+template <typename T>
+static PyObject* decode_struct(PyObject* output_obj,
+                               PyObject* transport,
+                               long string_limit,
+                               long container_limit,
+                               bool typed_arrays,
+                               bool binary_views,
+                               PyObject* intern_table,
+                               PyObject* typeargs) {
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, typeargs)) {
+    return NULL;
+  }
+
+  T protocol;
+  protocol.setStringLengthLimit(string_limit);
+  protocol.setContainerLengthLimit(container_limit);
+  protocol.setTypedArrays(typed_arrays);
+  protocol.setBinaryViews(binary_views);
+  if (!protocol.setInternTable(intern_table)
+      || !protocol.prepareDecodeBufferFromTransport(transport)) {
+    return NULL;
+  }
+
+  ScopedPyObject ret(
+      protocol.readStruct(output_obj, parsedargs.structargs.klass, parsedargs.nested));
+  if (!ret || !protocol.finishDecode()) {
+    return NULL;
+  }
+  return ret.release();
+}
+
+/**
+ * Decodes a struct from the start of any object supporting the buffer
+ * protocol, returning a (struct, bytes consumed) tuple.
+ */
+template <typename T>
+static PyObject* decode_struct_from_buffer(PyObject* output_obj,
+                                           PyObject* buf,
+                                           long string_limit,
+                                           long container_limit,
+                                           bool typed_arrays,
+                                           bool binary_views,
+                                           PyObject* intern_table,
+                                           PyObject* typeargs) {
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, typeargs)) {
+    return NULL;
+  }
+
+  T protocol;
+  protocol.setStringLengthLimit(string_limit);
+  protocol.setContainerLengthLimit(container_limit);
+  protocol.setTypedArrays(typed_arrays);
+  protocol.setBinaryViews(binary_views);
+  if (!protocol.setInternTable(intern_table)
+      || !protocol.prepareDecodeBufferFromBuffer(buf)) {
+    return NULL;
+  }
+
+  ScopedPyObject ret(
+      protocol.readStruct(output_obj, parsedargs.structargs.klass, parsedargs.nested));
+  if (!ret) {
+    return NULL;
+  }
+  return Py_BuildValue("(On)", ret.get(), protocol.readPosition());
+}
+
+static PyObject* get_optional_attr(PyObject* obj, PyObject* name) {
+  PyObject* value = PyObject_GetAttr(obj, name);
+  if (!value && PyErr_ExceptionMatches(PyExc_AttributeError)) {
+    PyErr_Clear();
+  }
+  return value;
+}
+
+// Returns 1 when obj has a true attribute name, 0 when it is false or
+// missing, -1 on error.
+static int optional_flag(PyObject* obj, PyObject* name) {
+  ScopedPyObject value(get_optional_attr(obj, name));
+  if (!value) {
+    return PyErr_Occurred() ? -1 : 0;
+  }
+  return PyObject_IsTrue(value.get());
+}
+
 template <typename T>
 static PyObject* decode_impl(PyObject* args) {
   PyObject* output_obj = NULL;
@@ -86,30 +358,511 @@ static PyObject* decode_impl(PyObject* args) {
     return NULL;
   }
 
-  T protocol;
   int32_t default_limit = (std::numeric_limits<int32_t>::max)();
-  protocol.setStringLengthLimit(
-      as_long_then_delete(PyObject_GetAttr(oprot, INTERN_STRING(string_length_limit)),
-                          default_limit));
-  protocol.setContainerLengthLimit(
-      as_long_then_delete(PyObject_GetAttr(oprot, INTERN_STRING(container_length_limit)),
-                          default_limit));
+  if (PyObject_CheckBuffer(oprot)) {
+    return decode_struct_from_buffer<T>(output_obj, oprot, default_limit, default_limit, false,
+                                        false, NULL, typeargs);
+  }
+
+  long string_limit
+      = as_long_then_delete(PyObject_GetAttr(oprot, INTERN_STRING(string_length_limit)),
+                            default_limit);
+  long container_limit
+      = as_long_then_delete(PyObject_GetAttr(oprot, INTERN_STRING(container_length_limit)),
+                            default_limit);
+  int is_typed_arrays = optional_flag(oprot, INTERN_STRING(typed_arrays));
+  int is_binary_views = optional_flag(oprot, INTERN_STRING(binary_views));
+  ScopedPyObject intern_table(get_optional_attr(oprot, INTERN_STRING(intern_table)));
   ScopedPyObject transport(PyObject_GetAttr(oprot, INTERN_STRING(trans)));
-  if (!transport) {
+  if (is_typed_arrays < 0 || is_binary_views < 0 || PyErr_Occurred() || !transport) {
+    return NULL;
+  }
+
+  return decode_struct<T>(output_obj, transport.get(), string_limit, container_limit,
+                          is_typed_arrays != 0, is_binary_views != 0, intern_table.get(),
+                          typeargs);
+}
+
+/**
+ * A codec bound to the transport and length limits of one protocol
+ * instance, so that decoding doesn't have to look them up on every call.
+ * The accelerated protocols call __init__ again whenever one of those
+ * attributes is set, to rebind it.
+ */
+struct BoundCodec {
+  PyObject_HEAD
+  PyObject* trans;
+  // trans.cbuffer_output and trans.cbuffer_written, when implemented
+  PyObject* output_callable;
+  PyObject* written_callable;
+  long string_limit;
+  long container_limit;
+  bool strict_read;
+  bool strict_write;
+  bool typed_arrays;
+  bool binary_views;
+  // a TInternTable, or NULL
+  PyObject* intern_table;
+  // a TEncodedCache, or NULL
+  PyObject* encoded_cache;
+  // the encoding_key() of the protocol, or NULL
+  PyObject* encoding_key;
+};
+
+static int bound_codec_init(BoundCodec* self, PyObject* args, PyObject* kwargs) {
+  static const char* kwlist[] = {"trans",        "string_length_limit", "container_length_limit",
+                                 "strict_read",  "strict_write",        "typed_arrays",
+                                 "binary_views", "intern_table",        "encoded_cache",
+                                 "encoding_key", NULL};
+  PyObject* trans = Py_None;
+  PyObject* string_limit = Py_None;
+  PyObject* container_limit = Py_None;
+  PyObject* strict_read = Py_False;
+  PyObject* strict_write = Py_True;
+  PyObject* typed_arrays = Py_False;
+  PyObject* binary_views = Py_False;
+  PyObject* intern_table = Py_None;
+  PyObject* encoded_cache = Py_None;
+  PyObject* encoding_key = Py_None;
+  if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOOOOOOOOO", const_cast<char**>(kwlist),
+                                   &trans, &string_limit, &container_limit, &strict_read,
+                                   &strict_write, &typed_arrays, &binary_views, &intern_table,
+                                   &encoded_cache, &encoding_key)) {
+    return -1;
+  }
+  int is_strict_read = PyObject_IsTrue(strict_read);
+  int is_strict_write = PyObject_IsTrue(strict_write);
+  int is_typed_arrays = PyObject_IsTrue(typed_arrays);
+  int is_binary_views = PyObject_IsTrue(binary_views);
+  if (is_strict_read < 0 || is_strict_write < 0 || is_typed_arrays < 0 || is_binary_views < 0) {
+    return -1;
+  }
+  self->strict_read = is_strict_read != 0;
+  self->strict_write = is_strict_write != 0;
+  self->typed_arrays = is_typed_arrays != 0;
+  self->binary_views = is_binary_views != 0;
+  int32_t default_limit = (std::numeric_limits<int32_t>::max)();
+  Py_INCREF(string_limit);
+  self->string_limit = as_long_then_delete(string_limit, default_limit);
+  Py_INCREF(container_limit);
+  self->container_limit = as_long_then_delete(container_limit, default_limit);
+  if (PyErr_Occurred()) {
+    return -1;
+  }
+
+  ScopedPyObject output_callable;
+  ScopedPyObject written_callable;
+  if (trans == Py_None) {
+    trans = NULL;
+  } else {
+    output_callable.reset(get_optional_attr(trans, INTERN_STRING(cbuffer_output)));
+    written_callable.reset(get_optional_attr(trans, INTERN_STRING(cbuffer_written)));
+    if (PyErr_Occurred()) {
+      return -1;
+    }
+    if (!output_callable || !written_callable) {
+      output_callable.reset(NULL);
+      written_callable.reset(NULL);
+    }
+  }
+  if (intern_table == Py_None) {
+    intern_table = NULL;
+  }
+  if (encoded_cache == Py_None) {
+    encoded_cache = NULL;
+  }
+  if (encoding_key == Py_None) {
+    encoding_key = NULL;
+  }
+  PyObject* old_trans = self->trans;
+  PyObject* old_output = self->output_callable;
+  PyObject* old_written = self->written_callable;
+  PyObject* old_intern_table = self->intern_table;
+  PyObject* old_encoded_cache = self->encoded_cache;
+  PyObject* old_encoding_key = self->encoding_key;
+  Py_XINCREF(trans);
+  Py_XINCREF(intern_table);
+  Py_XINCREF(encoded_cache);
+  Py_XINCREF(encoding_key);
+  self->trans = trans;
+  self->output_callable = output_callable.release();
+  self->written_callable = written_callable.release();
+  self->intern_table = intern_table;
+  self->encoded_cache = encoded_cache;
+  self->encoding_key = encoding_key;
+  Py_XDECREF(old_trans);
+  Py_XDECREF(old_output);
+  Py_XDECREF(old_written);
+  Py_XDECREF(old_intern_table);
+  Py_XDECREF(old_encoded_cache);
+  Py_XDECREF(old_encoding_key);
+  return 0;
+}
+
+static int bound_codec_traverse(BoundCodec* self, visitproc visit, void* arg) {
+  Py_VISIT(self->trans);
+  Py_VISIT(self->output_callable);
+  Py_VISIT(self->written_callable);
+  Py_VISIT(self->intern_table);
+  Py_VISIT(self->encoded_cache);
+  Py_VISIT(self->encoding_key);
+  return 0;
+}
+
+static int bound_codec_clear(BoundCodec* self) {
+  Py_CLEAR(self->trans);
+  Py_CLEAR(self->output_callable);
+  Py_CLEAR(self->written_callable);
+  Py_CLEAR(self->intern_table);
+  Py_CLEAR(self->encoded_cache);
+  Py_CLEAR(self->encoding_key);
+  return 0;
+}
+
+static void bound_codec_dealloc(BoundCodec* self) {
+  PyObject_GC_UnTrack(self);
+  bound_codec_clear(self);
+  Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+// decode(output, iprot, typeargs), the signature of decode_binary.
+// iprot is ignored in favor of the bound transport and limits.
+template <typename T>
+static PyObject* bound_codec_decode(BoundCodec* self, PyObject* args) {
+  if (PyTuple_GET_SIZE(args) != 3) {
+    PyErr_SetString(PyExc_TypeError, "decode() takes exactly 3 arguments");
+    return NULL;
+  }
+  if (!self->trans) {
+    PyErr_SetString(PyExc_ValueError, "codec is not bound to a transport");
+    return NULL;
+  }
+  return decode_struct<T>(PyTuple_GET_ITEM(args, 0), self->trans, self->string_limit,
+                          self->container_limit, self->typed_arrays, self->binary_views,
+                          self->intern_table, PyTuple_GET_ITEM(args, 2));
+}
+
+// decode_buffer(output, buf, typeargs) -> (output, bytes consumed)
+template <typename T>
+static PyObject* bound_codec_decode_buffer(BoundCodec* self, PyObject* args) {
+  if (PyTuple_GET_SIZE(args) != 3) {
+    PyErr_SetString(PyExc_TypeError, "decode_buffer() takes exactly 3 arguments");
+    return NULL;
+  }
+  return decode_struct_from_buffer<T>(PyTuple_GET_ITEM(args, 0), PyTuple_GET_ITEM(args, 1),
+                                      self->string_limit, self->container_limit,
+                                      self->typed_arrays, self->binary_views,
+                                      self->intern_table,
+                                      PyTuple_GET_ITEM(args, 2));
+}
+
+// scan(buf) -> (fields, bytes consumed), fields being a list of
+// (tag, type, start, end, value) tuples for the struct encoded in buf.
+template <typename T>
+static PyObject* bound_codec_scan(BoundCodec* self, PyObject* buf) {
+  T protocol;
+  protocol.setStringLengthLimit(self->string_limit);
+  protocol.setContainerLengthLimit(self->container_limit);
+  if (!protocol.prepareDecodeBufferFromBuffer(buf)) {
+    return NULL;
+  }
+  ScopedPyObject fields(protocol.scanStruct());
+  if (!fields) {
+    return NULL;
+  }
+  return Py_BuildValue("(On)", fields.get(), protocol.readPosition());
+}
+
+// decode_value(buf, type, spec_args) -> a single value of the given type,
+// as found between the start and end offsets returned by scan().
+template <typename T>
+static PyObject* bound_codec_decode_value(BoundCodec* self, PyObject* args) {
+  PyObject* buf;
+  int type;
+  PyObject* typeargs;
+  if (!PyArg_ParseTuple(args, "OiO", &buf, &type, &typeargs)) {
+    return NULL;
+  }
+  SpecArgs parsedargs;
+  if (!compile_spec_args(&parsedargs, static_cast<TType>(type), typeargs)) {
+    return NULL;
+  }
+
+  T protocol;
+  protocol.setStringLengthLimit(self->string_limit);
+  protocol.setContainerLengthLimit(self->container_limit);
+  protocol.setTypedArrays(self->typed_arrays);
+  protocol.setBinaryViews(self->binary_views);
+  if (!protocol.setInternTable(self->intern_table)
+      || !protocol.prepareDecodeBufferFromBuffer(buf)) {
+    return NULL;
+  }
+  return protocol.readValue(static_cast<TType>(type), parsedargs);
+}
+
+// Encodes into the transport's write buffer when it implements
+// cbuffer_output, returning an empty string for the caller to write.
+// TSizedIterables with a chunk_size are drained into the transport as they
+// are encoded.
+template <typename T>
+static PyObject* bound_codec_write(BoundCodec* self,
+                                   PyObject* enc_obj,
+                                   PyObject* type_args,
+                                   const MessageHeader* header) {
+  EncodeSink sink = {self->trans, self->output_callable, self->written_callable};
+  const EncodeSink* sink_ptr = self->trans ? &sink : NULL;
+  if (self->output_callable) {
+    ScopedPyObject target(PyObject_CallObject(self->output_callable, NULL));
+    if (!target) {
+      return NULL;
+    }
+    if (target.get() != Py_None) {
+      PyObject* out;
+      Py_ssize_t offset;
+      if (!PyTuple_Check(target.get())
+          || !PyArg_ParseTuple(target.get(), "On", &out, &offset)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "cbuffer_output must return an (output, offset) tuple or None");
+        return NULL;
+      }
+      ScopedPyObject end(encode_struct_into<T>(out, offset, false, enc_obj, type_args, header,
+                                               sink_ptr, self->encoded_cache,
+                                               self->encoding_key));
+      if (!end) {
+        return NULL;
+      }
+      ScopedPyObject ret(PyObject_CallFunctionObjArgs(self->written_callable, end.get(), NULL));
+      if (!ret) {
+        return NULL;
+      }
+      return PyBytes_FromStringAndSize(NULL, 0);
+    }
+  }
+  return encode_struct<T>(enc_obj, type_args, header, sink_ptr, self->encoded_cache,
+                          self->encoding_key);
+}
+
+// encode(obj, typeargs), the signature of encode_binary.
+template <typename T>
+static PyObject* bound_codec_encode(BoundCodec* self, PyObject* args) {
+  if (PyTuple_GET_SIZE(args) != 2) {
+    PyErr_SetString(PyExc_TypeError, "encode() takes exactly 2 arguments");
+    return NULL;
+  }
+  return bound_codec_write<T>(self, PyTuple_GET_ITEM(args, 0), PyTuple_GET_ITEM(args, 1), NULL);
+}
+
+// encode_message(name, type, seqid, obj) -> the whole message: header, obj
+// and end.  Like encode(), the transport's write buffer is encoded into when
+// possible.
+template <typename T>
+static PyObject* bound_codec_encode_message(BoundCodec* self, PyObject* args) {
+  PyObject* name;
+  int type;
+  int32_t seqid;
+  PyObject* enc_obj;
+  if (!PyArg_ParseTuple(args, "OiiO", &name, &type, &seqid, &enc_obj)) {
+    return NULL;
+  }
+  ScopedPyObject spec(PyObject_GetAttr(enc_obj, INTERN_STRING(thrift_spec)));
+  if (!spec) {
+    return NULL;
+  }
+  ScopedPyObject type_args(
+      PyTuple_Pack(2, reinterpret_cast<PyObject*>(Py_TYPE(enc_obj)), spec.get()));
+  ScopedPyObject name_bytes(message_name_to_bytes(name));
+  if (!type_args || !name_bytes) {
+    return NULL;
+  }
+  MessageHeader header = {name_bytes.get(), static_cast<int8_t>(type), seqid, self->strict_write};
+  return bound_codec_write<T>(self, enc_obj, type_args.get(), &header);
+}
+
+// encoded_size(obj, typeargs) -> the number of bytes encode() produces for
+// obj, counted without encoding it.
+template <typename T>
+static PyObject* bound_codec_encoded_size(BoundCodec* self, PyObject* args) {
+  PyObject* enc_obj = NULL;
+  PyObject* type_args = NULL;
+  if (!PyArg_ParseTuple(args, "OO", &enc_obj, &type_args)) {
+    return NULL;
+  }
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, type_args)) {
+    return NULL;
+  }
+  Py_ssize_t size = encoded_size<T>(enc_obj, parsedargs, self->encoded_cache,
+                                     self->encoding_key);
+  if (size < 0) {
+    return NULL;
+  }
+  return PyInt_FromSsize_t(size);
+}
+
+// decode_message(classes) -> (name, type, seqid, body), read from the bound
+// transport.  classes maps message names to the classes of their bodies.
+template <typename T>
+static PyObject* bound_codec_decode_message(BoundCodec* self, PyObject* args) {
+  PyObject* classes;
+  if (!PyArg_ParseTuple(args, "O!", &PyDict_Type, &classes)) {
+    return NULL;
+  }
+  if (!self->trans) {
+    PyErr_SetString(PyExc_ValueError, "codec is not bound to a transport");
+    return NULL;
+  }
+
+  T protocol;
+  protocol.setStringLengthLimit(self->string_limit);
+  protocol.setContainerLengthLimit(self->container_limit);
+  protocol.setStrict(self->strict_read, self->strict_write);
+  protocol.setTypedArrays(self->typed_arrays);
+  protocol.setBinaryViews(self->binary_views);
+  if (!protocol.setInternTable(self->intern_table)
+      || !protocol.prepareDecodeBufferFromTransport(self->trans)) {
+    return NULL;
+  }
+  ScopedPyObject ret(protocol.readMessage(classes));
+  if (!ret || !protocol.finishDecode()) {
     return NULL;
   }
+  return ret.release();
+}
 
-  StructTypeArgs parsedargs;
-  if (!parse_struct_args(&parsedargs, typeargs)) {
+// encode_many(objs) -> [bytes], each object encoded on its own with the
+// thrift_spec of its class, through a single protocol.
+template <typename T>
+static PyObject* bound_codec_encode_many(BoundCodec* self, PyObject* objs) {
+  ScopedPyObject seq(PySequence_Fast(objs, "encode_many() expects a sequence"));
+  if (!seq) {
+    return NULL;
+  }
+  Py_ssize_t count = PySequence_Fast_GET_SIZE(seq.get());
+  ScopedPyObject result(PyList_New(count));
+  T protocol;
+  if (!result || !protocol.setEncodedCache(self->encoded_cache, self->encoding_key)
+      || !protocol.prepareEncodeBuffer()) {
     return NULL;
   }
+  SpecArgs parsedargs;
+  ScopedPyObject type_args;
+  for (Py_ssize_t i = 0; i < count; ++i) {
+    PyObject* obj = PySequence_Fast_GET_ITEM(seq.get(), i);
+    PyObject* klass = reinterpret_cast<PyObject*>(Py_TYPE(obj));
+    if (!type_args || PyTuple_GET_ITEM(type_args.get(), 0) != klass) {
+      ScopedPyObject spec(PyObject_GetAttr(obj, INTERN_STRING(thrift_spec)));
+      if (!spec) {
+        return NULL;
+      }
+      type_args.reset(PyTuple_Pack(2, klass, spec.get()));
+      parsedargs.nested = NULL;
+      if (!type_args || !parse_top_level_args(&parsedargs, type_args.get())) {
+        return NULL;
+      }
+    }
+    if ((i && !protocol.resetEncodeBuffer())
+        || !protocol.encodeValue(obj, T_STRUCT, parsedargs) || PyErr_Occurred()) {
+      return NULL;
+    }
+    PyObject* encoded = protocol.getEncodedValue();
+    if (!encoded) {
+      return NULL;
+    }
+    PyList_SET_ITEM(result.get(), i, encoded);
+  }
+  return result.release();
+}
 
-  if (!protocol.prepareDecodeBufferFromTransport(transport.get())) {
+// decode_many(bufs, typeargs) -> [struct], one struct decoded from the start
+// of each buffer, through a single protocol.
+template <typename T>
+static PyObject* bound_codec_decode_many(BoundCodec* self, PyObject* args) {
+  PyObject* bufs;
+  PyObject* typeargs;
+  if (!PyArg_ParseTuple(args, "OO", &bufs, &typeargs)) {
+    return NULL;
+  }
+  SpecArgs parsedargs;
+  if (!parse_top_level_args(&parsedargs, typeargs)) {
+    return NULL;
+  }
+  ScopedPyObject seq(PySequence_Fast(bufs, "decode_many() expects a sequence"));
+  if (!seq) {
+    return NULL;
+  }
+  Py_ssize_t count = PySequence_Fast_GET_SIZE(seq.get());
+  ScopedPyObject result(PyList_New(count));
+  if (!result) {
     return NULL;
   }
 
-  return protocol.readStruct(output_obj, parsedargs.klass, parsedargs.spec);
+  T protocol;
+  protocol.setStringLengthLimit(self->string_limit);
+  protocol.setContainerLengthLimit(self->container_limit);
+  protocol.setTypedArrays(self->typed_arrays);
+  protocol.setBinaryViews(self->binary_views);
+  if (!protocol.setInternTable(self->intern_table)) {
+    return NULL;
+  }
+  for (Py_ssize_t i = 0; i < count; ++i) {
+    if (!protocol.prepareDecodeBufferFromBuffer(PySequence_Fast_GET_ITEM(seq.get(), i))) {
+      return NULL;
+    }
+    PyObject* decoded
+        = protocol.readStruct(Py_None, parsedargs.structargs.klass, parsedargs.nested);
+    if (!decoded) {
+      return NULL;
+    }
+    PyList_SET_ITEM(result.get(), i, decoded);
+    if (!protocol.finishDecode()) {
+      return NULL;
+    }
+  }
+  return result.release();
 }
+
+template <typename T>
+struct BoundCodecType {
+  static PyMethodDef methods[];
+  static PyTypeObject type;
+
+  static bool ready(const char* name, const char* doc) {
+    type.tp_name = name;
+    type.tp_doc = doc;
+    type.tp_basicsize = sizeof(BoundCodec);
+    type.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC;
+    type.tp_new = PyType_GenericNew;
+    type.tp_init = reinterpret_cast<initproc>(bound_codec_init);
+    type.tp_traverse = reinterpret_cast<traverseproc>(bound_codec_traverse);
+    type.tp_clear = reinterpret_cast<inquiry>(bound_codec_clear);
+    type.tp_dealloc = reinterpret_cast<destructor>(bound_codec_dealloc);
+    type.tp_methods = methods;
+    return PyType_Ready(&type) == 0;
+  }
+};
+
+template <typename T>
+PyMethodDef BoundCodecType<T>::methods[] = {
+    {"decode", reinterpret_cast<PyCFunction>(bound_codec_decode<T>), METH_VARARGS, ""},
+    {"decode_buffer", reinterpret_cast<PyCFunction>(bound_codec_decode_buffer<T>), METH_VARARGS,
+     ""},
+    {"encode", reinterpret_cast<PyCFunction>(bound_codec_encode<T>), METH_VARARGS, ""},
+    {"scan", reinterpret_cast<PyCFunction>(bound_codec_scan<T>), METH_O, ""},
+    {"decode_value", reinterpret_cast<PyCFunction>(bound_codec_decode_value<T>), METH_VARARGS,
+     ""},
+    {"decode_message", reinterpret_cast<PyCFunction>(bound_codec_decode_message<T>), METH_VARARGS,
+     ""},
+    {"encode_message", reinterpret_cast<PyCFunction>(bound_codec_encode_message<T>), METH_VARARGS,
+     ""},
+    {"encode_many", reinterpret_cast<PyCFunction>(bound_codec_encode_many<T>), METH_O, ""},
+    {"encoded_size", reinterpret_cast<PyCFunction>(bound_codec_encoded_size<T>), METH_VARARGS,
+     ""},
+    {"decode_many", reinterpret_cast<PyCFunction>(bound_codec_decode_many<T>), METH_VARARGS, ""},
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+template <typename T>
+PyTypeObject BoundCodecType<T>::type = {PyVarObject_HEAD_INIT(NULL, 0)};
 }
 }
 }
@@ -136,11 +889,45 @@ static PyObject* decode_compact(PyObject*, PyObject* args) {
   return decode_impl<CompactProtocol>(args);
 }
 
+static PyObject* encode_json(PyObject*, PyObject* args) {
+  return encode_impl<JSONProtocol>(args);
+}
+
+static PyObject* decode_json(PyObject*, PyObject* args) {
+  return decode_impl<JSONProtocol>(args);
+}
+
+static PyObject* encode_binary_into(PyObject*, PyObject* args, PyObject* kwargs) {
+  return encode_into_impl<BinaryProtocol>(args, kwargs);
+}
+
+static PyObject* encode_compact_into(PyObject*, PyObject* args, PyObject* kwargs) {
+  return encode_into_impl<CompactProtocol>(args, kwargs);
+}
+
+static PyObject* convert_to_primitive(PyObject*, PyObject* args, PyObject* kwargs) {
+  return convert_primitive(args, kwargs, true);
+}
+
+static PyObject* convert_from_primitive(PyObject*, PyObject* args, PyObject* kwargs) {
+  return convert_primitive(args, kwargs, false);
+}
+
 static PyMethodDef ThriftFastBinaryMethods[] = {
     {"encode_binary", encode_binary, METH_VARARGS, ""},
     {"decode_binary", decode_binary, METH_VARARGS, ""},
     {"encode_compact", encode_compact, METH_VARARGS, ""},
     {"decode_compact", decode_compact, METH_VARARGS, ""},
+    {"encode_json", encode_json, METH_VARARGS, ""},
+    {"decode_json", decode_json, METH_VARARGS, ""},
+    {"encode_binary_into", reinterpret_cast<PyCFunction>(encode_binary_into),
+     METH_VARARGS | METH_KEYWORDS, ""},
+    {"encode_compact_into", reinterpret_cast<PyCFunction>(encode_compact_into),
+     METH_VARARGS | METH_KEYWORDS, ""},
+    {"to_primitive", reinterpret_cast<PyCFunction>(convert_to_primitive),
+     METH_VARARGS | METH_KEYWORDS, "to_primitive(obj, typeargs, simple_json=False)"},
+    {"from_primitive", reinterpret_cast<PyCFunction>(convert_from_primitive),
+     METH_VARARGS | METH_KEYWORDS, "from_primitive(data, typeargs, simple_json=False)"},
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
 
@@ -182,11 +969,57 @@ void initfastbinary() {
   INIT_INTERN_STRING(TFrozenDict);
   INIT_INTERN_STRING(cstringio_buf);
   INIT_INTERN_STRING(cstringio_refill);
+  INIT_INTERN_STRING(thrift_spec);
+  INIT_INTERN_STRING(cbuffer_view);
+  INIT_INTERN_STRING(cbuffer_seek);
+  INIT_INTERN_STRING(cbuffer_output);
+  INIT_INTERN_STRING(cbuffer_written);
+  INIT_INTERN_STRING(getbuffer);
+  INIT_INTERN_STRING(tell);
+  INIT_INTERN_STRING(seek);
+  INIT_INTERN_STRING(TSizedIterable);
+  INIT_INTERN_STRING(chunk_size);
+  INIT_INTERN_STRING(write);
+  INIT_INTERN_STRING(drain);
+  INIT_INTERN_STRING(size);
+  INIT_INTERN_STRING(max_length);
+  INIT_INTERN_STRING(current);
+  INIT_INTERN_STRING(previous);
+  INIT_INTERN_STRING(rotate);
+  INIT_INTERN_STRING(_thrift_compiled_specs);
   INIT_INTERN_STRING(string_length_limit);
   INIT_INTERN_STRING(container_length_limit);
   INIT_INTERN_STRING(trans);
+  INIT_INTERN_STRING(typed_arrays);
+  INIT_INTERN_STRING(binary_views);
+  INIT_INTERN_STRING(intern_table);
+  INIT_INTERN_STRING(get);
+  INIT_INTERN_STRING(put);
+  INIT_INTERN_STRING(TFrozenBase);
+  INIT_INTERN_STRING(binary);
+  INIT_INTERN_STRING(compact);
+  INIT_INTERN_STRING(encoded_cache);
 #undef INIT_INTERN_STRING
 
+  if (!BoundCodecType<BinaryProtocol>::ready("thrift.protocol.fastbinary.BinaryCodec",
+                                              "BinaryCodec(trans=None, string_length_limit=None, "
+                                              "container_length_limit=None, strict_read=False, "
+                                              "strict_write=True, typed_arrays=False, "
+                                              "binary_views=False, intern_table=None, "
+                                              "encoded_cache=None, encoding_key=None)")
+      || !BoundCodecType<CompactProtocol>::ready("thrift.protocol.fastbinary.CompactCodec",
+                                                 "CompactCodec(trans=None, "
+                                                 "string_length_limit=None, "
+                                                 "container_length_limit=None, "
+                                                 "typed_arrays=False, binary_views=False, "
+                                                 "intern_table=None, encoded_cache=None, "
+                                                 "encoding_key=None)")
+      || !BoundCodecType<JSONProtocol>::ready("thrift.protocol.fastbinary.JSONCodec",
+                                              "JSONCodec(trans=None, string_length_limit=None, "
+                                              "container_length_limit=None, typed_arrays=False, "
+                                              "intern_table=None)"))
+    INITERROR;
+
   PyObject* module =
 #if PY_MAJOR_VERSION >= 3
       PyModule_Create(&ThriftFastBinaryDef);
@@ -196,6 +1029,16 @@ void initfastbinary() {
   if (module == NULL)
     INITERROR;
 
+  Py_INCREF(&BoundCodecType<BinaryProtocol>::type);
+  PyModule_AddObject(module, "BinaryCodec",
+                     reinterpret_cast<PyObject*>(&BoundCodecType<BinaryProtocol>::type));
+  Py_INCREF(&BoundCodecType<CompactProtocol>::type);
+  PyModule_AddObject(module, "CompactCodec",
+                     reinterpret_cast<PyObject*>(&BoundCodecType<CompactProtocol>::type));
+  Py_INCREF(&BoundCodecType<JSONProtocol>::type);
+  PyModule_AddObject(module, "JSONCodec",
+                     reinterpret_cast<PyObject*>(&BoundCodecType<JSONProtocol>::type));
+
 #if PY_MAJOR_VERSION >= 3
   return module;
 #endif
@@ -0,0 +1,415 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements. See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership. The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License. You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied. See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+
+#include "ext/primitive.h"
+
+#include <string>
+
+#if PY_MAJOR_VERSION >= 3
+#define PyNumber_Int(v) PyNumber_Long(v)
+#endif
+
+namespace apache {
+namespace thrift {
+namespace py {
+
+namespace {
+
+inline PyObject* new_reference(PyObject* value) {
+  Py_INCREF(value);
+  return value;
+}
+
+// Whether to_primitive returns values of type as they are.
+bool kept_to_primitive(TType type, const SpecArgs& args, bool simple_json) {
+  switch (type) {
+  case T_BOOL:
+    return !simple_json;
+  case T_I08:
+  case T_I16:
+  case T_I32:
+  case T_I64:
+  case T_DOUBLE:
+    return true;
+  case T_STRING:
+    return !args.binary;
+  default:
+    return false;
+  }
+}
+
+// Whether from_primitive returns primitives of type as they are.
+bool kept_from_primitive(TType type, const SpecArgs& args, bool simple_json) {
+  switch (type) {
+  case T_BOOL:
+  case T_DOUBLE:
+    return !simple_json;
+  case T_I08:
+  case T_I16:
+  case T_I32:
+  case T_I64:
+    return true;
+  case T_STRING:
+    return !simple_json || !args.binary;
+  default:
+    return false;
+  }
+}
+
+/**
+ * Returns a new reference to value when it is a dict, or to a dict of its
+ * items otherwise.
+ */
+PyObject* as_dict(PyObject* value) {
+  if (PyDict_Check(value)) {
+    return new_reference(value);
+  }
+  ScopedPyObject dict(PyDict_New());
+  if (!dict || PyDict_Merge(dict.get(), value, 1) < 0) {
+    return NULL;
+  }
+  return dict.release();
+}
+
+PyObject* binary_to_primitive(PyObject* value, bool simple_json) {
+  if (!simple_json && !PyMemoryView_Check(value)) {
+    return new_reference(value);
+  }
+  Py_buffer view;
+  if (PyObject_GetBuffer(value, &view, PyBUF_C_CONTIGUOUS) < 0) {
+    return NULL;
+  }
+  const char* data = static_cast<const char*>(view.buf);
+  PyObject* result;
+  if (simple_json) {
+    std::string encoded;
+    base64_encode(data, view.len, encoded);
+    result = PyUnicode_DecodeASCII(encoded.data(), encoded.size(), NULL);
+  } else {
+    result = PyBytes_FromStringAndSize(data, view.len);
+  }
+  PyBuffer_Release(&view);
+  return result;
+}
+
+PyObject* binary_from_base64(PyObject* data) {
+  ScopedPyObject ascii;
+  if (PyUnicode_Check(data)) {
+    ascii.reset(PyUnicode_AsASCIIString(data));
+    if (!ascii) {
+      return NULL;
+    }
+    data = ascii.get();
+  }
+  Py_buffer view;
+  if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0) {
+    return NULL;
+  }
+  std::string decoded;
+  bool ok = base64_decode(static_cast<const char*>(view.buf), view.len, decoded);
+  PyBuffer_Release(&view);
+  if (!ok) {
+    PyErr_SetString(PyExc_ValueError, "Incorrect base64 padding");
+    return NULL;
+  }
+  return PyBytes_FromStringAndSize(decoded.data(), decoded.size());
+}
+
+/**
+ * Converts the values of a list or set to a new list, or to the items
+ * of a new list to build a container from.
+ */
+PyObject* convert_values(PyObject* value, TType etype, SpecArgs& eargs, bool simple_json,
+                         PyObject* (*convert)(PyObject*, TType, SpecArgs&, bool)) {
+  ScopedPyObject items(PySequence_Fast(value, "expecting an iterable of values"));
+  if (!items) {
+    return NULL;
+  }
+  Py_ssize_t len = PySequence_Fast_GET_SIZE(items.get());
+  ScopedPyObject result(PyList_New(len));
+  if (!result) {
+    return NULL;
+  }
+  for (Py_ssize_t i = 0; i < len; ++i) {
+    PyObject* item = convert(PySequence_Fast_GET_ITEM(items.get(), i), etype, eargs, simple_json);
+    if (!item) {
+      return NULL;
+    }
+    PyList_SET_ITEM(result.get(), i, item);
+  }
+  return result.release();
+}
+
+PyObject* struct_to_primitive(PyObject* value, SpecArgs& args, bool simple_json) {
+  StructSpec* spec = nested_struct_spec(args);
+  if (!spec) {
+    return NULL;
+  }
+  ScopedPyObject result(PyDict_New());
+  if (!result) {
+    return NULL;
+  }
+  for (std::vector<FieldSpec*>::iterator it = spec->fields.begin(); it != spec->fields.end();
+       ++it) {
+    FieldSpec* field = *it;
+    ScopedPyObject instval(PyObject_GetAttr(value, field->attrname));
+    if (!instval) {
+      return NULL;
+    }
+    // unset fields are left out, as protocols do
+    if (instval.get() == Py_None) {
+      continue;
+    }
+    ScopedPyObject converted(to_primitive(instval.get(), field->type, field->args, simple_json));
+    if (!converted || PyDict_SetItem(result.get(), field->attrname, converted.get()) < 0) {
+      return NULL;
+    }
+  }
+  return result.release();
+}
+
+PyObject* struct_from_primitive(PyObject* data, SpecArgs& args, bool simple_json) {
+  StructSpec* spec = nested_struct_spec(args);
+  if (!spec) {
+    return NULL;
+  }
+  if (!PyDict_Check(data)) {
+    PyErr_Format(PyExc_TypeError, "expecting a dict of struct fields, got %s",
+                 Py_TYPE(data)->tp_name);
+    return NULL;
+  }
+  ScopedPyObject kwargs(PyDict_New());
+  if (!kwargs) {
+    return NULL;
+  }
+  // keys that are not fields are ignored, as protocols skip unknown fields
+  for (std::vector<FieldSpec*>::iterator it = spec->fields.begin(); it != spec->fields.end();
+       ++it) {
+    FieldSpec* field = *it;
+    PyObject* val = PyDict_GetItem(data, field->attrname);
+    if (!val || val == Py_None) {
+      continue;
+    }
+    ScopedPyObject converted(from_primitive(val, field->type, field->args, simple_json));
+    if (!converted || PyDict_SetItem(kwargs.get(), field->attrname, converted.get()) < 0) {
+      return NULL;
+    }
+  }
+  ScopedPyObject noargs(PyTuple_New(0));
+  if (!noargs) {
+    return NULL;
+  }
+  return PyObject_Call(args.structargs.klass, noargs.get(), kwargs.get());
+}
+
+PyObject* frozen_dict(PyObject* dict) {
+  if (!ThriftModule) {
+    ThriftModule = PyImport_ImportModule("thrift.Thrift");
+  }
+  if (!ThriftModule) {
+    return NULL;
+  }
+  ScopedPyObject cls(PyObject_GetAttr(ThriftModule, INTERN_STRING(TFrozenDict)));
+  if (!cls) {
+    return NULL;
+  }
+  return PyObject_CallFunctionObjArgs(cls.get(), dict, NULL);
+}
+
+/**
+ * Converts a map key json.loads returned as a string back to ktype, as
+ * int() and float() do.  Bools are false for "0" and "false".
+ */
+PyObject* key_from_json(PyObject* key, TType ktype) {
+  static PyObject* false_keys = NULL;
+  switch (ktype) {
+  case T_BOOL: {
+    if (!false_keys) {
+      ScopedPyObject zero_str(PyUnicode_FromString("0"));
+      ScopedPyObject false_str(PyUnicode_FromString("false"));
+      ScopedPyObject zero(PyInt_FromLong(0));
+      if (!zero_str || !false_str || !zero) {
+        return NULL;
+      }
+      false_keys = PyTuple_Pack(3, zero_str.get(), false_str.get(), zero.get());
+      if (!false_keys) {
+        return NULL;
+      }
+    }
+    int is_false = PySequence_Contains(false_keys, key);
+    if (is_false < 0) {
+      return NULL;
+    }
+    return PyBool_FromLong(!is_false);
+  }
+  case T_DOUBLE:
+    return PyNumber_Float(key);
+  default:
+    return PyNumber_Int(key);
+  }
+}
+
+PyObject* map_to_primitive(PyObject* value, SpecArgs& args, bool simple_json) {
+  ScopedPyObject dict(as_dict(value));
+  ScopedPyObject result(PyDict_New());
+  if (!dict || !result) {
+    return NULL;
+  }
+  Py_ssize_t pos = 0;
+  PyObject* k = NULL;
+  PyObject* v = NULL;
+  while (PyDict_Next(dict.get(), &pos, &k, &v)) {
+    ScopedPyObject key(to_primitive(k, args.map.ktag, *args.element, simple_json));
+    if (!key) {
+      return NULL;
+    }
+    ScopedPyObject val(to_primitive(v, args.map.vtag, *args.value, simple_json));
+    if (!val || PyDict_SetItem(result.get(), key.get(), val.get()) < 0) {
+      return NULL;
+    }
+  }
+  return result.release();
+}
+
+PyObject* map_from_primitive(PyObject* data, SpecArgs& args, bool simple_json) {
+  const MapTypeArgs& parsedargs = args.map;
+  // json.dumps writes the keys that are not strings as strings
+  bool json_keys = simple_json && parsedargs.ktag != T_STRING && parsedargs.ktag != T_STRUCT
+                   && parsedargs.ktag != T_LIST && parsedargs.ktag != T_SET
+                   && parsedargs.ktag != T_MAP;
+  ScopedPyObject dict(as_dict(data));
+  ScopedPyObject result(PyDict_New());
+  if (!dict || !result) {
+    return NULL;
+  }
+  Py_ssize_t pos = 0;
+  PyObject* k = NULL;
+  PyObject* v = NULL;
+  while (PyDict_Next(dict.get(), &pos, &k, &v)) {
+    ScopedPyObject key(json_keys ? key_from_json(k, parsedargs.ktag)
+                                 : from_primitive(k, parsedargs.ktag, *args.element, simple_json));
+    if (!key) {
+      return NULL;
+    }
+    ScopedPyObject val(from_primitive(v, parsedargs.vtag, *args.value, simple_json));
+    if (!val || PyDict_SetItem(result.get(), key.get(), val.get()) < 0) {
+      return NULL;
+    }
+  }
+  if (parsedargs.immutable) {
+    return frozen_dict(result.get());
+  }
+  return result.release();
+}
+}
+
+PyObject* to_primitive(PyObject* value, TType type, SpecArgs& args, bool simple_json) {
+  switch (type) {
+  case T_BOOL:
+    if (simple_json) {
+      // as TSimpleJSONProtocol.writeBool
+      return PyInt_FromLong(value == Py_True ? 1 : 0);
+    }
+    return new_reference(value);
+
+  case T_I08:
+  case T_I16:
+  case T_I32:
+  case T_I64:
+  case T_DOUBLE:
+    return new_reference(value);
+
+  case T_STRING:
+    return args.binary ? binary_to_primitive(value, simple_json) : new_reference(value);
+
+  case T_LIST:
+  case T_SET: {
+    TType etype = args.setlist.element_type;
+    if (kept_to_primitive(etype, *args.element, simple_json)) {
+      if (PyMemoryView_Check(value)) {
+        return PyObject_CallMethod(value, const_cast<char*>("tolist"), NULL);
+      }
+      return PySequence_List(value);
+    }
+    return convert_values(value, etype, *args.element, simple_json, to_primitive);
+  }
+
+  case T_MAP:
+    return map_to_primitive(value, args, simple_json);
+
+  case T_STRUCT:
+    return struct_to_primitive(value, args, simple_json);
+
+  default:
+    PyErr_Format(PyExc_TypeError, "Unexpected TType for to_primitive: %d", type);
+    return NULL;
+  }
+}
+
+PyObject* from_primitive(PyObject* data, TType type, SpecArgs& args, bool simple_json) {
+  switch (type) {
+  case T_BOOL:
+    if (simple_json) {
+      int v = PyObject_IsTrue(data);
+      return v < 0 ? NULL : PyBool_FromLong(v);
+    }
+    return new_reference(data);
+
+  case T_DOUBLE:
+    return simple_json ? PyNumber_Float(data) : new_reference(data);
+
+  case T_I08:
+  case T_I16:
+  case T_I32:
+  case T_I64:
+    return new_reference(data);
+
+  case T_STRING:
+    return simple_json && args.binary ? binary_from_base64(data) : new_reference(data);
+
+  case T_LIST:
+  case T_SET: {
+    TType etype = args.setlist.element_type;
+    ScopedPyObject items(kept_from_primitive(etype, *args.element, simple_json)
+                             ? PySequence_List(data)
+                             : convert_values(data, etype, *args.element, simple_json,
+                                              from_primitive));
+    if (!items) {
+      return NULL;
+    }
+    if (type == T_LIST) {
+      return args.setlist.immutable ? PyList_AsTuple(items.get()) : items.release();
+    }
+    return args.setlist.immutable ? PyFrozenSet_New(items.get()) : PySet_New(items.get());
+  }
+
+  case T_MAP:
+    return map_from_primitive(data, args, simple_json);
+
+  case T_STRUCT:
+    return struct_from_primitive(data, args, simple_json);
+
+  default:
+    PyErr_Format(PyExc_TypeError, "Unexpected TType for from_primitive: %d", type);
+    return NULL;
+  }
+}
+}
+}
+}
@@ -0,0 +1,49 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements. See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership. The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License. You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied. See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+
+#ifndef THRIFT_PY_PRIMITIVE_H
+#define THRIFT_PY_PRIMITIVE_H
+
+#include <Python.h>
+#include "ext/types.h"
+
+namespace apache {
+namespace thrift {
+namespace py {
+
+/**
+ * Returns a new reference to value converted to primitives, as
+ * thrift.protocol.TCodec.struct_to_primitive does: structs become dicts of
+ * their set fields by name, lists and sets lists and maps dicts.  With
+ * simple_json, bools are 1 or 0 and binary strings base64 encoded.
+ */
+PyObject* to_primitive(PyObject* value, TType type, SpecArgs& args, bool simple_json);
+
+/**
+ * Returns a new reference to the value of type the primitive data converts
+ * back to, as thrift.protocol.TCodec.struct_from_primitive does.  With
+ * simple_json, the map keys json.loads returns as strings are converted
+ * back to the key type.
+ */
+PyObject* from_primitive(PyObject* data, TType type, SpecArgs& args, bool simple_json);
+}
+}
+}
+
+#endif // THRIFT_PY_PRIMITIVE_H
@@ -35,16 +35,80 @@ public:
   ProtocolBase()
     : stringLimit_(std::numeric_limits<int32_t>::max()),
       containerLimit_(std::numeric_limits<int32_t>::max()),
-      output_(NULL) {}
+      typedArrays_(false),
+      binaryViews_(false),
+      internSize_(0),
+      internMaxLength_(0),
+      output_(NULL),
+      sink_(NULL) {}
   inline virtual ~ProtocolBase();
 
   bool prepareDecodeBufferFromTransport(PyObject* trans);
 
-  PyObject* readStruct(PyObject* output, PyObject* klass, PyObject* spec_seq);
+  bool prepareDecodeBufferFromBuffer(PyObject* buf);
+
+  /**
+   * Hands the read position back to the transport once a value was decoded.
+   */
+  bool finishDecode();
+
+  Py_ssize_t readPosition() const { return input_.pos; }
+
+  PyObject* readStruct(PyObject* output, PyObject* klass, StructSpec* spec);
+
+  /**
+   * Reads a whole message: the header and a body of the class classes maps
+   * the message name to.  Returns a (name, type, seqid, body) tuple.
+   * The body of an EXCEPTION message is left unread and returned as None,
+   * the body of a message with an unknown name is skipped.
+   */
+  PyObject* readMessage(PyObject* classes);
+
+  /**
+   * Reads the fields of a struct without decoding them.  Returns a list of
+   * (tag, type, start, end, value) tuples, start and end delimiting the
+   * encoded value in the input buffer.  value is only decoded for bools,
+   * whose value may live in the field header; it is None otherwise.
+   */
+  PyObject* scanStruct();
+
+  PyObject* readValue(TType type, SpecArgs& args) { return decodeValue(type, args); }
 
   bool prepareEncodeBuffer();
 
-  bool encodeValue(PyObject* value, TType type, PyObject* typeargs);
+  /**
+   * Empties the buffer prepareEncodeBuffer set up, to encode another value.
+   */
+  bool resetEncodeBuffer();
+
+  /**
+   * Encodes into out starting at offset instead of a private buffer.  When
+   * framed, 4 bytes are reserved for the frame length, filled in by
+   * finishEncodeTarget.
+   */
+  bool prepareEncodeTarget(PyObject* out, Py_ssize_t offset, bool framed);
+
+  /**
+   * Returns the offset just past the encoded bytes, or -1 on error.
+   */
+  Py_ssize_t finishEncodeTarget();
+
+  /**
+   * Counts the bytes encodeValue would write instead of writing them, for
+   * finishEncodeTarget to return.  Values of fixed width are counted
+   * without checking them.  TSizedIterables, which can only be iterated
+   * once, cannot be counted and raise TypeError.
+   */
+  bool prepareEncodeCount();
+
+  bool encodeValue(PyObject* value, TType type, SpecArgs& args);
+
+  /**
+   * Lets encodeValue hand the bytes encoded so far to sink->trans and drain
+   * it every chunk_size elements of a TSizedIterable.  Without a sink,
+   * TSizedIterables are encoded like any other container.
+   */
+  void setSink(const EncodeSink* sink) { sink_ = sink; }
 
   PyObject* getEncodedValue();
 
@@ -54,9 +118,61 @@ public:
   long containerLimit() const { return containerLimit_; }
   void setContainerLengthLimit(long limit) { containerLimit_ = limit; }
 
+  /**
+   * Decode list<byte|i16|i32|i64|double> into array.array instead of list.
+   */
+  bool typedArrays() const { return typedArrays_; }
+  void setTypedArrays(bool enabled) { typedArrays_ = enabled; }
+
+  /**
+   * Decode binary fields into read-only memoryviews of the input buffer
+   * instead of bytes, when decoding from a buffer or a transport view.
+   */
+  bool binaryViews() const { return binaryViews_; }
+  void setBinaryViews(bool enabled) { binaryViews_ = enabled; }
+
+  /**
+   * Share decoded string map keys, and string values of up to max_length
+   * characters, through a thrift.Thrift.TInternTable.  None disables it.
+   */
+  bool setInternTable(PyObject* table);
+
+  /**
+   * Copy frozen structs from a thrift.protocol.TBase.TEncodedCache, adding
+   * the ones that are not in it yet, under key, the encoding_key() of the
+   * Python protocol.  NULL keys them by wire format alone.  None disables
+   * the cache.
+   */
+  bool setEncodedCache(PyObject* cache, PyObject* key = NULL);
+
+  /**
+   * Close what the matching Begin call opened, for the protocols that
+   * delimit containers and messages.  The defaults do nothing.
+   */
+  void writeListEnd() {}
+  void writeMapEnd() {}
+  void writeMessageEnd() {}
+  bool readListEnd() { return true; }
+  bool readMapEnd() { return true; }
+  bool readMessageEnd() { return true; }
+
+  /**
+   * Strings declared binary, for the protocols that encode them differently
+   * from UTF-8 strings.  The defaults treat them as any other string.
+   */
+  void writeBinary(const char* data, int32_t len) { impl()->writeString(data, len); }
+  int32_t readBinary(char** buf) { return impl()->readString(buf); }
+
 protected:
   bool readBytes(char** output, int len);
 
+  /**
+   * Points *output at the unread input without consuming it, refilling the
+   * buffer first when it is exhausted.  Returns the number of bytes there,
+   * or -1 on error.  Only works on a view of the input.
+   */
+  Py_ssize_t peekBytes(char** output);
+
   bool readByte(uint8_t& val) {
     char* buf;
     if (!readBytes(&buf, 1)) {
@@ -70,21 +186,80 @@ protected:
 
   void writeByte(uint8_t val) { writeBuffer(reinterpret_cast<char*>(&val), 1); }
 
-  PyObject* decodeValue(TType type, PyObject* typeargs);
+  PyObject* decodeValue(TType type, SpecArgs& args);
 
   bool skip(TType type);
 
+  /**
+   * Skips len bytes of input, in slices of at most INT_MAX.
+   */
+  bool skipBytes(int64_t len);
+
+  /**
+   * Skip count values of the given type, or count key-value pairs, one by
+   * one.  Protocols override these to skip the types they can in bulk.
+   */
+  bool skipValues(TType type, int64_t count);
+  bool skipPairs(TType ktype, TType vtype, int64_t count);
+
+  /**
+   * Reads len values of the fixed width numeric type into out, in native
+   * byte order.  Protocols override this to read the values in bulk.
+   */
+  bool readArrayData(TType type, int32_t len, char* out);
+
+  /**
+   * Writes len values of the fixed width numeric type, packed in native
+   * byte order in data.
+   */
+  void writeArrayData(TType type, const char* data, int32_t len);
+
   inline bool checkType(TType got, TType expected);
   inline bool checkLengthLimit(int32_t len, long limit);
 
-  inline bool isUtf8(PyObject* typeargs);
-
 private:
   Impl* impl() { return static_cast<Impl*>(this); }
 
+  bool writeTarget(const char* data, size_t len);
+
+  template <typename T>
+  bool readArrayValues(bool (Impl::*read)(T&), int32_t len, char* out);
+
+  PyObject* decodeArray(TType type, int32_t len);
+  int encodeArray(PyObject* value, const SetListTypeArgs& args);
+  int sizedIterable(PyObject* value, long& chunk);
+  bool checkNotCounting();
+  bool encodePairs(PyObject* value, SpecArgs& args, long chunk);
+  bool drainOutput();
+  bool drainEncoded();
+
+  bool viewTransport();
+  bool refillView(int len);
+  PyObject* readBinaryView(const char* buf, int len);
+  PyObject* internString(PyObject* str);
+  bool loadInternGenerations();
+  int writeCachedStruct(PyObject* value, SpecArgs& args);
+
   long stringLimit_;
   long containerLimit_;
+  bool typedArrays_;
+  bool binaryViews_;
+  ScopedPyObject binaryOwner_; // the input_.view.obj binaryBase_ views
+  ScopedPyObject binaryBase_;
+  // The intern table and its generations, see TInternTable.
+  ScopedPyObject internTable_;
+  ScopedPyObject internCurrent_;
+  ScopedPyObject internPrevious_;
+  long internSize_;
+  long internMaxLength_;
+  // The encoded cache and its get method, see TEncodedCache.
+  ScopedPyObject encodedCache_;
+  ScopedPyObject encodedGet_;
+  ScopedPyObject encodedKey_;
+  ScopedPyObject frozenBase_;
   EncodeBuffer* output_;
+  EncodeTarget target_;
+  const EncodeSink* sink_;
   DecodeBuffer input_;
 };
 }
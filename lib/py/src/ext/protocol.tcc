@@ -20,6 +20,8 @@
 #ifndef THRIFT_PY_PROTOCOL_TCC
 #define THRIFT_PY_PROTOCOL_TCC
 
+#include <algorithm>
+#include <cstring>
 #include <iterator>
 
 #define CHECK_RANGE(v, min, max) (((v) <= (max)) && ((v) >= (min)))
@@ -27,8 +29,6 @@
 
 #if PY_MAJOR_VERSION < 3
 #include <cStringIO.h>
-#else
-#include <algorithm>
 #endif
 
 namespace apache {
@@ -63,6 +63,10 @@ inline int read_buffer(PyObject* buf, char** output, int len) {
   }
   return PycStringIO->cread(buf, output, len);
 }
+
+inline Py_ssize_t utf8_length(PyObject*) {
+  return -1;
+}
 }
 
 template <typename Impl>
@@ -72,11 +76,6 @@ inline ProtocolBase<Impl>::~ProtocolBase() {
   }
 }
 
-template <typename Impl>
-inline bool ProtocolBase<Impl>::isUtf8(PyObject* typeargs) {
-  return PyString_Check(typeargs) && !strncmp(PyString_AS_STRING(typeargs), "UTF8", 4);
-}
-
 template <typename Impl>
 PyObject* ProtocolBase<Impl>::getEncodedValue() {
   if (!PycStringIO) {
@@ -90,6 +89,9 @@ PyObject* ProtocolBase<Impl>::getEncodedValue() {
 
 template <typename Impl>
 inline bool ProtocolBase<Impl>::writeBuffer(char* data, size_t size) {
+  if (target_.active) {
+    return writeTarget(data, size);
+  }
   if (!PycStringIO) {
     PycString_IMPORT;
   }
@@ -113,11 +115,6 @@ inline bool ProtocolBase<Impl>::writeBuffer(char* data, size_t size) {
 
 namespace detail {
 
-inline bool input_check(PyObject* input) {
-  // TODO: Check for BytesIO type
-  return true;
-}
-
 inline EncodeBuffer* new_encode_buffer(size_t size) {
   EncodeBuffer* buffer = new EncodeBuffer;
   buffer->buf.reserve(size);
@@ -125,27 +122,63 @@ inline EncodeBuffer* new_encode_buffer(size_t size) {
   return buffer;
 }
 
-struct bytesio {
-  PyObject_HEAD
-#if PY_MINOR_VERSION < 5
-      char* buf;
-#else
-      PyObject* buf;
-#endif
-  Py_ssize_t pos;
-  Py_ssize_t string_size;
-};
+inline bool acquire_view(DecodeBuffer& input,
+                         PyObject* obj,
+                         Py_ssize_t pos,
+                         DecodeBuffer::Source source);
 
-inline int read_buffer(PyObject* buf, char** output, int len) {
-  bytesio* buf2 = reinterpret_cast<bytesio*>(buf);
-#if PY_MINOR_VERSION < 5
-  *output = buf2->buf + buf2->pos;
-#else
-  *output = PyBytes_AS_STRING(buf2->buf) + buf2->pos;
+/**
+ * Views the unread part of a BytesIO through its public interface.
+ */
+inline bool stringio_view(DecodeBuffer& input) {
+  ScopedPyObject tell(
+      PyObject_CallMethodObjArgs(input.stringiobuf.get(), INTERN_STRING(tell), NULL));
+  if (!tell) {
+    return false;
+  }
+  Py_ssize_t pos = PyLong_AsSsize_t(tell.get());
+  if (pos == -1 && PyErr_Occurred()) {
+    return false;
+  }
+  ScopedPyObject memview(
+      PyObject_CallMethodObjArgs(input.stringiobuf.get(), INTERN_STRING(getbuffer), NULL));
+  if (!memview) {
+    return false;
+  }
+  return acquire_view(input, memview.get(), pos, DecodeBuffer::STRINGIO);
+}
+
+/**
+ * The length of str encoded in UTF-8, or -1 when it has to be encoded to
+ * tell, such as when it holds lone surrogates, which fail to encode.
+ */
+inline Py_ssize_t utf8_length(PyObject* str) {
+#if PY_VERSION_HEX < 0x030C0000
+  if (PyUnicode_READY(str) < 0) {
+    PyErr_Clear();
+    return -1;
+  }
 #endif
-  Py_ssize_t pos0 = buf2->pos;
-  buf2->pos = std::min(buf2->pos + static_cast<Py_ssize_t>(len), buf2->string_size);
-  return static_cast<int>(buf2->pos - pos0);
+  Py_ssize_t len = PyUnicode_GET_LENGTH(str);
+  if (PyUnicode_IS_ASCII(str)) {
+    return len;
+  }
+  int kind = PyUnicode_KIND(str);
+  const void* data = PyUnicode_DATA(str);
+  Py_ssize_t size = 0;
+  for (Py_ssize_t i = 0; i < len; ++i) {
+    Py_UCS4 c = PyUnicode_READ(kind, data, i);
+    if (c < 0x80) {
+      size += 1;
+    } else if (c < 0x800) {
+      size += 2;
+    } else if (c >= 0xd800 && c <= 0xdfff) {
+      return -1;
+    } else {
+      size += c < 0x10000 ? 3 : 4;
+    }
+  }
+  return size;
 }
 }
 
@@ -156,13 +189,6 @@ inline ProtocolBase<Impl>::~ProtocolBase() {
   }
 }
 
-template <typename Impl>
-inline bool ProtocolBase<Impl>::isUtf8(PyObject* typeargs) {
-  // while condition for py2 is "arg == 'UTF8'", it should be "arg != 'BINARY'" for py3.
-  // HACK: check the length and don't bother reading the value
-  return !PyUnicode_Check(typeargs) || PyUnicode_GET_LENGTH(typeargs) != 6;
-}
-
 template <typename Impl>
 PyObject* ProtocolBase<Impl>::getEncodedValue() {
   return PyBytes_FromStringAndSize(output_->buf.data(), output_->buf.size());
@@ -170,6 +196,9 @@ PyObject* ProtocolBase<Impl>::getEncodedValue() {
 
 template <typename Impl>
 inline bool ProtocolBase<Impl>::writeBuffer(char* data, size_t size) {
+  if (target_.active) {
+    return writeTarget(data, size);
+  }
   size_t need = size + output_->pos;
   if (output_->buf.capacity() < need) {
     try {
@@ -187,6 +216,49 @@ inline bool ProtocolBase<Impl>::writeBuffer(char* data, size_t size) {
 
 namespace detail {
 
+inline bool acquire_view(DecodeBuffer& input,
+                         PyObject* obj,
+                         Py_ssize_t pos,
+                         DecodeBuffer::Source source) {
+  if (PyObject_GetBuffer(obj, &input.view, PyBUF_SIMPLE) < 0) {
+    return false;
+  }
+  input.source = source;
+  if (pos < 0 || pos > input.view.len) {
+    input.release_view();
+    PyErr_SetString(PyExc_ValueError, "read position out of range");
+    return false;
+  }
+  input.pos = pos;
+  return true;
+}
+
+/**
+ * Views the unread part of a transport's read buffer as returned by
+ * trans.cbuffer_view().  Returns 0 when the transport has nothing to offer
+ * and its cstringio_buf should be read instead, -1 on error.
+ */
+inline int transport_view(DecodeBuffer& input) {
+  ScopedPyObject result(PyObject_CallObject(input.view_callable.get(), NULL));
+  if (!result) {
+    return -1;
+  }
+  if (result.get() == Py_None) {
+    return 0;
+  }
+  if (!PyTuple_Check(result.get()) || PyTuple_GET_SIZE(result.get()) != 2) {
+    PyErr_SetString(PyExc_TypeError, "cbuffer_view must return a (buffer, offset) tuple or None");
+    return -1;
+  }
+  Py_ssize_t pos = PyInt_AsSsize_t(PyTuple_GET_ITEM(result.get(), 1));
+  if (pos == -1 && PyErr_Occurred()) {
+    return -1;
+  }
+  return acquire_view(input, PyTuple_GET_ITEM(result.get(), 0), pos, DecodeBuffer::TRANSPORT)
+             ? 1
+             : -1;
+}
+
 #define DECLARE_OP_SCOPE(name, op)                                                                 \
   template <typename Impl>                                                                         \
   struct name##Scope {                                                                             \
@@ -264,6 +336,17 @@ bool ProtocolBase<Impl>::readBytes(char** output, int len) {
     PyErr_Format(PyExc_ValueError, "attempted to read negative length: %d", len);
     return false;
   }
+
+  if (input_.has_view()) {
+    if (input_.view.len - input_.pos < len && !refillView(len)) {
+      return false;
+    }
+    *output = static_cast<char*>(input_.view.buf) + input_.pos;
+    input_.pos += len;
+    return true;
+  }
+
+#if PY_MAJOR_VERSION < 3
   // TODO(dreiss): Don't fear the malloc.  Think about taking a copy of
   //               the partial read instead of forcing the transport
   //               to prepend it to its buffer.
@@ -277,7 +360,7 @@ bool ProtocolBase<Impl>::readBytes(char** output, int len) {
   } else {
     // using building functions as this is a rare codepath
     ScopedPyObject newiobuf(PyObject_CallFunction(input_.refill_callable.get(), refill_signature,
-                                                  *output, rlen, len, NULL));
+                                                  PyBytes_FromStringAndSize(*output, rlen), len));
     if (!newiobuf) {
       return false;
     }
@@ -297,23 +380,94 @@ bool ProtocolBase<Impl>::readBytes(char** output, int len) {
       return false;
     }
   }
+#else
+  PyErr_SetString(PyExc_ValueError, "decode buffer is not initialized");
+  return false;
+#endif
 }
 
 template <typename Impl>
-bool ProtocolBase<Impl>::prepareDecodeBufferFromTransport(PyObject* trans) {
-  if (input_.stringiobuf) {
-    PyErr_SetString(PyExc_ValueError, "decode buffer is already initialized");
+Py_ssize_t ProtocolBase<Impl>::peekBytes(char** output) {
+  if (!input_.has_view()) {
+    PyErr_SetString(PyExc_TypeError, "expecting a transport with a buffer view");
+    return -1;
+  }
+  if (input_.pos >= input_.view.len && !refillView(1)) {
+    return -1;
+  }
+  *output = static_cast<char*>(input_.view.buf) + input_.pos;
+  return input_.view.len - input_.pos;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::refillView(int len) {
+  if (!input_.refill_callable) {
+    PyErr_Format(PyExc_EOFError, "unexpected end of buffer: %zd bytes left, %d needed",
+                 input_.view.len - input_.pos, len);
     return false;
   }
 
-  ScopedPyObject stringiobuf(PyObject_GetAttr(trans, INTERN_STRING(cstringio_buf)));
-  if (!stringiobuf) {
+  // using building functions as this is a rare codepath
+  ScopedPyObject partial(
+      PyBytes_FromStringAndSize(static_cast<char*>(input_.view.buf) + input_.pos,
+                                input_.view.len - input_.pos));
+  if (!partial) {
+    return false;
+  }
+  // the transport is about to replace the buffer we are looking at
+  input_.release_view();
+
+  ScopedPyObject newiobuf(PyObject_CallFunction(input_.refill_callable.get(), refill_signature,
+                                                partial.release(), len));
+  if (!newiobuf) {
+    return false;
+  }
+  input_.stringiobuf.reset(newiobuf.release());
+
+  if (!viewTransport()) {
+    return false;
+  }
+  if (!input_.has_view() || input_.view.len - input_.pos < len) {
+    // TODO(dreiss): This could be a valid code path for big binary blobs.
+    PyErr_SetString(PyExc_TypeError, "refill claimed to have refilled the buffer, but didn't!!");
     return false;
   }
-  if (!detail::input_check(stringiobuf.get())) {
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::viewTransport() {
+  if (input_.view_callable) {
+    int rc = detail::transport_view(input_);
+    if (rc != 0) {
+      return rc > 0;
+    }
+  }
+
+  if (!input_.stringiobuf) {
+    ScopedPyObject stringiobuf(PyObject_GetAttr(input_.trans.get(), INTERN_STRING(cstringio_buf)));
+    if (!stringiobuf) {
+      return false;
+    }
+    input_.stringiobuf.swap(stringiobuf);
+  }
+#if PY_MAJOR_VERSION < 3
+  if (!detail::input_check(input_.stringiobuf.get())) {
     PyErr_SetString(PyExc_TypeError, "expecting stringio input_");
     return false;
   }
+  return true;
+#else
+  return detail::stringio_view(input_);
+#endif
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::prepareDecodeBufferFromTransport(PyObject* trans) {
+  if (input_.trans || input_.has_view()) {
+    PyErr_SetString(PyExc_ValueError, "decode buffer is already initialized");
+    return false;
+  }
 
   ScopedPyObject refill_callable(PyObject_GetAttr(trans, INTERN_STRING(cstringio_refill)));
   if (!refill_callable) {
@@ -323,10 +477,50 @@ bool ProtocolBase<Impl>::prepareDecodeBufferFromTransport(PyObject* trans) {
     PyErr_SetString(PyExc_TypeError, "expecting callable");
     return false;
   }
-
-  input_.stringiobuf.swap(stringiobuf);
   input_.refill_callable.swap(refill_callable);
-  return true;
+
+  // transports may expose their read buffer directly instead of a BytesIO
+  ScopedPyObject view_callable(PyObject_GetAttr(trans, INTERN_STRING(cbuffer_view)));
+  if (!view_callable) {
+    if (!PyErr_ExceptionMatches(PyExc_AttributeError)) {
+      return false;
+    }
+    PyErr_Clear();
+  }
+  input_.view_callable.swap(view_callable);
+
+  Py_INCREF(trans);
+  input_.trans.reset(trans);
+  return viewTransport();
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::prepareDecodeBufferFromBuffer(PyObject* buf) {
+  if (input_.trans || input_.has_view()) {
+    PyErr_SetString(PyExc_ValueError, "decode buffer is already initialized");
+    return false;
+  }
+  return detail::acquire_view(input_, buf, 0, DecodeBuffer::BUFFER);
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::finishDecode() {
+  DecodeBuffer::Source source = input_.source;
+  input_.release_view();
+  if (source != DecodeBuffer::TRANSPORT && source != DecodeBuffer::STRINGIO) {
+    return true;
+  }
+  ScopedPyObject pos(PyInt_FromSsize_t(input_.pos));
+  if (!pos) {
+    return false;
+  }
+  ScopedPyObject ret(
+      source == DecodeBuffer::TRANSPORT
+          ? PyObject_CallMethodObjArgs(input_.trans.get(), INTERN_STRING(cbuffer_seek), pos.get(),
+                                       NULL)
+          : PyObject_CallMethodObjArgs(input_.stringiobuf.get(), INTERN_STRING(seek), pos.get(),
+                                       NULL));
+  return !!ret;
 }
 
 template <typename Impl>
@@ -336,7 +530,281 @@ bool ProtocolBase<Impl>::prepareEncodeBuffer() {
 }
 
 template <typename Impl>
-bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* typeargs) {
+bool ProtocolBase<Impl>::resetEncodeBuffer() {
+#if PY_MAJOR_VERSION < 3
+  Py_CLEAR(output_);
+  return prepareEncodeBuffer();
+#else
+  output_->buf.clear();
+  return true;
+#endif
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::prepareEncodeTarget(PyObject* out, Py_ssize_t offset, bool framed) {
+  if (target_.active || output_) {
+    PyErr_SetString(PyExc_ValueError, "encode buffer is already initialized");
+    return false;
+  }
+  if (PyByteArray_Check(out)) {
+    target_.bytearray = out;
+    target_.data = PyByteArray_AS_STRING(out);
+    target_.size = PyByteArray_GET_SIZE(out);
+  } else {
+    if (PyObject_GetBuffer(out, &target_.view, PyBUF_WRITABLE) < 0) {
+      return false;
+    }
+    target_.has_view = true;
+    target_.data = static_cast<char*>(target_.view.buf);
+    target_.size = target_.view.len;
+  }
+  if (offset < 0 || offset > target_.size) {
+    PyErr_SetString(PyExc_ValueError, "offset out of range");
+    return false;
+  }
+  target_.pos = offset;
+  target_.active = true;
+  if (framed) {
+    target_.frame = offset;
+    char reserved[4] = {0, 0, 0, 0};
+    return writeTarget(reserved, sizeof(reserved));
+  }
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::prepareEncodeCount() {
+  if (target_.active || output_) {
+    PyErr_SetString(PyExc_ValueError, "encode buffer is already initialized");
+    return false;
+  }
+  target_.active = true;
+  target_.count = true;
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::writeTarget(const char* data, size_t len) {
+  if (target_.pos < 0) {
+    // an earlier write failed, the exception is already set
+    return false;
+  }
+  if (target_.count) {
+    target_.pos += static_cast<Py_ssize_t>(len);
+    return true;
+  }
+  Py_ssize_t need = target_.pos + static_cast<Py_ssize_t>(len);
+  if (need > target_.size) {
+    if (!target_.bytearray) {
+      PyErr_Format(PyExc_ValueError, "output buffer too small: %zd bytes needed", need);
+      target_.pos = -1;
+      return false;
+    }
+    // grow geometrically, callers keep the capacity for the next message
+    Py_ssize_t size = (std::max)(need, target_.size * 2);
+    size = (std::max)(size, static_cast<Py_ssize_t>(INIT_OUTBUF_SIZE));
+    if (PyByteArray_Resize(target_.bytearray, size) < 0) {
+      target_.pos = -1;
+      return false;
+    }
+    target_.data = PyByteArray_AS_STRING(target_.bytearray);
+    target_.size = PyByteArray_GET_SIZE(target_.bytearray);
+  }
+  memcpy(target_.data + target_.pos, data, len);
+  target_.pos = need;
+  return true;
+}
+
+template <typename Impl>
+Py_ssize_t ProtocolBase<Impl>::finishEncodeTarget() {
+  if (target_.pos < 0) {
+    return -1;
+  }
+  if (target_.frame >= 0) {
+    Py_ssize_t len = target_.pos - target_.frame - 4;
+    if (len > std::numeric_limits<int32_t>::max()) {
+      PyErr_SetString(PyExc_OverflowError, "frame size exceeded INT32_MAX");
+      return -1;
+    }
+    uint32_t n = static_cast<uint32_t>(len);
+    unsigned char* prefix = reinterpret_cast<unsigned char*>(target_.data + target_.frame);
+    prefix[0] = static_cast<unsigned char>(n >> 24);
+    prefix[1] = static_cast<unsigned char>(n >> 16);
+    prefix[2] = static_cast<unsigned char>(n >> 8);
+    prefix[3] = static_cast<unsigned char>(n);
+  }
+  return target_.pos;
+}
+
+/**
+ * Returns 1 when value is a TSizedIterable, 0 when it isn't and -1 on error.
+ * chunk is set to the number of elements to encode between drainOutput
+ * calls, 0 for none.
+ */
+template <typename Impl>
+int ProtocolBase<Impl>::sizedIterable(PyObject* value, long& chunk) {
+  chunk = 0;
+  if (PyList_CheckExact(value) || PyTuple_CheckExact(value) || PyAnySet_CheckExact(value)
+      || PyDict_Check(value)) {
+    return 0;
+  }
+  if (!ThriftModule) {
+    ThriftModule = PyImport_ImportModule("thrift.Thrift");
+  }
+  if (!ThriftModule) {
+    return -1;
+  }
+  ScopedPyObject cls(PyObject_GetAttr(ThriftModule, INTERN_STRING(TSizedIterable)));
+  if (!cls) {
+    return -1;
+  }
+  int is_sized = PyObject_IsInstance(value, cls.get());
+  if (is_sized <= 0 || !sink_) {
+    return is_sized;
+  }
+  ScopedPyObject chunk_size(PyObject_GetAttr(value, INTERN_STRING(chunk_size)));
+  if (!chunk_size) {
+    return -1;
+  }
+  if (chunk_size.get() != Py_None) {
+    chunk = PyInt_AsLong(chunk_size.get());
+    if (INT_CONV_ERROR_OCCURRED(chunk)) {
+      return -1;
+    }
+  }
+  return 1;
+}
+
+/**
+ * Hands the bytes encoded so far to the sink's transport, drains it and
+ * carries on encoding into an empty buffer.  Draining, unlike flushing,
+ * keeps the message in one piece: transports that can't send part of one
+ * raise instead.
+ */
+template <typename Impl>
+bool ProtocolBase<Impl>::drainOutput() {
+  if (drainEncoded()) {
+    return true;
+  }
+  if (!target_.active && !output_) {
+    // The target went back to the transport and no new one was set up:
+    // fail the writes that follow, which would have nowhere to go.
+    target_.active = true;
+    target_.pos = -1;
+  }
+  return false;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::drainEncoded() {
+  if (target_.active) {
+    Py_ssize_t end = finishEncodeTarget();
+    if (end < 0) {
+      return false;
+    }
+    if (target_.has_view) {
+      PyBuffer_Release(&target_.view);
+      target_.has_view = false;
+    }
+    target_.active = false;
+    target_.bytearray = NULL;
+    ScopedPyObject offset(PyInt_FromSsize_t(end));
+    if (!offset) {
+      return false;
+    }
+    ScopedPyObject ret(
+        PyObject_CallFunctionObjArgs(sink_->written_callable, offset.get(), NULL));
+    if (!ret) {
+      return false;
+    }
+  } else {
+    ScopedPyObject encoded(getEncodedValue());
+    if (!encoded) {
+      return false;
+    }
+    ScopedPyObject ret(
+        PyObject_CallMethodObjArgs(sink_->trans, INTERN_STRING(write), encoded.get(), NULL));
+    if (!ret) {
+      return false;
+    }
+    if (!resetEncodeBuffer()) {
+      return false;
+    }
+  }
+
+  ScopedPyObject ret(PyObject_CallMethodObjArgs(sink_->trans, INTERN_STRING(drain), NULL));
+  if (!ret) {
+    return false;
+  }
+  if (output_) {
+    return true;
+  }
+  // the transport may start a new write buffer when drained
+  ScopedPyObject target(PyObject_CallObject(sink_->output_callable, NULL));
+  if (!target) {
+    return false;
+  }
+  PyObject* out;
+  Py_ssize_t offset;
+  if (!PyTuple_Check(target.get()) || !PyArg_ParseTuple(target.get(), "On", &out, &offset)) {
+    PyErr_SetString(PyExc_TypeError, "cbuffer_output must return an (output, offset) tuple");
+    return false;
+  }
+  return prepareEncodeTarget(out, offset, false);
+}
+
+/**
+ * Checks that a TSizedIterable is being encoded rather than counted.
+ */
+template <typename Impl>
+bool ProtocolBase<Impl>::checkNotCounting() {
+  if (target_.count) {
+    PyErr_SetString(PyExc_TypeError, "cannot size a TSizedIterable without consuming it");
+    return false;
+  }
+  return true;
+}
+
+/**
+ * Encodes the (key, value) pairs a TSizedIterable yields as a map.
+ */
+template <typename Impl>
+bool ProtocolBase<Impl>::encodePairs(PyObject* value, SpecArgs& args, long chunk) {
+  Py_ssize_t len = PyObject_Length(value);
+  if (!detail::check_ssize_t_32(len)) {
+    return false;
+  }
+  if (!impl()->writeMapBegin(value, args.map, static_cast<int32_t>(len)) || PyErr_Occurred()) {
+    return false;
+  }
+  ScopedPyObject iterator(PyObject_GetIter(value));
+  if (!iterator) {
+    return false;
+  }
+  long count = 0;
+  while (PyObject* rawItem = PyIter_Next(iterator.get())) {
+    ScopedPyObject item(rawItem);
+    if (!PyTuple_Check(item.get()) || PyTuple_GET_SIZE(item.get()) != 2) {
+      PyErr_SetString(PyExc_TypeError, "map elements must be (key, value) tuples");
+      return false;
+    }
+    if (!encodeValue(PyTuple_GET_ITEM(item.get(), 0), args.map.ktag, *args.element)
+        || !encodeValue(PyTuple_GET_ITEM(item.get(), 1), args.map.vtag, *args.value)) {
+      return false;
+    }
+    if (chunk > 0 && ++count % chunk == 0 && !drainOutput()) {
+      return false;
+    }
+  }
+  if (PyErr_Occurred()) {
+    return false;
+  }
+  impl()->writeMapEnd();
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, SpecArgs& args) {
   /*
    * Refcounting Strategy:
    *
@@ -347,6 +815,12 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
    * responsible for handling references
    */
 
+  if (target_.count && Impl::fixedWidth(type)) {
+    // counted without converting the value
+    target_.pos += Impl::fixedWidth(type);
+    return true;
+  }
+
   switch (type) {
 
   case T_BOOL: {
@@ -421,10 +895,34 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
     ScopedPyObject nval;
 
     if (PyUnicode_Check(value)) {
+      Py_ssize_t len = target_.count ? detail::utf8_length(value) : -1;
+      if (len >= 0) {
+        // counted without encoding, the data is never read
+        if (!detail::check_ssize_t_32(len)) {
+          return false;
+        }
+        args.binary ? impl()->writeBinary(NULL, static_cast<int32_t>(len))
+                    : impl()->writeString(NULL, static_cast<int32_t>(len));
+        return true;
+      }
       nval.reset(PyUnicode_AsUTF8String(value));
       if (!nval) {
         return false;
       }
+    } else if (!PyBytes_Check(value) && PyObject_CheckBuffer(value)) {
+      // memoryviews and other buffers are written without a bytes copy
+      Py_buffer view;
+      if (PyObject_GetBuffer(value, &view, PyBUF_C_CONTIGUOUS) < 0) {
+        return false;
+      }
+      bool ok = detail::check_ssize_t_32(view.len);
+      if (ok) {
+        const char* data = static_cast<const char*>(view.buf);
+        args.binary ? impl()->writeBinary(data, static_cast<int32_t>(view.len))
+                    : impl()->writeString(data, static_cast<int32_t>(view.len));
+      }
+      PyBuffer_Release(&view);
+      return ok;
     } else {
       Py_INCREF(value);
       nval.reset(value);
@@ -435,76 +933,108 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
       return false;
     }
 
-    impl()->writeString(nval.get(), static_cast<int32_t>(len));
+    args.binary ? impl()->writeBinary(PyBytes_AS_STRING(nval.get()), static_cast<int32_t>(len))
+                : impl()->writeString(PyBytes_AS_STRING(nval.get()), static_cast<int32_t>(len));
     return true;
   }
 
   case T_LIST:
   case T_SET: {
-    SetListTypeArgs parsedargs;
-    if (!parse_set_list_args(&parsedargs, typeargs)) {
-      return false;
+    if (type == T_LIST && typed_array_typecode(args.setlist.element_type)
+        && PyObject_CheckBuffer(value)) {
+      int written = encodeArray(value, args.setlist);
+      if (written != 0) {
+        return written > 0;
+      }
+    }
+    long chunk = 0;
+    if (sink_ || target_.count) {
+      int is_sized = sizedIterable(value, chunk);
+      if (is_sized < 0 || (is_sized && !checkNotCounting())) {
+        return false;
+      }
     }
-
     Py_ssize_t len = PyObject_Length(value);
     if (!detail::check_ssize_t_32(len)) {
       return false;
     }
 
-    if (!impl()->writeListBegin(value, parsedargs, static_cast<int32_t>(len)) || PyErr_Occurred()) {
+    if (!impl()->writeListBegin(value, args.setlist, static_cast<int32_t>(len)) || PyErr_Occurred()) {
       return false;
     }
+    if (target_.count && Impl::fixedWidth(args.setlist.element_type)) {
+      target_.pos += len * Impl::fixedWidth(args.setlist.element_type);
+      impl()->writeListEnd();
+      return true;
+    }
     ScopedPyObject iterator(PyObject_GetIter(value));
     if (!iterator) {
       return false;
     }
 
+    long count = 0;
     while (PyObject* rawItem = PyIter_Next(iterator.get())) {
       ScopedPyObject item(rawItem);
-      if (!encodeValue(item.get(), parsedargs.element_type, parsedargs.typeargs)) {
+      if (!encodeValue(item.get(), args.setlist.element_type, *args.element)) {
+        return false;
+      }
+      if (chunk > 0 && ++count % chunk == 0 && !drainOutput()) {
         return false;
       }
     }
 
+    if (PyErr_Occurred()) {
+      return false;
+    }
+    impl()->writeListEnd();
     return true;
   }
 
   case T_MAP: {
+    long chunk = 0;
+    int is_sized = sizedIterable(value, chunk);
+    if (is_sized < 0) {
+      return false;
+    }
+    if (is_sized) {
+      return checkNotCounting() && encodePairs(value, args, chunk);
+    }
     Py_ssize_t len = PyDict_Size(value);
     if (!detail::check_ssize_t_32(len)) {
       return false;
     }
 
-    MapTypeArgs parsedargs;
-    if (!parse_map_args(&parsedargs, typeargs)) {
+    if (!impl()->writeMapBegin(value, args.map, static_cast<int32_t>(len)) || PyErr_Occurred()) {
       return false;
     }
-
-    if (!impl()->writeMapBegin(value, parsedargs, static_cast<int32_t>(len)) || PyErr_Occurred()) {
-      return false;
+    if (target_.count && Impl::fixedWidth(args.map.ktag) && Impl::fixedWidth(args.map.vtag)) {
+      target_.pos += len * (Impl::fixedWidth(args.map.ktag) + Impl::fixedWidth(args.map.vtag));
+      impl()->writeMapEnd();
+      return true;
     }
     Py_ssize_t pos = 0;
     PyObject* k = NULL;
     PyObject* v = NULL;
     // TODO(bmaurer): should support any mapping, not just dicts
     while (PyDict_Next(value, &pos, &k, &v)) {
-      if (!encodeValue(k, parsedargs.ktag, parsedargs.ktypeargs)
-          || !encodeValue(v, parsedargs.vtag, parsedargs.vtypeargs)) {
+      if (!encodeValue(k, args.map.ktag, *args.element)
+          || !encodeValue(v, args.map.vtag, *args.value)) {
         return false;
       }
     }
+    impl()->writeMapEnd();
     return true;
   }
 
   case T_STRUCT: {
-    StructTypeArgs parsedargs;
-    if (!parse_struct_args(&parsedargs, typeargs)) {
-      return false;
+    if (encodedCache_) {
+      int cached = writeCachedStruct(value, args);
+      if (cached != 0) {
+        return cached > 0;
+      }
     }
-
-    Py_ssize_t nspec = PyTuple_Size(parsedargs.spec);
-    if (nspec == -1) {
-      PyErr_SetString(PyExc_TypeError, "spec is not a tuple");
+    StructSpec* spec = nested_struct_spec(args);
+    if (!spec) {
       return false;
     }
 
@@ -512,18 +1042,10 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
     if (!scope) {
       return false;
     }
-    for (Py_ssize_t i = 0; i < nspec; i++) {
-      PyObject* spec_tuple = PyTuple_GET_ITEM(parsedargs.spec, i);
-      if (spec_tuple == Py_None) {
-        continue;
-      }
-
-      StructItemSpec parsedspec;
-      if (!parse_struct_item_spec(&parsedspec, spec_tuple)) {
-        return false;
-      }
-
-      ScopedPyObject instval(PyObject_GetAttr(value, parsedspec.attrname));
+    for (std::vector<FieldSpec*>::iterator it = spec->fields.begin(); it != spec->fields.end();
+         ++it) {
+      FieldSpec* field = *it;
+      ScopedPyObject instval(PyObject_GetAttr(value, field->attrname));
 
       if (!instval) {
         return false;
@@ -533,7 +1055,7 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
         continue;
       }
 
-      bool res = impl()->writeField(instval.get(), parsedspec);
+      bool res = impl()->writeField(instval.get(), *field);
       if (!res) {
         return false;
       }
@@ -555,6 +1077,353 @@ bool ProtocolBase<Impl>::encodeValue(PyObject* value, TType type, PyObject* type
   return true;
 }
 
+template <typename Impl>
+template <typename T>
+bool ProtocolBase<Impl>::readArrayValues(bool (Impl::*read)(T&), int32_t len, char* out) {
+  for (int32_t i = 0; i < len; ++i, out += sizeof(T)) {
+    T val;
+    if (!(impl()->*read)(val)) {
+      return false;
+    }
+    memcpy(out, &val, sizeof(T));
+  }
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::readArrayData(TType type, int32_t len, char* out) {
+  switch (type) {
+  case T_BYTE:
+    return readArrayValues(&Impl::readI8, len, out);
+  case T_I16:
+    return readArrayValues(&Impl::readI16, len, out);
+  case T_I32:
+    return readArrayValues(&Impl::readI32, len, out);
+  case T_I64:
+    return readArrayValues(&Impl::readI64, len, out);
+  case T_DOUBLE:
+    return readArrayValues(&Impl::readDouble, len, out);
+  default:
+    PyErr_Format(PyExc_TypeError, "Unexpected TType for array: %d", type);
+    return false;
+  }
+}
+
+template <typename Impl>
+void ProtocolBase<Impl>::writeArrayData(TType type, const char* data, int32_t len) {
+  for (int32_t i = 0; i < len; ++i) {
+    switch (type) {
+    case T_BYTE: {
+      int8_t val;
+      memcpy(&val, data + i * sizeof(val), sizeof(val));
+      impl()->writeI8(val);
+      break;
+    }
+    case T_I16: {
+      int16_t val;
+      memcpy(&val, data + i * sizeof(val), sizeof(val));
+      impl()->writeI16(val);
+      break;
+    }
+    case T_I32: {
+      int32_t val;
+      memcpy(&val, data + i * sizeof(val), sizeof(val));
+      impl()->writeI32(val);
+      break;
+    }
+    case T_I64: {
+      int64_t val;
+      memcpy(&val, data + i * sizeof(val), sizeof(val));
+      impl()->writeI64(val);
+      break;
+    }
+    case T_DOUBLE: {
+      double val;
+      memcpy(&val, data + i * sizeof(val), sizeof(val));
+      impl()->writeDouble(val);
+      break;
+    }
+    default:
+      return;
+    }
+  }
+}
+
+template <typename Impl>
+PyObject* ProtocolBase<Impl>::decodeArray(TType type, int32_t len) {
+  ScopedPyObject ret(new_typed_array(type, len));
+  if (!ret || len == 0) {
+    return ret.release();
+  }
+  char* data = typed_array_data(ret.get());
+  if (!data || !impl()->readArrayData(type, len, data)) {
+    return NULL;
+  }
+  return ret.release();
+}
+
+/**
+ * Writes a list value exposing a buffer of matching format, such as an
+ * array.array or a memoryview, without boxing its items.  Returns 1 when the
+ * list was written, 0 when value has to be iterated instead and -1 on error.
+ */
+template <typename Impl>
+int ProtocolBase<Impl>::encodeArray(PyObject* value, const SetListTypeArgs& args) {
+  Py_buffer view;
+  if (PyObject_GetBuffer(value, &view, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) < 0) {
+    PyErr_Clear();
+    return 0;
+  }
+  int ret = 0;
+  if (typed_array_view_matches(args.element_type, view)) {
+    Py_ssize_t len = view.len / view.itemsize;
+    ret = -1;
+    if (detail::check_ssize_t_32(len)
+        && impl()->writeListBegin(value, args, static_cast<int32_t>(len)) && !PyErr_Occurred()) {
+      impl()->writeArrayData(args.element_type, static_cast<const char*>(view.buf),
+                             static_cast<int32_t>(len));
+      impl()->writeListEnd();
+      ret = PyErr_Occurred() ? -1 : 1;
+    }
+  }
+  PyBuffer_Release(&view);
+  return ret;
+}
+
+/**
+ * Returns the len bytes at buf, read from input_, as a read-only memoryview
+ * slice of the object viewed, which the slice keeps alive.  BytesIO buffers
+ * are copied instead, as exporting them would lock them against writes.
+ */
+template <typename Impl>
+PyObject* ProtocolBase<Impl>::readBinaryView(const char* buf, int len) {
+#if PY_MAJOR_VERSION >= 3
+  if (input_.source == DecodeBuffer::BUFFER || input_.source == DecodeBuffer::TRANSPORT) {
+    if (binaryOwner_.get() != input_.view.obj) {
+      ScopedPyObject view(PyMemoryView_FromObject(input_.view.obj));
+      if (!view) {
+        return NULL;
+      }
+      ScopedPyObject base(PyObject_CallMethod(view.get(), const_cast<char*>("cast"),
+                                              const_cast<char*>("s"), "B"));
+      if (!base) {
+        return NULL;
+      }
+      if (!PyMemoryView_GET_BUFFER(base.get())->readonly) {
+        base.reset(PyObject_CallMethod(base.get(), const_cast<char*>("toreadonly"), NULL));
+        if (!base) {
+          return NULL;
+        }
+      }
+      binaryBase_.swap(base);
+      Py_INCREF(input_.view.obj);
+      binaryOwner_.reset(input_.view.obj);
+    }
+    const char* base_buf
+        = static_cast<const char*>(PyMemoryView_GET_BUFFER(binaryBase_.get())->buf);
+    Py_ssize_t start = buf - base_buf;
+    return PySequence_GetSlice(binaryBase_.get(), start, start + len);
+  }
+#endif
+  return PyBytes_FromStringAndSize(buf, len);
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::setInternTable(PyObject* table) {
+  internTable_.reset(NULL);
+  internCurrent_.reset(NULL);
+  internPrevious_.reset(NULL);
+  if (!table || table == Py_None) {
+    return true;
+  }
+  ScopedPyObject size(PyObject_GetAttr(table, INTERN_STRING(size)));
+  ScopedPyObject max_length(PyObject_GetAttr(table, INTERN_STRING(max_length)));
+  if (!size || !max_length) {
+    return false;
+  }
+  internSize_ = PyInt_AsLong(size.get());
+  internMaxLength_ = PyInt_AsLong(max_length.get());
+  if (INT_CONV_ERROR_OCCURRED(internSize_) || INT_CONV_ERROR_OCCURRED(internMaxLength_)) {
+    return false;
+  }
+  Py_INCREF(table);
+  internTable_.reset(table);
+  if (!loadInternGenerations()) {
+    internTable_.reset(NULL);
+    internCurrent_.reset(NULL);
+    internPrevious_.reset(NULL);
+    return false;
+  }
+  return true;
+}
+
+/**
+ * Reads the current and previous generations of the intern table, after
+ * it is set or rotated.
+ */
+template <typename Impl>
+bool ProtocolBase<Impl>::loadInternGenerations() {
+  internCurrent_.reset(PyObject_GetAttr(internTable_.get(), INTERN_STRING(current)));
+  internPrevious_.reset(PyObject_GetAttr(internTable_.get(), INTERN_STRING(previous)));
+  if (!internCurrent_ || !internPrevious_) {
+    return false;
+  }
+  if (!PyDict_Check(internCurrent_.get()) || !PyDict_Check(internPrevious_.get())) {
+    PyErr_SetString(PyExc_TypeError, "expecting a TInternTable");
+    return false;
+  }
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::setEncodedCache(PyObject* cache, PyObject* key) {
+  encodedCache_.reset(NULL);
+  encodedGet_.reset(NULL);
+  encodedKey_.reset(NULL);
+  if (!cache || cache == Py_None) {
+    return true;
+  }
+  encodedGet_.reset(PyObject_GetAttr(cache, INTERN_STRING(get)));
+  if (!encodedGet_) {
+    return false;
+  }
+  if (!frozenBase_) {
+    if (!TBaseModule) {
+      TBaseModule = PyImport_ImportModule("thrift.protocol.TBase");
+    }
+    if (!TBaseModule) {
+      return false;
+    }
+    frozenBase_.reset(PyObject_GetAttr(TBaseModule, INTERN_STRING(TFrozenBase)));
+    if (!frozenBase_) {
+      return false;
+    }
+    if (!PyType_Check(frozenBase_.get())) {
+      frozenBase_.reset(NULL);
+      PyErr_SetString(PyExc_TypeError, "TFrozenBase is not a class");
+      return false;
+    }
+  }
+  if (!key || key == Py_None) {
+    key = impl()->wireFormat();
+  }
+  Py_INCREF(key);
+  encodedKey_.reset(key);
+  Py_INCREF(cache);
+  encodedCache_.reset(cache);
+  return true;
+}
+
+/**
+ * Writes a frozen struct as its bytes in the encoded cache, encoding it on
+ * its own and adding it to the cache first when they are not there, like
+ * TEncodedCache.encode.  Returns 1 when done, 0 for structs that are not
+ * frozen, to be encoded as usual, and -1 on error.
+ */
+template <typename Impl>
+int ProtocolBase<Impl>::writeCachedStruct(PyObject* value, SpecArgs& args) {
+  if (!PyType_IsSubtype(Py_TYPE(value), reinterpret_cast<PyTypeObject*>(frozenBase_.get()))) {
+    return 0;
+  }
+  PyObject* format = encodedKey_.get();
+  ScopedPyObject cached(PyObject_CallFunctionObjArgs(encodedGet_.get(), value, format, NULL));
+  if (!cached) {
+    return -1;
+  }
+  if (PyBytes_Check(cached.get())) {
+    return writeBuffer(PyBytes_AS_STRING(cached.get()), PyBytes_GET_SIZE(cached.get())) ? 1 : -1;
+  }
+
+  if (target_.count) {
+    // counted as usual, the cache is only filled by encoding
+    return 0;
+  }
+
+  // The struct is encoded without the cache, so the structs it contains
+  // are only cached as part of it.
+  Impl standalone;
+  if (!standalone.prepareEncodeBuffer() || !standalone.encodeValue(value, T_STRUCT, args)
+      || PyErr_Occurred()) {
+    return -1;
+  }
+  ScopedPyObject data(standalone.getEncodedValue());
+  if (!data) {
+    return -1;
+  }
+  ScopedPyObject ret(PyObject_CallMethodObjArgs(encodedCache_.get(), INTERN_STRING(put), value,
+                                                format, data.get(), NULL));
+  if (!ret) {
+    return -1;
+  }
+  return writeBuffer(PyBytes_AS_STRING(data.get()), PyBytes_GET_SIZE(data.get())) ? 1 : -1;
+}
+
+/**
+ * Returns the string of the intern table equal to str, adding str when
+ * there is none, like TInternTable.intern.  Steals the reference to str.
+ */
+template <typename Impl>
+PyObject* ProtocolBase<Impl>::internString(PyObject* str) {
+  ScopedPyObject ret(str);
+  PyObject* cached = PyDict_GetItem(internCurrent_.get(), str);
+  if (cached) {
+    Py_INCREF(cached);
+    ret.reset(cached);
+    return ret.release();
+  }
+  cached = PyDict_GetItem(internPrevious_.get(), str);
+  if (cached) {
+    Py_INCREF(cached);
+    ret.reset(cached);
+    if (PyDict_DelItem(internPrevious_.get(), cached) == -1) {
+      return NULL;
+    }
+  }
+  if (PyDict_Size(internCurrent_.get()) >= internSize_ / 2) {
+    ScopedPyObject rotated(
+        PyObject_CallMethodObjArgs(internTable_.get(), INTERN_STRING(rotate), NULL));
+    if (!rotated || !loadInternGenerations()) {
+      return NULL;
+    }
+  }
+  if (PyDict_SetItem(internCurrent_.get(), ret.get(), ret.get()) == -1) {
+    return NULL;
+  }
+  return ret.release();
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::skipBytes(int64_t len) {
+  char* buf;
+  while (len > std::numeric_limits<int>::max()) {
+    if (!readBytes(&buf, std::numeric_limits<int>::max())) {
+      return false;
+    }
+    len -= std::numeric_limits<int>::max();
+  }
+  return readBytes(&buf, static_cast<int>(len));
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::skipValues(TType type, int64_t count) {
+  for (int64_t i = 0; i < count; i++) {
+    if (!skip(type)) {
+      return false;
+    }
+  }
+  return true;
+}
+
+template <typename Impl>
+bool ProtocolBase<Impl>::skipPairs(TType ktype, TType vtype, int64_t count) {
+  for (int64_t i = 0; i < count; i++) {
+    if (!skip(ktype) || !skip(vtype)) {
+      return false;
+    }
+  }
+  return true;
+}
+
 template <typename Impl>
 bool ProtocolBase<Impl>::skip(TType type) {
   switch (type) {
@@ -582,12 +1451,7 @@ bool ProtocolBase<Impl>::skip(TType type) {
     if (len < 0) {
       return false;
     }
-    for (int32_t i = 0; i < len; i++) {
-      if (!skip(etype)) {
-        return false;
-      }
-    }
-    return true;
+    return impl()->skipValues(etype, len) && impl()->readListEnd();
   }
 
   case T_MAP: {
@@ -597,12 +1461,7 @@ bool ProtocolBase<Impl>::skip(TType type) {
     if (len < 0) {
       return false;
     }
-    for (int32_t i = 0; i < len; i++) {
-      if (!skip(ktype) || !skip(vtype)) {
-        return false;
-      }
-    }
-    return true;
+    return impl()->skipPairs(ktype, vtype, len) && impl()->readMapEnd();
   }
 
   case T_STRUCT: {
@@ -639,9 +1498,90 @@ bool ProtocolBase<Impl>::skip(TType type) {
   return true;
 }
 
+template <typename Impl>
+PyObject* ProtocolBase<Impl>::readMessage(PyObject* classes) {
+  ScopedPyObject name;
+  int8_t type = 0;
+  int32_t seqid = 0;
+  if (!impl()->readMessageBegin(name, type, seqid)) {
+    return NULL;
+  }
+
+  ScopedPyObject body;
+  if (type != T_EXCEPTION) {
+    PyObject* klass = PyDict_GetItem(classes, name.get());
+    if (!klass) {
+      if (!skip(T_STRUCT)) {
+        return NULL;
+      }
+    } else {
+      ScopedPyObject spec(PyObject_GetAttr(klass, INTERN_STRING(thrift_spec)));
+      if (!spec) {
+        return NULL;
+      }
+      StructSpec* compiled = get_struct_spec(klass, spec.get());
+      if (!compiled) {
+        return NULL;
+      }
+      ScopedPyObject output(PyObject_CallObject(klass, NULL));
+      if (!output) {
+        return NULL;
+      }
+      body.reset(readStruct(output.get(), klass, compiled));
+      if (!body) {
+        return NULL;
+      }
+    }
+    if (!impl()->readMessageEnd()) {
+      return NULL;
+    }
+  }
+  return Py_BuildValue("(OiiO)", name.get(), static_cast<int>(type), static_cast<int>(seqid),
+                       body ? body.get() : Py_None);
+}
+
+template <typename Impl>
+PyObject* ProtocolBase<Impl>::scanStruct() {
+  ScopedPyObject fields(PyList_New(0));
+  if (!fields) {
+    return NULL;
+  }
+  detail::ReadStructScope<Impl> scope = detail::readStructScope(this);
+  if (!scope) {
+    return NULL;
+  }
+  while (true) {
+    TType type = T_STOP;
+    int16_t tag;
+    if (!impl()->readFieldBegin(type, tag)) {
+      return NULL;
+    }
+    if (type == T_STOP) {
+      break;
+    }
+    Py_ssize_t start = input_.pos;
+    PyObject* value = Py_None;
+    if (type == T_BOOL) {
+      bool v = false;
+      if (!impl()->readBool(v)) {
+        return NULL;
+      }
+      value = v ? Py_True : Py_False;
+    } else if (!skip(type)) {
+      return NULL;
+    }
+    ScopedPyObject field(Py_BuildValue("(iinnO)", static_cast<int>(tag), static_cast<int>(type),
+                                       start, input_.pos, value));
+    if (!field || PyList_Append(fields.get(), field.get()) < 0) {
+      return NULL;
+    }
+  }
+  return fields.release();
+}
+
 // Returns a new reference.
 template <typename Impl>
-PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
+PyObject* ProtocolBase<Impl>::decodeValue(TType type, SpecArgs& args) {
   switch (type) {
 
   case T_BOOL: {
@@ -700,12 +1640,22 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
 
   case T_STRING: {
     char* buf = NULL;
-    int len = impl()->readString(&buf);
+    int len = args.binary ? impl()->readBinary(&buf) : impl()->readString(&buf);
     if (len < 0) {
       return NULL;
     }
-    if (isUtf8(typeargs)) {
-      return PyUnicode_DecodeUTF8(buf, len, 0);
+    if (args.utf8) {
+      PyObject* str = PyUnicode_DecodeUTF8(buf, len, 0);
+#if PY_MAJOR_VERSION >= 3
+      if (str && internTable_ && PyUnicode_GET_LENGTH(str) <= internMaxLength_) {
+#else
+      if (str && internTable_ && PyUnicode_GET_SIZE(str) <= internMaxLength_) {
+#endif
+        return internString(str);
+      }
+      return str;
+    } else if (binaryViews_) {
+      return readBinaryView(buf, len);
     } else {
       return PyBytes_FromStringAndSize(buf, len);
     }
@@ -713,10 +1663,7 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
 
   case T_LIST:
   case T_SET: {
-    SetListTypeArgs parsedargs;
-    if (!parse_set_list_args(&parsedargs, typeargs)) {
-      return NULL;
-    }
+    const SetListTypeArgs& parsedargs = args.setlist;
 
     TType etype = T_STOP;
     int32_t len = impl()->readListBegin(etype);
@@ -727,6 +1674,15 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
       return NULL;
     }
 
+    if (type == T_LIST && typedArrays_ && !parsedargs.immutable
+        && typed_array_typecode(parsedargs.element_type)) {
+      ScopedPyObject array(decodeArray(parsedargs.element_type, len));
+      if (!array || !impl()->readListEnd()) {
+        return NULL;
+      }
+      return array.release();
+    }
+
     bool use_tuple = type == T_LIST && parsedargs.immutable;
     ScopedPyObject ret(use_tuple ? PyTuple_New(len) : PyList_New(len));
     if (!ret) {
@@ -734,7 +1690,7 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
     }
 
     for (int i = 0; i < len; i++) {
-      PyObject* item = decodeValue(etype, parsedargs.typeargs);
+      PyObject* item = decodeValue(etype, *args.element);
       if (!item) {
         return NULL;
       }
@@ -744,6 +1700,9 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
         PyList_SET_ITEM(ret.get(), i, item);
       }
     }
+    if (!impl()->readListEnd()) {
+      return NULL;
+    }
 
     // TODO(dreiss): Consider biting the bullet and making two separate cases
     //               for list and set, avoiding this post facto conversion.
@@ -756,14 +1715,14 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
   }
 
   case T_MAP: {
-    MapTypeArgs parsedargs;
-    if (!parse_map_args(&parsedargs, typeargs)) {
-      return NULL;
-    }
+    const MapTypeArgs& parsedargs = args.map;
 
     TType ktype = T_STOP;
     TType vtype = T_STOP;
-    uint32_t len = impl()->readMapBegin(ktype, vtype);
+    int32_t len = impl()->readMapBegin(ktype, vtype);
+    if (len < 0) {
+      return NULL;
+    }
     if (len > 0 && (!checkType(ktype, parsedargs.ktag) || !checkType(vtype, parsedargs.vtag))) {
       return NULL;
     }
@@ -773,12 +1732,15 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
       return NULL;
     }
 
-    for (uint32_t i = 0; i < len; i++) {
-      ScopedPyObject k(decodeValue(ktype, parsedargs.ktypeargs));
+    for (int32_t i = 0; i < len; i++) {
+      ScopedPyObject k(decodeValue(ktype, *args.element));
+      if (k && internTable_ && ktype == T_STRING && args.element->utf8) {
+        k.reset(internString(k.release()));
+      }
       if (!k) {
         return NULL;
       }
-      ScopedPyObject v(decodeValue(vtype, parsedargs.vtypeargs));
+      ScopedPyObject v(decodeValue(vtype, *args.value));
       if (!v) {
         return NULL;
       }
@@ -786,6 +1748,9 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
         return NULL;
       }
     }
+    if (!impl()->readMapEnd()) {
+      return NULL;
+    }
 
     if (parsedargs.immutable) {
       if (!ThriftModule) {
@@ -809,11 +1774,11 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
   }
 
   case T_STRUCT: {
-    StructTypeArgs parsedargs;
-    if (!parse_struct_args(&parsedargs, typeargs)) {
+    StructSpec* spec = nested_struct_spec(args);
+    if (!spec) {
       return NULL;
     }
-    return readStruct(Py_None, parsedargs.klass, parsedargs.spec);
+    return readStruct(Py_None, args.structargs.klass, spec);
   }
 
   case T_STOP:
@@ -828,13 +1793,10 @@ PyObject* ProtocolBase<Impl>::decodeValue(TType type, PyObject* typeargs) {
 }
 
 template <typename Impl>
-PyObject* ProtocolBase<Impl>::readStruct(PyObject* output, PyObject* klass, PyObject* spec_seq) {
-  int spec_seq_len = PyTuple_Size(spec_seq);
+PyObject* ProtocolBase<Impl>::readStruct(PyObject* output, PyObject* klass, StructSpec* spec) {
+  int spec_seq_len = static_cast<int>(spec->by_tag.size());
   bool immutable = output == Py_None;
   ScopedPyObject kwargs;
-  if (spec_seq_len == -1) {
-    return NULL;
-  }
 
   if (immutable) {
     kwargs.reset(PyDict_New());
@@ -865,34 +1827,30 @@ PyObject* ProtocolBase<Impl>::readStruct(PyObject* output, PyObject* klass, PyOb
       continue;
     }
 
-    PyObject* item_spec = PyTuple_GET_ITEM(spec_seq, tag);
-    if (item_spec == Py_None) {
+    FieldSpec* parsedspec = spec->by_tag[tag];
+    if (!parsedspec) {
       if (!skip(type)) {
         PyErr_SetString(PyExc_TypeError, "Error while skipping unknown field");
         return NULL;
       }
       continue;
     }
-    StructItemSpec parsedspec;
-    if (!parse_struct_item_spec(&parsedspec, item_spec)) {
-      return NULL;
-    }
-    if (parsedspec.type != type) {
+    if (parsedspec->type != type) {
       if (!skip(type)) {
         PyErr_Format(PyExc_TypeError, "struct field had wrong type: expected %d but got %d",
-                     parsedspec.type, type);
+                     parsedspec->type, type);
         return NULL;
       }
       continue;
     }
 
-    ScopedPyObject fieldval(decodeValue(parsedspec.type, parsedspec.typeargs));
+    ScopedPyObject fieldval(decodeValue(parsedspec->type, parsedspec->args));
     if (!fieldval) {
       return NULL;
     }
 
-    if ((immutable && PyDict_SetItem(kwargs.get(), parsedspec.attrname, fieldval.get()) == -1)
-        || (!immutable && PyObject_SetAttr(output, parsedspec.attrname, fieldval.get()) == -1)) {
+    if ((immutable && PyDict_SetItem(kwargs.get(), parsedspec->attrname, fieldval.get()) == -1)
+        || (!immutable && PyObject_SetAttr(output, parsedspec->attrname, fieldval.get()) == -1)) {
       return NULL;
     }
   }
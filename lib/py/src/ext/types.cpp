@@ -20,17 +20,19 @@
 #include "ext/types.h"
 #include "ext/protocol.h"
 
+#include <map>
+#include <string.h>
+
 namespace apache {
 namespace thrift {
 namespace py {
 
 PyObject* ThriftModule = NULL;
+PyObject* TBaseModule = NULL;
 
-#if PY_MAJOR_VERSION < 3
-char refill_signature[] = {'s', '#', 'i'};
-#else
-const char* refill_signature = "y#i";
-#endif
+// The partial read is passed as a new bytes object ("N" steals it), which
+// avoids the PY_SSIZE_T_CLEAN dependent "#" format units.
+const char* refill_signature = "Ni";
 
 bool parse_struct_item_spec(StructItemSpec* dest, PyObject* spec_tuple) {
   // i'd like to use ParseArgs here, but it seems to be a bottleneck.
@@ -108,6 +110,378 @@ bool parse_struct_args(StructTypeArgs* dest, PyObject* typeargs) {
 
   return true;
 }
+
+static bool is_utf8(PyObject* typeargs) {
+#if PY_MAJOR_VERSION < 3
+  return PyString_Check(typeargs) && !strncmp(PyString_AS_STRING(typeargs), "UTF8", 4);
+#else
+  // while condition for py2 is "arg == 'UTF8'", it should be "arg != 'BINARY'" for py3.
+  // HACK: check the length and don't bother reading the value
+  return !PyUnicode_Check(typeargs) || PyUnicode_GET_LENGTH(typeargs) != 6;
+#endif
+}
+
+static bool is_binary(PyObject* typeargs) {
+#if PY_MAJOR_VERSION < 3
+  return PyString_Check(typeargs) && !strcmp(PyString_AS_STRING(typeargs), "BINARY");
+#else
+  return !is_utf8(typeargs);
+#endif
+}
+
+bool compile_spec_args(SpecArgs* dest, TType type, PyObject* typeargs) {
+  dest->typeargs = typeargs;
+  switch (type) {
+  case T_STRING:
+    dest->utf8 = is_utf8(typeargs);
+    dest->binary = is_binary(typeargs);
+    return true;
+
+  case T_LIST:
+  case T_SET:
+    if (!parse_set_list_args(&dest->setlist, typeargs)) {
+      return false;
+    }
+    dest->element = new SpecArgs;
+    return compile_spec_args(dest->element, dest->setlist.element_type, dest->setlist.typeargs);
+
+  case T_MAP:
+    if (!parse_map_args(&dest->map, typeargs)) {
+      return false;
+    }
+    dest->element = new SpecArgs;
+    dest->value = new SpecArgs;
+    return compile_spec_args(dest->element, dest->map.ktag, dest->map.ktypeargs)
+           && compile_spec_args(dest->value, dest->map.vtag, dest->map.vtypeargs);
+
+  case T_STRUCT:
+    // the nested StructSpec is resolved on first use, which also takes care
+    // of structs that refer to themselves.
+    return parse_struct_args(&dest->structargs, typeargs);
+
+  default:
+    return true;
+  }
+}
+
+StructSpec::~StructSpec() {
+  for (std::vector<FieldSpec*>::iterator it = fields.begin(); it != fields.end(); ++it) {
+    delete *it;
+  }
+}
+
+static StructSpec* compile_struct_spec(PyObject* spec) {
+  if (!PyTuple_Check(spec)) {
+    PyErr_SetString(PyExc_TypeError, "spec is not a tuple");
+    return NULL;
+  }
+  Py_ssize_t nspec = PyTuple_GET_SIZE(spec);
+  StructSpec* compiled = new StructSpec;
+  compiled->spec = spec;
+  compiled->by_tag.resize(nspec, NULL);
+  for (Py_ssize_t i = 0; i < nspec; i++) {
+    PyObject* spec_tuple = PyTuple_GET_ITEM(spec, i);
+    if (spec_tuple == Py_None) {
+      continue;
+    }
+    FieldSpec* field = new FieldSpec;
+    compiled->fields.push_back(field);
+    compiled->by_tag[i] = field;
+    if (!parse_struct_item_spec(field, spec_tuple)
+        || !compile_spec_args(&field->args, field->type, field->typeargs)) {
+      delete compiled;
+      return NULL;
+    }
+  }
+  return compiled;
+}
+
+static const char* const STRUCT_SPEC_CAPSULE = "thrift.protocol.fastbinary.StructSpec";
+
+static void free_struct_spec(PyObject* capsule) {
+  delete static_cast<StructSpec*>(PyCapsule_GetPointer(capsule, STRUCT_SPEC_CAPSULE));
+}
+
+// Compiled specs of the classes that cannot hold their own, such as
+// old-style classes.  The cache holds a reference to each thrift_spec tuple,
+// so their address is a stable key.
+typedef std::map<PyObject*, StructSpec*> StructSpecCache;
+static StructSpecCache struct_spec_cache;
+
+static StructSpec* get_shared_struct_spec(PyObject* spec) {
+  StructSpecCache::iterator it = struct_spec_cache.find(spec);
+  if (it != struct_spec_cache.end()) {
+    return it->second;
+  }
+  StructSpec* compiled = compile_struct_spec(spec);
+  if (compiled) {
+    Py_INCREF(spec);
+    struct_spec_cache[spec] = compiled;
+  }
+  return compiled;
+}
+
+StructSpec* get_struct_spec(PyObject* klass, PyObject* spec) {
+  if (!PyType_Check(klass)) {
+    return get_shared_struct_spec(spec);
+  }
+  // Only the class's own dict, subclasses keep entries of their own.
+  PyObject* type_dict = reinterpret_cast<PyTypeObject*>(klass)->tp_dict;
+  PyObject* specs = type_dict ? PyDict_GetItem(type_dict, INTERN_STRING(_thrift_compiled_specs))
+                              : NULL;
+  if (specs && !PyDict_Check(specs)) {
+    return get_shared_struct_spec(spec);
+  }
+  ScopedPyObject key(PyLong_FromVoidPtr(spec));
+  if (!key) {
+    return NULL;
+  }
+  if (specs) {
+    PyObject* entry = PyDict_GetItem(specs, key.get());
+    if (entry) {
+      return static_cast<StructSpec*>(
+          PyCapsule_GetPointer(PyTuple_GET_ITEM(entry, 1), STRUCT_SPEC_CAPSULE));
+    }
+  }
+
+  StructSpec* compiled = compile_struct_spec(spec);
+  if (!compiled) {
+    return NULL;
+  }
+  ScopedPyObject capsule(PyCapsule_New(compiled, STRUCT_SPEC_CAPSULE, free_struct_spec));
+  if (!capsule) {
+    delete compiled;
+    return NULL;
+  }
+  ScopedPyObject fresh;
+  if (!specs) {
+    fresh.reset(PyDict_New());
+    if (!fresh) {
+      return NULL;
+    }
+    if (PyObject_SetAttr(klass, INTERN_STRING(_thrift_compiled_specs), fresh.get()) == -1) {
+      if (!PyErr_ExceptionMatches(PyExc_TypeError)
+          && !PyErr_ExceptionMatches(PyExc_AttributeError)) {
+        return NULL;
+      }
+      PyErr_Clear();
+      return get_shared_struct_spec(spec);
+    }
+    specs = fresh.get();
+  }
+  ScopedPyObject entry(PyTuple_Pack(2, spec, capsule.get()));
+  if (!entry || PyDict_SetItem(specs, key.get(), entry.get()) == -1) {
+    return NULL;
+  }
+  return compiled;
+}
+
+void set_protocol_error(int type, const char* message) {
+  static PyObject* exception_class = NULL;
+  if (!exception_class) {
+    ScopedPyObject mod(PyImport_ImportModule("thrift.protocol.TProtocol"));
+    if (!mod) {
+      return;
+    }
+    exception_class = PyObject_GetAttrString(mod.get(), "TProtocolException");
+    if (!exception_class) {
+      return;
+    }
+  }
+  ScopedPyObject exc(
+      PyObject_CallFunction(exception_class, const_cast<char*>("is"), type, message));
+  if (exc) {
+    PyErr_SetObject(exception_class, exc.get());
+  }
+}
+
+PyObject* message_name_from_bytes(const char* buf, Py_ssize_t len) {
+#if PY_MAJOR_VERSION >= 3
+  return PyUnicode_DecodeUTF8(buf, len, NULL);
+#else
+  return PyString_FromStringAndSize(buf, len);
+#endif
+}
+
+PyObject* message_name_to_bytes(PyObject* name) {
+  if (PyUnicode_Check(name)) {
+    return PyUnicode_AsUTF8String(name);
+  }
+  if (PyBytes_Check(name)) {
+    Py_INCREF(name);
+    return name;
+  }
+  PyErr_SetString(PyExc_TypeError, "message name must be a string");
+  return NULL;
+}
+
+static int typecode_size(char typecode) {
+  switch (typecode) {
+  case 'b':
+    return 1;
+  case 'h':
+    return sizeof(short);
+  case 'i':
+    return sizeof(int);
+  case 'l':
+    return sizeof(long);
+  case 'q':
+    return sizeof(PY_LONG_LONG);
+  case 'd':
+    return sizeof(double);
+  default:
+    return 0;
+  }
+}
+
+static char signed_typecode(int size) {
+  static const char typecodes[] = "bhilq";
+  for (const char* code = typecodes; *code; ++code) {
+    if (typecode_size(*code) == size) {
+      return *code;
+    }
+  }
+  return 0;
+}
+
+char typed_array_typecode(TType type) {
+  switch (type) {
+  case T_BYTE:
+    return signed_typecode(1);
+  case T_I16:
+    return signed_typecode(2);
+  case T_I32:
+    return signed_typecode(4);
+  case T_I64:
+    return signed_typecode(8);
+  case T_DOUBLE:
+    return 'd';
+  default:
+    return 0;
+  }
+}
+
+PyObject* new_typed_array(TType type, Py_ssize_t len) {
+  static PyObject* array_type = NULL;
+  if (!array_type) {
+    ScopedPyObject mod(PyImport_ImportModule("array"));
+    if (!mod) {
+      return NULL;
+    }
+    array_type = PyObject_GetAttrString(mod.get(), "array");
+    if (!array_type) {
+      return NULL;
+    }
+  }
+  char typecode[2] = {typed_array_typecode(type), 0};
+  ScopedPyObject zero(PyObject_CallFunction(array_type, const_cast<char*>("s[i]"), typecode, 0));
+  if (!zero) {
+    return NULL;
+  }
+  return PySequence_Repeat(zero.get(), len);
+}
+
+char* typed_array_data(PyObject* array) {
+#if PY_MAJOR_VERSION >= 3
+  Py_buffer view;
+  if (PyObject_GetBuffer(array, &view, PyBUF_WRITABLE) < 0) {
+    return NULL;
+  }
+  char* data = static_cast<char*>(view.buf);
+  // the array is private to the decoder and never resized, so its storage
+  // outlives the view
+  PyBuffer_Release(&view);
+  return data;
+#else
+  void* data;
+  Py_ssize_t size;
+  if (PyObject_AsWriteBuffer(array, &data, &size) < 0) {
+    return NULL;
+  }
+  return static_cast<char*>(data);
+#endif
+}
+
+namespace {
+
+const char BASE64_CHARS[] = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+
+inline int base64_value(char c) {
+  if (c >= 'A' && c <= 'Z') {
+    return c - 'A';
+  } else if (c >= 'a' && c <= 'z') {
+    return c - 'a' + 26;
+  } else if (c >= '0' && c <= '9') {
+    return c - '0' + 52;
+  } else if (c == '+') {
+    return 62;
+  } else if (c == '/') {
+    return 63;
+  }
+  return -1;
+}
+}
+
+void base64_encode(const char* data, Py_ssize_t len, std::string& out) {
+  const unsigned char* in = reinterpret_cast<const unsigned char*>(data);
+  out.reserve(out.size() + (len + 2) / 3 * 4);
+  for (Py_ssize_t i = 0; i < len; i += 3) {
+    uint32_t chunk = in[i] << 16;
+    if (i + 1 < len) {
+      chunk |= in[i + 1] << 8;
+    }
+    if (i + 2 < len) {
+      chunk |= in[i + 2];
+    }
+    out += BASE64_CHARS[(chunk >> 18) & 0x3f];
+    out += BASE64_CHARS[(chunk >> 12) & 0x3f];
+    out += i + 1 < len ? BASE64_CHARS[(chunk >> 6) & 0x3f] : '=';
+    out += i + 2 < len ? BASE64_CHARS[chunk & 0x3f] : '=';
+  }
+}
+
+bool base64_decode(const char* data, Py_ssize_t len, std::string& out) {
+  uint32_t bits = 0;
+  int count = 0;
+  for (Py_ssize_t i = 0; i < len && data[i] != '='; ++i) {
+    int value = base64_value(data[i]);
+    if (value < 0) {
+      continue;
+    }
+    bits = bits << 6 | value;
+    if (++count % 4 == 0) {
+      out += static_cast<char>(bits >> 16);
+      out += static_cast<char>(bits >> 8);
+      out += static_cast<char>(bits);
+      bits = 0;
+    }
+  }
+  if (count % 4 == 1) {
+    return false;
+  } else if (count % 4 == 2) {
+    out += static_cast<char>(bits >> 4);
+  } else if (count % 4 == 3) {
+    out += static_cast<char>(bits >> 10);
+    out += static_cast<char>(bits >> 2);
+  }
+  return true;
+}
+
+bool typed_array_view_matches(TType type, const Py_buffer& view) {
+  char typecode = typed_array_typecode(type);
+  if (!typecode || view.ndim > 1 || !view.format) {
+    return false;
+  }
+  const char* format = view.format;
+  if (*format == '@') {
+    ++format;
+  }
+  if (!format[0] || format[1] || view.itemsize != typecode_size(typecode)) {
+    return false;
+  }
+  // any signed integer format of the right size will do
+  return typecode == 'd' ? format[0] == 'd' : strchr("bhilq", format[0]) != NULL;
+}
 }
 }
 }
@@ -26,14 +26,16 @@
 #define __STDC_LIMIT_MACROS
 #endif
 #include <stdint.h>
+#include <string>
+#include <vector>
 
 #if PY_MAJOR_VERSION >= 3
 
-#include <vector>
-
 // TODO: better macros
 #define PyInt_AsLong(v) PyLong_AsLong(v)
 #define PyInt_FromLong(v) PyLong_FromLong(v)
+#define PyInt_AsSsize_t(v) PyLong_AsSsize_t(v)
+#define PyInt_FromSsize_t(v) PyLong_FromSsize_t(v)
 
 #define PyString_InternFromString(v) PyUnicode_InternFromString(v)
 
@@ -47,6 +49,27 @@ extern "C" {
 extern PyObject* INTERN_STRING(TFrozenDict);
 extern PyObject* INTERN_STRING(cstringio_buf);
 extern PyObject* INTERN_STRING(cstringio_refill);
+extern PyObject* INTERN_STRING(thrift_spec);
+extern PyObject* INTERN_STRING(cbuffer_view);
+extern PyObject* INTERN_STRING(cbuffer_seek);
+extern PyObject* INTERN_STRING(getbuffer);
+extern PyObject* INTERN_STRING(tell);
+extern PyObject* INTERN_STRING(seek);
+extern PyObject* INTERN_STRING(TSizedIterable);
+extern PyObject* INTERN_STRING(chunk_size);
+extern PyObject* INTERN_STRING(write);
+extern PyObject* INTERN_STRING(drain);
+extern PyObject* INTERN_STRING(size);
+extern PyObject* INTERN_STRING(max_length);
+extern PyObject* INTERN_STRING(current);
+extern PyObject* INTERN_STRING(get);
+extern PyObject* INTERN_STRING(put);
+extern PyObject* INTERN_STRING(TFrozenBase);
+extern PyObject* INTERN_STRING(binary);
+extern PyObject* INTERN_STRING(compact);
+extern PyObject* INTERN_STRING(previous);
+extern PyObject* INTERN_STRING(rotate);
+extern PyObject* INTERN_STRING(_thrift_compiled_specs);
 }
 
 namespace apache {
@@ -54,6 +77,7 @@ namespace thrift {
 namespace py {
 
 extern PyObject* ThriftModule;
+extern PyObject* TBaseModule;
 
 // Stolen out of TProtocol.h.
 // It would be a huge pain to have both get this from one place.
@@ -114,19 +138,90 @@ private:
 };
 
 /**
- * A cache of the two key attributes of a CReadableTransport,
- * so we don't have to keep calling PyObject_GetAttr.
+ * The input of a decode.
+ *
+ * Whenever possible the bytes are read through a buffer protocol view, either
+ * of a caller supplied object (bytes, bytearray, memoryview, mmap...) or of
+ * the read buffer of a CReadableTransport.  The key attributes of the
+ * transport are cached so we don't have to keep calling PyObject_GetAttr.
  */
 struct DecodeBuffer {
+  enum Source {
+    NONE,
+    BUFFER,    // caller supplied object, no refill
+    TRANSPORT, // view returned by trans.cbuffer_view()
+    STRINGIO   // view of trans.cstringio_buf
+  };
+
+  DecodeBuffer() : source(NONE), pos(0) {}
+  ~DecodeBuffer() { release_view(); }
+
+  bool has_view() const { return source != NONE; }
+
+  void release_view() {
+    if (source != NONE) {
+      PyBuffer_Release(&view);
+      source = NONE;
+    }
+  }
+
   ScopedPyObject stringiobuf;
   ScopedPyObject refill_callable;
+  ScopedPyObject trans;
+  ScopedPyObject view_callable;
+  Py_buffer view;
+  Source source;
+  Py_ssize_t pos;
+};
+
+extern const char* refill_signature;
+
+/**
+ * A caller owned buffer to encode into: a bytearray, which is grown as
+ * needed and never shrunk, or any other writable buffer of fixed size.
+ * A counting target has no buffer and only adds up the encoded sizes.
+ */
+struct EncodeTarget {
+  EncodeTarget()
+    : active(false),
+      count(false),
+      bytearray(NULL),
+      has_view(false),
+      data(NULL),
+      pos(0),
+      size(0),
+      frame(-1) {}
+  ~EncodeTarget() {
+    if (has_view) {
+      PyBuffer_Release(&view);
+    }
+  }
+
+  bool active;
+  bool count;
+  PyObject* bytearray; // borrowed
+  Py_buffer view;
+  bool has_view;
+  char* data;
+  Py_ssize_t pos;
+  Py_ssize_t size;
+  Py_ssize_t frame; // offset of the reserved frame length, or -1
+};
+
+/**
+ * The transport encodeValue drains the encoded bytes to while writing a
+ * TSizedIterable with a chunk_size, along with its cbuffer_output and
+ * cbuffer_written when encoding into its write buffer.
+ */
+struct EncodeSink {
+  PyObject* trans;            // borrowed
+  PyObject* output_callable;  // borrowed, or NULL
+  PyObject* written_callable; // borrowed, or NULL
 };
 
 #if PY_MAJOR_VERSION < 3
-extern char refill_signature[3];
 typedef PyObject EncodeBuffer;
 #else
-extern const char* refill_signature;
 struct EncodeBuffer {
   std::vector<char> buf;
   size_t pos;
@@ -177,6 +272,68 @@ struct StructItemSpec {
   PyObject* defval;
 };
 
+struct StructSpec;
+
+/**
+ * The compiled form of the spec_args of a value.
+ * Nested spec_args are compiled along with their parent, so we don't have
+ * to parse the spec tuples again on every call.
+ * typeargs and the PyObjects in the parsed args are borrowed references;
+ * the spec cache holds a reference to the thrift_spec owning them.
+ */
+struct SpecArgs {
+  SpecArgs()
+    : typeargs(NULL), utf8(false), binary(false), element(NULL), value(NULL), nested(NULL) {}
+  ~SpecArgs() {
+    delete element;
+    delete value;
+  }
+
+  PyObject* typeargs;
+  bool utf8;                 // T_STRING
+  bool binary;               // T_STRING declared binary
+  SetListTypeArgs setlist;   // T_LIST and T_SET
+  MapTypeArgs map;           // T_MAP
+  StructTypeArgs structargs; // T_STRUCT
+  SpecArgs* element;         // element of a list or set, key of a map
+  SpecArgs* value;           // value of a map
+  StructSpec* nested;        // T_STRUCT, resolved on first use
+
+private:
+  SpecArgs(const SpecArgs&);
+  SpecArgs& operator=(const SpecArgs&);
+};
+
+/**
+ * A struct item spec along with its compiled spec_args.
+ */
+struct FieldSpec : StructItemSpec {
+  SpecArgs args;
+};
+
+/**
+ * The compiled form of a thrift_spec tuple.
+ * Instances are cached in the _thrift_compiled_specs dict of the struct
+ * class, keyed by the identity of the thrift_spec tuple, which the entry
+ * holds a reference to.  Replacing a class's thrift_spec simply yields a new
+ * entry, and the entries go away along with the class.  spec is borrowed
+ * from the entry.
+ */
+struct StructSpec {
+  StructSpec() : spec(NULL) {}
+  ~StructSpec();
+
+  PyObject* spec;
+  // non-None items in thrift_spec order
+  std::vector<FieldSpec*> fields;
+  // indexed by position in thrift_spec, NULL for None items
+  std::vector<FieldSpec*> by_tag;
+
+private:
+  StructSpec(const StructSpec&);
+  StructSpec& operator=(const StructSpec&);
+};
+
 bool parse_set_list_args(SetListTypeArgs* dest, PyObject* typeargs);
 
 bool parse_map_args(MapTypeArgs* dest, PyObject* typeargs);
@@ -184,6 +341,88 @@ bool parse_map_args(MapTypeArgs* dest, PyObject* typeargs);
 bool parse_struct_args(StructTypeArgs* dest, PyObject* typeargs);
 
 bool parse_struct_item_spec(StructItemSpec* dest, PyObject* spec_tuple);
+
+bool compile_spec_args(SpecArgs* dest, TType type, PyObject* typeargs);
+
+/**
+ * Returns the cached compiled form of klass's thrift_spec tuple spec,
+ * compiling it on first use. The result is owned by the cache.
+ */
+StructSpec* get_struct_spec(PyObject* klass, PyObject* spec);
+
+// TMessageType values
+enum TMessageType {
+  T_CALL = 1,
+  T_REPLY = 2,
+  T_EXCEPTION = 3,
+  T_ONEWAY = 4
+};
+
+// TProtocolException types
+enum TProtocolExceptionType {
+  T_INVALID_DATA = 1,
+  T_BAD_VERSION = 4
+};
+
+/**
+ * Sets thrift.protocol.TProtocol.TProtocolException(type, message) as the
+ * current exception.
+ */
+void set_protocol_error(int type, const char* message);
+
+/**
+ * The array.array typecode holding list<type> values, or 0 when the values
+ * of type have no fixed width native representation.
+ */
+char typed_array_typecode(TType type);
+
+/**
+ * Returns a zero filled array.array of len list<type> values.
+ */
+PyObject* new_typed_array(TType type, Py_ssize_t len);
+
+/**
+ * The storage of a non empty array.array created by new_typed_array, to be
+ * filled in place.
+ */
+char* typed_array_data(PyObject* array);
+
+/**
+ * Whether a one dimensional buffer holds list<type> values in the native
+ * format of typed_array_typecode(type).
+ */
+bool typed_array_view_matches(TType type, const Py_buffer& view);
+
+/**
+ * Appends the padded base64 encoding of len bytes of data to out.
+ */
+void base64_encode(const char* data, Py_ssize_t len, std::string& out);
+
+/**
+ * Appends the bytes base64 encoded in len characters of data to out, as
+ * base64.b64decode does: characters out of the alphabet are ignored and
+ * the padding may be missing.  Returns false when a character is left
+ * over, which no encoding ends with.
+ */
+bool base64_decode(const char* data, Py_ssize_t len, std::string& out);
+
+/**
+ * Returns a new reference to a message name read from the wire: str on
+ * both Python 2 and 3, like the pure Python protocols return.
+ */
+PyObject* message_name_from_bytes(const char* buf, Py_ssize_t len);
+
+/**
+ * Returns a new reference to a bytes object holding the UTF-8 encoded name.
+ */
+PyObject* message_name_to_bytes(PyObject* name);
+
+inline StructSpec* nested_struct_spec(SpecArgs& args) {
+  if (!args.nested) {
+    args.nested = get_struct_spec(args.structargs.klass, args.structargs.spec);
+  }
+  return args.nested;
+}
 }
 }
 }
@@ -17,6 +17,9 @@
 # under the License.
 #
 
+import weakref
+from operator import attrgetter
+
 from thrift.transport import TTransport
 
 
@@ -61,14 +64,35 @@ class TExceptionBase(TBase, Exception):
 
 
 class TFrozenBase(TBase):
+    # _thrift_hash keeps the hash of the field values once it is computed.
+    __slots__ = ('_thrift_hash', '__weakref__')
+
     def __setitem__(self, *args):
         raise TypeError("Can't modify frozen struct")
 
     def __delitem__(self, *args):
         raise TypeError("Can't modify frozen struct")
 
-    def __hash__(self, *args):
-        return hash(self.__class__) ^ hash(self.__slots__)
+    def __hash__(self):
+        try:
+            return self._thrift_hash
+        except AttributeError:
+            pass
+        cls = self.__class__
+        values = _field_getters.get(cls)
+        if values is None:
+            values = _field_getters[cls] = _field_getter(cls.thrift_spec)
+        value = hash(cls) ^ hash(values(self))
+        object.__setattr__(self, '_thrift_hash', value)
+        return value
+
+    def __reduce__(self):
+        # Instances can't be modified once created, so pickle them as the
+        # keyword arguments to their constructor.  Its positional arguments
+        # are in declaration order, which needn't be thrift_spec's.
+        fields = dict((spec[2], getattr(self, spec[2]))
+                      for spec in self.thrift_spec if spec is not None)
+        return (_rebuild_frozen, (self.__class__, fields))
 
     @classmethod
     def read(cls, iprot):
@@ -80,3 +104,105 @@ class TFrozenBase(TBase):
                                       (self.__class__, self.thrift_spec))
         else:
             return iprot.readStruct(cls, cls.thrift_spec, True)
+
+    def write(self, oprot):
+        cache = oprot.encoded_cache
+        if (cache is None or oprot.wire_format is None or
+                oprot._fast_encode is not None or self.thrift_spec is None):
+            TBase.write(self, oprot)
+        else:
+            oprot.trans.write(cache.encode(self, oprot))
+
+
+def _rebuild_frozen(cls, fields):
+    return cls(**fields)
+
+
+# struct class -> function returning the tuple of the field values of an
+# instance, in thrift_spec order
+_field_getters = {}
+
+
+def _field_getter(thrift_spec):
+    names = [spec[2] for spec in thrift_spec if spec is not None]
+    if len(names) == 1:
+        getter = attrgetter(names[0])
+        return lambda obj: (getter(obj),)
+    if not names:
+        return lambda obj: ()
+    return attrgetter(*names)
+
+
+class TEncodedCache(object):
+    """Remembers the encoding of frozen structs.
+
+    Given to a protocol (or its factory) as encoded_cache, each TFrozenBase
+    instance written is encoded once per encoding_key() of the protocols
+    writing it, and its bytes are copied as they are when the same instance
+    is written again, on its own or within another struct.  Entries go away
+    along with their structs.
+
+    get() and put() are the whole interface to the entries: the pure Python
+    protocols go through encode(), and the accelerated ones call get() and
+    put() directly.
+    """
+
+    __slots__ = ('_entries', '__weakref__')
+
+    def __init__(self):
+        # id(obj) -> (weak reference to obj, {encoding key: bytes})
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, obj, encoding):
+        """Returns the encoding of obj cached under encoding, a protocol's
+        encoding_key(), or None."""
+        entry = self._entries.get(id(obj))
+        if entry is None or entry[0]() is not obj:
+            return None
+        return entry[1].get(encoding)
+
+    def put(self, obj, encoding, data):
+        """Caches data as the encoding of frozen struct obj."""
+        if not isinstance(obj, TFrozenBase):
+            return
+        key = id(obj)
+        entry = self._entries.get(key)
+        if entry is None or entry[0]() is not obj:
+            entry = (weakref.ref(obj, _forget(self, key)), {})
+            self._entries[key] = entry
+        entry[1][encoding] = data
+
+    def encode(self, obj, oprot):
+        """Returns the encoding of frozen struct obj with oprot, from the
+        cache when possible."""
+        encoding = oprot.encoding_key()
+        data = self.get(obj, encoding)
+        if data is None:
+            # Encoded by oprot itself, settings and all, into a buffer.
+            buf = TTransport.TMemoryBuffer()
+            trans = oprot.trans
+            oprot.trans = buf
+            try:
+                TBase.write(obj, oprot)
+            finally:
+                oprot.trans = trans
+            data = buf.getvalue()
+            self.put(obj, encoding, data)
+        return data
+
+
+def _forget(cache, key):
+    """Returns a weakref callback dropping the entry of key from cache."""
+    cache = weakref.ref(cache)
+
+    def callback(ref):
+        owner = cache()
+        if owner is not None and owner._entries.get(key, (None,))[0] is ref:
+            del owner._entries[key]
+    return callback
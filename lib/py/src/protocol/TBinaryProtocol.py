@@ -17,8 +17,24 @@
 # under the License.
 #
 
-from .TProtocol import TType, TProtocolBase, TProtocolException
+from .TProtocol import TType, TProtocolBase, TProtocolException, codec_property
+from .TCodec import ARRAY_TYPECODES, array_to_bytes, as_array
+from ..compat import binary_to_str
 from struct import pack, unpack
+import array
+import sys
+
+_SWAP_ARRAYS = sys.byteorder == 'little'
+
+# TType -> encoded size of the fixed width types
+_FIXED_WIDTHS = {
+    TType.BOOL: 1,
+    TType.BYTE: 1,
+    TType.I16: 2,
+    TType.I32: 4,
+    TType.I64: 8,
+    TType.DOUBLE: 8,
+}
 
 
 class TBinaryProtocol(TProtocolBase):
@@ -36,12 +52,19 @@ class TBinaryProtocol(TProtocolBase):
 
     TYPE_MASK = 0x000000ff
 
+    wire_format = 'binary'
+    encoding_settings = ('strictWrite', 'string_length_limit', 'container_length_limit')
+
     def __init__(self, trans, strictRead=False, strictWrite=True, **kwargs):
         TProtocolBase.__init__(self, trans)
         self.strictRead = strictRead
         self.strictWrite = strictWrite
         self.string_length_limit = kwargs.get('string_length_limit', None)
         self.container_length_limit = kwargs.get('container_length_limit', None)
+        self.typed_arrays = kwargs.get('typed_arrays', False)
+        self.binary_views = kwargs.get('binary_views', False)
+        self.intern_table = kwargs.get('intern_table', None)
+        self.encoded_cache = kwargs.get('encoded_cache', None)
 
     def _check_string_length(self, length):
         self._check_length(self.string_length_limit, length)
@@ -228,12 +251,74 @@ class TBinaryProtocol(TProtocolBase):
         val, = unpack('!d', buff)
         return val
 
+    def readString(self):
+        size = self.readI32()
+        self._check_string_length(size)
+        s = binary_to_str(self.trans.readAll(size))
+        if self.intern_table is not None:
+            return self.intern_table.intern_value(s)
+        return s
+
     def readBinary(self):
         size = self.readI32()
         self._check_string_length(size)
+        if self.binary_views:
+            return self._read_binary_view(size)
         s = self.trans.readAll(size)
         return s
 
+    def skip(self, ttype):
+        # Fixed width values, alone or in containers, are skipped with a
+        # single read rather than decoded one by one.
+        width = _FIXED_WIDTHS.get(ttype)
+        if width is not None:
+            self.trans.readAll(width)
+        elif ttype == TType.STRING:
+            size = self.readI32()
+            self._check_string_length(size)
+            self.trans.readAll(size)
+        elif ttype == TType.STRUCT:
+            while True:
+                ftype = self.readByte()
+                if ftype == TType.STOP:
+                    break
+                self.trans.readAll(2)
+                self.skip(ftype)
+        elif ttype in (TType.LIST, TType.SET):
+            (etype, size) = self.readListBegin()
+            width = _FIXED_WIDTHS.get(etype)
+            if width is not None:
+                self.trans.readAll(size * width)
+            else:
+                for _ in range(size):
+                    self.skip(etype)
+        elif ttype == TType.MAP:
+            (ktype, vtype, size) = self.readMapBegin()
+            kwidth = _FIXED_WIDTHS.get(ktype)
+            vwidth = _FIXED_WIDTHS.get(vtype)
+            if kwidth is not None and vwidth is not None:
+                self.trans.readAll(size * (kwidth + vwidth))
+            else:
+                for _ in range(size):
+                    self.skip(ktype)
+                    self.skip(vtype)
+        else:
+            super(TBinaryProtocol, self).skip(ttype)
+
+    def readArray(self, etype, size):
+        result = array.array(ARRAY_TYPECODES[etype])
+        result = array.array(result.typecode, self.trans.readAll(size * result.itemsize))
+        if _SWAP_ARRAYS:
+            result.byteswap()
+        return result
+
+    def writeArray(self, etype, values):
+        values = as_array(etype, values)
+        if _SWAP_ARRAYS and values.itemsize > 1:
+            values = values[:]
+            values.byteswap()
+        self.trans.write(array_to_bytes(values))
+
 
 class TBinaryProtocolFactory(object):
     def __init__(self, strictRead=False, strictWrite=True, **kwargs):
@@ -241,11 +326,19 @@ class TBinaryProtocolFactory(object):
         self.strictWrite = strictWrite
         self.string_length_limit = kwargs.get('string_length_limit', None)
         self.container_length_limit = kwargs.get('container_length_limit', None)
+        self.typed_arrays = kwargs.get('typed_arrays', False)
+        self.binary_views = kwargs.get('binary_views', False)
+        self.intern_table = kwargs.get('intern_table', None)
+        self.encoded_cache = kwargs.get('encoded_cache', None)
 
     def getProtocol(self, trans):
         prot = TBinaryProtocol(trans, self.strictRead, self.strictWrite,
                                string_length_limit=self.string_length_limit,
-                               container_length_limit=self.container_length_limit)
+                               container_length_limit=self.container_length_limit,
+                               typed_arrays=self.typed_arrays,
+                               binary_views=self.binary_views,
+                               intern_table=self.intern_table,
+                               encoded_cache=self.encoded_cache)
         return prot
 
 
@@ -269,7 +362,18 @@ class TBinaryProtocolAccelerated(TBinaryProtocol):
            Please feel free to report bugs and/or success stories
            to the public mailing list.
     """
-    pass
+
+    # The C codec keeps its own copy of these, so setting one rebinds it.
+    _codec = None
+    trans = codec_property('trans')
+    string_length_limit = codec_property('string_length_limit')
+    container_length_limit = codec_property('container_length_limit')
+    strictRead = codec_property('strictRead')
+    strictWrite = codec_property('strictWrite')
+    typed_arrays = codec_property('typed_arrays')
+    binary_views = codec_property('binary_views')
+    intern_table = codec_property('intern_table')
+    encoded_cache = codec_property('encoded_cache')
 
     def __init__(self, *args, **kwargs):
         fallback = kwargs.pop('fallback', True)
@@ -280,22 +384,56 @@ class TBinaryProtocolAccelerated(TBinaryProtocol):
             if not fallback:
                 raise
         else:
-            self._fast_decode = fastbinary.decode_binary
-            self._fast_encode = fastbinary.encode_binary
+            codec = self._codec = fastbinary.BinaryCodec()
+            self._bind_codec()
+            self._fast_decode = codec.decode
+            self._fast_encode = codec.encode
+            self._fast_decode_message = codec.decode_message
+            self._fast_encode_message = codec.encode_message
+            self._fast_scan = codec.scan
+            self._fast_decode_value = codec.decode_value
+            self._fast_encode_many = codec.encode_many
+            self._fast_decode_many = codec.decode_many
+            self._fast_encoded_size = codec.encoded_size
+
+    def _bind_codec(self):
+        self._codec.__init__(
+            self.trans,
+            string_length_limit=self.string_length_limit,
+            container_length_limit=self.container_length_limit,
+            strict_read=self.strictRead,
+            strict_write=self.strictWrite,
+            typed_arrays=self.typed_arrays,
+            binary_views=self.binary_views,
+            intern_table=self.intern_table,
+            encoded_cache=self.encoded_cache,
+            encoding_key=self.encoding_key())
 
 
 class TBinaryProtocolAcceleratedFactory(object):
     def __init__(self,
                  string_length_limit=None,
                  container_length_limit=None,
-                 fallback=True):
+                 fallback=True,
+                 typed_arrays=False,
+                 binary_views=False,
+                 intern_table=None,
+                 encoded_cache=None):
         self.string_length_limit = string_length_limit
         self.container_length_limit = container_length_limit
         self._fallback = fallback
+        self.typed_arrays = typed_arrays
+        self.binary_views = binary_views
+        self.intern_table = intern_table
+        self.encoded_cache = encoded_cache
 
     def getProtocol(self, trans):
         return TBinaryProtocolAccelerated(
             trans,
             string_length_limit=self.string_length_limit,
             container_length_limit=self.container_length_limit,
-            fallback=self._fallback)
+            fallback=self._fallback,
+            typed_arrays=self.typed_arrays,
+            binary_views=self.binary_views,
+            intern_table=self.intern_table,
+            encoded_cache=self.encoded_cache)
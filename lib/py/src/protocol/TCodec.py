@@ -0,0 +1,898 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Per-class compiled codecs for the pure-Python readStruct/writeStruct path.
+
+The generic implementation in TProtocolBase walks thrift_spec for every
+struct it reads or writes and resolves a handler method for every field.
+This module turns a (protocol class, struct class, thrift_spec) triple into
+a pair of specialized closures once, and caches them until the class's
+thrift_spec is replaced.  Values read or written outside of a struct are
+compiled once per (protocol class, ttype, spec) the same way.
+
+Compiled closures call the *unbound* protocol methods of the protocol class,
+so they take the protocol instance as their first argument:
+
+    reader = struct_reader(type(prot), cls, cls.thrift_spec, False)
+    reader(prot, obj)
+
+The same goes for the conversions of structs to and from primitives, the
+dicts, lists and scalars json.dumps takes and json.loads returns.
+"""
+
+import array
+import base64
+import sys
+
+from thrift.Thrift import TType, TFrozenDict, TSizedIterable
+from thrift.protocol.TBase import TBase, TFrozenBase
+
+import six
+
+__all__ = ['struct_reader', 'struct_writer', 'value_reader', 'value_writer',
+           'struct_sizer', 'struct_to_primitive', 'struct_from_primitive', 'clear_cache',
+           'ARRAY_TYPECODES', 'ARRAY_TYPES', 'as_array', 'array_to_bytes',
+           'ProjectedSpec', 'projected_spec']
+
+# (protocol class, struct class, is_immutable[, id(ProjectedSpec)])
+#   -> (thrift_spec, reader)
+_readers = {}
+# (protocol class, struct class) -> (thrift_spec, writer)
+_writers = {}
+# (protocol class, ttype, id(spec)) -> (spec, reader)
+_value_readers = {}
+# (protocol class, ttype, id(spec)) -> (spec, writer)
+_value_writers = {}
+# (wire format, struct class) -> (thrift_spec, sizer)
+_sizers = {}
+# (struct class, simple_json) -> (thrift_spec, converter)
+_dumpers = {}
+# (struct class, is_immutable, simple_json) -> (thrift_spec, converter)
+_loaders = {}
+# (id(thrift_spec), projection) -> (thrift_spec, ProjectedSpec)
+_projections = {}
+
+
+def _signed_typecode(size):
+    for code in 'bhilq':
+        try:
+            if array.array(code).itemsize == size:
+                return code
+        except ValueError:
+            # 'q' needs Python 3.3
+            pass
+    return None
+
+
+# TType -> array.array typecode of the list<ttype> values decoded as arrays
+# when a protocol's typed_arrays is set
+ARRAY_TYPECODES = dict(
+    (ttype, code) for ttype, code in (
+        (TType.BYTE, _signed_typecode(1)),
+        (TType.I16, _signed_typecode(2)),
+        (TType.I32, _signed_typecode(4)),
+        (TType.I64, _signed_typecode(8)),
+        (TType.DOUBLE, 'd'),
+    ) if code is not None)
+
+# list values written in bulk rather than item by item
+ARRAY_TYPES = (array.array, memoryview)
+
+array_to_bytes = getattr(array.array, 'tobytes', None) or array.array.tostring
+
+
+def as_array(ttype, values):
+    """Returns an array.array or memoryview of list<ttype> values as an array.array.
+
+    The array is returned as is when it already has the typecode of ttype.
+    """
+    code = ARRAY_TYPECODES[ttype]
+    if isinstance(values, array.array) and values.typecode == code:
+        return values
+    if isinstance(values, memoryview):
+        fmt = values.format.lstrip('@')
+        same_kind = fmt == 'd' if code == 'd' else len(fmt) == 1 and fmt in 'bhilq'
+        if same_kind and values.ndim == 1 and values.itemsize == array.array(code).itemsize:
+            return array.array(code, values.tobytes())
+        values = values.tolist()
+    return array.array(code, values)
+
+
+def clear_cache():
+    """Drops every compiled codec."""
+    _readers.clear()
+    _writers.clear()
+    _value_readers.clear()
+    _value_writers.clear()
+    _sizers.clear()
+    _dumpers.clear()
+    _loaders.clear()
+    _projections.clear()
+
+
+def _func(method):
+    return getattr(method, '__func__', method)
+
+
+_STOCK_READS = (_func(TBase.read), _func(TFrozenBase.read))
+_STOCK_WRITE = _func(TBase.write)
+
+
+def _has_stock_read(klass):
+    return _func(getattr(klass, 'read', None)) in _STOCK_READS
+
+
+def _is_classmethod_read(klass):
+    return getattr(getattr(klass, 'read', None), '__self__', None) is klass
+
+
+def _has_stock_write(klass):
+    return _func(getattr(klass, 'write', None)) is _STOCK_WRITE
+
+
+def _invalid_type(ttype):
+    # Imported here to avoid a circular import with TProtocol.
+    from thrift.protocol.TProtocol import TProtocolException
+
+    def fail(*args):
+        raise TProtocolException(type=TProtocolException.INVALID_DATA,
+                                 message='Invalid type %d' % ttype)
+    return fail
+
+
+def _string_methods(ttype, spec):
+    from thrift.protocol.TProtocol import TProtocolException
+    if spec == 'BINARY':
+        if ttype != TType.STRING:
+            raise TProtocolException(type=TProtocolException.INVALID_DATA,
+                                     message='Invalid binary field type %d' % ttype)
+        return 'readBinary', 'writeBinary'
+    if sys.version_info[0] == 2 and spec == 'UTF8':
+        if ttype != TType.STRING:
+            raise TProtocolException(type=TProtocolException.INVALID_DATA,
+                                     message='Invalid string field type %d' % ttype)
+        return 'readUtf8', 'writeUtf8'
+    return 'readString', 'writeString'
+
+
+_PRIMITIVES = {
+    TType.BOOL: ('readBool', 'writeBool'),
+    TType.BYTE: ('readByte', 'writeByte'),
+    TType.I16: ('readI16', 'writeI16'),
+    TType.I32: ('readI32', 'writeI32'),
+    TType.I64: ('readI64', 'writeI64'),
+    TType.DOUBLE: ('readDouble', 'writeDouble'),
+}
+
+
+def value_reader(prot_cls, ttype, spec):
+    """Returns a callable reading one value of ``ttype`` from a protocol."""
+    key = (prot_cls, ttype, id(spec))
+    entry = _value_readers.get(key)
+    if entry is None or entry[0] is not spec:
+        entry = (spec, _compile_value_reader(prot_cls, ttype, spec))
+        _value_readers[key] = entry
+    return entry[1]
+
+
+def value_writer(prot_cls, ttype, spec):
+    """Returns a callable writing one value of ``ttype`` to a protocol."""
+    key = (prot_cls, ttype, id(spec))
+    entry = _value_writers.get(key)
+    if entry is None or entry[0] is not spec:
+        entry = (spec, _compile_value_writer(prot_cls, ttype, spec))
+        _value_writers[key] = entry
+    return entry[1]
+
+
+def _compile_value_reader(prot_cls, ttype, spec):
+    if ttype == TType.STRING or spec in ('BINARY', 'UTF8'):
+        return getattr(prot_cls, _string_methods(ttype, spec)[0])
+    if ttype in _PRIMITIVES:
+        return getattr(prot_cls, _PRIMITIVES[ttype][0])
+    if ttype == TType.STRUCT:
+        return _nested_struct_reader(prot_cls, spec)
+    if ttype in (TType.LIST, TType.SET):
+        return _collection_reader(prot_cls, ttype, spec)
+    if ttype == TType.MAP:
+        return _map_reader(prot_cls, spec)
+    return _invalid_type(ttype)
+
+
+def _compile_value_writer(prot_cls, ttype, spec):
+    if ttype == TType.STRING or spec in ('BINARY', 'UTF8'):
+        return getattr(prot_cls, _string_methods(ttype, spec)[1])
+    if ttype in _PRIMITIVES:
+        return getattr(prot_cls, _PRIMITIVES[ttype][1])
+    if ttype == TType.STRUCT:
+        return _nested_struct_writer(prot_cls, spec)
+    if ttype in (TType.LIST, TType.SET):
+        return _collection_writer(prot_cls, ttype, spec)
+    if ttype == TType.MAP:
+        return _map_writer(prot_cls, spec)
+    return _invalid_type(ttype)
+
+
+def _nested_struct_reader(prot_cls, spec):
+    klass = spec[0]
+    if not _has_stock_read(klass):
+        if _is_classmethod_read(klass):
+            return klass.read
+
+        def read_custom_struct(prot):
+            obj = klass()
+            obj.read(prot)
+            return obj
+        return read_custom_struct
+
+    projection = spec[1] if isinstance(spec[1], ProjectedSpec) else None
+    if issubclass(klass, TFrozenBase):
+        def read_frozen_struct(prot):
+            return struct_reader(prot_cls, klass, projection or klass.thrift_spec,
+                                 True)(prot, klass)
+        return read_frozen_struct
+
+    def read_struct(prot):
+        obj = klass()
+        struct_reader(prot_cls, klass, projection or klass.thrift_spec, False)(prot, obj)
+        return obj
+    return read_struct
+
+
+def _nested_struct_writer(prot_cls, spec):
+    klass = spec[0]
+    if not _has_stock_write(klass):
+        return lambda prot, val: val.write(prot)
+
+    def write_struct(prot, val):
+        cls = val.__class__
+        if cls is klass:
+            struct_writer(prot_cls, cls, cls.thrift_spec)(prot, val)
+        else:
+            val.write(prot)
+    return write_struct
+
+
+def _collection_reader(prot_cls, ttype, spec):
+    etype, espec, is_immutable = spec
+    read_elem = value_reader(prot_cls, etype, espec)
+    if ttype == TType.LIST and not is_immutable and etype in ARRAY_TYPECODES:
+        return _array_list_reader(prot_cls, etype, read_elem)
+    if ttype == TType.LIST:
+        readBegin = prot_cls.readListBegin
+        readEnd = prot_cls.readListEnd
+        build = tuple if is_immutable else None
+    else:
+        readBegin = prot_cls.readSetBegin
+        readEnd = prot_cls.readSetEnd
+        build = frozenset if is_immutable else set
+
+    def read_collection(prot):
+        # TODO: compare types we just decoded with thrift_spec
+        size = readBegin(prot)[1]
+        result = [read_elem(prot) for _ in range(size)]
+        readEnd(prot)
+        return result if build is None else build(result)
+    return read_collection
+
+
+def _array_list_reader(prot_cls, etype, read_elem):
+    readBegin = prot_cls.readListBegin
+    readEnd = prot_cls.readListEnd
+    readArray = prot_cls.readArray
+
+    def read_list(prot):
+        size = readBegin(prot)[1]
+        if prot.typed_arrays:
+            result = readArray(prot, etype, size)
+        else:
+            result = [read_elem(prot) for _ in range(size)]
+        readEnd(prot)
+        return result
+    return read_list
+
+
+def _collection_writer(prot_cls, ttype, spec):
+    etype, espec, _ = spec
+    write_elem = value_writer(prot_cls, etype, espec)
+    if ttype == TType.LIST and etype in ARRAY_TYPECODES:
+        return _array_list_writer(prot_cls, etype, write_elem)
+    if ttype == TType.LIST:
+        writeBegin = prot_cls.writeListBegin
+        writeEnd = prot_cls.writeListEnd
+    else:
+        writeBegin = prot_cls.writeSetBegin
+        writeEnd = prot_cls.writeSetEnd
+
+    def write_collection(prot, val):
+        writeBegin(prot, etype, len(val))
+        if isinstance(val, TSizedIterable):
+            val = prot._stream(val)
+        for v in val:
+            write_elem(prot, v)
+        writeEnd(prot)
+    return write_collection
+
+
+def _array_list_writer(prot_cls, etype, write_elem):
+    writeBegin = prot_cls.writeListBegin
+    writeEnd = prot_cls.writeListEnd
+    writeArray = prot_cls.writeArray
+
+    def write_list(prot, val):
+        writeBegin(prot, etype, len(val))
+        if isinstance(val, ARRAY_TYPES):
+            writeArray(prot, etype, val)
+        else:
+            if isinstance(val, TSizedIterable):
+                val = prot._stream(val)
+            for v in val:
+                write_elem(prot, v)
+        writeEnd(prot)
+    return write_list
+
+
+def _map_reader(prot_cls, spec):
+    ktype, kspec, vtype, vspec, is_immutable = spec
+    read_key = value_reader(prot_cls, ktype, kspec)
+    read_val = value_reader(prot_cls, vtype, vspec)
+    readBegin = prot_cls.readMapBegin
+    readEnd = prot_cls.readMapEnd
+    string_keys = ktype == TType.STRING and kspec != 'BINARY'
+
+    def read_map(prot):
+        # TODO: compare types we just decoded with thrift_spec and
+        # abort/skip if types disagree
+        size = readBegin(prot)[2]
+        result = {}
+        table = prot.intern_table
+        intern = table.intern if string_keys and table is not None else None
+        for _ in range(size):
+            # keys must be read before values, so no dict comprehension here
+            k = read_key(prot)
+            if intern is not None:
+                k = intern(k)
+            result[k] = read_val(prot)
+        readEnd(prot)
+        return TFrozenDict(result) if is_immutable else result
+    return read_map
+
+
+def _map_writer(prot_cls, spec):
+    ktype, kspec, vtype, vspec, _ = spec
+    write_key = value_writer(prot_cls, ktype, kspec)
+    write_val = value_writer(prot_cls, vtype, vspec)
+    writeBegin = prot_cls.writeMapBegin
+    writeEnd = prot_cls.writeMapEnd
+
+    def write_map(prot, val):
+        writeBegin(prot, ktype, vtype, len(val))
+        if isinstance(val, TSizedIterable):
+            items = prot._stream(val)
+        else:
+            items = six.iteritems(val)
+        for k, v in items:
+            write_key(prot, k)
+            write_val(prot, v)
+        writeEnd(prot)
+    return write_map
+
+
+def _compile_reader(prot_cls, thrift_spec, is_immutable):
+    fields = {}
+    for field in thrift_spec:
+        if field is None:
+            continue
+        fid, ftype, fname, fspec = field[:4]
+        fields[fid] = (ftype, fname, value_reader(prot_cls, ftype, fspec))
+
+    readStructBegin = prot_cls.readStructBegin
+    readStructEnd = prot_cls.readStructEnd
+    readFieldBegin = prot_cls.readFieldBegin
+    readFieldEnd = prot_cls.readFieldEnd
+    skip = prot_cls.skip
+    STOP = TType.STOP
+
+    if is_immutable:
+        def read_frozen(prot, cls):
+            values = {}
+            readStructBegin(prot)
+            while True:
+                _, ftype, fid = readFieldBegin(prot)
+                if ftype == STOP:
+                    break
+                field = fields.get(fid)
+                if field is not None and field[0] == ftype:
+                    values[field[1]] = field[2](prot)
+                else:
+                    skip(prot, ftype)
+                readFieldEnd(prot)
+            readStructEnd(prot)
+            return cls(**values)
+        return read_frozen
+
+    def read(prot, obj):
+        readStructBegin(prot)
+        while True:
+            _, ftype, fid = readFieldBegin(prot)
+            if ftype == STOP:
+                break
+            field = fields.get(fid)
+            if field is not None and field[0] == ftype:
+                setattr(obj, field[1], field[2](prot))
+            else:
+                skip(prot, ftype)
+            readFieldEnd(prot)
+        readStructEnd(prot)
+    return read
+
+
+def _compile_writer(prot_cls, thrift_spec):
+    fields = tuple(
+        (field[2], field[1], field[0], value_writer(prot_cls, field[1], field[3]))
+        for field in thrift_spec if field is not None)
+
+    writeStructBegin = prot_cls.writeStructBegin
+    writeStructEnd = prot_cls.writeStructEnd
+    writeFieldBegin = prot_cls.writeFieldBegin
+    writeFieldEnd = prot_cls.writeFieldEnd
+    writeFieldStop = prot_cls.writeFieldStop
+
+    def write(prot, obj):
+        writeStructBegin(prot, obj.__class__.__name__)
+        for fname, ftype, fid, write_value in fields:
+            val = getattr(obj, fname)
+            if val is None:
+                # skip writing out unset fields
+                continue
+            writeFieldBegin(prot, fname, ftype, fid)
+            write_value(prot, val)
+            writeFieldEnd(prot)
+        writeFieldStop(prot)
+        writeStructEnd(prot)
+    return write
+
+
+def struct_reader(prot_cls, klass, thrift_spec, is_immutable=False):
+    """Returns the compiled reader of ``klass`` for protocol ``prot_cls``.
+
+    The reader is called as ``reader(prot, obj)`` for mutable structs and
+    as ``reader(prot, cls)`` returning a new instance for immutable ones.
+    """
+    key = (prot_cls, klass, is_immutable)
+    if isinstance(thrift_spec, ProjectedSpec):
+        key += (id(thrift_spec),)
+    entry = _readers.get(key)
+    if entry is None or entry[0] is not thrift_spec:
+        entry = (thrift_spec, _compile_reader(prot_cls, thrift_spec, is_immutable))
+        _readers[key] = entry
+    return entry[1]
+
+
+def struct_writer(prot_cls, klass, thrift_spec):
+    """Returns the compiled writer of ``klass`` for protocol ``prot_cls``.
+
+    The writer is called as ``writer(prot, obj)``.
+    """
+    key = (prot_cls, klass)
+    entry = _writers.get(key)
+    if entry is None or entry[0] is not thrift_spec:
+        entry = (thrift_spec, _compile_writer(prot_cls, thrift_spec))
+        _writers[key] = entry
+    return entry[1]
+
+
+# wire format -> {TType: size} of the values whose size does not depend
+# on the value
+_FIXED_SIZES = {
+    'binary': {TType.BOOL: 1, TType.BYTE: 1, TType.I16: 2, TType.I32: 4, TType.I64: 8,
+               TType.DOUBLE: 8},
+    'compact': {TType.BOOL: 1, TType.BYTE: 1, TType.DOUBLE: 8},
+}
+
+
+def _varint_size(n):
+    return (n.bit_length() + 6) // 7 or 1
+
+
+def _zigzag_size(n):
+    return _varint_size((n << 1) ^ (n >> 63))
+
+
+def _string_size(val):
+    if isinstance(val, six.text_type):
+        return len(val.encode('utf-8'))
+    if isinstance(val, memoryview):
+        return val.nbytes
+    return len(val)
+
+
+def _check_sizable(val):
+    if isinstance(val, TSizedIterable):
+        raise TypeError('cannot size a TSizedIterable without consuming it')
+
+
+def _value_sizer(wire_format, ttype, spec):
+    """Returns a (size, sizer) pair for values of ``ttype``: their size when
+    it is fixed, and None and a callable taking the value otherwise."""
+    fixed = _FIXED_SIZES[wire_format].get(ttype)
+    if fixed is not None:
+        return fixed, None
+    compact = wire_format == 'compact'
+    if ttype in (TType.I16, TType.I32, TType.I64):
+        return None, _zigzag_size
+    if ttype == TType.STRING:
+        def size_string(val):
+            size = _string_size(val)
+            return size + (_varint_size(size) if compact else 4)
+        return None, size_string
+    if ttype == TType.STRUCT:
+        def size_struct(val):
+            cls = val.__class__
+            return struct_sizer(wire_format, cls, cls.thrift_spec)(val)
+        return None, size_struct
+    if ttype in (TType.LIST, TType.SET):
+        return None, _collection_sizer(wire_format, spec)
+    if ttype == TType.MAP:
+        return None, _map_sizer(wire_format, spec)
+    return None, _invalid_type(ttype)
+
+
+def _collection_sizer(wire_format, spec):
+    etype, espec, _ = spec
+    fixed, size_elem = _value_sizer(wire_format, etype, espec)
+    compact = wire_format == 'compact'
+
+    def size_collection(val):
+        _check_sizable(val)
+        n = len(val)
+        if compact:
+            size = 1 if n < 15 else 1 + _varint_size(n)
+        else:
+            size = 5
+        if fixed is not None:
+            return size + n * fixed
+        if isinstance(val, ARRAY_TYPES):
+            val = as_array(etype, val)
+        return size + sum(map(size_elem, val))
+    return size_collection
+
+
+def _map_sizer(wire_format, spec):
+    ktype, kspec, vtype, vspec, _ = spec
+    kfixed, size_key = _value_sizer(wire_format, ktype, kspec)
+    vfixed, size_val = _value_sizer(wire_format, vtype, vspec)
+    compact = wire_format == 'compact'
+
+    def size_map(val):
+        _check_sizable(val)
+        n = len(val)
+        if compact:
+            size = 1 if n == 0 else 1 + _varint_size(n)
+        else:
+            size = 6
+        size += n * kfixed if kfixed is not None else sum(map(size_key, six.iterkeys(val)))
+        size += n * vfixed if vfixed is not None else sum(map(size_val, six.itervalues(val)))
+        return size
+    return size_map
+
+
+def _compile_sizer(wire_format, thrift_spec):
+    compact = wire_format == 'compact'
+    fields = []
+    for field in thrift_spec:
+        if field is None:
+            continue
+        (fid, ftype, fname, fspec) = field[:4]
+        fixed, size_value = _value_sizer(wire_format, ftype, fspec)
+        if compact and ftype == TType.BOOL:
+            # the value goes in the field header
+            fixed = 0
+        # the field header when the field id is written in full
+        header = 1 + _zigzag_size(fid) if compact else 3
+        fields.append((fname, fid, header, fixed, size_value))
+    fields = tuple(fields)
+
+    if not compact:
+        def size(obj):
+            total = 1
+            for fname, _, header, fixed, size_value in fields:
+                val = getattr(obj, fname)
+                if val is not None:
+                    total += header + (fixed if size_value is None else size_value(val))
+            return total
+        return size
+
+    def size_compact(obj):
+        total = 1
+        last_fid = 0
+        for fname, fid, header, fixed, size_value in fields:
+            val = getattr(obj, fname)
+            if val is None:
+                continue
+            # the field id is a delta from the last one when it fits in 4 bits
+            total += 1 if 0 < fid - last_fid <= 15 else header
+            total += fixed if size_value is None else size_value(val)
+            last_fid = fid
+        return total
+    return size_compact
+
+
+def struct_sizer(wire_format, klass, thrift_spec):
+    """Returns the compiled sizer of ``klass`` for protocols writing
+    ``wire_format``, 'binary' or 'compact'.
+
+    The sizer is called as ``sizer(obj)`` and returns the number of bytes
+    the protocols write for obj, without encoding it.
+    """
+    if wire_format not in _FIXED_SIZES:
+        raise ValueError('cannot size structs in %r' % (wire_format,))
+    key = (wire_format, klass)
+    entry = _sizers.get(key)
+    if entry is None or entry[0] is not thrift_spec:
+        entry = (thrift_spec, _compile_sizer(wire_format, thrift_spec))
+        _sizers[key] = entry
+    return entry[1]
+
+
+def _identity(val):
+    return val
+
+
+def _binary_to_bytes(val):
+    return val.tobytes() if isinstance(val, memoryview) else val
+
+
+def _binary_to_base64(val):
+    return base64.b64encode(_binary_to_bytes(val)).decode('ascii')
+
+
+def _base64_to_binary(val):
+    return base64.b64decode(val)
+
+
+def _bool_to_number(val):
+    # as TSimpleJSONProtocol.writeBool
+    return 1 if val is True else 0
+
+
+def _values_to_list(val):
+    return val.tolist() if isinstance(val, memoryview) else list(val)
+
+
+def _key_to_bool(key):
+    return key not in (u'0', u'false', 0)
+
+
+def _value_to_primitive(ttype, spec, simple_json):
+    """Returns a callable converting values of ``ttype`` to primitives, or
+    None when they are primitives already."""
+    if ttype == TType.STRING:
+        if spec != 'BINARY':
+            return None
+        return _binary_to_base64 if simple_json else _binary_to_bytes
+    if ttype == TType.BOOL:
+        return _bool_to_number if simple_json else None
+    if ttype in _PRIMITIVES:
+        return None
+    if ttype == TType.STRUCT:
+        def struct_to_dict(val):
+            cls = val.__class__
+            return struct_to_primitive(cls, cls.thrift_spec, simple_json)(val)
+        return struct_to_dict
+    if ttype in (TType.LIST, TType.SET):
+        convert = _value_to_primitive(spec[0], spec[1], simple_json)
+        if convert is None:
+            return _values_to_list
+        return lambda val: [convert(v) for v in val]
+    if ttype == TType.MAP:
+        ktype, kspec, vtype, vspec, _ = spec
+        convert_key = _value_to_primitive(ktype, kspec, simple_json) or _identity
+        convert_val = _value_to_primitive(vtype, vspec, simple_json) or _identity
+        return lambda val: dict((convert_key(k), convert_val(v)) for k, v in six.iteritems(val))
+    return _invalid_type(ttype)
+
+
+def _value_from_primitive(ttype, spec, simple_json):
+    """Returns a callable converting primitives to values of ``ttype``, or
+    None when they are the values already."""
+    if ttype == TType.STRING:
+        return _base64_to_binary if simple_json and spec == 'BINARY' else None
+    if ttype == TType.BOOL:
+        return bool if simple_json else None
+    if ttype == TType.DOUBLE:
+        return float if simple_json else None
+    if ttype in _PRIMITIVES:
+        return None
+    if ttype == TType.STRUCT:
+        klass = spec[0]
+        if issubclass(klass, TFrozenBase):
+            return lambda val: struct_from_primitive(
+                klass, klass.thrift_spec, True, simple_json)(klass, val)
+
+        def dict_to_struct(val):
+            obj = klass()
+            struct_from_primitive(klass, klass.thrift_spec, False, simple_json)(obj, val)
+            return obj
+        return dict_to_struct
+    if ttype in (TType.LIST, TType.SET):
+        etype, espec, is_immutable = spec
+        convert = _value_from_primitive(etype, espec, simple_json)
+        if ttype == TType.LIST:
+            build = tuple if is_immutable else list
+        else:
+            build = frozenset if is_immutable else set
+        if convert is None:
+            return build
+        return lambda val: build([convert(v) for v in val])
+    if ttype == TType.MAP:
+        ktype, kspec, vtype, vspec, is_immutable = spec
+        convert_key = _value_from_primitive(ktype, kspec, simple_json) or _identity
+        if simple_json:
+            # json.dumps writes the keys that are not strings as strings
+            if ktype == TType.BOOL:
+                convert_key = _key_to_bool
+            elif ktype in _PRIMITIVES:
+                convert_key = float if ktype == TType.DOUBLE else int
+        convert_val = _value_from_primitive(vtype, vspec, simple_json) or _identity
+        build = TFrozenDict if is_immutable else dict
+        return lambda val: build((convert_key(k), convert_val(v)) for k, v in six.iteritems(val))
+    return _invalid_type(ttype)
+
+
+def _compile_to_primitive(thrift_spec, simple_json):
+    fields = tuple((field[2], _value_to_primitive(field[1], field[3], simple_json))
+                   for field in thrift_spec if field is not None)
+
+    def to_primitive(obj):
+        result = {}
+        for fname, convert in fields:
+            val = getattr(obj, fname)
+            if val is None:
+                # unset fields are left out, as protocols do
+                continue
+            result[fname] = val if convert is None else convert(val)
+        return result
+    return to_primitive
+
+
+def _compile_from_primitive(thrift_spec, is_immutable, simple_json):
+    fields = dict((field[2], _value_from_primitive(field[1], field[3], simple_json))
+                  for field in thrift_spec if field is not None)
+
+    def field_values(data):
+        for fname, val in six.iteritems(data):
+            # unknown fields are ignored, as protocols skip them
+            if val is None or fname not in fields:
+                continue
+            convert = fields[fname]
+            yield fname, val if convert is None else convert(val)
+
+    if is_immutable:
+        def from_frozen(cls, data):
+            return cls(**dict(field_values(data)))
+        return from_frozen
+
+    def from_primitive(obj, data):
+        for fname, val in field_values(data):
+            setattr(obj, fname, val)
+    return from_primitive
+
+
+def struct_to_primitive(klass, thrift_spec, simple_json=False):
+    """Returns the compiled converter of ``klass`` instances to primitives.
+
+    The converter is called as ``converter(obj)`` and returns a dict of
+    the fields of obj that are set, by name.  Nested structs become dicts,
+    lists and sets lists and maps dicts.  With ``simple_json``, the dict is
+    what TSimpleJSONProtocol writes once passed to json.dumps: bools are 1
+    or 0 and binary strings are base64 encoded.
+    """
+    key = (klass, simple_json)
+    entry = _dumpers.get(key)
+    if entry is None or entry[0] is not thrift_spec:
+        entry = (thrift_spec, _compile_to_primitive(thrift_spec, simple_json))
+        _dumpers[key] = entry
+    return entry[1]
+
+
+def struct_from_primitive(klass, thrift_spec, is_immutable=False, simple_json=False):
+    """Returns the compiled converter of primitives to ``klass`` instances,
+    the reverse of struct_to_primitive.
+
+    The converter is called as ``converter(obj, data)`` for mutable structs
+    and as ``converter(cls, data)`` returning a new instance for immutable
+    ones.  With ``simple_json``, the map keys json.loads returns as strings
+    are converted back to the key type.
+    """
+    key = (klass, is_immutable, simple_json)
+    entry = _loaders.get(key)
+    if entry is None or entry[0] is not thrift_spec:
+        entry = (thrift_spec, _compile_from_primitive(thrift_spec, is_immutable, simple_json))
+        _loaders[key] = entry
+    return entry[1]
+
+
+class ProjectedSpec(tuple):
+    """A thrift_spec whose fields outside of a projection are left out.
+
+    Readers skip the fields left out instead of decoding them, and nested
+    struct fields carry the ProjectedSpec of their own projection.
+    """
+    __slots__ = ()
+
+
+def _split_paths(paths):
+    """Groups dotted field paths by their first component.
+
+    A field mapped to None is wanted whole.
+    """
+    wanted = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        if not head:
+            raise ValueError('Invalid field path: %r' % path)
+        if not rest or wanted.get(head, ()) is None:
+            wanted[head] = None
+        else:
+            wanted.setdefault(head, []).append(rest)
+    return wanted
+
+
+def _project_args(ttype, spec_args, paths, path):
+    """Returns spec_args restricted to paths below the field at path."""
+    if ttype == TType.STRUCT:
+        return (spec_args[0], projected_spec(spec_args[1], paths))
+    if ttype in (TType.LIST, TType.SET):
+        etype, espec, is_immutable = spec_args
+        return (etype, _project_args(etype, espec, paths, path), is_immutable)
+    if ttype == TType.MAP:
+        ktype, kspec, vtype, vspec, is_immutable = spec_args
+        return (ktype, kspec, vtype, _project_args(vtype, vspec, paths, path), is_immutable)
+    raise ValueError('Field %r holds no struct to project' % path)
+
+
+def projected_spec(thrift_spec, projection):
+    """Returns ``thrift_spec`` restricted to the fields of ``projection``.
+
+    ``projection`` is an iterable of dotted field paths such as
+    ``{'header.ts', 'user_id'}``; a path naming a struct field keeps all of
+    it.  Paths go through lists, sets and map values of structs.  The
+    result is cached, so repeated projections reuse the compiled codecs of
+    the first one.
+    """
+    projection = frozenset(projection)
+    key = (id(thrift_spec), projection)
+    entry = _projections.get(key)
+    if entry is not None and entry[0] is thrift_spec:
+        return entry[1]
+    by_name = dict((field[2], (i, field)) for i, field in enumerate(thrift_spec)
+                   if field is not None)
+    fields = [None] * len(thrift_spec)
+    for name, paths in _split_paths(projection).items():
+        if name not in by_name:
+            raise ValueError('Unknown field in projection: %r' % name)
+        i, field = by_name[name]
+        if paths is not None:
+            field = (field[:3] + (_project_args(field[1], field[3], paths, name),) +
+                     field[4:])
+        fields[i] = field
+    projected = ProjectedSpec(fields)
+    _projections[key] = (thrift_spec, projected)
+    return projected
@@ -17,8 +17,11 @@
 # under the License.
 #
 
-from .TProtocol import TType, TProtocolBase, TProtocolException, checkIntegerLimits
+from .TProtocol import TType, TProtocolBase, TProtocolException, checkIntegerLimits, codec_property
+from .TCodec import ARRAY_TYPECODES, array_to_bytes, as_array
 from struct import pack, unpack
+import array
+import sys
 
 from ..compat import binary_to_str, str_to_binary
 
@@ -37,6 +40,11 @@ BOOL_READ = 8
 
 def make_helper(v_from, container):
     def helper(func):
+        if not __debug__:
+            # the state check is an assert, so without it there is nothing
+            # left to wrap and the extra call per value can go too
+            return func
+
         def nested(self, *args, **kwargs):
             assert self.state in (v_from, container), (self.state, v_from, container)
             return func(self, *args, **kwargs)
@@ -55,7 +63,21 @@ def fromZigZag(n):
     return (n >> 1) ^ -(n & 1)
 
 
+# The encodings of the varints below _SMALL_VARINT, and of the zigzagged
+# integers between -_SMALL_ZIGZAG and _SMALL_ZIGZAG (which share them),
+# so that most integers are written without encoding them first.
+_SMALL_VARINT = 0x800
+_SMALL_ZIGZAG = _SMALL_VARINT // 2
+_VARINTS = [bytes(bytearray([n])) for n in range(0x80)] + [
+    bytes(bytearray([(n & 0x7f) | 0x80, n >> 7])) for n in range(0x80, _SMALL_VARINT)]
+_ZIGZAGS = [_VARINTS[(n << 1) ^ (n >> 63)] for n in range(-_SMALL_ZIGZAG, _SMALL_ZIGZAG)]
+_UBYTES = [bytes(bytearray([n])) for n in range(0x100)]
+
+
 def writeVarint(trans, n):
+    if 0 <= n < _SMALL_VARINT:
+        trans.write(_VARINTS[n])
+        return
     out = bytearray()
     while True:
         if n & ~0x7f == 0:
@@ -67,7 +89,19 @@ def writeVarint(trans, n):
     trans.write(bytes(out))
 
 
-def readVarint(trans):
+def writeZigZag(trans, n, bits):
+    if -_SMALL_ZIGZAG <= n < _SMALL_ZIGZAG:
+        trans.write(_ZIGZAGS[n + _SMALL_ZIGZAG])
+    else:
+        writeVarint(trans, makeZigZag(n, bits))
+
+
+def _buffer_view(trans):
+    view = getattr(trans, 'cbuffer_view', None)
+    return view() if view is not None else None
+
+
+def _readVarintBytes(trans):
     result = 0
     shift = 0
     while True:
@@ -79,6 +113,69 @@ def readVarint(trans):
         shift += 7
 
 
+def readVarint(trans):
+    # read() returns what the transport has without readAll()'s loop, and
+    # only comes up empty when readAll() has to wait for more
+    byte = ord(trans.read(1) or trans.readAll(1))
+    if byte < 0x80:
+        return byte
+    # the rest of longer varints is decoded from the transport's buffer when
+    # it has a view of it, and a byte at a time otherwise or when the varint
+    # runs past the buffer
+    low = byte & 0x7f
+    view = _buffer_view(trans)
+    if view is not None:
+        buf, pos = view
+        result = low
+        shift = 7
+        for byte in bytearray(buf[pos:pos + 9]):
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                trans.cbuffer_seek(pos)
+                return result
+            shift += 7
+    return low | (_readVarintBytes(trans) << 7)
+
+
+def readVarints(trans, count):
+    """Reads count varints, decoding as many as the transport's buffer holds
+    at once."""
+    values = []
+    append = values.append
+    while count:
+        view = _buffer_view(trans)
+        if view is None:
+            for _ in range(count):
+                append(_readVarintBytes(trans))
+            break
+        buf, start = view
+        # each varint takes at most 10 bytes
+        data = bytearray(buf[start:start + 10 * count])
+        end = 0
+        result = 0
+        shift = 0
+        for pos, byte in enumerate(data):
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                append(result)
+                end = pos + 1
+                count -= 1
+                if not count:
+                    break
+                result = 0
+                shift = 0
+            else:
+                shift += 7
+        trans.cbuffer_seek(start + end)
+        if count:
+            # the next varint runs past the end of the buffer, reading it
+            # refills the buffer
+            append(_readVarintBytes(trans))
+            count -= 1
+    return values
+
+
 class CompactType(object):
     STOP = 0x00
     TRUE = 0x01
@@ -117,6 +214,17 @@ del k
 del v
 
 
+# TType -> encoded size of the fixed width types in containers
+_FIXED_WIDTHS = {
+    TType.BOOL: 1,
+    TType.BYTE: 1,
+    TType.DOUBLE: 8,
+}
+_VARINT_TYPES = frozenset([TType.I16, TType.I32, TType.I64])
+# every byte of a varint but its last one has the high bit set
+_VARINT_CONTINUATION = bytes(bytearray(range(0x80, 0x100)))
+
+
 class TCompactProtocol(TProtocolBase):
     """Compact implementation of the Thrift protocol driver."""
 
@@ -127,9 +235,16 @@ class TCompactProtocol(TProtocolBase):
     TYPE_BITS = 0x07
     TYPE_SHIFT_AMOUNT = 5
 
+    wire_format = 'compact'
+    encoding_settings = ('string_length_limit', 'container_length_limit')
+
     def __init__(self, trans,
                  string_length_limit=None,
-                 container_length_limit=None):
+                 container_length_limit=None,
+                 typed_arrays=False,
+                 binary_views=False,
+                 intern_table=None,
+                 encoded_cache=None):
         TProtocolBase.__init__(self, trans)
         self.state = CLEAR
         self.__last_fid = 0
@@ -139,6 +254,10 @@ class TCompactProtocol(TProtocolBase):
         self.__containers = []
         self.string_length_limit = string_length_limit
         self.container_length_limit = container_length_limit
+        self.typed_arrays = typed_arrays
+        self.binary_views = binary_views
+        self.intern_table = intern_table
+        self.encoded_cache = encoded_cache
 
     def _check_string_length(self, length):
         self._check_length(self.string_length_limit, length)
@@ -197,13 +316,13 @@ class TCompactProtocol(TProtocolBase):
         self.state = FIELD_WRITE
 
     def __writeUByte(self, byte):
-        self.trans.write(pack('!B', byte))
+        self.trans.write(_UBYTES[byte])
 
     def __writeByte(self, byte):
         self.trans.write(pack('!b', byte))
 
     def __writeI16(self, i16):
-        self.__writeVarint(makeZigZag(i16, 16))
+        writeZigZag(self.trans, i16, 16)
 
     def __writeSize(self, i32):
         self.__writeVarint(i32)
@@ -257,11 +376,11 @@ class TCompactProtocol(TProtocolBase):
 
     @writer
     def writeI32(self, i32):
-        self.__writeVarint(makeZigZag(i32, 32))
+        writeZigZag(self.trans, i32, 32)
 
     @writer
     def writeI64(self, i64):
-        self.__writeVarint(makeZigZag(i64, 64))
+        writeZigZag(self.trans, i64, 64)
 
     @writer
     def writeDouble(self, dub):
@@ -299,8 +418,7 @@ class TCompactProtocol(TProtocolBase):
         self.state = FIELD_READ
 
     def __readUByte(self):
-        result, = unpack('!B', self.trans.readAll(1))
-        return result
+        return ord(self.trans.read(1) or self.trans.readAll(1))
 
     def __readByte(self):
         result, = unpack('!b', self.trans.readAll(1))
@@ -382,6 +500,86 @@ class TCompactProtocol(TProtocolBase):
     readListEnd = readCollectionEnd
     readMapEnd = readCollectionEnd
 
+    def readValue(self, ttype, spec):
+        # Outside of a field header, values are encoded like container
+        # elements, bools included.
+        state = self.state
+        self.state = CONTAINER_READ
+        try:
+            return self.readFieldByTType(ttype, spec)
+        finally:
+            self.state = state
+
+    def skip(self, ttype):
+        # Skips raw values below the state machine, leaving the state
+        # as it was: fixed width and varint runs in containers are skipped
+        # in bulk rather than decoded one by one.
+        if ttype == TType.BOOL and self.state == BOOL_READ:
+            return
+        self.__skip(ttype)
+
+    def __skip(self, ttype):
+        width = _FIXED_WIDTHS.get(ttype)
+        if width is not None:
+            self.trans.readAll(width)
+        elif ttype in _VARINT_TYPES:
+            self.__skipVarints(1)
+        elif ttype == TType.STRING:
+            size = self.__readSize()
+            self._check_string_length(size)
+            self.trans.readAll(size)
+        elif ttype == TType.STRUCT:
+            while True:
+                header = self.__readUByte()
+                if header == CompactType.STOP:
+                    break
+                if not header >> 4:
+                    self.__skipVarints(1)
+                ctype = header & 0x0f
+                if ctype not in (CompactType.TRUE, CompactType.FALSE):
+                    self.__skip(self.__getTType(ctype))
+        elif ttype in (TType.LIST, TType.SET):
+            size_type = self.__readUByte()
+            size = size_type >> 4
+            if size == 15:
+                size = self.__readSize()
+            self._check_container_length(size)
+            self.__skipValues(self.__getTType(size_type), size)
+        elif ttype == TType.MAP:
+            size = self.__readSize()
+            self._check_container_length(size)
+            if size:
+                types = self.__readUByte()
+                ktype = self.__getTType(types >> 4)
+                vtype = self.__getTType(types)
+                if ktype == vtype:
+                    self.__skipValues(ktype, 2 * size)
+                elif ktype in _FIXED_WIDTHS and vtype in _FIXED_WIDTHS:
+                    self.trans.readAll(size * (_FIXED_WIDTHS[ktype] + _FIXED_WIDTHS[vtype]))
+                else:
+                    for _ in range(size):
+                        self.__skip(ktype)
+                        self.__skip(vtype)
+        else:
+            super(TCompactProtocol, self).skip(ttype)
+
+    def __skipValues(self, ttype, count):
+        width = _FIXED_WIDTHS.get(ttype)
+        if width is not None:
+            self.trans.readAll(count * width)
+        elif ttype in _VARINT_TYPES:
+            self.__skipVarints(count)
+        else:
+            for _ in range(count):
+                self.__skip(ttype)
+
+    def __skipVarints(self, count):
+        # Each varint takes at least one byte, so reading as many bytes as
+        # there are varints left never reads past the last one.
+        while count:
+            chunk = self.trans.readAll(count)
+            count -= len(chunk.translate(None, _VARINT_CONTINUATION))
+
     def readBool(self):
         if self.state == BOOL_READ:
             return self.__bool_value == CompactType.TRUE
@@ -407,7 +605,54 @@ class TCompactProtocol(TProtocolBase):
         size = self.__readSize()
         self._check_string_length(size)
         return self.trans.readAll(size)
-    readBinary = reader(__readBinary)
+
+    @reader
+    def readString(self):
+        s = binary_to_str(self.__readBinary())
+        if self.intern_table is not None:
+            return self.intern_table.intern_value(s)
+        return s
+
+    @reader
+    def readBinary(self):
+        if self.binary_views:
+            size = self.__readSize()
+            self._check_string_length(size)
+            return self._read_binary_view(size)
+        return self.__readBinary()
+
+    def readArray(self, etype, size):
+        assert self.state == CONTAINER_READ, self.state
+        result = array.array(ARRAY_TYPECODES[etype])
+        if etype in (TType.BYTE, TType.DOUBLE):
+            # fixed width, doubles are little endian
+            result = array.array(result.typecode, self.trans.readAll(size * result.itemsize))
+            if sys.byteorder == 'big' and etype == TType.DOUBLE:
+                result.byteswap()
+        else:
+            result.extend(fromZigZag(n) for n in readVarints(self.trans, size))
+        return result
+
+    def writeArray(self, etype, values):
+        assert self.state == CONTAINER_WRITE, self.state
+        values = as_array(etype, values)
+        if etype in (TType.BYTE, TType.DOUBLE):
+            if sys.byteorder == 'big' and etype == TType.DOUBLE:
+                values = values[:]
+                values.byteswap()
+            self.trans.write(array_to_bytes(values))
+            return
+        # the array's typecode already bounds the values, so skip the range
+        # checks of makeZigZag and emit all varints in one write
+        shift = values.itemsize * 8 - 1
+        out = bytearray()
+        for n in values:
+            n = (n << 1) ^ (n >> shift)
+            while n & ~0x7f:
+                out.append((n & 0x7f) | 0x80)
+                n >>= 7
+            out.append(n)
+        self.trans.write(bytes(out))
 
     def __getTType(self, byte):
         return TTYPES[byte & 0x0f]
@@ -416,14 +661,26 @@ class TCompactProtocol(TProtocolBase):
 class TCompactProtocolFactory(object):
     def __init__(self,
                  string_length_limit=None,
-                 container_length_limit=None):
+                 container_length_limit=None,
+                 typed_arrays=False,
+                 binary_views=False,
+                 intern_table=None,
+                 encoded_cache=None):
         self.string_length_limit = string_length_limit
         self.container_length_limit = container_length_limit
+        self.typed_arrays = typed_arrays
+        self.binary_views = binary_views
+        self.intern_table = intern_table
+        self.encoded_cache = encoded_cache
 
     def getProtocol(self, trans):
         return TCompactProtocol(trans,
                                 self.string_length_limit,
-                                self.container_length_limit)
+                                self.container_length_limit,
+                                self.typed_arrays,
+                                self.binary_views,
+                                self.intern_table,
+                                self.encoded_cache)
 
 
 class TCompactProtocolAccelerated(TCompactProtocol):
@@ -440,7 +697,16 @@ class TCompactProtocolAccelerated(TCompactProtocol):
     In order to take advantage of the C module, just use
     TCompactProtocolAccelerated instead of TCompactProtocol.
     """
-    pass
+
+    # The C codec keeps its own copy of these, so setting one rebinds it.
+    _codec = None
+    trans = codec_property('trans')
+    string_length_limit = codec_property('string_length_limit')
+    container_length_limit = codec_property('container_length_limit')
+    typed_arrays = codec_property('typed_arrays')
+    binary_views = codec_property('binary_views')
+    intern_table = codec_property('intern_table')
+    encoded_cache = codec_property('encoded_cache')
 
     def __init__(self, *args, **kwargs):
         fallback = kwargs.pop('fallback', True)
@@ -451,22 +717,54 @@ class TCompactProtocolAccelerated(TCompactProtocol):
             if not fallback:
                 raise
         else:
-            self._fast_decode = fastbinary.decode_compact
-            self._fast_encode = fastbinary.encode_compact
+            codec = self._codec = fastbinary.CompactCodec()
+            self._bind_codec()
+            self._fast_decode = codec.decode
+            self._fast_encode = codec.encode
+            self._fast_decode_message = codec.decode_message
+            self._fast_encode_message = codec.encode_message
+            self._fast_scan = codec.scan
+            self._fast_decode_value = codec.decode_value
+            self._fast_encode_many = codec.encode_many
+            self._fast_decode_many = codec.decode_many
+            self._fast_encoded_size = codec.encoded_size
+
+    def _bind_codec(self):
+        self._codec.__init__(
+            self.trans,
+            string_length_limit=self.string_length_limit,
+            container_length_limit=self.container_length_limit,
+            typed_arrays=self.typed_arrays,
+            binary_views=self.binary_views,
+            intern_table=self.intern_table,
+            encoded_cache=self.encoded_cache,
+            encoding_key=self.encoding_key())
 
 
 class TCompactProtocolAcceleratedFactory(object):
     def __init__(self,
                  string_length_limit=None,
                  container_length_limit=None,
-                 fallback=True):
+                 fallback=True,
+                 typed_arrays=False,
+                 binary_views=False,
+                 intern_table=None,
+                 encoded_cache=None):
         self.string_length_limit = string_length_limit
         self.container_length_limit = container_length_limit
         self._fallback = fallback
+        self.typed_arrays = typed_arrays
+        self.binary_views = binary_views
+        self.intern_table = intern_table
+        self.encoded_cache = encoded_cache
 
     def getProtocol(self, trans):
         return TCompactProtocolAccelerated(
             trans,
             string_length_limit=self.string_length_limit,
             container_length_limit=self.container_length_limit,
-            fallback=self._fallback)
+            fallback=self._fallback,
+            typed_arrays=self.typed_arrays,
+            binary_views=self.binary_views,
+            intern_table=self.intern_table,
+            encoded_cache=self.encoded_cache)
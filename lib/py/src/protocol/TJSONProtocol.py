@@ -21,6 +21,7 @@ from .TProtocol import (TType, TProtocolBase, TProtocolException,
                         checkIntegerLimits)
 import base64
 import math
+import re
 import sys
 
 from ..compat import str_to_binary
@@ -28,6 +29,8 @@ from ..compat import str_to_binary
 
 __all__ = ['TJSONProtocol',
            'TJSONProtocolFactory',
+           'TJSONProtocolAccelerated',
+           'TJSONProtocolAcceleratedFactory',
            'TSimpleJSONProtocol',
            'TSimpleJSONProtocolFactory']
 
@@ -67,6 +70,13 @@ ESCAPE_CHARS = {
 }
 NUMERIC_CHAR = b'+-.0123456789Ee'
 
+# Runs of bytes read in one go: the characters of a number, the characters of
+# a string up to the next quote or escape, and the control characters a
+# string may not hold unescaped.
+NUMERIC_RUN = re.compile(b'[-+.0-9Ee]*')
+STRING_RUN = re.compile(b'[^"\\\\]*')
+UNESCAPED_CHAR = re.compile(b'[\\b\\f\\n\\r\\t]')
+
 CTYPES = {
     TType.BOOL: 'tf',
     TType.BYTE: 'i8',
@@ -157,11 +167,13 @@ class LookaheadReader():
     def __init__(self, protocol):
         self.protocol = protocol
 
-    def read(self):
+    def read(self, sz=1):
         if self.hasData is True:
             self.hasData = False
-        else:
-            self.data = self.protocol.trans.read(1)
+            if sz == 1:
+                return self.data
+            return self.data + self.protocol.trans.read(sz - 1)
+        self.data = self.protocol.trans.read(sz)
         return self.data
 
     def peek(self):
@@ -170,6 +182,125 @@ class LookaheadReader():
         self.hasData = True
         return self.data
 
+    def scan(self, pattern):
+        run = []
+        while pattern.match(self.peek()).end():
+            run.append(self.read())
+        return b''.join(run)
+
+    def hold(self):
+        pass
+
+    def release(self):
+        pass
+
+    def sync(self):
+        pass
+
+
+class BufferReader(LookaheadReader):
+    """Reads from the buffer of a CReadableTransport that has a cbuffer_view,
+    and a character at a time from any other transport.
+
+    Runs of characters are found with a regular expression and taken as one
+    slice, refilling the transport when they reach the end of its buffer.
+    Between hold() and the matching release(), which bracket an object or
+    array, the read offset is kept here and only handed back to the transport
+    at the end, so the transport must not be read from meanwhile.  Nothing
+    past the last character read is consumed.
+    """
+
+    def __init__(self, protocol):
+        LookaheadReader.__init__(self, protocol)
+        self.held = 0
+        self.trans = None
+        self.buf = None
+        self.pos = 0
+
+    def _load(self):
+        trans = self.protocol.trans
+        view = getattr(trans, 'cbuffer_view', None)
+        view = view() if view is not None else None
+        if view is None:
+            return False
+        (buf, self.pos) = view
+        self.buf = buf if type(buf) is bytes else bytes(buf)
+        self.trans = trans
+        return True
+
+    def _store(self):
+        self.trans.cbuffer_seek(self.pos)
+        self.buf = None
+
+    def _refill(self, sz):
+        self.trans.cstringio_refill(self.buf[self.pos:], sz)
+        (buf, self.pos) = self.trans.cbuffer_view()
+        self.buf = buf if type(buf) is bytes else bytes(buf)
+
+    def hold(self):
+        if not self.held:
+            self._load()
+        self.held += 1
+
+    def release(self):
+        self.held -= 1
+        if not self.held and self.buf is not None:
+            self._store()
+
+    def sync(self):
+        """Hands the read offset back to the transport, for the C codec to
+        read from it."""
+        if self.buf is not None:
+            self._store()
+
+    def read(self, sz=1):
+        if self.buf is None and not self._load():
+            return LookaheadReader.read(self, sz)
+        pos = self.pos
+        if len(self.buf) - pos < sz:
+            self._refill(sz)
+            pos = self.pos
+        self.pos = end = pos + sz
+        data = self.buf[pos:end]
+        if not self.held:
+            self._store()
+        return data
+
+    def peek(self):
+        if self.buf is None and not self._load():
+            return LookaheadReader.peek(self)
+        if self.pos >= len(self.buf):
+            self._refill(1)
+        data = self.buf[self.pos:self.pos + 1]
+        if not self.held:
+            self.buf = None
+        return data
+
+    def scan(self, pattern):
+        if self.buf is None and not self._load():
+            return LookaheadReader.scan(self, pattern)
+        (buf, pos) = (self.buf, self.pos)
+        end = pattern.match(buf, pos).end()
+        if end < len(buf):
+            run = buf[pos:end]
+        else:
+            # The run may go on past the buffer: keep what there is and look
+            # at the next chunk, without copying the run back into the
+            # transport.
+            pieces = []
+            while end == len(buf):
+                pieces.append(buf[pos:end])
+                self.pos = end
+                self._refill(1)
+                (buf, pos) = (self.buf, self.pos)
+                end = pattern.match(buf, pos).end()
+            pieces.append(buf[pos:end])
+            run = b''.join(pieces)
+        self.pos = end
+        if not self.held:
+            self._store()
+        return run
+
 
 class TJSONProtocolBase(TProtocolBase):
 
@@ -193,7 +324,7 @@ class TJSONProtocolBase(TProtocolBase):
 
     def resetReadContext(self):
         self.resetWriteContext()
-        self.reader = LookaheadReader(self)
+        self.reader = BufferReader(self)
 
     def pushContext(self, ctx):
         self.contextStack.append(ctx)
@@ -284,44 +415,50 @@ class TJSONProtocolBase(TProtocolBase):
             self.context.read()
         self.readJSONSyntaxChar(QUOTE)
         while True:
+            run = self.reader.scan(STRING_RUN)
+            if run:
+                if highSurrogate:
+                    raise TProtocolException(TProtocolException.INVALID_DATA,
+                                             "Expected low surrogate char")
+                if sys.version_info[0] > 2:
+                    string.append(run.decode('utf8'))
+                elif UNESCAPED_CHAR.search(run):
+                    raise TProtocolException(TProtocolException.INVALID_DATA,
+                                             "Unescaped control char")
+                else:
+                    string.append(run)
             character = self.reader.read()
             if character == QUOTE:
                 break
-            if ord(character) == ESCSEQ0:
-                character = self.reader.read()
-                if ord(character) == ESCSEQ1:
-                    character = self.trans.read(4).decode('ascii')
-                    codeunit = int(character, 16)
-                    if self._isHighSurrogate(codeunit):
-                        if highSurrogate:
-                            raise TProtocolException(
-                                TProtocolException.INVALID_DATA,
-                                "Expected low surrogate char")
-                        highSurrogate = codeunit
-                        continue
-                    elif self._isLowSurrogate(codeunit):
-                        if not highSurrogate:
-                            raise TProtocolException(
-                                TProtocolException.INVALID_DATA,
-                                "Expected high surrogate char")
-                        character = self._toChar(highSurrogate, codeunit)
-                        highSurrogate = None
-                    else:
-                        character = self._toChar(codeunit)
-                else:
-                    if character not in ESCAPE_CHARS:
+            if not character:
+                raise EOFError()
+            # The run stopped at a backslash.
+            character = self.reader.read()
+            if ord(character) == ESCSEQ1:
+                character = self.reader.read(4).decode('ascii')
+                codeunit = int(character, 16)
+                if self._isHighSurrogate(codeunit):
+                    if highSurrogate:
                         raise TProtocolException(
                             TProtocolException.INVALID_DATA,
-                            "Expected control char")
-                    character = ESCAPE_CHARS[character]
-            elif character in ESCAPE_CHAR_VALS:
-                raise TProtocolException(TProtocolException.INVALID_DATA,
-                                         "Unescaped control char")
-            elif sys.version_info[0] > 2:
-                utf8_bytes = bytearray([ord(character)])
-                while ord(self.reader.peek()) >= 0x80:
-                    utf8_bytes.append(ord(self.reader.read()))
-                character = utf8_bytes.decode('utf8')
+                            "Expected low surrogate char")
+                    highSurrogate = codeunit
+                    continue
+                elif self._isLowSurrogate(codeunit):
+                    if not highSurrogate:
+                        raise TProtocolException(
+                            TProtocolException.INVALID_DATA,
+                            "Expected high surrogate char")
+                    character = self._toChar(highSurrogate, codeunit)
+                    highSurrogate = None
+                else:
+                    character = self._toChar(codeunit)
+            else:
+                if character not in ESCAPE_CHARS:
+                    raise TProtocolException(
+                        TProtocolException.INVALID_DATA,
+                        "Expected control char")
+                character = ESCAPE_CHARS[character]
             string.append(character)
 
             if highSurrogate:
@@ -337,13 +474,7 @@ class TJSONProtocolBase(TProtocolBase):
             self.readJSONSyntaxChar(QUOTE)
 
     def readJSONNumericChars(self):
-        numeric = []
-        while True:
-            character = self.reader.peek()
-            if self.isJSONNumeric(character) is False:
-                break
-            numeric.append(self.reader.read())
-        return b''.join(numeric).decode('ascii')
+        return self.reader.scan(NUMERIC_RUN).decode('ascii')
 
     def readJSONInteger(self):
         self.context.read()
@@ -393,21 +524,25 @@ class TJSONProtocolBase(TProtocolBase):
 
     def readJSONObjectStart(self):
         self.context.read()
+        self.reader.hold()
         self.readJSONSyntaxChar(LBRACE)
         self.pushContext(JSONPairContext(self))
 
     def readJSONObjectEnd(self):
         self.readJSONSyntaxChar(RBRACE)
         self.popContext()
+        self.reader.release()
 
     def readJSONArrayStart(self):
         self.context.read()
+        self.reader.hold()
         self.readJSONSyntaxChar(LBRACKET)
         self.pushContext(JSONListContext(self))
 
     def readJSONArrayEnd(self):
         self.readJSONSyntaxChar(RBRACKET)
         self.popContext()
+        self.reader.release()
 
 
 class TJSONProtocol(TJSONProtocolBase):
@@ -491,6 +626,14 @@ class TJSONProtocol(TJSONProtocolBase):
     def readBinary(self):
         return self.readJSONBase64()
 
+    def skip(self, ttype):
+        # Binary strings are base64 encoded and UTF-8 ones are not, skip
+        # either without decoding.
+        if ttype == TType.STRING:
+            self.readJSONString(False)
+        else:
+            super(TJSONProtocol, self).skip(ttype)
+
     def writeMessageBegin(self, name, request_type, seqid):
         self.resetWriteContext()
         self.writeJSONArrayStart()
@@ -590,10 +733,78 @@ class TJSONProtocolFactory(object):
         return None
 
 
+class TJSONProtocolAccelerated(TJSONProtocol):
+    """C-Accelerated version of TJSONProtocol.
+
+    Structs, and whole messages written with writeMessage, are encoded and
+    decoded by our C module, byte for byte as TJSONProtocol does.  Message
+    headers are read by the methods of TJSONProtocol, which hand the body to
+    the C module.  If the fastbinary module doesn't work for some
+    reason, this behaves exactly like TJSONProtocol.
+    To disable this behavior, pass fallback=False constructor argument.
+
+    Structs have no encoding of their own in JSON, which depends on the
+    separator in front of them, so the encoded cache of frozen structs and
+    encodedSize() are not supported.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fallback = kwargs.pop('fallback', True)
+        super(TJSONProtocolAccelerated, self).__init__(*args, **kwargs)
+        try:
+            from thrift.protocol import fastbinary
+        except ImportError:
+            if not fallback:
+                raise
+        else:
+            self._codec = fastbinary.JSONCodec(self.trans)
+            self._fast_decode = self._decode_struct
+            self._fast_encode = self._encode_struct
+            self._fast_encode_message = self._codec.encode_message
+            self._fast_decode_value = self._codec.decode_value
+            self._fast_encode_many = self._codec.encode_many
+            self._fast_decode_many = self._codec.decode_many
+
+    def __setattr__(self, name, value):
+        super(TJSONProtocolAccelerated, self).__setattr__(name, value)
+        # The C codec keeps its own reference to the transport, so rebind it.
+        if name == 'trans' and '_codec' in self.__dict__:
+            self._codec.__init__(value)
+
+    def _decode_struct(self, output, iprot, typeargs):
+        # The codec starts at the struct itself, past the separator the
+        # current context expects in front of it.
+        self.context.read()
+        self.reader.sync()
+        return self._codec.decode(output, iprot, typeargs)
+
+    def _encode_struct(self, obj, typeargs):
+        self.context.write()
+        return self._codec.encode(obj, typeargs)
+
+
+class TJSONProtocolAcceleratedFactory(object):
+    def __init__(self, fallback=True):
+        self._fallback = fallback
+
+    def getProtocol(self, trans):
+        return TJSONProtocolAccelerated(trans, fallback=self._fallback)
+
+    @property
+    def string_length_limit(senf):
+        return None
+
+    @property
+    def container_length_limit(senf):
+        return None
+
+
 class TSimpleJSONProtocol(TJSONProtocolBase):
     """Simple, readable, write-only JSON protocol.
 
-    Useful for interacting with scripting languages.
+    Useful for interacting with scripting languages.  Whole structs are
+    written faster by thrift.TSerialization.serialize_simple_json, and read
+    back by deserialize_simple_json.
     """
 
     def readMessageBegin(self):
@@ -0,0 +1,208 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Lazily decoded structs.
+
+A TLazyStruct scans an encoded struct once to find where each of its fields
+lies and keeps the encoded bytes around.  A field is only decoded the first
+time it is accessed, and writing the struct back out with the protocol it
+was read with copies the bytes of the fields that were never accessed
+instead of re-encoding them.
+"""
+
+from thrift.Thrift import TType
+from thrift.transport.TTransport import TMemoryBuffer
+from .TBinaryProtocol import TBinaryProtocol, TBinaryProtocolFactory
+from .TCompactProtocol import TCompactProtocol
+
+_ENCODINGS = (TBinaryProtocol, TCompactProtocol)
+
+_field_maps = {}
+
+
+def _field_map(thrift_spec):
+    """Maps field ids and names of a thrift_spec to their spec items."""
+    fields = _field_maps.get(id(thrift_spec))
+    if fields is None or fields[0] is not thrift_spec:
+        by_id = {}
+        by_name = {}
+        for field in thrift_spec:
+            if field is not None:
+                by_id[field[0]] = field
+                by_name[field[2]] = field
+        fields = _field_maps[id(thrift_spec)] = (thrift_spec, by_id, by_name)
+    return fields[1], fields[2]
+
+
+def _encoding(prot):
+    for encoding in _ENCODINGS:
+        if isinstance(prot, encoding):
+            return encoding
+    raise TypeError('lazy decoding needs a binary or compact protocol, not %s'
+                    % prot.__class__.__name__)
+
+
+def _scan(prot):
+    """Returns [(fid, ttype, start, end, value)] for the struct prot reads.
+
+    start and end delimit the encoded value of each field; value is only
+    filled in for bools, which the compact protocol folds into the header.
+    """
+    buf = prot.trans.cstringio_buf
+    fields = []
+    prot.readStructBegin()
+    while True:
+        (_, ttype, fid) = prot.readFieldBegin()
+        if ttype == TType.STOP:
+            break
+        start = buf.tell()
+        value = None
+        if ttype == TType.BOOL:
+            value = prot.readBool()
+        else:
+            prot.skip(ttype)
+        fields.append((fid, ttype, start, buf.tell(), value))
+        prot.readFieldEnd()
+    prot.readStructEnd()
+    return fields, buf.tell()
+
+
+class TLazyStruct(object):
+    """A struct of class ``cls`` whose fields are decoded from ``buf`` on
+    first access.
+
+    Fields read like attributes of the struct and may be assigned to.
+    Fields that were read or assigned are re-encoded by write(), the others
+    are copied from ``buf`` when writing with the same encoding.
+    materialize() decodes everything into a regular ``cls`` instance.
+    """
+
+    __slots__ = ('_cls', '_data', '_end', '_prot', '_encoding', '_fields',
+                 '_values', '_defaults')
+
+    def __init__(self, cls, buf, protocol_factory=TBinaryProtocolFactory()):
+        prot = protocol_factory.getProtocol(TMemoryBuffer(buf))
+        set_ = object.__setattr__
+        set_(self, '_cls', cls)
+        set_(self, '_data', memoryview(buf))
+        set_(self, '_prot', prot)
+        set_(self, '_encoding', _encoding(prot))
+        if prot._fast_scan is not None:
+            (fields, end) = prot._fast_scan(buf)
+        else:
+            (fields, end) = _scan(prot)
+        set_(self, '_end', end)
+        set_(self, '_fields', dict((f[0], f[1:]) for f in fields))
+        set_(self, '_values', {})
+        set_(self, '_defaults', None)
+
+    @property
+    def thrift_spec(self):
+        return self._cls.thrift_spec
+
+    def _decode(self, field):
+        (fid, ttype, name, spec_args) = field[:4]
+        found = self._fields.get(fid)
+        if found is None or found[0] != ttype:
+            if self._defaults is None:
+                object.__setattr__(self, '_defaults', self._cls())
+            return getattr(self._defaults, name)
+        (_, start, end, value) = found
+        if ttype == TType.BOOL:
+            return value
+        prot = self._prot
+        if prot._fast_decode_value is not None:
+            return prot._fast_decode_value(self._data[start:end], ttype, spec_args)
+        prot.trans.cstringio_buf.seek(start)
+        return prot.readValue(ttype, spec_args)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        values = self._values
+        try:
+            return values[name]
+        except KeyError:
+            pass
+        field = _field_map(self._cls.thrift_spec)[1].get(name)
+        if field is None:
+            raise AttributeError("'%s' has no field '%s'" % (self._cls.__name__, name))
+        value = values[name] = self._decode(field)
+        return value
+
+    def __setattr__(self, name, value):
+        if name not in _field_map(self._cls.thrift_spec)[1]:
+            raise AttributeError("'%s' has no field '%s'" % (self._cls.__name__, name))
+        self._values[name] = value
+
+    def materialize(self):
+        """Decodes the remaining fields and returns a ``cls`` instance."""
+        by_name = _field_map(self._cls.thrift_spec)[1]
+        return self._cls(**dict((name, getattr(self, name)) for name in by_name))
+
+    def write(self, oprot):
+        if not isinstance(oprot, self._encoding):
+            self.materialize().write(oprot)
+            return
+        data = self._data
+        if not self._values:
+            oprot.trans.write(data[:self._end])
+            return
+        by_id = _field_map(self._cls.thrift_spec)[0]
+        oprot.writeStructBegin(self._cls.__name__)
+        for field in self._cls.thrift_spec:
+            if field is None:
+                continue
+            (fid, ttype, name, spec_args) = field[:4]
+            if name in self._values:
+                value = self._values[name]
+                if value is not None:
+                    oprot.writeFieldBegin(name, ttype, fid)
+                    oprot.writeFieldByTType(ttype, value, spec_args)
+                    oprot.writeFieldEnd()
+            elif fid in self._fields:
+                self._copy_field(oprot, name, fid, self._fields[fid], ttype)
+        for fid, found in self._fields.items():
+            if fid not in by_id:
+                self._copy_field(oprot, None, fid, found, found[0])
+        oprot.writeFieldStop()
+        oprot.writeStructEnd()
+
+    def _copy_field(self, oprot, name, fid, found, ttype):
+        (found_ttype, start, end, value) = found
+        if found_ttype != ttype:
+            # Dropped by a regular read as well.
+            return
+        oprot.writeFieldBegin(name, ttype, fid)
+        if ttype == TType.BOOL:
+            oprot.writeBool(value)
+        else:
+            oprot.trans.write(self._data[start:end])
+        oprot.writeFieldEnd()
+
+    def __repr__(self):
+        return 'TLazyStruct(%r)' % (self.materialize(),)
+
+    def __eq__(self, other):
+        if isinstance(other, TLazyStruct):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __ne__(self, other):
+        return not (self == other)
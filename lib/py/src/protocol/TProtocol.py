@@ -17,14 +17,19 @@
 # under the License.
 #
 
-from thrift.Thrift import TException, TType, TFrozenDict
-from thrift.transport.TTransport import TTransportException
+from thrift.Thrift import (TApplicationException, TException, TMessageType, TType, TFrozenDict,
+                           TSizedIterable)
+from thrift.transport.TTransport import CReadableTransport, TTransportException
 from ..compat import binary_to_str, str_to_binary
+from . import TCodec
+from .TBase import TFrozenBase
 
+import array
 import six
 import sys
 from itertools import islice
-from six.moves import zip
+from operator import attrgetter
+from six.moves import map, zip
 
 
 class TProtocolException(TException):
@@ -43,13 +48,93 @@ class TProtocolException(TException):
         self.type = type
 
 
+class _DrainStream(Exception):
+    """Thrown into a streamed read to read the rest of its struct."""
+
+
+class _StreamedRead(object):
+    """The iterator of TProtocolBase.readStreamed, which only reads the rest
+    of the struct when closed explicitly, not from a finalizer."""
+
+    def __init__(self, gen):
+        self._gen = gen
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._started = True
+        return next(self._gen)
+
+    next = __next__
+
+    def close(self):
+        gen = self._gen
+        try:
+            if not self._started:
+                self._started = True
+                next(gen)
+            gen.throw(_DrainStream)
+        except (StopIteration, _DrainStream):
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class TProtocolBase(object):
     """Base class for Thrift protocol driver."""
 
+    # Read and write structs through per-class codecs compiled from
+    # thrift_spec (see TCodec). Compiled codecs call the methods of the
+    # protocol class, so set this to False on protocols whose primitive
+    # readers/writers are replaced per instance.
+    compiled_codecs = True
+
+    # Decode list<byte>, list<i16>, list<i32>, list<i64> and list<double>
+    # into array.array instead of list.
+    typed_arrays = False
+
+    # Decode binary fields into read-only memoryviews of the transport's
+    # read buffer (see CReadableTransport.cbuffer_view) instead of bytes.
+    binary_views = False
+
+    # A thrift.Thrift.TInternTable to share equal decoded strings through.
+    intern_table = None
+
+    # A thrift.protocol.TBase.TEncodedCache to reuse the bytes of frozen
+    # structs from, when the protocol has a wire_format.
+    encoded_cache = None
+
+    # The name of the encoding written by protocols whose structs can be
+    # copied from one message into another byte for byte.
+    wire_format = None
+
+    # The attributes that, along with wire_format, tell apart the encodings
+    # a TEncodedCache keeps (see encoding_key).
+    encoding_settings = ()
+
     def __init__(self, trans):
         self.trans = trans
         self._fast_decode = None
         self._fast_encode = None
+        self._fast_decode_message = None
+        self._fast_encode_message = None
+        self._fast_scan = None
+        self._fast_decode_value = None
+        self._fast_encode_many = None
+        self._fast_decode_many = None
+        self._fast_encoded_size = None
+
+    def encoding_key(self):
+        """Returns what a TEncodedCache keeps the structs this protocol
+        encodes under: its wire_format and encoding_settings."""
+        return (self.wire_format,) + tuple(getattr(self, name)
+                                           for name in self.encoding_settings)
 
     @staticmethod
     def _check_length(limit, length):
@@ -186,6 +271,21 @@ class TProtocolBase(object):
     def readBinary(self):
         pass
 
+    def _read_binary_view(self, size):
+        """Reads size bytes as a read-only memoryview, sliced out of the
+        transport's read buffer when it exposes one."""
+        trans = self.trans
+        if isinstance(trans, CReadableTransport):
+            view = trans.cbuffer_view()
+            if view is not None:
+                (buf, offset) = view
+                buf = memoryview(buf)
+                if len(buf) - offset >= size:
+                    trans.cbuffer_seek(offset + size)
+                    buf = buf[offset:offset + size]
+                    return buf if buf.readonly else buf.toreadonly()
+        return memoryview(trans.readAll(size))
+
     def readUtf8(self):
         return self.readString().decode('utf8')
 
@@ -205,7 +305,7 @@ class TProtocolBase(object):
         elif ttype == TType.DOUBLE:
             self.readDouble()
         elif ttype == TType.STRING:
-            self.readString()
+            self.readBinary()
         elif ttype == TType.STRUCT:
             name = self.readStructBegin()
             while True:
@@ -280,16 +380,27 @@ class TProtocolBase(object):
     def readFieldByTType(self, ttype, spec):
         return next(self._read_by_ttype(ttype, spec, spec))
 
+    def readValue(self, ttype, spec):
+        """Reads a single value of ``ttype`` outside of any struct."""
+        return self.readFieldByTType(ttype, spec)
+
     def readContainerList(self, spec):
+        if self.compiled_codecs:
+            return TCodec.value_reader(self.__class__, TType.LIST, spec)(self)
         ttype, tspec, is_immutable = spec
         (list_type, list_len) = self.readListBegin()
         # TODO: compare types we just decoded with thrift_spec
-        elems = islice(self._read_by_ttype(ttype, spec, tspec), list_len)
-        results = (tuple if is_immutable else list)(elems)
+        if self.typed_arrays and not is_immutable and ttype in TCodec.ARRAY_TYPECODES:
+            results = self.readArray(ttype, list_len)
+        else:
+            elems = islice(self._read_by_ttype(ttype, spec, tspec), list_len)
+            results = (tuple if is_immutable else list)(elems)
         self.readListEnd()
         return results
 
     def readContainerSet(self, spec):
+        if self.compiled_codecs:
+            return TCodec.value_reader(self.__class__, TType.SET, spec)(self)
         ttype, tspec, is_immutable = spec
         (set_type, set_len) = self.readSetBegin()
         # TODO: compare types we just decoded with thrift_spec
@@ -300,16 +411,28 @@ class TProtocolBase(object):
 
     def readContainerStruct(self, spec):
         (obj_class, obj_spec) = spec
+        if isinstance(obj_spec, TCodec.ProjectedSpec):
+            if issubclass(obj_class, TFrozenBase):
+                return self.readStruct(obj_class, obj_spec, True)
+            obj = obj_class()
+            self.readStruct(obj, obj_spec)
+            return obj
+        if issubclass(obj_class, TFrozenBase):
+            return obj_class.read(self)
         obj = obj_class()
         obj.read(self)
         return obj
 
     def readContainerMap(self, spec):
+        if self.compiled_codecs:
+            return TCodec.value_reader(self.__class__, TType.MAP, spec)(self)
         ktype, kspec, vtype, vspec, is_immutable = spec
         (map_ktype, map_vtype, map_len) = self.readMapBegin()
         # TODO: compare types we just decoded with thrift_spec and
         # abort/skip if types disagree
         keys = self._read_by_ttype(ktype, spec, kspec)
+        if self.intern_table is not None and ktype == TType.STRING and kspec != 'BINARY':
+            keys = map(self.intern_table.intern, keys)
         vals = self._read_by_ttype(vtype, spec, vspec)
         keyvals = islice(zip(keys, vals), map_len)
         results = (TFrozenDict if is_immutable else dict)(keyvals)
@@ -317,6 +440,10 @@ class TProtocolBase(object):
         return results
 
     def readStruct(self, obj, thrift_spec, is_immutable=False):
+        if self.compiled_codecs:
+            klass = obj if is_immutable else obj.__class__
+            reader = TCodec.struct_reader(self.__class__, klass, thrift_spec, is_immutable)
+            return reader(self, obj)
         if is_immutable:
             fields = {}
         self.readStructBegin()
@@ -344,32 +471,148 @@ class TProtocolBase(object):
         if is_immutable:
             return obj(**fields)
 
+    def readStreamed(self, obj, fname, batch_size=None):
+        """Reads a struct into obj, yielding the elements of its list, set or
+        map field fname as they are read instead of collecting them.
+
+        Map elements are yielded as (key, value) pairs.  With batch_size,
+        lists of up to batch_size elements are yielded instead.  Fields
+        before fname are set on obj by the time the first element is
+        yielded, the ones after it when the iteration ends; fname itself is
+        left unset.
+
+        The iterator returned is also a context manager.  Closing it
+        part-way, with close() or by leaving its with block, skips the
+        remaining elements and reads the rest of the struct, leaving the
+        transport past it as when iterating to the end.  An iterator that is
+        only dropped reads nothing more, leaving the transport at an
+        undefined position within the struct.
+        """
+        for field in obj.thrift_spec:
+            if field is not None and field[2] == fname:
+                break
+        else:
+            raise ValueError('%s has no field %s' % (obj.__class__.__name__, fname))
+        if field[1] not in (TType.LIST, TType.SET, TType.MAP):
+            raise ValueError('%s is not a list, set or map' % fname)
+        return _StreamedRead(self._read_streamed(obj, field[0], field[1], field[3], batch_size))
+
+    def _read_streamed(self, obj, fid, ftype, spec, batch_size):
+        thrift_spec = obj.thrift_spec
+        aborted = False
+        self.readStructBegin()
+        while True:
+            (_, rtype, rid) = self.readFieldBegin()
+            if rtype == TType.STOP:
+                break
+            if rid == fid and rtype == ftype and not aborted:
+                if ftype == TType.MAP:
+                    ktype, kspec, vtype, vspec, _ = spec
+                    size = self.readMapBegin()[2]
+                    elems = zip(self._read_by_ttype(ktype, spec, kspec),
+                                self._read_by_ttype(vtype, spec, vspec))
+                    etypes = (ktype, vtype)
+                    readEnd = self.readMapEnd
+                else:
+                    etype, espec, _ = spec
+                    if ftype == TType.LIST:
+                        size = self.readListBegin()[1]
+                        readEnd = self.readListEnd
+                    else:
+                        size = self.readSetBegin()[1]
+                        readEnd = self.readSetEnd
+                    elems = self._read_by_ttype(etype, spec, espec)
+                    etypes = (etype,)
+                remaining = size
+                batch = []
+                try:
+                    while remaining:
+                        elem = next(elems)
+                        remaining -= 1
+                        if not batch_size:
+                            yield elem
+                            continue
+                        batch.append(elem)
+                        if len(batch) == batch_size or not remaining:
+                            yield batch
+                            batch = []
+                except _DrainStream:
+                    aborted = True
+                    for _ in range(remaining):
+                        for etype in etypes:
+                            self.skip(etype)
+                readEnd()
+            else:
+                try:
+                    field = thrift_spec[rid]
+                except IndexError:
+                    field = None
+                if field is not None and rtype == field[1]:
+                    setattr(obj, field[2], self.readFieldByTType(rtype, field[3]))
+                else:
+                    self.skip(rtype)
+            self.readFieldEnd()
+        self.readStructEnd()
+
     def writeContainerStruct(self, val, spec):
         val.write(self)
 
     def writeContainerList(self, val, spec):
+        if self.compiled_codecs:
+            TCodec.value_writer(self.__class__, TType.LIST, spec)(self, val)
+            return
         ttype, tspec, _ = spec
         self.writeListBegin(ttype, len(val))
-        for _ in self._write_by_ttype(ttype, val, spec, tspec):
-            pass
+        if isinstance(val, TCodec.ARRAY_TYPES) and ttype in TCodec.ARRAY_TYPECODES:
+            self.writeArray(ttype, val)
+        else:
+            if isinstance(val, TSizedIterable):
+                val = self._stream(val)
+            for _ in self._write_by_ttype(ttype, val, spec, tspec):
+                pass
         self.writeListEnd()
 
     def writeContainerSet(self, val, spec):
+        if self.compiled_codecs:
+            TCodec.value_writer(self.__class__, TType.SET, spec)(self, val)
+            return
         ttype, tspec, _ = spec
         self.writeSetBegin(ttype, len(val))
+        if isinstance(val, TSizedIterable):
+            val = self._stream(val)
         for _ in self._write_by_ttype(ttype, val, spec, tspec):
             pass
         self.writeSetEnd()
 
     def writeContainerMap(self, val, spec):
+        if self.compiled_codecs:
+            TCodec.value_writer(self.__class__, TType.MAP, spec)(self, val)
+            return
         ktype, kspec, vtype, vspec, _ = spec
         self.writeMapBegin(ktype, vtype, len(val))
-        for _ in zip(self._write_by_ttype(ktype, six.iterkeys(val), spec, kspec),
-                     self._write_by_ttype(vtype, six.itervalues(val), spec, vspec)):
-            pass
+        if isinstance(val, TSizedIterable):
+            for k, v in self._stream(val):
+                next(self._write_by_ttype(ktype, (k,), spec, kspec))
+                next(self._write_by_ttype(vtype, (v,), spec, vspec))
+        else:
+            for _ in zip(self._write_by_ttype(ktype, six.iterkeys(val), spec, kspec),
+                         self._write_by_ttype(vtype, six.itervalues(val), spec, vspec)):
+                pass
         self.writeMapEnd()
 
+    def _stream(self, val):
+        """Iterates over a TSizedIterable, draining the transport every
+        val.chunk_size elements."""
+        chunk_size = val.chunk_size
+        for count, item in enumerate(val, 1):
+            yield item
+            if chunk_size and count % chunk_size == 0:
+                self.trans.drain()
+
     def writeStruct(self, obj, thrift_spec):
+        if self.compiled_codecs:
+            TCodec.struct_writer(self.__class__, obj.__class__, thrift_spec)(self, obj)
+            return
         self.writeStructBegin(obj.__class__.__name__)
         for field in thrift_spec:
             if field is None:
@@ -398,6 +641,68 @@ class TProtocolBase(object):
     def writeFieldByTType(self, ttype, val, spec):
         next(self._write_by_ttype(ttype, [val], spec, spec))
 
+    def readArray(self, etype, size):
+        """Reads the size values of a list<etype> into an array.array."""
+        read = getattr(self, self._TTYPE_HANDLERS[etype][0])
+        return array.array(TCodec.ARRAY_TYPECODES[etype], [read() for _ in range(size)])
+
+    def writeArray(self, etype, values):
+        """Writes the values of a list<etype> given as array.array or memoryview."""
+        write = getattr(self, self._TTYPE_HANDLERS[etype][1])
+        for v in TCodec.as_array(etype, values):
+            write(v)
+
+    def encodedSize(self, obj):
+        """Returns the number of bytes writing the struct obj takes, computed
+        from its thrift_spec without encoding it.
+
+        Only protocols with a wire_format can tell; TSizedIterables, which
+        cannot be iterated twice, raise TypeError.
+        """
+        if self._fast_encoded_size is not None:
+            return self._fast_encoded_size(obj, (obj.__class__, obj.thrift_spec))
+        if self.wire_format is None:
+            raise TProtocolException(TProtocolException.NOT_IMPLEMENTED,
+                                     '%s cannot size structs' % self.__class__.__name__)
+        return TCodec.struct_sizer(self.wire_format, obj.__class__, obj.thrift_spec)(obj)
+
+    def readMessage(self, classes):
+        """Reads a whole message and returns a (name, type, seqid, body) tuple.
+
+        classes maps message names to the struct class of their body.  The
+        body of an EXCEPTION message is read as a TApplicationException, the
+        body of a message whose name is not in classes is skipped and
+        returned as None.
+        """
+        if (self._fast_decode_message is not None and
+                isinstance(self.trans, CReadableTransport)):
+            (name, ttype, seqid, body) = self._fast_decode_message(classes)
+            if ttype != TMessageType.EXCEPTION:
+                return (name, ttype, seqid, body)
+        else:
+            (name, ttype, seqid) = self.readMessageBegin()
+        if ttype == TMessageType.EXCEPTION:
+            body = TApplicationException()
+            body.read(self)
+        elif name in classes:
+            body = classes[name]()
+            body.read(self)
+        else:
+            self.skip(TType.STRUCT)
+            body = None
+        self.readMessageEnd()
+        return (name, ttype, seqid, body)
+
+    def writeMessage(self, name, ttype, seqid, body):
+        """Writes a whole message: its header, body and end."""
+        if (self._fast_encode_message is not None and
+                getattr(body, 'thrift_spec', None) is not None):
+            self.trans.write(self._fast_encode_message(name, ttype, seqid, body))
+            return
+        self.writeMessageBegin(name, ttype, seqid)
+        body.write(self)
+        self.writeMessageEnd()
+
 
 def checkIntegerLimits(i, bits):
     if bits == 8 and (i < -128 or i > 127):
@@ -414,6 +719,19 @@ def checkIntegerLimits(i, bits):
                                  "i64 requires -9223372036854775808 <= number <= 9223372036854775807")
 
 
+def codec_property(name):
+    """Returns a property for name, a setting of an accelerated protocol
+    that its C codec keeps a copy of, rebinding the codec when it is set.
+    The value is kept in the instance as _name."""
+    key = '_' + name
+
+    def set_value(self, value):
+        setattr(self, key, value)
+        if self._codec is not None:
+            self._bind_codec()
+    return property(attrgetter(key), set_value)
+
+
 class TProtocolFactory(object):
     def getProtocol(self, trans):
         pass
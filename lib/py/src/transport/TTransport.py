@@ -17,7 +17,7 @@
 # under the License.
 #
 
-from struct import pack, unpack
+from struct import pack, pack_into, unpack
 from thrift.Thrift import TException
 from ..compat import BufferIO
 
@@ -73,6 +73,16 @@ class TTransportBase(object):
     def flush(self):
         pass
 
+    def drain(self):
+        """Hands what was written so far on towards the peer, like flush(),
+        but without ending the message it belongs to.
+
+        Transports that delimit messages by their flushes raise
+        TTransportException instead.  By default writes are left where
+        they are, to go out with the next flush().
+        """
+        pass
+
 
 # This class should be thought of as an interface.
 class CReadableTransport(object):
@@ -102,6 +112,41 @@ class CReadableTransport(object):
         """
         pass
 
+    def cbuffer_view(self):
+        """The bytes behind cstringio_buf and the read offset into them.
+
+        Returns a (buffer, offset) tuple, where buffer is any object supporting
+        the buffer protocol, so the C code can decode straight from it without
+        going through cstringio_buf.  Returning None (the default) makes it
+        read cstringio_buf instead.  The C code hands back the new read offset
+        through cbuffer_seek, and calls cbuffer_view again after a refill.
+        """
+        return None
+
+    def cbuffer_seek(self, offset):
+        """Moves the read offset of the buffer returned by cbuffer_view."""
+        pass
+
+
+# This class should be thought of as an interface.
+class CWritableTransport(object):
+    """base class for transports that C code can encode into directly"""
+
+    def cbuffer_output(self):
+        """The buffer pending writes are collected in.
+
+        Returns an (output, offset) tuple, where output is a bytearray (or any
+        other writable buffer) and offset is where the next write goes.  The C
+        code encodes into it, growing a bytearray as needed, and reports the
+        offset past the encoded bytes through cbuffer_written.  Returning None
+        makes it produce a string for write() instead.
+        """
+        return None
+
+    def cbuffer_written(self, offset):
+        """Moves the write offset of the buffer returned by cbuffer_output."""
+        pass
+
 
 class TServerTransportBase(object):
     """Base class for Thrift server transports."""
@@ -143,7 +188,8 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         self.__trans = trans
         self.__wbuf = BufferIO()
         # Pass string argument to initialize read buffer as cStringIO.InputType
-        self.__rbuf = BufferIO(b'')
+        self.__rbytes = b''
+        self.__rbuf = BufferIO(self.__rbytes)
         self.__rbuf_size = rbuf_size
 
     def isOpen(self):
@@ -159,7 +205,8 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         ret = self.__rbuf.read(sz)
         if len(ret) != 0:
             return ret
-        self.__rbuf = BufferIO(self.__trans.read(max(sz, self.__rbuf_size)))
+        self.__rbytes = self.__trans.read(max(sz, self.__rbuf_size))
+        self.__rbuf = BufferIO(self.__rbytes)
         return self.__rbuf.read(sz)
 
     def write(self, buf):
@@ -177,6 +224,12 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         self.__trans.write(out)
         self.__trans.flush()
 
+    def drain(self):
+        out = self.__wbuf.getvalue()
+        self.__wbuf = BufferIO()
+        self.__trans.write(out)
+        self.__trans.drain()
+
     # Implement the CReadableTransport interface.
     @property
     def cstringio_buf(self):
@@ -192,9 +245,16 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         if len(retstring) < reqlen:
             retstring += self.__trans.readAll(reqlen - len(retstring))
 
+        self.__rbytes = retstring
         self.__rbuf = BufferIO(retstring)
         return self.__rbuf
 
+    def cbuffer_view(self):
+        return self.__rbytes, self.__rbuf.tell()
+
+    def cbuffer_seek(self, offset):
+        self.__rbuf.seek(offset)
+
 
 class TMemoryBuffer(TTransportBase, CReadableTransport):
     """Wraps a cBytesIO object as a TTransport.
@@ -210,6 +270,7 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
 
         If value is set, this will be a transport for reading,
         otherwise, it is for writing"""
+        self._value = value
         if value is not None:
             self._buffer = BufferIO(value)
         else:
@@ -230,6 +291,7 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
         return self._buffer.read(sz)
 
     def write(self, buf):
+        self._value = None
         self._buffer.write(buf)
 
     def flush(self):
@@ -247,6 +309,14 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
         # only one shot at reading...
         raise EOFError()
 
+    def cbuffer_view(self):
+        if self._value is None:
+            return None
+        return self._value, self._buffer.tell()
+
+    def cbuffer_seek(self, offset):
+        self._buffer.seek(offset)
+
 
 class TFramedTransportFactory(object):
     """Factory transport that builds framed transports"""
@@ -256,13 +326,15 @@ class TFramedTransportFactory(object):
         return framed
 
 
-class TFramedTransport(TTransportBase, CReadableTransport):
+class TFramedTransport(TTransportBase, CReadableTransport, CWritableTransport):
     """Class that wraps another transport and frames its I/O when writing."""
 
     def __init__(self, trans,):
         self.__trans = trans
-        self.__rbuf = BufferIO(b'')
-        self.__wbuf = BufferIO()
+        self.__rframe = b''
+        self.__rbuf = BufferIO(self.__rframe)
+        # The first 4 bytes are reserved for the frame length.
+        self.__wbuf = bytearray(4)
 
     def isOpen(self):
         return self.__trans.isOpen()
@@ -284,24 +356,32 @@ class TFramedTransport(TTransportBase, CReadableTransport):
     def readFrame(self):
         buff = self.__trans.readAll(4)
         sz, = unpack('!i', buff)
-        self.__rbuf = BufferIO(self.__trans.readAll(sz))
+        self.__rframe = self.__trans.readAll(sz)
+        self.__rbuf = BufferIO(self.__rframe)
 
     def write(self, buf):
-        self.__wbuf.write(buf)
+        self.__wbuf += buf
 
     def flush(self):
-        wout = self.__wbuf.getvalue()
-        wsz = len(wout)
-        # reset wbuf before write/flush to preserve state on underlying failure
-        self.__wbuf = BufferIO()
-        # N.B.: Doing this string concatenation is WAY cheaper than making
-        # two separate calls to the underlying socket object. Socket writes in
-        # Python turn out to be REALLY expensive, but it seems to do a pretty
-        # good job of managing string buffer operations without excessive copies
-        buf = pack("!i", wsz) + wout
-        self.__trans.write(buf)
+        wbuf = self.__wbuf
+        # N.B.: Back-patching the length into the reserved prefix is WAY
+        # cheaper than making two separate calls to the underlying socket
+        # object, and doesn't copy the frame like concatenating would.
+        pack_into("!i", wbuf, 0, len(wbuf) - 4)
+        try:
+            self.__trans.write(wbuf)
+        finally:
+            # The buffer is kept for the next frame, emptied even on
+            # underlying failure to preserve state.
+            del wbuf[4:]
         self.__trans.flush()
 
+    def drain(self):
+        # The frame length goes ahead of the frame, so no part of one can be
+        # sent before all of it is written, and every flush ends one.
+        raise TTransportException(TTransportException.UNKNOWN,
+                                  'TFramedTransport cannot send part of a frame')
+
     # Implement the CReadableTransport interface.
     @property
     def cstringio_buf(self):
@@ -314,9 +394,24 @@ class TFramedTransport(TTransportBase, CReadableTransport):
         while len(prefix) < reqlen:
             self.readFrame()
             prefix += self.__rbuf.getvalue()
+        self.__rframe = prefix
         self.__rbuf = BufferIO(prefix)
         return self.__rbuf
 
+    def cbuffer_view(self):
+        return self.__rframe, self.__rbuf.tell()
+
+    def cbuffer_seek(self, offset):
+        self.__rbuf.seek(offset)
+
+    # Implement the CWritableTransport interface.
+    def cbuffer_output(self):
+        return self.__wbuf, len(self.__wbuf)
+
+    def cbuffer_written(self, offset):
+        # drop the spare capacity the encoder grew the buffer by
+        del self.__wbuf[offset:]
+
 
 class TFileObjectTransport(TTransportBase):
     """Wraps a file-like object to make it work as a Thrift transport."""
@@ -339,6 +434,9 @@ class TFileObjectTransport(TTransportBase):
     def flush(self):
         self.fileobj.flush()
 
+    def drain(self):
+        self.fileobj.flush()
+
 
 class TSaslClientTransport(TTransportBase, CReadableTransport):
     """
@@ -0,0 +1,331 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Hand-written equivalent of ``thrift --gen py:dynamic,slots`` output.
+
+These mirror a subset of test/DebugProtoTest.thrift so that the library can
+be unit tested without running the compiler first.
+"""
+
+import _import_local_thrift  # noqa
+from thrift.Thrift import TType
+from thrift.protocol.TBase import TBase, TFrozenBase
+
+
+class OneOfEach(TBase):
+    __slots__ = (
+        'im_true',
+        'im_false',
+        'a_bite',
+        'integer16',
+        'integer32',
+        'integer64',
+        'double_precision',
+        'some_characters',
+        'zomg_unicode',
+        'what_who',
+        'base64',
+        'byte_list',
+        'i16_list',
+        'i64_list',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.BOOL, 'im_true', None, None, ),  # 1
+        (2, TType.BOOL, 'im_false', None, None, ),  # 2
+        (3, TType.BYTE, 'a_bite', None, 127, ),  # 3
+        (4, TType.I16, 'integer16', None, 32767, ),  # 4
+        (5, TType.I32, 'integer32', None, None, ),  # 5
+        (6, TType.I64, 'integer64', None, 10000000000, ),  # 6
+        (7, TType.DOUBLE, 'double_precision', None, None, ),  # 7
+        (8, TType.STRING, 'some_characters', 'UTF8', None, ),  # 8
+        (9, TType.STRING, 'zomg_unicode', 'UTF8', None, ),  # 9
+        (10, TType.BOOL, 'what_who', None, None, ),  # 10
+        (11, TType.STRING, 'base64', 'BINARY', None, ),  # 11
+        (12, TType.LIST, 'byte_list', (TType.BYTE, None, False), [1, 2, 3], ),  # 12
+        (13, TType.LIST, 'i16_list', (TType.I16, None, False), [1, 2, 3], ),  # 13
+        (14, TType.LIST, 'i64_list', (TType.I64, None, False), [1, 2, 3], ),  # 14
+    )
+
+    def __init__(self, im_true=None, im_false=None, a_bite=thrift_spec[3][4],
+                 integer16=thrift_spec[4][4], integer32=None,
+                 integer64=thrift_spec[6][4], double_precision=None,
+                 some_characters=None, zomg_unicode=None, what_who=None,
+                 base64=None, byte_list=thrift_spec[12][4],
+                 i16_list=thrift_spec[13][4], i64_list=thrift_spec[14][4],):
+        if byte_list is self.thrift_spec[12][4]:
+            byte_list = [1, 2, 3]
+        if i16_list is self.thrift_spec[13][4]:
+            i16_list = [1, 2, 3]
+        if i64_list is self.thrift_spec[14][4]:
+            i64_list = [1, 2, 3]
+        self.im_true = im_true
+        self.im_false = im_false
+        self.a_bite = a_bite
+        self.integer16 = integer16
+        self.integer32 = integer32
+        self.integer64 = integer64
+        self.double_precision = double_precision
+        self.some_characters = some_characters
+        self.zomg_unicode = zomg_unicode
+        self.what_who = what_who
+        self.base64 = base64
+        self.byte_list = byte_list
+        self.i16_list = i16_list
+        self.i64_list = i64_list
+
+
+class Bonk(TBase):
+    __slots__ = (
+        'type',
+        'message',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'type', None, None, ),  # 1
+        (2, TType.STRING, 'message', 'UTF8', None, ),  # 2
+    )
+
+    def __init__(self, type=None, message=None,):
+        self.type = type
+        self.message = message
+
+
+class Nesting(TBase):
+    __slots__ = (
+        'my_bonk',
+        'my_ooe',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.STRUCT, 'my_bonk', (Bonk, Bonk.thrift_spec), None, ),  # 1
+        (2, TType.STRUCT, 'my_ooe', (OneOfEach, OneOfEach.thrift_spec), None, ),  # 2
+    )
+
+    def __init__(self, my_bonk=None, my_ooe=None,):
+        self.my_bonk = my_bonk
+        self.my_ooe = my_ooe
+
+
+class HolyMoley(TBase):
+    __slots__ = (
+        'big',
+        'contain',
+        'bonks',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.LIST, 'big',
+         (TType.STRUCT, (OneOfEach, OneOfEach.thrift_spec), False), None, ),  # 1
+        (2, TType.SET, 'contain', (TType.LIST, (TType.STRING, 'UTF8', True), False), None, ),  # 2
+        (3, TType.MAP, 'bonks',
+         (TType.STRING, 'UTF8', TType.LIST, (TType.STRUCT, (Bonk, Bonk.thrift_spec), False),
+          False), None, ),  # 3
+    )
+
+    def __init__(self, big=None, contain=None, bonks=None,):
+        self.big = big
+        self.contain = contain
+        self.bonks = bonks
+
+
+class Backwards(TBase):
+    __slots__ = (
+        'second_tag1',
+        'first_tag2',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'second_tag1', None, None, ),  # 1
+        (2, TType.I32, 'first_tag2', None, None, ),  # 2
+    )
+
+    def __init__(self, first_tag2=None, second_tag1=None,):
+        self.first_tag2 = first_tag2
+        self.second_tag1 = second_tag1
+
+
+class Empty(TFrozenBase):
+    __slots__ = (
+    )
+
+    thrift_spec = (
+    )
+
+    def __setattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+    def __delattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+
+class Wrapper(TFrozenBase):
+    __slots__ = (
+        'foo',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.STRUCT, 'foo', (Empty, Empty.thrift_spec), None, ),  # 1
+    )
+
+    def __init__(self, foo=None,):
+        super(Wrapper, self).__setattr__('foo', foo)
+
+    def __setattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+    def __delattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+
+class RandomStuff(TBase):
+    __slots__ = (
+        'a',
+        'b',
+        'c',
+        'd',
+        'myintlist',
+        'maps',
+        'bigint',
+        'triple',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'a', None, None, ),  # 1
+        (2, TType.I32, 'b', None, None, ),  # 2
+        (3, TType.I32, 'c', None, None, ),  # 3
+        (4, TType.I32, 'd', None, None, ),  # 4
+        (5, TType.LIST, 'myintlist', (TType.I32, None, False), None, ),  # 5
+        (6, TType.MAP, 'maps',
+         (TType.I32, None, TType.STRUCT, (Wrapper, Wrapper.thrift_spec), False), None, ),  # 6
+        (7, TType.I64, 'bigint', None, None, ),  # 7
+        (8, TType.DOUBLE, 'triple', None, None, ),  # 8
+    )
+
+    def __init__(self, a=None, b=None, c=None, d=None, myintlist=None, maps=None,
+                 bigint=None, triple=None,):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.myintlist = myintlist
+        self.maps = maps
+        self.bigint = bigint
+        self.triple = triple
+
+
+class NumericLists(TBase):
+    __slots__ = (
+        'bytes',
+        'shorts',
+        'ints',
+        'longs',
+        'doubles',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.LIST, 'bytes', (TType.BYTE, None, False), None, ),  # 1
+        (2, TType.LIST, 'shorts', (TType.I16, None, False), None, ),  # 2
+        (3, TType.LIST, 'ints', (TType.I32, None, False), None, ),  # 3
+        (4, TType.LIST, 'longs', (TType.I64, None, False), None, ),  # 4
+        (5, TType.LIST, 'doubles', (TType.DOUBLE, None, False), None, ),  # 5
+    )
+
+    def __init__(self, bytes=None, shorts=None, ints=None, longs=None, doubles=None,):
+        self.bytes = bytes
+        self.shorts = shorts
+        self.ints = ints
+        self.longs = longs
+        self.doubles = doubles
+
+
+class PrimitiveMaps(TBase):
+    __slots__ = (
+        'longs',
+        'doubles',
+        'flags',
+        'bools',
+        'names',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.MAP, 'longs', (TType.I64, None, TType.I64, None, False), None, ),  # 1
+        (2, TType.MAP, 'doubles', (TType.I32, None, TType.DOUBLE, None, False), None, ),  # 2
+        (3, TType.MAP, 'flags', (TType.BYTE, None, TType.BOOL, None, False), None, ),  # 3
+        (4, TType.SET, 'bools', (TType.BOOL, None, False), None, ),  # 4
+        (5, TType.MAP, 'names', (TType.STRING, 'UTF8', TType.I16, None, False), None, ),  # 5
+    )
+
+    def __init__(self, longs=None, doubles=None, flags=None, bools=None, names=None,):
+        self.longs = longs
+        self.doubles = doubles
+        self.flags = flags
+        self.bools = bools
+        self.names = names
+
+
+# Declared out of tag order: struct FrozenReordered { 2: string name, 1: i32 id }
+class FrozenReordered(TFrozenBase):
+    __slots__ = (
+        'name',
+        'id',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'id', None, None, ),  # 1
+        (2, TType.STRING, 'name', 'UTF8', None, ),  # 2
+    )
+
+    def __init__(self, name=None, id=None,):
+        super(FrozenReordered, self).__setattr__('name', name)
+        super(FrozenReordered, self).__setattr__('id', id)
+
+    def __setattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+    def __delattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+
+# Declared out of tag order: struct Reordered { 2: string name, 1: i32 id }
+class Reordered(TBase):
+    __slots__ = (
+        'name',
+        'id',
+    )
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'id', None, None, ),  # 1
+        (2, TType.STRING, 'name', 'UTF8', None, ),  # 2
+    )
+
+    def __init__(self, name=None, id=None,):
+        self.name = name
+        self.id = id
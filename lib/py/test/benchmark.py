@@ -0,0 +1,559 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+r"""
+Micro benchmarks for the Python library.
+
+PYTHONPATH=../build/lib... ./benchmark.py [--iters N] [name ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import multiprocessing
+import os
+import shutil
+import tempfile
+import timeit
+
+import _import_local_thrift  # noqa
+from _test_types import (Bonk, Empty, HolyMoley, Nesting, NumericLists, OneOfEach,
+                         PrimitiveMaps)
+from test_codec import make_objects
+from thrift.TParallelCodec import TParallelCodec
+from thrift.TRecordFile import TRecordReader, TRecordWriter
+from thrift.TSerialization import (deserialize, deserialize_many, deserialize_simple_json,
+                                   from_primitive, serialize, serialize_many,
+                                   serialize_simple_json, serialized_size, to_primitive)
+from thrift.Thrift import TInternTable, TSizedIterable, TType
+from thrift.protocol import TCodec
+from thrift.protocol.TBase import TBase, TEncodedCache, TFrozenBase
+from thrift.protocol.TBinaryProtocol import (TBinaryProtocol, TBinaryProtocolAccelerated,
+                                             TBinaryProtocolAcceleratedFactory,
+                                             TBinaryProtocolFactory)
+from thrift.protocol.TCompactProtocol import (TCompactProtocol, TCompactProtocolAccelerated,
+                                              TCompactProtocolAcceleratedFactory,
+                                              TCompactProtocolFactory)
+from thrift.protocol.TJSONProtocol import (LookaheadReader, TJSONProtocol, TJSONProtocolAccelerated,
+                                           TJSONProtocolFactory, TSimpleJSONProtocolFactory)
+from thrift.protocol.TProtocol import TProtocolBase
+from thrift.transport import TTransport
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def report(name, seconds, baseline=None):
+    if baseline:
+        print("%-40s = %f (x%.2f)" % (name, seconds, baseline / seconds))
+    else:
+        print("%-40s = %f" % (name, seconds))
+
+
+class TDevNullTransport(TTransport.TTransportBase):
+    def isOpen(self):
+        return True
+
+
+@benchmark
+def codec(iters):
+    """Compiled per-class codecs against the generic readStruct/writeStruct."""
+    objs = make_objects()
+    for protocol in (TBinaryProtocol, TCompactProtocol):
+        generic = type('Generic' + protocol.__name__, (protocol,), {'compiled_codecs': False})
+        encoded = []
+        for obj in objs:
+            trans = TTransport.TMemoryBuffer()
+            obj.write(protocol(trans))
+            encoded.append((obj.__class__, trans.getvalue()))
+
+        def write(cls):
+            prot = cls(TDevNullTransport())
+            for obj in objs:
+                obj.write(prot)
+
+        def read(cls):
+            for klass, data in encoded:
+                klass().read(cls(TTransport.TMemoryBuffer(data)))
+
+        for op in (write, read):
+            slow = timeit.timeit(lambda: op(generic), number=iters)
+            fast = timeit.timeit(lambda: op(protocol), number=iters)
+            report('%s %s generic' % (protocol.__name__, op.__name__), slow)
+            report('%s %s compiled' % (protocol.__name__, op.__name__), fast, slow)
+
+
+@benchmark
+def projection(iters):
+    """deserialize() of a few fields of wide, nested structs against all of them."""
+    ooes = make_objects()[1].big * 50
+    records = [
+        (Nesting(my_bonk=make_objects()[3].my_bonk, my_ooe=ooes[0]),
+         set(['my_bonk.type', 'my_ooe.integer64'])),
+        (HolyMoley(big=ooes, bonks=make_objects()[1].bonks), set(['big.integer32'])),
+    ]
+    for factory in (TBinaryProtocolFactory(), TCompactProtocolFactory(),
+                    TBinaryProtocolAcceleratedFactory(), TCompactProtocolAcceleratedFactory()):
+        name = factory.__class__.__name__[:-len('Factory')]
+        for obj, fields in records:
+            data = serialize(obj, factory)
+            cls = obj.__class__
+            full = timeit.timeit(lambda: deserialize(cls(), data, factory), number=iters)
+            part = timeit.timeit(lambda: deserialize(cls(), data, factory, projection=fields),
+                                 number=iters)
+            report('%s %s full' % (name, cls.__name__), full)
+            report('%s %s projected' % (name, cls.__name__), part, full)
+
+
+@benchmark
+def skip(iters):
+    """Skipping unknown fields: the generic per-value skip against the protocols' own."""
+    n = 100000
+    obj = NumericLists(shorts=[i % 65536 - 32768 for i in range(n)],
+                       longs=[i << 33 for i in range(n)], doubles=[i / 3.0 for i in range(n)])
+    for protocol, accelerated in ((TBinaryProtocol, TBinaryProtocolAccelerated),
+                                  (TCompactProtocol, TCompactProtocolAccelerated)):
+        generic = type('Generic' + protocol.__name__, (protocol,),
+                       {'skip': TProtocolBase.skip})
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol(trans))
+        data = trans.getvalue()
+        times = {}
+        for cls in (generic, protocol, accelerated):
+            times[cls] = timeit.timeit(
+                lambda: Empty.read(cls(TTransport.TMemoryBuffer(data))), number=iters)
+            report('%s skip' % cls.__name__, times[cls], times[generic])
+
+
+@benchmark
+def binary_views(iters):
+    """Large binary fields decoded as memoryviews of the frame against bytes copies."""
+    obj = OneOfEach(base64=b'\xab' * (4 << 20))
+    for protocol in (TBinaryProtocol, TBinaryProtocolAccelerated,
+                     TCompactProtocol, TCompactProtocolAccelerated):
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol(trans))
+        data = trans.getvalue()
+        times = {}
+        for views in (False, True):
+            times[views] = timeit.timeit(
+                lambda: OneOfEach().read(protocol(TTransport.TMemoryBuffer(data),
+                                                  binary_views=views)),
+                number=iters)
+        report('%s read bytes' % protocol.__name__, times[False])
+        report('%s read views' % protocol.__name__, times[True], times[False])
+
+
+@benchmark
+def streaming(iters):
+    """Peak memory of writing a huge list: materialized against a chunked TSizedIterable."""
+    import tracemalloc
+    n = iters * 1000
+    for protocol in (TBinaryProtocol, TBinaryProtocolAccelerated,
+                     TCompactProtocol, TCompactProtocolAccelerated):
+        peaks = []
+        for make in (lambda: list(range(n)),
+                     lambda: TSizedIterable(n, iter(range(n)), chunk_size=10000)):
+            tracemalloc.start()
+            NumericLists(longs=make()).write(
+                protocol(TTransport.TBufferedTransport(TDevNullTransport())))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print('%-40s = %d -> %d KiB' % ('%s peak' % protocol.__name__,
+                                        peaks[0] // 1024, peaks[1] // 1024))
+
+
+@benchmark
+def record_file(iters):
+    """Reading a file of structs through TFileObjectTransport against TRecordReader."""
+    objs = [obj for obj in make_objects() if obj.__class__ is HolyMoley] * iters
+    tmp = tempfile.mkdtemp()
+    try:
+        for factory in (TBinaryProtocolFactory(), TBinaryProtocolAcceleratedFactory(),
+                        TCompactProtocolFactory(), TCompactProtocolAcceleratedFactory()):
+            plain = os.path.join(tmp, 'plain')
+            records = os.path.join(tmp, 'records')
+            with open(plain, 'wb') as f:
+                prot = factory.getProtocol(TTransport.TFileObjectTransport(f))
+                for obj in objs:
+                    obj.write(prot)
+            with TRecordWriter(records, factory, index=True) as writer:
+                for obj in objs:
+                    writer.write(obj)
+
+            def read_plain():
+                with open(plain, 'rb') as f:
+                    prot = factory.getProtocol(TTransport.TFileObjectTransport(f))
+                    for _ in objs:
+                        HolyMoley().read(prot)
+
+            def read_records():
+                with TRecordReader(records, HolyMoley, factory) as reader:
+                    for _ in reader:
+                        pass
+
+            name = factory.__class__.__name__.replace('Factory', '')
+            slow = timeit.timeit(read_plain, number=1)
+            report('%s file transport' % name, slow)
+            report('%s record file' % name, timeit.timeit(read_records, number=1), slow)
+    finally:
+        shutil.rmtree(tmp)
+
+
+@benchmark
+def batch(iters):
+    """serialize()/deserialize() per message against serialize_many()/deserialize_many()."""
+    msgs = [Bonk(type=i, message=u'message %d ' % i + u'x' * 80) for i in range(iters * 10)]
+    for factory in (TBinaryProtocolFactory(), TBinaryProtocolAcceleratedFactory(),
+                    TCompactProtocolFactory(), TCompactProtocolAcceleratedFactory()):
+        data = serialize_many(msgs, factory)
+        name = factory.__class__.__name__.replace('Factory', '')
+        slow = timeit.timeit(lambda: [serialize(msg, factory) for msg in msgs], number=1)
+        fast = timeit.timeit(lambda: serialize_many(msgs, factory), number=1)
+        report('%s serialize' % name, slow)
+        report('%s serialize_many' % name, fast, slow)
+        slow = timeit.timeit(lambda: [deserialize(Bonk(), d, factory) for d in data], number=1)
+        fast = timeit.timeit(lambda: deserialize_many(Bonk, data, factory), number=1)
+        report('%s deserialize' % name, slow)
+        report('%s deserialize_many' % name, fast, slow)
+
+
+@benchmark
+def parallel(iters):
+    """serialize_many()/deserialize_many() against TParallelCodec on 1..CPUs processes."""
+    objs = [obj for obj in make_objects() if obj.__class__ is HolyMoley] * (iters * 10)
+    counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    print('%d CPUs' % multiprocessing.cpu_count())
+    for factory in (TCompactProtocolFactory(), TCompactProtocolAcceleratedFactory()):
+        data = serialize_many(objs, factory)
+        name = factory.__class__.__name__.replace('Factory', '')
+        encode = timeit.timeit(lambda: serialize_many(objs, factory), number=1)
+        decode = timeit.timeit(lambda: deserialize_many(HolyMoley, data, factory), number=1)
+        report('%s serialize_many' % name, encode)
+        report('%s deserialize_many' % name, decode)
+        for processes in counts:
+            with TParallelCodec(factory, processes) as codec:
+                report('%s serialize %d processes' % (name, processes),
+                       timeit.timeit(lambda: codec.serialize_many(objs), number=1), encode)
+                report('%s deserialize %d processes' % (name, processes),
+                       timeit.timeit(lambda: codec.deserialize_many(HolyMoley, data), number=1),
+                       decode)
+
+
+@benchmark
+def intern(iters):
+    """Decoding maps keyed by a few repeating labels, without and with a TInternTable."""
+    import tracemalloc
+    labels = [u'tenant-%d' % i for i in range(50)]
+    msgs = [PrimitiveMaps(names=dict((label, i) for label in labels)) for i in range(iters)]
+    for factory in (TBinaryProtocolFactory, TBinaryProtocolAcceleratedFactory,
+                    TCompactProtocolFactory, TCompactProtocolAcceleratedFactory):
+        data = serialize_many(msgs, factory())
+        name = factory.__name__.replace('Factory', '')
+        results = []
+        for table in (None, TInternTable()):
+            fac = factory(intern_table=table)
+            seconds = timeit.timeit(lambda: deserialize_many(PrimitiveMaps, data, fac), number=1)
+            tracemalloc.start()
+            decoded = deserialize_many(PrimitiveMaps, data, fac)
+            results.append((seconds, tracemalloc.get_traced_memory()[0]))
+            tracemalloc.stop()
+            del decoded
+        report('%s decode' % name, results[0][0])
+        report('%s decode interned' % name, results[1][0], results[0][0])
+        print('%-40s = %d -> %d KiB' % ('%s retained' % name,
+                                        results[0][1] // 1024, results[1][1] // 1024))
+
+
+class Route(TFrozenBase):
+    """A frozen struct of some size, like the entries of a routing table."""
+    __slots__ = ('prefix', 'hops', 'weights')
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.STRING, 'prefix', 'UTF8', None, ),  # 1
+        (2, TType.LIST, 'hops', (TType.STRING, 'UTF8', False), None, ),  # 2
+        (3, TType.MAP, 'weights', (TType.STRING, 'UTF8', TType.DOUBLE, None, False), None, ),  # 3
+    )
+
+    def __init__(self, prefix=None, hops=None, weights=None):
+        super(Route, self).__setattr__('prefix', prefix)
+        super(Route, self).__setattr__('hops', hops)
+        super(Route, self).__setattr__('weights', weights)
+
+    def __setattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+
+class RouteTable(TBase):
+    __slots__ = ('version', 'routes')
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'version', None, None, ),  # 1
+        (2, TType.MAP, 'routes',
+         (TType.I32, None, TType.STRUCT, (Route, Route.thrift_spec), False), None, ),  # 2
+    )
+
+    def __init__(self, version=None, routes=None):
+        self.version = version
+        self.routes = routes
+
+
+@benchmark
+def frozen(iters):
+    """Replies made mostly of shared frozen structs, encoded each time against copied from a
+    TEncodedCache."""
+    routes = [Route(prefix=u'10.%d.0.0/16' % i, hops=[u'gw-%d-%d' % (i, j) for j in range(4)],
+                    weights=dict((u'link-%d' % j, j / 4.0) for j in range(4)))
+              for i in range(20)]
+    replies = []
+    for i in range(iters):
+        # One in ten entries is built for the reply, the others are shared.
+        table = dict((j, routes[j % 20]) for j in range(100))
+        for j in range(0, 100, 10):
+            table[j] = Route(prefix=u'reply %d' % i, hops=[u'local'])
+        replies.append(RouteTable(version=i, routes=table))
+    for protocol in (TBinaryProtocol, TBinaryProtocolAccelerated, TCompactProtocol,
+                     TCompactProtocolAccelerated):
+        def encode(cache):
+            prot = protocol(TDevNullTransport(), encoded_cache=cache)
+            for reply in replies:
+                reply.write(prot)
+
+        slow = timeit.timeit(lambda: encode(None), number=1)
+        cache = TEncodedCache()
+        fast = timeit.timeit(lambda: encode(cache), number=1)
+        report('%s encode' % protocol.__name__, slow)
+        report('%s encode cached' % protocol.__name__, fast, slow)
+
+
+class UncachedRoute(Route):
+    """Route hashed the way generated immutable classes used to be."""
+
+    def __hash__(self):
+        return hash(self.__class__) ^ hash((self.prefix, self.hops, self.weights, ))
+
+
+class ConstantRoute(Route):
+    """Route hashed the way TFrozenBase used to hash, the same for all instances."""
+
+    def __hash__(self):
+        return hash(self.__class__) ^ hash(self.__slots__)
+
+
+@benchmark
+def hashing(iters):
+    """Dedup and set membership of iters * 1000 frozen structs, half of them duplicates."""
+    count = iters * 1000
+
+    def make(cls, n):
+        return [cls(prefix=u'10.%d.%d.0/24' % (i // 256 % 256, i % 256),
+                    hops=(u'gw-%d' % (i % 7), u'core')) for i in range(n // 2)] * 2
+
+    def run(cls, n):
+        routes = make(cls, n)
+        dedup = timeit.timeit(lambda: set(routes), number=1)
+        table = set(routes)
+        probes = make(cls, n)
+        member = timeit.timeit(lambda: sum(1 for route in probes if route in table), number=1)
+        again = timeit.timeit(lambda: sum(1 for route in probes if route in table), number=1)
+        return (dedup, member, again)
+
+    # A constant hash makes every operation linear in the size of the set.
+    sample = min(count, 4000)
+    for (n, classes) in ((sample, (ConstantRoute, UncachedRoute, Route)),
+                         (count, (UncachedRoute, Route))):
+        results = [run(cls, n) for cls in classes]
+        for (i, name) in enumerate(('dedup', 'membership', 'membership again')):
+            for (cls, result) in zip(classes, results):
+                report('%d %s %s' % (n, cls.__name__, name), result[i], results[0][i])
+
+
+@benchmark
+def sizing(iters):
+    """serialized_size() against len(serialize()) on small and large structs."""
+    objs = make_objects()
+    big = HolyMoley(big=[objs[0]] * 200,
+                    bonks=dict((u'bonk %d' % i, [Bonk(type=i, message=u'x' * 30)] * 5)
+                               for i in range(50)))
+    for factory in (TBinaryProtocolFactory(), TBinaryProtocolAcceleratedFactory(),
+                    TCompactProtocolFactory(), TCompactProtocolAcceleratedFactory()):
+        name = factory.__class__.__name__.replace('Factory', '')
+        for (label, values, n) in (('small', objs, iters), ('big', [big], max(iters // 100, 1))):
+            slow = timeit.timeit(lambda: [len(serialize(obj, factory)) for obj in values],
+                                 number=n)
+            fast = timeit.timeit(lambda: [serialized_size(obj, factory) for obj in values],
+                                 number=n)
+            report('%s %s len(serialize)' % (name, label), slow)
+            report('%s %s serialized_size' % (name, label), fast, slow)
+
+
+@benchmark
+def json_read(iters):
+    """TJSONProtocol reading from the transport buffer against a character at a time."""
+    objs = make_objects()
+    big = HolyMoley(big=[objs[0]] * 200,
+                    bonks=dict((u'bonk %d' % i, [Bonk(type=i, message=u'x\u00e9\n' * 30)] * 5)
+                               for i in range(50)))
+    blob = Bonk(type=1, message=u'a long message, ' * 65536)
+    factory = TJSONProtocolFactory()
+
+    def read(values, lookahead):
+        for (cls, data) in values:
+            protocol = TJSONProtocol(TTransport.TMemoryBuffer(data))
+            if lookahead:
+                protocol.reader = LookaheadReader(protocol)
+            cls().read(protocol)
+
+    for (label, values, n) in (('small', objs, iters), ('big', [big], max(iters // 100, 1)),
+                               ('1MB string', [blob], max(iters // 1000, 1))):
+        values = [(obj.__class__, serialize(obj, factory)) for obj in values]
+        slow = timeit.timeit(lambda: read(values, True), number=n)
+        fast = timeit.timeit(lambda: read(values, False), number=n)
+        report('%s per character' % label, slow)
+        report('%s buffered' % label, fast, slow)
+
+
+@benchmark
+def json_accelerated(iters):
+    """TJSONProtocolAccelerated against TJSONProtocol."""
+    objs = make_objects()
+    encoded = []
+    for obj in objs:
+        trans = TTransport.TMemoryBuffer()
+        obj.write(TJSONProtocol(trans))
+        encoded.append((obj.__class__, trans.getvalue()))
+
+    def write(cls):
+        prot = cls(TDevNullTransport())
+        for obj in objs:
+            obj.write(prot)
+
+    def read(cls):
+        for klass, data in encoded:
+            klass().read(cls(TTransport.TMemoryBuffer(data)))
+
+    for op in (write, read):
+        slow = timeit.timeit(lambda: op(TJSONProtocol), number=iters)
+        fast = timeit.timeit(lambda: op(TJSONProtocolAccelerated), number=iters)
+        report('%s TJSONProtocol' % op.__name__, slow)
+        report('%s TJSONProtocolAccelerated' % op.__name__, fast, slow)
+
+
+@benchmark
+def simple_json(iters):
+    """serialize_simple_json against TSimpleJSONProtocol, which cannot read."""
+    objs = make_objects()
+    factory = TSimpleJSONProtocolFactory()
+    encoded = [(obj.__class__, serialize_simple_json(obj)) for obj in objs]
+
+    slow = timeit.timeit(lambda: [serialize(obj, factory) for obj in objs], number=iters)
+    fast = timeit.timeit(lambda: [serialize_simple_json(obj) for obj in objs], number=iters)
+    report('write TSimpleJSONProtocol', slow)
+    report('write serialize_simple_json', fast, slow)
+    fast = timeit.timeit(lambda: [deserialize_simple_json(cls, data) for cls, data in encoded],
+                         number=iters)
+    report('read deserialize_simple_json', fast)
+
+
+@benchmark
+def primitive(iters):
+    """to_primitive and from_primitive in C against the compiled Python converters."""
+    objs = make_objects()
+    encoded = [(obj.__class__, to_primitive(obj)) for obj in objs]
+
+    def to_python():
+        for obj in objs:
+            cls = obj.__class__
+            TCodec.struct_to_primitive(cls, cls.thrift_spec)(obj)
+
+    def from_python():
+        for cls, data in encoded:
+            if issubclass(cls, TFrozenBase):
+                TCodec.struct_from_primitive(cls, cls.thrift_spec, True)(cls, data)
+            else:
+                TCodec.struct_from_primitive(cls, cls.thrift_spec)(cls(), data)
+
+    slow = timeit.timeit(to_python, number=iters)
+    fast = timeit.timeit(lambda: [to_primitive(obj) for obj in objs], number=iters)
+    report('to_primitive TCodec', slow)
+    report('to_primitive fastbinary', fast, slow)
+    slow = timeit.timeit(from_python, number=iters)
+    fast = timeit.timeit(lambda: [from_primitive(cls, data) for cls, data in encoded],
+                         number=iters)
+    report('from_primitive TCodec', slow)
+    report('from_primitive fastbinary', fast, slow)
+
+
+class TUnviewedTransport(TTransport.TTransportBase):
+    """Reads from a TMemoryBuffer without exposing its cbuffer_view."""
+
+    def __init__(self, data):
+        self.__trans = TTransport.TMemoryBuffer(data)
+
+    def read(self, sz):
+        return self.__trans.read(sz)
+
+
+@benchmark
+def compact_varints(iters):
+    """Pure Python TCompactProtocol integers, decoded from the transport's buffer view against
+    a byte at a time.  Run with python -O to also drop the state assertions."""
+    values = list(range(-2000, 2000, 7))
+    obj = NumericLists(shorts=values, ints=[n << 16 for n in values],
+                       longs=[n << 40 for n in values])
+    trans = TTransport.TMemoryBuffer()
+    obj.write(TCompactProtocol(trans))
+    data = trans.getvalue()
+
+    def read(trans_class, typed_arrays):
+        NumericLists().read(TCompactProtocol(trans_class(data), typed_arrays=typed_arrays))
+
+    report('write', timeit.timeit(lambda: obj.write(TCompactProtocol(TDevNullTransport())),
+                                  number=iters))
+    for typed_arrays in (False, True):
+        slow = timeit.timeit(lambda: read(TUnviewedTransport, typed_arrays), number=iters)
+        fast = timeit.timeit(lambda: read(TTransport.TMemoryBuffer, typed_arrays), number=iters)
+        name = 'read %s' % ('arrays' if typed_arrays else 'lists')
+        report('%s byte at a time' % name, slow)
+        report('%s buffer view' % name, fast, slow)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iters', type=int, default=1000)
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='one of: %s' % ', '.join(BENCHMARKS))
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    for name in args.names or BENCHMARKS:
+        print('== %s: %s' % (name, BENCHMARKS[name].__doc__))
+        BENCHMARKS[name](args.iters)
+
+
+if __name__ == '__main__':
+    main()
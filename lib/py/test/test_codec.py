@@ -0,0 +1,981 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import array
+import gc
+import json
+import math
+import pickle
+import struct
+import sys
+import unittest
+
+import six
+
+import _import_local_thrift  # noqa
+from _test_types import (Backwards, Bonk, Empty, FrozenReordered, HolyMoley, Nesting, NumericLists,
+                         OneOfEach, PrimitiveMaps, RandomStuff, Wrapper)
+from thrift.TSerialization import (deserialize, deserialize_simple_json, from_primitive, serialize,
+                                   serialize_simple_json, serialized_size, to_primitive)
+from thrift.Thrift import TFrozenDict, TInternTable, TSizedIterable, TType
+from thrift.compat import BufferIO
+from thrift.protocol import TCodec
+from thrift.protocol import TCompactProtocol as compact
+from thrift.protocol.TBase import TBase, TEncodedCache, TFrozenBase
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.protocol.TCompactProtocol import TCompactProtocol
+from thrift.protocol.TJSONProtocol import TJSONProtocol, TSimpleJSONProtocolFactory
+from thrift.protocol.TProtocol import TProtocolException
+from thrift.transport import TTransport
+
+
+def make_objects():
+    ooe = OneOfEach(im_true=True, im_false=False, a_bite=0x22, integer16=27000,
+                    integer32=1 << 24, integer64=6000 * 1000 * 1000,
+                    double_precision=math.pi, some_characters=u'Debug THIS!',
+                    zomg_unicode=u'\xd7\n\a\t', base64=b'\x00\x01\xff')
+    hm = HolyMoley(big=[ooe, OneOfEach(integer16=16, integer32=32)],
+                   contain=set([(u'and a one', u'and a two'), ()]),
+                   bonks={u'nothing': [],
+                          u'poe': [Bonk(type=3, message=u'quoth'),
+                                   Bonk(type=4, message=u'the raven')]})
+    rs = RandomStuff(a=1, b=2, c=3, myintlist=list(range(20)),
+                     maps={1: Wrapper(foo=Empty()), 2: Wrapper(foo=Empty())},
+                     bigint=124523452435, triple=3.14)
+    return [ooe, hm, rs, Nesting(my_bonk=Bonk(type=1, message=u'Wait.'), my_ooe=ooe),
+            Backwards(first_tag2=4, second_tag1=2), HolyMoley()]
+
+
+def make_numeric_lists():
+    return NumericLists(bytes=[-128, 0, 127], shorts=[-32768, 1, 32767],
+                        ints=[-2 ** 31, 0, 2 ** 31 - 1] + list(range(20)),
+                        longs=[-2 ** 63, 2 ** 40, 2 ** 63 - 1], doubles=[math.pi, -0.5, 1e300])
+
+
+def make_skippable():
+    """Objects with a field of every type, to be skipped as unknown fields."""
+    maps = PrimitiveMaps(longs=dict((i * 2 ** 40, -i) for i in range(300)),
+                         doubles={-1: 0.5, 2 ** 31 - 1: 1e300},
+                         flags={-128: True, 127: False}, bools=set([True, False]),
+                         names={u'a': -1, u'\xd7': 2 ** 15 - 1})
+    return make_objects() + [make_numeric_lists(), maps, PrimitiveMaps(longs={})]
+
+
+def as_arrays(obj, convert):
+    return NumericLists(**dict((name, convert(getattr(obj, name)))
+                               for name in NumericLists.__slots__))
+
+
+class ProtocolFactory(object):
+    def __init__(self, protocol_class):
+        self.protocol_class = protocol_class
+
+    def getProtocol(self, trans):
+        return self.protocol_class(trans)
+
+
+def check_projection(test, protocol_class, data_protocol_class=None):
+    """Decodes projections of make_objects() encoded with protocol_class."""
+    factory = ProtocolFactory(protocol_class)
+    ooe, hm, rs, nesting = make_objects()[:4]
+    cases = [
+        (ooe, ['integer32', 'base64'],
+         OneOfEach(integer32=ooe.integer32, base64=ooe.base64)),
+        (nesting, ['my_bonk', 'my_ooe.integer16', 'my_ooe.im_true'],
+         Nesting(my_bonk=nesting.my_bonk,
+                 my_ooe=OneOfEach(integer16=ooe.integer16, im_true=True))),
+        (hm, ['big.integer32', 'bonks.message'],
+         HolyMoley(big=[OneOfEach(integer32=o.integer32) for o in hm.big],
+                   bonks=dict((k, [Bonk(message=b.message) for b in v])
+                              for k, v in hm.bonks.items()))),
+        (rs, ['maps.foo', 'a'], RandomStuff(a=rs.a, maps=rs.maps)),
+        (Wrapper(foo=Empty()), ['foo'], Wrapper(foo=Empty())),
+    ]
+    for obj, projection, expected in cases:
+        trans = TTransport.TMemoryBuffer()
+        obj.write((data_protocol_class or protocol_class)(trans))
+        data = trans.getvalue()
+        for _ in range(2):
+            decoded = deserialize(obj.__class__(), data, factory, projection=projection)
+            test.assertEqual(decoded, expected)
+        test.assertEqual(deserialize(obj.__class__(), data, factory, projection=[]),
+                         obj.__class__())
+    # A mutable base is decoded into and returned, a frozen one is left as
+    # it is for a new instance, with or without a projection.
+    for obj in (nesting, Wrapper(foo=Empty())):
+        trans = TTransport.TMemoryBuffer()
+        obj.write((data_protocol_class or protocol_class)(trans))
+        fields = [spec[2] for spec in obj.thrift_spec if spec is not None]
+        for projection in (None, fields):
+            base = obj.__class__()
+            decoded = deserialize(base, trans.getvalue(), factory, projection=projection)
+            test.assertEqual(decoded, obj)
+            if isinstance(base, TFrozenBase):
+                test.assertEqual(base, obj.__class__())
+            else:
+                test.assertIs(decoded, base)
+    test.assertRaises(ValueError, deserialize, Nesting(), b'', factory, projection=['nope'])
+    test.assertRaises(ValueError, deserialize, Nesting(), b'', factory,
+                      projection=['my_bonk.type.x'])
+    test.assertRaises(ValueError, deserialize, Nesting(), b'', factory, projection=['.type'])
+
+
+def check_binary_views(test, protocol_class):
+    """Decodes binary fields as views of the encoded buffer and writes them back."""
+    ooe = OneOfEach(base64=b'\x00\x01\xff' * 100, some_characters=u'text',
+                    zomg_unicode=u'\xd7')
+    trans = TTransport.TMemoryBuffer()
+    ooe.write(protocol_class(trans))
+    data = trans.getvalue()
+    for source in (TTransport.TMemoryBuffer(data),
+                   TTransport.TBufferedTransport(TTransport.TMemoryBuffer(data), 100)):
+        decoded = OneOfEach()
+        decoded.read(protocol_class(source, binary_views=True))
+        test.assertIsInstance(decoded.base64, memoryview)
+        test.assertTrue(decoded.base64.readonly)
+        test.assertEqual(bytes(decoded.base64), ooe.base64)
+        test.assertEqual((decoded.some_characters, decoded.zomg_unicode),
+                         (ooe.some_characters, ooe.zomg_unicode))
+        trans = TTransport.TMemoryBuffer()
+        decoded.write(protocol_class(trans))
+        test.assertEqual(trans.getvalue(), data)
+    decoded = OneOfEach()
+    decoded.read(protocol_class(TTransport.TMemoryBuffer(data), binary_views=True))
+    test.assertIs(decoded.base64.obj, data)
+
+    # Views outlive the frame they were read from.
+    trans = TTransport.TMemoryBuffer()
+    framed = TTransport.TFramedTransport(trans)
+    ooe.write(protocol_class(framed))
+    framed.flush()
+    Bonk(message=u'next').write(protocol_class(framed))
+    framed.flush()
+    framed = TTransport.TFramedTransport(TTransport.TMemoryBuffer(trans.getvalue()))
+    prot = protocol_class(framed, binary_views=True)
+    decoded = OneOfEach()
+    decoded.read(prot)
+    bonk = Bonk()
+    bonk.read(prot)
+    test.assertEqual(bonk, Bonk(message=u'next'))
+    test.assertEqual(bytes(decoded.base64), ooe.base64)
+
+
+def check_intern_table(test, protocol_class):
+    """Decodes equal map keys and short strings into the same objects."""
+    def decode(data, table):
+        obj = HolyMoley()
+        obj.read(protocol_class(TTransport.TMemoryBuffer(data), intern_table=table))
+        return obj
+
+    keys = [u'key %d' % i for i in range(10)]
+    hm = HolyMoley(bonks=dict((key, [Bonk(message=u'short'), Bonk(message=u'x' * 20)])
+                              for key in keys))
+    trans = TTransport.TMemoryBuffer()
+    hm.write(protocol_class(trans))
+    data = trans.getvalue()
+
+    table = TInternTable(max_length=10)
+    first = decode(data, table)
+    second = decode(data, table)
+    test.assertEqual(first, hm)
+    test.assertEqual(second, hm)
+    test.assertEqual(len(table), 11)
+    for key in keys:
+        test.assertIs(table.intern(key), table.intern(key))
+    second_keys = dict((key, key) for key in second.bonks)
+    for key, bonks in first.bonks.items():
+        test.assertIs(table.intern(key), key)
+        test.assertIs(second_keys[key], key)
+        test.assertIs(bonks[0].message, second.bonks[key][0].message)
+        test.assertIsNot(bonks[1].message, second.bonks[key][1].message)
+
+    table = TInternTable(size=4)
+    test.assertEqual(decode(data, table), hm)
+    test.assertIn(len(table), (3, 4))
+    test.assertNotIn(u'short', table)
+
+    unused = decode(data, None)
+    test.assertIsNot(unused.bonks[keys[0]][0].message, unused.bonks[keys[1]][0].message)
+
+    # Decoding goes through the generations and rotate() of the table.
+    table = RotationCounter(size=4)
+    test.assertEqual(decode(data, table), hm)
+    test.assertEqual(table.rotations, 4)
+    test.assertEqual(len(table), len(table.current) + len(table.previous))
+    for key in table.current:
+        test.assertIs(table.current[key], key)
+    test.assertIn(keys[-1], table.current)
+
+
+class RotationCounter(TInternTable):
+    __slots__ = ('rotations',)
+
+    def __init__(self, *args, **kwargs):
+        TInternTable.__init__(self, *args, **kwargs)
+        self.rotations = 0
+
+    def rotate(self):
+        self.rotations += 1
+        TInternTable.rotate(self)
+
+
+def check_encoded_cache(test, protocol_class):
+    """Copies the cached bytes of frozen structs instead of encoding them."""
+    def encode(obj, cache):
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol_class(trans, encoded_cache=cache))
+        return trans.getvalue()
+
+    key = protocol_class(TTransport.TMemoryBuffer()).encoding_key()
+    wrapper = Wrapper(foo=Empty())
+    rs = RandomStuff(a=1, maps={1: wrapper, 2: wrapper, 3: Wrapper()})
+    expected = encode(rs, None)
+    cache = TEncodedCache()
+    test.assertEqual(encode(rs, cache), expected)
+    test.assertEqual(encode(rs, cache), expected)
+    test.assertEqual(encode(wrapper, cache), encode(wrapper, None))
+    test.assertEqual(cache.get(wrapper, key), encode(wrapper, None))
+    test.assertIsNone(cache.get(rs, key))
+
+    # Encoding goes through get() and put().
+    recorder = CacheRecorder()
+    empty = Empty()
+    test.assertEqual(encode(empty, recorder), encode(empty, None))
+    test.assertEqual(encode(empty, recorder), encode(empty, None))
+    test.assertEqual(recorder.calls, ['get', 'put', 'get'])
+
+    # What is in the cache is what gets written: an empty struct here.
+    cache.put(wrapper, key, b'\x00')
+    test.assertEqual(encode(rs, cache),
+                     encode(RandomStuff(a=1, maps={1: Wrapper(), 2: Wrapper(), 3: Wrapper()}),
+                            None))
+    cache.clear()
+    test.assertEqual(len(cache), 0)
+    test.assertEqual(encode(rs, cache), expected)
+    test.assertNotEqual(len(cache), 0)
+
+    # Protocols configured differently keep encodings of their own.
+    trans = TTransport.TMemoryBuffer()
+    prot = protocol_class(trans, encoded_cache=cache, string_length_limit=1000)
+    test.assertNotEqual(prot.encoding_key(), key)
+    cache.put(wrapper, key, b'\x00')
+    rs.write(prot)
+    test.assertEqual(trans.getvalue(), expected)
+    test.assertEqual(cache.get(wrapper, prot.encoding_key()), encode(wrapper, None))
+    test.assertEqual(cache.get(wrapper, key), b'\x00')
+    if hasattr(sys, 'getrefcount'):
+        # Entries go away with their structs.
+        del rs, wrapper
+        test.assertEqual(len(cache), 0)
+
+
+class CacheRecorder(TEncodedCache):
+    __slots__ = ('calls',)
+
+    def __init__(self):
+        TEncodedCache.__init__(self)
+        self.calls = []
+
+    def get(self, obj, encoding):
+        self.calls.append('get')
+        return TEncodedCache.get(self, obj, encoding)
+
+    def put(self, obj, encoding, data):
+        self.calls.append('put')
+        TEncodedCache.put(self, obj, encoding, data)
+
+
+class Sparse(TBase):
+    """Field ids too far apart for the compact protocol's deltas."""
+    __slots__ = ('flag', 'name', 'values')
+
+    thrift_spec = ((None,) + ((1, TType.BOOL, 'flag', None, None, ),) + (None,) * 18 +
+                   ((20, TType.STRING, 'name', 'UTF8', None, ),) + (None,) * 279 +
+                   ((300, TType.LIST, 'values', (TType.I64, None, False), None, ),))
+
+    def __init__(self, flag=None, name=None, values=None):
+        self.flag = flag
+        self.name = name
+        self.values = values
+
+
+def check_encoded_size(test, protocol_class):
+    """Sizes structs exactly as they are encoded, without encoding them."""
+    def encode(obj):
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol_class(trans))
+        return trans.getvalue()
+
+    objs = make_skippable() + [
+        Sparse(flag=True, name=u'\xd7\u20ac\U0001f600', values=[-1, 2 ** 62, -2 ** 63] * 6),
+        Sparse(name=u''), Sparse(flag=False, values=list(range(-70, 70))),
+        NumericLists(ints=array.array(TCodec.ARRAY_TYPECODES[TType.I32], [-5, 1 << 30]),
+                     shorts=memoryview(array.array(TCodec.ARRAY_TYPECODES[TType.I16], [7])),
+                     doubles=array.array('d', [0.5] * 20)),
+        OneOfEach(base64=memoryview(b'\x00' * 200), some_characters=u'x' * 127),
+        RandomStuff(maps=dict((i, Wrapper(foo=Empty())) for i in range(20))),
+    ]
+    prot = protocol_class(TTransport.TMemoryBuffer())
+    for obj in objs:
+        size = len(encode(obj))
+        test.assertEqual(prot.encodedSize(obj), size)
+        test.assertEqual(serialized_size(obj, ProtocolFactory(protocol_class)), size)
+
+    streamed = NumericLists(ints=TSizedIterable(3, iter([1, 2, 3])))
+    test.assertRaises(TypeError, prot.encodedSize, streamed)
+    test.assertEqual(list(streamed.ints), [1, 2, 3])
+
+
+class FlushRecorder(TTransport.TMemoryBuffer):
+    """Records the number of bytes written at each flush and drain."""
+
+    def __init__(self):
+        TTransport.TMemoryBuffer.__init__(self)
+        self.flushes = []
+        self.drains = []
+
+    def flush(self):
+        self.flushes.append(len(self.getvalue()))
+
+    def drain(self):
+        self.drains.append(len(self.getvalue()))
+
+
+class ChunkedReader(TTransport.TTransportBase):
+    """Returns at most chunk bytes from each read, like a socket would."""
+
+    def __init__(self, value, chunk=1):
+        self._buffer = BufferIO(value)
+        self.chunk = chunk
+
+    def read(self, sz):
+        return self._buffer.read(min(sz, self.chunk))
+
+
+def reference_varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def reading_transports(data):
+    """Transports with and without a view of their buffer, some of which end
+    it in the middle of varints."""
+    return [TTransport.TMemoryBuffer(data),
+            ChunkedReader(data),
+            ChunkedReader(data, 3),
+            TTransport.TBufferedTransport(ChunkedReader(data, 3), 5),
+            TTransport.TFramedTransport(TTransport.TMemoryBuffer(
+                struct.pack('!i', len(data)) + data))]
+
+
+def check_sized_iterables(test, protocol_class):
+    """Writes containers from TSizedIterables, draining every chunk."""
+    n = 1000
+    obj = make_objects()[1]
+    obj.big = [OneOfEach(integer32=i) for i in range(n)]
+    lists = NumericLists(ints=list(range(n)), doubles=[i / 2.0 for i in range(n)])
+
+    def streamed(chunk_size):
+        return [
+            HolyMoley(big=TSizedIterable(n, (OneOfEach(integer32=i) for i in range(n)),
+                                         chunk_size),
+                      contain=TSizedIterable(len(obj.contain), iter(obj.contain), chunk_size),
+                      bonks=TSizedIterable(len(obj.bonks), six.iteritems(obj.bonks),
+                                           chunk_size)),
+            NumericLists(ints=TSizedIterable(n, iter(range(n)), chunk_size),
+                         doubles=TSizedIterable(n, (i / 2.0 for i in range(n)), chunk_size))]
+
+    for expected, drains, chunked, unchunked in zip((obj, lists), (n // 100, 2 * n // 100),
+                                                    streamed(100), streamed(None)):
+        trans = TTransport.TMemoryBuffer()
+        expected.write(protocol_class(trans))
+        data = trans.getvalue()
+
+        trans = TTransport.TMemoryBuffer()
+        unchunked.write(protocol_class(trans))
+        test.assertEqual(trans.getvalue(), data)
+
+        recorder = FlushRecorder()
+        trans = TTransport.TBufferedTransport(recorder)
+        chunked.write(protocol_class(trans))
+        test.assertEqual(recorder.flushes, [])
+        trans.flush()
+        test.assertEqual(recorder.getvalue(), data)
+        test.assertEqual(len(recorder.drains), drains)
+        test.assertLess(recorder.drains[0], len(data) // 5)
+        test.assertEqual(recorder.flushes, [len(data)])
+
+    # A message must be a single frame, so TFramedTransport refuses to send
+    # part of one, and only writes whole ones.
+    recorder = FlushRecorder()
+    trans = TTransport.TFramedTransport(recorder)
+    test.assertRaises(TTransport.TTransportException, streamed(100)[0].write, protocol_class(trans))
+    test.assertEqual((recorder.getvalue(), recorder.flushes, recorder.drains), (b'', [], []))
+    trans = TTransport.TFramedTransport(recorder)
+    streamed(None)[0].write(protocol_class(trans))
+    trans.flush()
+    test.assertEqual(len(recorder.flushes), 1)
+    decoded = HolyMoley()
+    decoded.read(protocol_class(TTransport.TFramedTransport(
+        TTransport.TMemoryBuffer(recorder.getvalue()))))
+    test.assertEqual(decoded, obj)
+
+    for size in (n - 1, n + 1):
+        bad = NumericLists(ints=TSizedIterable(size, range(n)))
+        test.assertRaises(ValueError, bad.write, protocol_class(TTransport.TMemoryBuffer()))
+
+
+def check_streamed_read(test, protocol_class):
+    """Streams a list and a map field out of structs followed by another."""
+    n = 500
+    obj = RandomStuff(a=1, b=2, myintlist=list(range(n)),
+                      maps=dict((i, Wrapper(foo=Empty())) for i in range(n)), bigint=1 << 40)
+    unframed = TTransport.TMemoryBuffer()
+    frames = TTransport.TMemoryBuffer()
+    framed = TTransport.TFramedTransport(frames)
+    for _ in range(6):
+        for trans in (unframed, framed):
+            obj.write(protocol_class(trans))
+            Bonk(message=u'next').write(protocol_class(trans))
+        framed.flush()
+    data = unframed.getvalue()
+
+    def check_next(prot):
+        bonk = Bonk()
+        bonk.read(prot)
+        test.assertEqual(bonk, Bonk(message=u'next'))
+
+    for trans in (TTransport.TMemoryBuffer(data),
+                  TTransport.TBufferedTransport(TTransport.TMemoryBuffer(data), 64),
+                  TTransport.TFramedTransport(TTransport.TMemoryBuffer(frames.getvalue()))):
+        prot = protocol_class(trans)
+        streamed = RandomStuff()
+        elems = prot.readStreamed(streamed, 'myintlist')
+        test.assertEqual(next(elems), 0)
+        test.assertEqual((streamed.a, streamed.b, streamed.maps), (1, 2, None))
+        test.assertEqual(list(elems), list(range(1, n)))
+        test.assertEqual(streamed.maps, obj.maps)
+        test.assertEqual(streamed.bigint, obj.bigint)
+        test.assertIsNone(streamed.myintlist)
+        check_next(prot)
+
+        streamed = RandomStuff()
+        batches = list(prot.readStreamed(streamed, 'maps', batch_size=64))
+        test.assertEqual([len(batch) for batch in batches], [64] * (n // 64) + [n % 64])
+        test.assertEqual(dict(pair for batch in batches for pair in batch), obj.maps)
+        test.assertEqual(streamed.myintlist, obj.myintlist)
+        check_next(prot)
+
+        # Closing the iterator part-way skips the rest of the struct.
+        for fname in ('myintlist', 'maps'):
+            streamed = RandomStuff()
+            elems = prot.readStreamed(streamed, fname, batch_size=10)
+            test.assertEqual(len(next(elems)), 10)
+            elems.close()
+            test.assertEqual(streamed.bigint, obj.bigint)
+            check_next(prot)
+
+        # So does leaving its with block, even before the first element.
+        streamed = RandomStuff()
+        with prot.readStreamed(streamed, 'myintlist') as elems:
+            test.assertEqual(next(elems), 0)
+        test.assertEqual(streamed.bigint, obj.bigint)
+        check_next(prot)
+        streamed = RandomStuff()
+        with prot.readStreamed(streamed, 'maps'):
+            pass
+        test.assertEqual(streamed.bigint, obj.bigint)
+        check_next(prot)
+
+    # Dropping it reads nothing more.
+    trans = TTransport.TMemoryBuffer(data)
+    elems = protocol_class(trans).readStreamed(RandomStuff(), 'myintlist')
+    test.assertEqual(next(elems), 0)
+    position = trans.cstringio_buf.tell()
+    del elems
+    gc.collect()
+    test.assertEqual(trans.cstringio_buf.tell(), position)
+
+    test.assertRaises(ValueError, prot.readStreamed, RandomStuff(), 'nope')
+    test.assertRaises(ValueError, prot.readStreamed, RandomStuff(), 'bigint')
+
+
+class GenericProtocolMixin(object):
+    compiled_codecs = False
+
+
+class CompiledCodecMixin(object):
+    def _encode(self, protocol_class, obj):
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol_class(trans))
+        return trans.getvalue()
+
+    def _decode(self, protocol_class, data, cls):
+        return self._decode_from(protocol_class, TTransport.TMemoryBuffer(data), cls)
+
+    def _decode_from(self, protocol_class, trans, cls):
+        obj = cls()
+        return obj.read(protocol_class(trans)) or obj
+
+    def test_write_matches_generic(self):
+        for obj in make_objects():
+            self.assertEqual(self._encode(self.protocol, obj),
+                             self._encode(self.generic_protocol, obj))
+
+    def test_read_matches_generic(self):
+        for obj in make_objects():
+            data = self._encode(self.generic_protocol, obj)
+            self.assertEqual(self._decode(self.protocol, data, obj.__class__), obj)
+
+    def test_frozen_roundtrip(self):
+        obj = Wrapper(foo=Empty())
+        data = self._encode(self.protocol, obj)
+        prot = self.protocol(TTransport.TMemoryBuffer(data))
+        self.assertEqual(Wrapper.read(prot), obj)
+
+    def test_unknown_fields_are_skipped(self):
+        data = self._encode(self.protocol, make_objects()[2])
+        bonk = self._decode(self.protocol, data, Bonk)
+        self.assertEqual(bonk, Bonk(type=1))
+
+    def test_projection(self):
+        check_projection(self, self.protocol)
+        check_projection(self, self.generic_protocol)
+        # The projected readers must not replace the cached full ones.
+        self.test_read_matches_generic()
+
+    def test_skip_every_type(self):
+        for obj in make_skippable():
+            data = self._encode(self.protocol, obj)
+            for protocol in (self.protocol, self.generic_protocol):
+                trans = TTransport.TMemoryBuffer(data + b'tail')
+                self.assertEqual(self._decode_from(protocol, trans, Empty), Empty())
+                self.assertEqual(trans.read(4), b'tail')
+
+    def test_spec_replacement_invalidates_codec(self):
+        class Point(Bonk):
+            __slots__ = ()
+        obj = Point(type=1, message=u'x')
+        full = self._encode(self.protocol, obj)
+        Point.thrift_spec = (None, Bonk.thrift_spec[1])
+        try:
+            self.assertEqual(self._decode(self.protocol, full, Point), Point(type=1))
+            self.assertNotEqual(self._encode(self.protocol, obj), full)
+        finally:
+            del Point.thrift_spec
+
+    def test_typed_arrays(self):
+        obj = make_numeric_lists()
+        data = self._encode(self.generic_protocol, obj)
+        for protocol in (self.protocol, self.generic_protocol):
+            prot = protocol(TTransport.TMemoryBuffer(data))
+            prot.typed_arrays = True
+            decoded = NumericLists()
+            decoded.read(prot)
+            for name in NumericLists.__slots__:
+                value = getattr(decoded, name)
+                self.assertIsInstance(value, array.array)
+                self.assertEqual(value.tolist(), getattr(obj, name))
+            self.assertEqual(self._decode(protocol, data, NumericLists), obj)
+
+    def test_write_arrays(self):
+        obj = make_numeric_lists()
+        data = self._encode(self.generic_protocol, obj)
+        arrays = as_arrays(self._decode_arrays(data), lambda a: a)
+        for protocol in (self.protocol, self.generic_protocol):
+            self.assertEqual(self._encode(protocol, arrays), data)
+            self.assertEqual(self._encode(protocol, as_arrays(arrays, memoryview)), data)
+        # arrays of another typecode are converted
+        floats = NumericLists(doubles=array.array('f', [0.5, 2.0]))
+        self.assertEqual(self._encode(self.protocol, floats),
+                         self._encode(self.protocol, NumericLists(doubles=[0.5, 2.0])))
+
+    def _decode_arrays(self, data):
+        prot = self.protocol(TTransport.TMemoryBuffer(data))
+        prot.typed_arrays = True
+        obj = NumericLists()
+        obj.read(prot)
+        return obj
+
+    def test_sized_iterables(self):
+        check_sized_iterables(self, self.protocol)
+        check_sized_iterables(self, self.generic_protocol)
+
+    def test_streamed_read(self):
+        check_streamed_read(self, self.protocol)
+        check_streamed_read(self, self.generic_protocol)
+
+    def test_codecs_are_cached(self):
+        writer = TCodec.struct_writer(self.protocol, Bonk, Bonk.thrift_spec)
+        self.assertIs(TCodec.struct_writer(self.protocol, Bonk, Bonk.thrift_spec), writer)
+        spec = (TType.STRUCT, (Bonk, Bonk.thrift_spec), False)
+        reader = TCodec.value_reader(self.protocol, TType.LIST, spec)
+        self.assertIs(TCodec.value_reader(self.protocol, TType.LIST, spec), reader)
+        writer = TCodec.value_writer(self.protocol, TType.LIST, spec)
+        self.assertIs(TCodec.value_writer(self.protocol, TType.LIST, spec), writer)
+
+
+class TestCompiledBinary(CompiledCodecMixin, unittest.TestCase):
+    protocol = TBinaryProtocol
+
+    class generic_protocol(GenericProtocolMixin, TBinaryProtocol):
+        pass
+
+    def test_binary_views(self):
+        check_binary_views(self, self.protocol)
+        check_binary_views(self, self.generic_protocol)
+
+    def test_intern_table(self):
+        check_intern_table(self, self.protocol)
+        check_intern_table(self, self.generic_protocol)
+
+    def test_encoded_cache(self):
+        check_encoded_cache(self, self.protocol)
+        check_encoded_cache(self, self.generic_protocol)
+
+    def test_encoded_cache_settings(self):
+        class Tagged(TBinaryProtocol):
+            def __init__(self, trans, tag, **kwargs):
+                TBinaryProtocol.__init__(self, trans, **kwargs)
+                self.tag = tag
+
+        cache = TEncodedCache()
+        wrapper = Wrapper(foo=Empty())
+        rs = RandomStuff(a=1, maps={1: wrapper})
+        trans = TTransport.TMemoryBuffer()
+        prot = Tagged(trans, 'tag', strictWrite=False, encoded_cache=cache)
+        rs.write(prot)
+        self.assertEqual(trans.getvalue(), self._encode(self.protocol, rs))
+        self.assertEqual(prot.encoding_key(), ('binary', False, None, None))
+        self.assertEqual(cache.get(wrapper, prot.encoding_key()),
+                         self._encode(self.protocol, wrapper))
+        self.assertIsNone(cache.get(wrapper, self.protocol(trans).encoding_key()))
+
+    def test_encoded_size(self):
+        check_encoded_size(self, self.protocol)
+        check_encoded_size(self, self.generic_protocol)
+
+    def test_container_helpers(self):
+        spec = (TType.I32, None, False)
+        trans = TTransport.TMemoryBuffer()
+        self.protocol(trans).writeContainerList([1, 2, 3], spec)
+        prot = self.protocol(TTransport.TMemoryBuffer(trans.getvalue()))
+        self.assertEqual(prot.readContainerList(spec), [1, 2, 3])
+
+
+class TestCompiledCompact(CompiledCodecMixin, unittest.TestCase):
+    protocol = TCompactProtocol
+
+    class generic_protocol(GenericProtocolMixin, TCompactProtocol):
+        pass
+
+    varints = [0, 1, 0x7f, 0x80, 0x7ff, 0x800, 0x3fff, 0x4000, 2 ** 31 - 1, 2 ** 32,
+               2 ** 63 - 1, 2 ** 64 - 1]
+    ints = {
+        16: [0, 1, -1, 63, -64, 64, -65, 1023, -1024, 1024, -1025, 2 ** 15 - 1, -2 ** 15],
+        32: [0, -1, 1023, -1024, 1024, -1025, 2 ** 31 - 1, -2 ** 31],
+        64: [0, -1, 1023, -1024, 1024, -1025, 2 ** 63 - 1, -2 ** 63],
+    }
+
+    def test_binary_views(self):
+        check_binary_views(self, self.protocol)
+        check_binary_views(self, self.generic_protocol)
+
+    def test_intern_table(self):
+        check_intern_table(self, self.protocol)
+        check_intern_table(self, self.generic_protocol)
+
+    def test_encoded_cache(self):
+        check_encoded_cache(self, self.protocol)
+        check_encoded_cache(self, self.generic_protocol)
+
+    def test_encoded_size(self):
+        check_encoded_size(self, self.protocol)
+        check_encoded_size(self, self.generic_protocol)
+
+    def test_varints(self):
+        data = b''.join(reference_varint(n) for n in self.varints)
+        trans = TTransport.TMemoryBuffer()
+        for n in self.varints:
+            compact.writeVarint(trans, n)
+        self.assertEqual(trans.getvalue(), data)
+        for trans in reading_transports(data + b'\x05'):
+            self.assertEqual([compact.readVarint(trans) for _ in self.varints], self.varints)
+            self.assertEqual(trans.readAll(1), b'\x05')
+        for trans in reading_transports(data + b'\x05'):
+            self.assertEqual(compact.readVarints(trans, len(self.varints)), self.varints)
+            self.assertEqual(trans.readAll(1), b'\x05')
+        for trans in reading_transports(data[:-1]):
+            self.assertRaises(EOFError, compact.readVarints, trans, len(self.varints))
+
+    def test_zigzag_ints(self):
+        for bits, values in self.ints.items():
+            write = getattr(TCompactProtocol, 'writeI%d' % bits)
+            read = getattr(TCompactProtocol, 'readI%d' % bits)
+            data = b''.join(reference_varint(compact.makeZigZag(n, bits)) for n in values)
+            trans = TTransport.TMemoryBuffer()
+            prot = TCompactProtocol(trans)
+            prot.state = compact.VALUE_WRITE
+            for n in values:
+                write(prot, n)
+            self.assertEqual(trans.getvalue(), data)
+            for trans in reading_transports(data):
+                prot = TCompactProtocol(trans)
+                prot.state = compact.VALUE_READ
+                self.assertEqual([read(prot) for _ in values], values)
+            prot = TCompactProtocol(TTransport.TMemoryBuffer())
+            prot.state = compact.VALUE_WRITE
+            for n in (max(values) + 1, min(values) - 1):
+                self.assertRaises(TProtocolException, write, prot, n)
+
+    def test_read_chunked(self):
+        numbers = NumericLists(shorts=self.ints[16], ints=self.ints[32], longs=self.ints[64])
+        for obj in make_objects() + [numbers]:
+            data = self._encode(self.protocol, obj)
+            for protocol_class in (self.protocol, self.generic_protocol):
+                for trans in reading_transports(data):
+                    self.assertEqual(self._decode_from(protocol_class, trans, obj.__class__), obj)
+
+    def test_read_arrays_chunked(self):
+        obj = NumericLists(shorts=self.ints[16], ints=self.ints[32], longs=self.ints[64])
+        data = self._encode(self.protocol, obj)
+        for trans in reading_transports(data):
+            result = NumericLists()
+            result.read(self.protocol(trans, typed_arrays=True))
+            for name in ('shorts', 'ints', 'longs'):
+                self.assertIsInstance(getattr(result, name), array.array)
+                self.assertEqual(list(getattr(result, name)), getattr(obj, name))
+
+
+class TestCompiledJSON(CompiledCodecMixin, unittest.TestCase):
+    protocol = TJSONProtocol
+
+    class generic_protocol(GenericProtocolMixin, TJSONProtocol):
+        pass
+
+    def test_encoded_size(self):
+        prot = self.protocol(TTransport.TMemoryBuffer())
+        self.assertRaises(TProtocolException, prot.encodedSize, Bonk(type=1))
+
+
+class TestInternTable(unittest.TestCase):
+    def test_eviction(self):
+        table = TInternTable(size=4)
+        a = table.intern(u''.join([u'a']))
+        self.assertIs(table.intern(u''.join([u'a'])), a)
+        table.intern(u'b')
+        table.intern(u'c')  # the current generation was full
+        self.assertEqual(len(table), 3)
+        self.assertIs(table.intern(u''.join([u'a'])), a)  # back to the current one
+        table.intern(u'd')
+        self.assertEqual(len(table), 3)
+        self.assertNotIn(u'b', table)
+        self.assertIn(u'a', table)
+        self.assertIs(table.intern(u''.join([u'a'])), a)
+
+    def test_values(self):
+        table = TInternTable(max_length=3)
+        self.assertIs(table.intern_value(u'abc'), table.intern_value(u''.join([u'abc'])))
+        self.assertEqual(table.intern_value(u'abcd'), u'abcd')
+        self.assertNotIn(u'abcd', table)
+        self.assertRaises(ValueError, TInternTable, size=1)
+
+
+class Pair(TFrozenBase):
+    __slots__ = ('first', 'second')
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.I32, 'first', None, None, ),  # 1
+        (2, TType.MAP, 'second', (TType.I32, None, TType.I32, None, True), None, ),  # 2
+    )
+
+    def __init__(self, first=None, second=None):
+        super(Pair, self).__setattr__('first', first)
+        super(Pair, self).__setattr__('second', second)
+
+    def __setattr__(self, *args):
+        raise TypeError("can't modify immutable instance")
+
+
+class CountedHash(object):
+    def __init__(self):
+        self.count = 0
+
+    def __hash__(self):
+        self.count += 1
+        return 7
+
+
+class TestFrozenHash(unittest.TestCase):
+    def _pairs(self, n):
+        return [Pair(first=i, second=TFrozenDict({i: -i})) for i in range(n)]
+
+    def test_struct_hash(self):
+        pairs = self._pairs(100)
+        self.assertEqual(len(set(hash(pair) for pair in pairs)), 100)
+        self.assertEqual(hash(Pair(first=3, second=TFrozenDict({3: -3}))), hash(pairs[3]))
+        self.assertEqual(len(set(pairs + self._pairs(100))), 100)
+        self.assertNotEqual(hash(Wrapper()), hash(Wrapper(foo=Empty())))
+        self.assertEqual(hash(Wrapper(foo=Empty())), hash(Wrapper(foo=Empty())))
+        self.assertRaises(TypeError, hash, Pair(second={}))
+
+    def test_struct_hash_cached(self):
+        key = CountedHash()
+        pair = Pair(first=key)
+        self.assertEqual(hash(pair), hash(pair))
+        self.assertEqual(key.count, 1)
+        self.assertEqual(pair, Pair(first=key))
+        self.assertEqual(repr(pair), 'Pair(first=%r, second=None)' % key)
+        pair = self._pairs(2)[1]
+        hash(pair)
+        copy = pickle.loads(pickle.dumps(pair))
+        self.assertEqual(copy, pair)
+        self.assertEqual(hash(copy), hash(pair))
+
+    def test_pickle_out_of_order(self):
+        value = FrozenReordered(name=u'x', id=7)
+        hash(value)
+        copy = pickle.loads(pickle.dumps(value))
+        self.assertEqual((copy.name, copy.id), (u'x', 7))
+        self.assertEqual(copy, value)
+        self.assertEqual(hash(copy), hash(value))
+
+    def test_frozen_dict(self):
+        value = TFrozenDict({u'b': 1, 2: u'a'})
+        self.assertEqual(hash(value), hash(TFrozenDict([(2, u'a'), (u'b', 1)])))
+        self.assertNotEqual(hash(value), hash(TFrozenDict({u'b': 2, 2: u'a'})))
+        self.assertRaises(TypeError, value.__setitem__, 1, 2)
+        copy = pickle.loads(pickle.dumps(value))
+        self.assertIsInstance(copy, TFrozenDict)
+        self.assertEqual(copy, value)
+        self.assertEqual(hash(copy), hash(value))
+        # The hash is only computed when needed, once.
+        self.assertRaises(TypeError, hash, TFrozenDict({1: []}))
+        key = CountedHash()
+        value = TFrozenDict({1: key})
+        self.assertEqual(hash(value), hash(value))
+        self.assertEqual(key.count, 1)
+
+
+class KeyedMaps(TBase):
+    """Maps whose keys json.dumps writes as strings."""
+    __slots__ = ('by_flag', 'by_double', 'by_blob', 'frozen')
+
+    thrift_spec = (
+        None,  # 0
+        (1, TType.MAP, 'by_flag', (TType.BOOL, None, TType.STRING, 'BINARY', False), None, ),  # 1
+        (2, TType.MAP, 'by_double', (TType.DOUBLE, None, TType.BOOL, None, False), None, ),  # 2
+        (3, TType.MAP, 'by_blob', (TType.STRING, 'BINARY', TType.BYTE, None, False), None, ),  # 3
+        (4, TType.LIST, 'frozen', (TType.STRUCT, (Pair, Pair.thrift_spec), True), None, ),  # 4
+    )
+
+    def __init__(self, by_flag=None, by_double=None, by_blob=None, frozen=None):
+        self.by_flag = by_flag
+        self.by_double = by_double
+        self.by_blob = by_blob
+        self.frozen = frozen
+
+
+def make_keyed_maps():
+    return KeyedMaps(by_flag={True: b'\x00\xff', False: b''}, by_double={-0.5: True, 1e300: False},
+                     by_blob={b'\xfe': -1}, frozen=(Pair(first=1, second=TFrozenDict({2: 3})),))
+
+
+def check_primitive(test, to_primitive, from_primitive):
+    """Converts structs to primitives and back."""
+    objs = make_skippable() + [make_keyed_maps(), Pair(first=1)]
+    for obj in objs:
+        data = to_primitive(obj)
+        test.assertEqual(from_primitive(obj.__class__, data), obj)
+        test.assertEqual(from_primitive(obj.__class__, to_primitive(obj, True), True), obj)
+
+    (ooe, hm) = objs[:2]
+    data = to_primitive(ooe)
+    test.assertEqual(data['base64'], b'\x00\x01\xff')
+    test.assertIs(data['im_false'], False)
+    test.assertNotIn('what_who', data)
+    test.assertEqual(to_primitive(ooe, True)['base64'], u'AAH/')
+    test.assertEqual(to_primitive(ooe, True)['im_true'], 1)
+    data = to_primitive(hm)
+    test.assertEqual(sorted(data['contain']), [[], [u'and a one', u'and a two']])
+    test.assertEqual(data['bonks'][u'poe'][1], {'type': 4, 'message': u'the raven'})
+    test.assertEqual(to_primitive(make_keyed_maps(), True)['by_flag'], {1: u'AP8=', 0: u''})
+    test.assertEqual(to_primitive(Wrapper(foo=Empty())), {'foo': {}})
+
+    pair = from_primitive(Pair, {'first': 1, 'second': {2: 3}})
+    test.assertIsInstance(pair.second, TFrozenDict)
+    test.assertEqual(hash(pair), hash(Pair(first=1, second=TFrozenDict({2: 3}))))
+    # unknown fields and nulls are ignored
+    test.assertEqual(from_primitive(Bonk, {'type': 1, 'message': None, 'other': 2}), Bonk(type=1))
+    test.assertEqual(from_primitive(OneOfEach, {}), OneOfEach())
+
+
+def codec_to_primitive(obj, simple_json=False):
+    cls = obj.__class__
+    return TCodec.struct_to_primitive(cls, cls.thrift_spec, simple_json)(obj)
+
+
+def codec_from_primitive(cls, data, simple_json=False):
+    if issubclass(cls, TFrozenBase):
+        return TCodec.struct_from_primitive(cls, cls.thrift_spec, True, simple_json)(cls, data)
+    obj = cls()
+    TCodec.struct_from_primitive(cls, cls.thrift_spec, False, simple_json)(obj, data)
+    return obj
+
+
+class TestPrimitive(unittest.TestCase):
+    def test_primitive(self):
+        check_primitive(self, codec_to_primitive, codec_from_primitive)
+        check_primitive(self, to_primitive, from_primitive)
+
+    def test_simple_json(self):
+        for obj in make_skippable() + [make_keyed_maps()]:
+            data = serialize(obj, TSimpleJSONProtocolFactory())
+            self.assertEqual(deserialize_simple_json(obj.__class__, data), obj)
+            self.assertEqual(deserialize_simple_json(obj.__class__, serialize_simple_json(obj)),
+                             obj)
+            self.assertEqual(json.loads(serialize_simple_json(obj).decode('utf-8')),
+                             json.loads(data.decode('utf-8'), strict=False))
+        # The same bytes, but for the control characters of the OneOfEach
+        # strings, which TSimpleJSONProtocol writes as they are.
+        objs = make_skippable()
+        for obj in objs[2:3] + objs[4:] + [make_keyed_maps()]:
+            self.assertEqual(serialize_simple_json(obj),
+                             serialize(obj, TSimpleJSONProtocolFactory()))
+
+    def test_spec_replacement(self):
+        bonk = Bonk(type=1, message=u'a')
+        self.assertEqual(codec_to_primitive(bonk), {'type': 1, 'message': u'a'})
+        saved = Bonk.thrift_spec
+        try:
+            Bonk.thrift_spec = saved[:2]
+            self.assertEqual(codec_to_primitive(bonk), {'type': 1})
+            self.assertEqual(codec_from_primitive(Bonk, {'type': 1, 'message': u'a'}),
+                             Bonk(type=1))
+        finally:
+            Bonk.thrift_spec = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,650 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import array
+import gc
+import mmap
+import tempfile
+import unittest
+import weakref
+from io import BytesIO
+from struct import pack
+
+import _import_local_thrift  # noqa
+from _test_types import Bonk, Empty, HolyMoley, NumericLists, OneOfEach, PrimitiveMaps, Wrapper
+from test_codec import (ProtocolFactory, as_arrays, check_binary_views, check_encoded_cache,
+                        check_encoded_size, check_intern_table, check_primitive, check_projection,
+                        check_sized_iterables, check_streamed_read, codec_from_primitive,
+                        codec_to_primitive, make_keyed_maps, make_numeric_lists, make_objects,
+                        make_skippable)
+from thrift.TSerialization import deserialize_many, serialize_many
+from thrift.Thrift import TApplicationException, TInternTable, TMessageType, TType
+from thrift.protocol import fastbinary
+from thrift.protocol.TBase import TBase, TEncodedCache
+from thrift.protocol.TProtocol import TProtocolException
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
+from thrift.protocol.TCompactProtocol import TCompactProtocol, TCompactProtocolAccelerated
+from thrift.protocol.TJSONProtocol import TJSONProtocol, TJSONProtocolAccelerated
+from thrift.transport import TTransport
+
+
+class FastbinaryMixin(object):
+    def _encode(self, protocol_class, obj):
+        trans = TTransport.TMemoryBuffer()
+        obj.write(protocol_class(trans))
+        return trans.getvalue()
+
+    def _decode(self, prot, cls):
+        obj = cls()
+        return obj.read(prot) or obj
+
+    def _fast(self, trans, **kwargs):
+        return self.fast(trans, fallback=False, **kwargs)
+
+    def test_write_matches_python(self):
+        for obj in make_objects():
+            self.assertEqual(self._encode(self._fast, obj), self._encode(self.slow, obj))
+
+    def test_read_matches_python(self):
+        for obj in make_objects():
+            data = self._encode(self.slow, obj)
+            prot = self._fast(TTransport.TMemoryBuffer(data))
+            self.assertEqual(self._decode(prot, obj.__class__), obj)
+            buffered = TTransport.TBufferedTransport(TTransport.TMemoryBuffer(data))
+            prot = self._fast(buffered)
+            self.assertEqual(self._decode(prot, obj.__class__), obj)
+
+    def test_frozen(self):
+        obj = Wrapper(foo=Empty())
+        data = self._encode(self._fast, obj)
+        self.assertEqual(Wrapper.read(self._fast(TTransport.TMemoryBuffer(data))), obj)
+
+    def test_projection(self):
+        check_projection(self, self._fast, self.slow)
+
+    def test_skip_every_type(self):
+        for obj in make_skippable():
+            data = self._encode(self.slow, obj)
+            trans = TTransport.TMemoryBuffer(data + b'tail')
+            self.assertEqual(Empty.read(self._fast(trans)), Empty())
+            self.assertEqual(trans.read(4), b'tail')
+            prot = self._fast(TTransport.TMemoryBuffer(data[:-1]))
+            self.assertRaises(EOFError, self._decode, prot, Bonk)
+
+    def test_serialize_many(self):
+        objs = make_objects()
+        fast = ProtocolFactory(self._fast)
+        slow = ProtocolFactory(self.slow)
+        encoded = serialize_many(objs, fast)
+        self.assertEqual(encoded, serialize_many(objs, slow))
+        self.assertEqual(encoded, [self._encode(self.slow, obj) for obj in objs])
+        self.assertEqual(serialize_many([], fast), [])
+        bonks = [Bonk(type=i, message=u'm%d' % i) for i in range(100)]
+        data = serialize_many(bonks, fast)
+        for factory in (fast, slow):
+            self.assertEqual(deserialize_many(Bonk, data, factory), bonks)
+            self.assertEqual(deserialize_many(Bonk, [memoryview(d) for d in data], factory),
+                             bonks)
+            frozen = [Wrapper(foo=Empty()), Wrapper()]
+            self.assertEqual(deserialize_many(Wrapper, serialize_many(frozen, factory), factory),
+                             frozen)
+        self.assertRaises(Exception, deserialize_many, Bonk, [data[0][:-1]], fast)
+
+    def test_streamed_read(self):
+        check_streamed_read(self, self._fast)
+
+    def test_sized_iterables(self):
+        check_sized_iterables(self, self._fast)
+
+    def test_intern_table(self):
+        check_intern_table(self, self._fast)
+
+    def test_encoded_cache(self):
+        check_encoded_cache(self, self._fast)
+
+    def test_encoded_size(self):
+        check_encoded_size(self, self._fast)
+        table = TInternTable(max_length=5)
+        data = self._encode(self.slow, Bonk(message=u'short'))
+        codec = self.codec(intern_table=table)
+        first = codec.decode_value(data, TType.STRUCT, (Bonk, Bonk.thrift_spec))
+        second = codec.decode_many([data], (Bonk, Bonk.thrift_spec))[0]
+        self.assertIs(first.message, second.message)
+        self.assertRaises(AttributeError, self.codec(intern_table=object()).decode_value, data,
+                          TType.STRUCT, (Bonk, Bonk.thrift_spec))
+
+    def test_binary_views(self):
+        check_binary_views(self, self._fast)
+        # Decoding straight from a buffer views that buffer.
+        ooe = OneOfEach(base64=b'blob')
+        data = bytearray(self._encode(self.slow, ooe))
+        codec = self.codec(binary_views=True)
+        decoded, _ = codec.decode_buffer(None, data, (OneOfEach, OneOfEach.thrift_spec))
+        self.assertTrue(decoded.base64.readonly)
+        self.assertIs(decoded.base64.obj, data)
+        self.assertEqual(decoded.base64, b'blob')
+
+    def test_spec_replacement(self):
+        class Point(Bonk):
+            __slots__ = ()
+        obj = Point(type=1, message=u'x')
+        full = self._encode(self._fast, obj)
+        self.assertEqual(self._decode(self._fast(TTransport.TMemoryBuffer(full)), Point), obj)
+        Point.thrift_spec = (None, Bonk.thrift_spec[1])
+        try:
+            self.assertEqual(self._encode(self._fast, obj), self._encode(self.slow, obj))
+            prot = self._fast(TTransport.TMemoryBuffer(full))
+            self.assertEqual(self._decode(prot, Point), Point(type=1))
+        finally:
+            del Point.thrift_spec
+
+    def test_spec_cache_dies_with_class(self):
+        class Node(TBase):
+            __slots__ = ('child', 'name')
+
+            def __init__(self, child=None, name=None):
+                self.child = child
+                self.name = name
+        leaf_spec = (None, None, (2, TType.STRING, 'name', 'UTF8', None, ), )
+        # The spec refers to its class, as that of a recursive struct does.
+        Node.thrift_spec = (None, (1, TType.STRUCT, 'child', (Node, leaf_spec), None, ),
+                            (2, TType.STRING, 'name', 'UTF8', None, ), )
+        obj = Node(child=Node(name=u'leaf'), name=u'root')
+        data = self._encode(self._fast, obj)
+        self.assertEqual(self._decode(self._fast(TTransport.TMemoryBuffer(data)), Node), obj)
+        self.assertEqual(len(vars(Node)['_thrift_compiled_specs']), 2)
+        ref = weakref.ref(Node)
+        del Node, obj, leaf_spec
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_string_length_limit(self):
+        data = self._encode(self.slow, OneOfEach(some_characters=u'x' * 100))
+        prot = self._fast(TTransport.TMemoryBuffer(data), string_length_limit=10)
+        self.assertRaises(Exception, self._decode, prot, OneOfEach)
+
+    def test_rebind_transport(self):
+        first = Bonk(type=1, message=u'first')
+        second = Bonk(type=2, message=u'second')
+        prot = self._fast(TTransport.TMemoryBuffer(self._encode(self.slow, first)))
+        prot.trans = TTransport.TMemoryBuffer(self._encode(self.slow, second))
+        self.assertEqual(self._decode(prot, Bonk), second)
+        prot.trans = trans = TTransport.TMemoryBuffer()
+        first.write(prot)
+        self.assertEqual(trans.getvalue(), self._encode(self.slow, first))
+
+    def test_rebind_settings(self):
+        data = self._encode(self.slow, HolyMoley(contain=set([(u'abcdef',)])))
+        prot = self._fast(TTransport.TMemoryBuffer(data))
+        prot.string_length_limit = 2
+        self.assertRaises(OverflowError, self._decode, prot, HolyMoley)
+        prot = self._fast(TTransport.TMemoryBuffer(data))
+        prot.container_length_limit = 0
+        self.assertRaises(OverflowError, self._decode, prot, HolyMoley)
+        prot = self._fast(TTransport.TMemoryBuffer(data), string_length_limit=2)
+        prot.string_length_limit = None
+        self.assertEqual(self._decode(prot, HolyMoley).contain, set([(u'abcdef',)]))
+
+        table = TInternTable(max_length=10)
+        prot = self._fast(TTransport.TMemoryBuffer(data))
+        prot.intern_table = table
+        self._decode(prot, HolyMoley)
+        self.assertEqual(len(table), 1)
+
+        prot = self._fast(TTransport.TMemoryBuffer(self._encode(self.slow, make_numeric_lists())))
+        prot.typed_arrays = True
+        self.assertIsInstance(self._decode(prot, NumericLists).ints, array.array)
+
+        # Only the settings the codec keeps a copy of rebind it.
+        rebinds = []
+        prot._bind_codec = lambda: rebinds.append(True)
+        prot.state = prot.seqid = None
+        self.assertEqual(rebinds, [])
+        prot.binary_views = True
+        self.assertEqual(rebinds, [True])
+
+    def test_bound_codec(self):
+        data = self._encode(self.slow, Bonk(type=3, message=u'quoth'))
+        codec = self.codec(TTransport.TMemoryBuffer(data))
+        self.assertEqual(codec.decode(Bonk(), None, (Bonk, Bonk.thrift_spec)),
+                         Bonk(type=3, message=u'quoth'))
+        self.assertEqual(codec.encode(Bonk(type=3, message=u'quoth'), (Bonk, Bonk.thrift_spec)),
+                         data)
+        self.assertRaises(TypeError, codec.encode, Bonk())
+
+    def test_decode_buffer(self):
+        obj = OneOfEach(some_characters=u'caf\xe9', base64=b'\x00\xff')
+        data = self._encode(self.slow, obj)
+        typeargs = (OneOfEach, OneOfEach.thrift_spec)
+        for buf in (data, bytearray(data), memoryview(b'xx' + data + b'yy')[2:]):
+            decoded, consumed = self.decode(OneOfEach(), buf, typeargs)
+            self.assertEqual(decoded, obj)
+            self.assertEqual(consumed, len(data))
+        codec = self.codec(string_length_limit=1)
+        self.assertRaises(Exception, codec.decode_buffer, OneOfEach(), data, typeargs)
+        self.assertRaises(EOFError, self.decode, OneOfEach(), data[:-1], typeargs)
+
+    def test_decode_mmap(self):
+        objs = [Bonk(type=i, message=u'm%d' % i) for i in range(3)]
+        data = b''.join(self._encode(self.slow, obj) for obj in objs)
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                view = memoryview(mm)
+                offset = 0
+                for obj in objs:
+                    decoded, consumed = self.codec().decode_buffer(
+                        Bonk(), view[offset:], (Bonk, Bonk.thrift_spec))
+                    self.assertEqual(decoded, obj)
+                    offset += consumed
+                self.assertEqual(offset, len(data))
+                del view
+            finally:
+                mm.close()
+
+    def test_framed_transport(self):
+        objs = [Bonk(type=i, message=u'm%d' % i) for i in range(3)]
+        wtrans = TTransport.TMemoryBuffer()
+        otrans = TTransport.TFramedTransport(wtrans)
+        # two messages in one frame, the last one split across two frames
+        objs[0].write(self.slow(otrans))
+        objs[1].write(self.slow(otrans))
+        otrans.flush()
+        data = self._encode(self.slow, objs[2])
+        otrans.write(data[:3])
+        otrans.flush()
+        otrans.write(data[3:])
+        otrans.flush()
+        itrans = TTransport.TFramedTransport(TTransport.TMemoryBuffer(wtrans.getvalue()))
+        prot = self._fast(itrans)
+        for obj in objs:
+            self.assertEqual(self._decode(prot, Bonk), obj)
+        self.assertRaises(EOFError, self._decode, prot, Bonk)
+
+    def test_transport_without_view(self):
+        class LegacyBuffer(TTransport.TMemoryBuffer):
+            def cbuffer_view(self):
+                return None
+        objs = [Bonk(type=i, message=u'm%d' % i) for i in range(2)]
+        data = b''.join(self._encode(self.slow, obj) for obj in objs)
+        prot = self._fast(LegacyBuffer(data))
+        for obj in objs:
+            self.assertEqual(self._decode(prot, Bonk), obj)
+        self.assertEqual(prot.trans.read(1), b'')
+
+    def test_encode_into(self):
+        obj = OneOfEach(some_characters=u'x' * 300)
+        data = self._encode(self.slow, obj)
+        typeargs = (OneOfEach, OneOfEach.thrift_spec)
+        out = bytearray(b'head')
+        end = self.encode_into(out, obj, typeargs, offset=4)
+        self.assertEqual(end, 4 + len(data))
+        self.assertEqual(bytes(out[:end]), b'head' + data)
+        # capacity is kept for the next message
+        capacity = len(out)
+        self.assertEqual(self.encode_into(out, obj, typeargs), len(data))
+        self.assertEqual(len(out), capacity)
+        end = self.encode_into(out, obj, typeargs, framed=True)
+        self.assertEqual(bytes(out[:end]), pack('!i', len(data)) + data)
+
+        view = memoryview(bytearray(len(data)))
+        self.assertEqual(self.encode_into(view, obj, typeargs), len(data))
+        self.assertEqual(view.tobytes(), data)
+        self.assertRaises(ValueError, self.encode_into, view[:-1], obj, typeargs)
+        self.assertRaises((TypeError, BufferError), self.encode_into, data, obj, typeargs)
+
+    def test_framed_write(self):
+        objs = [Bonk(type=i, message=u'm%d' % i) for i in range(3)]
+        expected = TTransport.TMemoryBuffer()
+        actual = TTransport.TMemoryBuffer()
+        for trans, protocol in ((expected, self.slow), (actual, self._fast)):
+            framed = TTransport.TFramedTransport(trans)
+            prot = protocol(framed)
+            for obj in objs:
+                obj.write(prot)
+                framed.flush()
+            objs[0].write(prot)
+            objs[1].write(prot)
+            framed.flush()
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_framed_flush_reuses_buffer(self):
+        class FailingBuffer(TTransport.TMemoryBuffer):
+            fail = False
+
+            def write(self, buf):
+                if self.fail:
+                    raise TTransport.TTransportException(message='write failed')
+                TTransport.TMemoryBuffer.write(self, buf)
+
+        trans = FailingBuffer()
+        framed = TTransport.TFramedTransport(trans)
+        framed.write(b'first frame')
+        framed.flush()
+        framed.write(b'lost')
+        trans.fail = True
+        self.assertRaises(TTransport.TTransportException, framed.flush)
+        trans.fail = False
+        framed.write(b'two')
+        framed.flush()
+        self.assertEqual(trans.getvalue(),
+                         pack('!i', 11) + b'first frame' + pack('!i', 3) + b'two')
+
+        classes = {'ping': OneOfEach, 'pong': Bonk}
+        messages = [('ping', TMessageType.CALL, 1, OneOfEach(some_characters=u'caf\xe9')),
+                    ('pong', TMessageType.REPLY, 2 ** 20, Bonk(type=3, message=u'quoth'))]
+        for writer, reader in ((self._fast, self.slow), (self.slow, self._fast)):
+            wtrans = TTransport.TMemoryBuffer()
+            wprot = writer(wtrans)
+            for message in messages:
+                wprot.writeMessage(*message)
+            rprot = reader(TTransport.TMemoryBuffer(wtrans.getvalue()))
+            for message in messages:
+                self.assertEqual(rprot.readMessage(classes), message)
+            # Transports the C codec cannot read from are read by Python.
+            rprot = reader(TTransport.TFileObjectTransport(BytesIO(wtrans.getvalue())))
+            for message in messages:
+                self.assertEqual(rprot.readMessage(classes), message)
+
+    def test_message_matches_python(self):
+        obj = Bonk(type=1, message=u'x')
+        expected = TTransport.TMemoryBuffer()
+        prot = self.slow(expected)
+        prot.writeMessageBegin('ping', TMessageType.ONEWAY, 7)
+        obj.write(prot)
+        prot.writeMessageEnd()
+        actual = TTransport.TMemoryBuffer()
+        self._fast(actual).writeMessage('ping', TMessageType.ONEWAY, 7, obj)
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_message_unknown_and_exception(self):
+        wtrans = TTransport.TMemoryBuffer()
+        prot = self.slow(wtrans)
+        prot.writeMessage('gone', TMessageType.CALL, 1, OneOfEach())
+        error = TApplicationException(TApplicationException.UNKNOWN_METHOD, 'boom')
+        prot.writeMessage('ping', TMessageType.EXCEPTION, 2, error)
+        prot.writeMessage('ping', TMessageType.REPLY, 3, Bonk(type=1))
+        prot = self._fast(TTransport.TMemoryBuffer(wtrans.getvalue()))
+        self.assertEqual(prot.readMessage({'ping': Bonk}), ('gone', TMessageType.CALL, 1, None))
+        name, mtype, seqid, body = prot.readMessage({'ping': Bonk})
+        self.assertEqual((name, mtype, seqid), ('ping', TMessageType.EXCEPTION, 2))
+        self.assertEqual((body.type, body.message), (error.type, error.message))
+        self.assertEqual(prot.readMessage({'ping': Bonk}),
+                         ('ping', TMessageType.REPLY, 3, Bonk(type=1)))
+
+    def test_message_bad_header(self):
+        prot = self._fast(TTransport.TMemoryBuffer(b'\x80\x02\x00\x01\x00'))
+        self.assertRaises(TProtocolException, prot.readMessage, {})
+
+    def test_typed_arrays(self):
+        obj = make_numeric_lists()
+        data = self._encode(self.slow, obj)
+        decoded = self._decode(self._fast(TTransport.TMemoryBuffer(data), typed_arrays=True),
+                               NumericLists)
+        for name in NumericLists.__slots__:
+            value = getattr(decoded, name)
+            self.assertIsInstance(value, array.array)
+            self.assertEqual(value.tolist(), getattr(obj, name))
+        decoded, _ = self.codec(typed_arrays=True).decode_buffer(
+            NumericLists(), data, (NumericLists, NumericLists.thrift_spec))
+        self.assertIsInstance(decoded.doubles, array.array)
+        self.assertEqual(self._decode(self._fast(TTransport.TMemoryBuffer(data)), NumericLists),
+                         obj)
+        self.assertRaises(EOFError, self._decode,
+                          self._fast(TTransport.TMemoryBuffer(data[:-3]), typed_arrays=True),
+                          NumericLists)
+
+    def test_write_arrays(self):
+        obj = make_numeric_lists()
+        data = self._encode(self.slow, obj)
+        arrays = as_arrays(obj, lambda values: array.array('d' if isinstance(values[0], float)
+                                                           else 'q', values))
+        arrays.bytes = array.array('b', obj.bytes)
+        arrays.shorts = array.array('h', obj.shorts)
+        arrays.ints = array.array('i', obj.ints)
+        self.assertEqual(self._encode(self._fast, arrays), data)
+        self.assertEqual(self._encode(self._fast, as_arrays(arrays, memoryview)), data)
+        # buffers of another format are iterated
+        floats = NumericLists(doubles=array.array('f', [0.5, 2.0]), ints=b'\x01\x02')
+        self.assertEqual(self._encode(self._fast, floats), self._encode(self.slow, floats))
+
+    def test_malformed_spec(self):
+        codec = self.codec(TTransport.TMemoryBuffer())
+        self.assertRaises(TypeError, codec.encode, Bonk(), (Bonk, [1, 2]))
+        self.assertRaises(TypeError, codec.encode, Bonk(), (Bonk, ((1, 2),)))
+
+
+class TestFastbinaryBinary(FastbinaryMixin, unittest.TestCase):
+    fast = TBinaryProtocolAccelerated
+    slow = TBinaryProtocol
+    codec = fastbinary.BinaryCodec
+    decode = staticmethod(fastbinary.decode_binary)
+    encode_into = staticmethod(fastbinary.encode_binary_into)
+
+    def test_message_strict_read(self):
+        wtrans = TTransport.TMemoryBuffer()
+        TBinaryProtocol(wtrans, strictWrite=False).writeMessage(
+            'ping', TMessageType.CALL, 1, Bonk())
+        data = wtrans.getvalue()
+        prot = self._fast(TTransport.TMemoryBuffer(data))
+        self.assertEqual(prot.readMessage({'ping': Bonk}),
+                         ('ping', TMessageType.CALL, 1, Bonk()))
+        prot = self._fast(TTransport.TMemoryBuffer(data), strictRead=True)
+        self.assertRaises(TProtocolException, prot.readMessage, {'ping': Bonk})
+        prot = self._fast(TTransport.TMemoryBuffer(data))
+        prot.strictRead = True
+        self.assertRaises(TProtocolException, prot.readMessage, {'ping': Bonk})
+
+    def test_rebind_strict_write(self):
+        trans = TTransport.TMemoryBuffer()
+        prot = self._fast(trans)
+        prot.strictWrite = False
+        prot.writeMessage('ping', TMessageType.CALL, 1, Bonk())
+        expected = TTransport.TMemoryBuffer()
+        TBinaryProtocol(expected, strictWrite=False).writeMessage(
+            'ping', TMessageType.CALL, 1, Bonk())
+        self.assertEqual(trans.getvalue(), expected.getvalue())
+
+
+class TestFastbinaryCompact(FastbinaryMixin, unittest.TestCase):
+    fast = TCompactProtocolAccelerated
+    slow = TCompactProtocol
+    codec = fastbinary.CompactCodec
+    decode = staticmethod(fastbinary.decode_compact)
+    encode_into = staticmethod(fastbinary.encode_compact_into)
+
+
+class TestFastbinaryJSON(FastbinaryMixin, unittest.TestCase):
+    fast = TJSONProtocolAccelerated
+    slow = TJSONProtocol
+    codec = fastbinary.JSONCodec
+    decode = staticmethod(fastbinary.decode_json)
+    # There is no encode_json_into, and binary strings are base64 decoded
+    # rather than viewed.
+    test_encode_into = None
+    test_binary_views = None
+    # TJSONProtocol has no settings, only its transport is bound
+    test_rebind_settings = None
+
+    def _decode_codec(self, codec, data, cls):
+        return codec.decode_buffer(None, data, (cls, cls.thrift_spec))[0]
+
+    def test_write_matches_python(self):
+        objs = make_skippable() + [
+            OneOfEach(some_characters=u'"\\/\b\f\n\r\t\x01 caf\xe9 \U0001f600',
+                      double_precision=1.5, base64=b'\xfb\xff'),
+            OneOfEach(double_precision=-0.0, base64=b'', integer64=-2 ** 63),
+            OneOfEach(double_precision=1e-300, base64=b'a' * 1000)]
+        for obj in objs:
+            data = self._encode(self.slow, obj)
+            self.assertEqual(self._encode(self._fast, obj), data)
+            self.assertEqual(self._decode(self._fast(TTransport.TMemoryBuffer(data)),
+                                          obj.__class__), obj)
+
+    def test_read_escapes(self):
+        cases = [
+            (b'"\\u00e9\\/\\"\\ud83d\\ude00"', u'\xe9/"\U0001f600'),
+            (b'"\\ud83d"', u''),  # a lone high surrogate before the end is dropped
+            (b'"a\\tb\\\\"', u'a\tb\\'),
+        ]
+        for (encoded, expected) in cases:
+            data = b'{"8":{"str":' + encoded + b'}}'
+            decoded = self._decode_codec(self.codec(), data, OneOfEach)
+            self.assertEqual(decoded.some_characters, expected)
+            self.assertEqual(self._decode(self.slow(TTransport.TMemoryBuffer(data)), OneOfEach),
+                             decoded)
+        for encoded in (b'"\\ud83dx"', b'"\\ude00"', b'"\\ud83d\\ud83d"', b'"\\q"',
+                        b'"\\u12g4"'):
+            data = b'{"8":{"str":' + encoded + b'}}'
+            self.assertRaises(TProtocolException, self._decode_codec, self.codec(), data,
+                              OneOfEach)
+        # base64 without padding, and quoted doubles
+        data = b'{"7":{"dbl":"-Infinity"},"11":{"str":"+/8"}}'
+        decoded = self._decode_codec(self.codec(), data, OneOfEach)
+        self.assertEqual((decoded.double_precision, decoded.base64), (float('-inf'), b'\xfb\xff'))
+        for data in (b'{"3":{"i8":128}}', b'{"3":{"i8":1.5}}', b'{"3":{"i9":1}}',
+                     b'{3:{"i8":1}}', b'{"4":{"i16":-}}'):
+            self.assertRaises(TProtocolException, self._decode_codec, self.codec(), data,
+                              OneOfEach)
+
+    def test_context(self):
+        # Structs read and written through the codec follow the separators
+        # of the values around them.
+        bonks = [Bonk(type=i, message=u'm%d' % i) for i in range(3)]
+        spec = (TType.STRUCT, (Bonk, Bonk.thrift_spec), False)
+        data = self._encode(self.slow, HolyMoley(big=[OneOfEach(integer16=i) for i in range(3)]))
+        for protocol in (self._fast, self.slow):
+            trans = TTransport.TMemoryBuffer()
+            prot = protocol(trans)
+            prot.writeContainerList(bonks, spec)
+            prot.writeI32(7)
+            prot = self._fast(TTransport.TMemoryBuffer(trans.getvalue() + data))
+            self.assertEqual(prot.readContainerList(spec), bonks)
+            self.assertEqual(prot.readI32(), 7)
+            self.assertEqual(self._decode(prot, HolyMoley).big[2], OneOfEach(integer16=2))
+
+    def test_intern_table(self):
+        table = TInternTable(max_length=5)
+        data = self._encode(self.slow, Bonk(message=u'short'))
+        codec = self.codec(intern_table=table)
+        first = self._decode_codec(codec, data, Bonk)
+        second = codec.decode_many([data], (Bonk, Bonk.thrift_spec))[0]
+        self.assertEqual(first, Bonk(message=u'short'))
+        self.assertIs(first.message, second.message)
+
+    def test_encoded_cache(self):
+        # Frozen structs are written by the codec, without the cache.
+        cache = TEncodedCache()
+        obj = Wrapper(foo=Empty())
+        trans = TTransport.TMemoryBuffer()
+        prot = self._fast(trans)
+        prot.encoded_cache = cache
+        obj.write(prot)
+        self.assertEqual(trans.getvalue(), self._encode(self.slow, obj))
+        self.assertEqual(len(cache), 0)
+        codec = self.codec(encoded_cache=cache)
+        self.assertRaises(TypeError, codec.encode, obj, (Wrapper, Wrapper.thrift_spec))
+
+    def test_encoded_size(self):
+        prot = self._fast(TTransport.TMemoryBuffer())
+        self.assertRaises(TProtocolException, prot.encodedSize, Bonk(type=1))
+        self.assertRaises(TypeError, self.codec().encoded_size, Bonk(type=1),
+                          (Bonk, Bonk.thrift_spec))
+        self.assertRaises(TypeError, self.codec().scan, self._encode(self.slow, Bonk(type=1)))
+
+    def test_spec_cache_dies_with_class(self):
+        class Node(TBase):
+            __slots__ = ('child', 'name')
+
+            def __init__(self, child=None, name=None):
+                self.child = child
+                self.name = name
+        leaf_spec = (None, None, (2, TType.STRING, 'name', 'UTF8', None, ), )
+        # The spec refers to its class, as that of a recursive struct does.
+        Node.thrift_spec = (None, (1, TType.STRUCT, 'child', (Node, leaf_spec), None, ),
+                            (2, TType.STRING, 'name', 'UTF8', None, ), )
+        obj = Node(child=Node(name=u'leaf'), name=u'root')
+        data = self._encode(self._fast, obj)
+        self.assertEqual(self._decode(self._fast(TTransport.TMemoryBuffer(data)), Node), obj)
+        self.assertEqual(len(vars(Node)['_thrift_compiled_specs']), 2)
+        ref = weakref.ref(Node)
+        del Node, obj, leaf_spec
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_string_length_limit(self):
+        data = self._encode(self.slow, OneOfEach(some_characters=u'x' * 100))
+        codec = self.codec(string_length_limit=10)
+        self.assertRaises(OverflowError, self._decode_codec, codec, data, OneOfEach)
+
+    def test_typed_arrays(self):
+        obj = make_numeric_lists()
+        data = self._encode(self.slow, obj)
+        decoded = self._decode_codec(self.codec(typed_arrays=True), data, NumericLists)
+        for name in NumericLists.__slots__:
+            value = getattr(decoded, name)
+            self.assertIsInstance(value, array.array)
+            self.assertEqual(value.tolist(), getattr(obj, name))
+
+
+def fast_to_primitive(obj, simple_json=False):
+    return fastbinary.to_primitive(obj, (obj.__class__, obj.thrift_spec), simple_json)
+
+
+def fast_from_primitive(cls, data, simple_json=False):
+    return fastbinary.from_primitive(data, (cls, cls.thrift_spec), simple_json)
+
+
+class TestFastbinaryPrimitive(unittest.TestCase):
+    def test_primitive(self):
+        check_primitive(self, fast_to_primitive, fast_from_primitive)
+
+    def test_matches_python(self):
+        for obj in make_skippable() + [make_keyed_maps()]:
+            for simple_json in (False, True):
+                data = codec_to_primitive(obj, simple_json)
+                self.assertEqual(fast_to_primitive(obj, simple_json), data)
+                self.assertEqual(fast_from_primitive(obj.__class__, data, simple_json),
+                                 codec_from_primitive(obj.__class__, data, simple_json))
+
+    def test_buffers(self):
+        obj = as_arrays(make_numeric_lists(), lambda values: memoryview(array.array(
+            'd' if isinstance(values[0], float) else 'q', values)))
+        self.assertEqual(fast_to_primitive(obj), codec_to_primitive(make_numeric_lists()))
+        data = fast_to_primitive(OneOfEach(base64=memoryview(b'\x00\xff')))
+        self.assertEqual(data['base64'], b'\x00\xff')
+        self.assertIs(type(data['base64']), bytes)
+        data = fast_to_primitive(OneOfEach(base64=bytearray(b'\x00\xff')), simple_json=True)
+        self.assertEqual(data['base64'], u'AP8=')
+
+    def test_invalid(self):
+        self.assertRaises(TypeError, fast_from_primitive, Bonk, [1])
+        self.assertRaises(TypeError, fast_from_primitive, HolyMoley, {'big': [1]})
+        self.assertRaises(ValueError, fast_from_primitive, OneOfEach, {'base64': u'A'}, True)
+        self.assertRaises(ValueError, fast_from_primitive, PrimitiveMaps, {'longs': {u'x': 1}},
+                          True)
+        self.assertRaises(TypeError, fast_to_primitive, OneOfEach(base64=u'text'), True)
+        self.assertRaises(AttributeError, fastbinary.to_primitive, object(),
+                          (Bonk, Bonk.thrift_spec))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import unittest
+
+import _import_local_thrift  # noqa
+from _test_types import Bonk, HolyMoley, Nesting, OneOfEach, RandomStuff
+from test_codec import make_objects
+from thrift.TSerialization import deserialize, deserialize_lazy, serialize
+from thrift.Thrift import TType
+from thrift.protocol.TBinaryProtocol import (TBinaryProtocolAcceleratedFactory,
+                                             TBinaryProtocolFactory)
+from thrift.protocol.TCompactProtocol import (TCompactProtocolAcceleratedFactory,
+                                              TCompactProtocolFactory)
+from thrift.protocol.TJSONProtocol import TJSONProtocolFactory
+from thrift.protocol.TLazy import TLazyStruct
+
+
+class Extended(Bonk):
+    """Bonk with a field Bonk does not know about."""
+    thrift_spec = Bonk.thrift_spec + ((3, TType.LIST, 'extra', (TType.I32, None, False), None),)
+
+    def __init__(self, type=None, message=None, extra=None):
+        Bonk.__init__(self, type=type, message=message)
+        self.extra = extra
+
+
+class LazyMixin(object):
+    def _lazy(self, obj):
+        return deserialize_lazy(obj.__class__, serialize(obj, self.factory), self.factory)
+
+    def test_fields_match_full_decode(self):
+        for obj in make_objects():
+            lazy = self._lazy(obj)
+            for name in obj.__slots__:
+                self.assertEqual(getattr(lazy, name), getattr(obj, name))
+            self.assertEqual(lazy.materialize(), obj)
+            self.assertEqual(lazy, obj)
+
+    def test_missing_fields_default(self):
+        lazy = self._lazy(OneOfEach(integer32=5))
+        self.assertEqual(lazy.integer32, 5)
+        self.assertEqual(lazy.integer16, OneOfEach().integer16)
+        self.assertEqual(lazy.byte_list, OneOfEach().byte_list)
+        self.assertEqual(lazy.im_true, None)
+        self.assertRaises(AttributeError, getattr, lazy, 'no_such_field')
+
+    def test_untouched_round_trip(self):
+        for obj in make_objects():
+            data = serialize(obj, self.factory)
+            lazy = deserialize_lazy(obj.__class__, data + b'trailing', self.factory)
+            self.assertEqual(serialize(lazy, self.factory), data)
+
+    def test_partially_read_round_trip(self):
+        obj = make_objects()[3]
+        data = serialize(obj, self.factory)
+        lazy = self._lazy(obj)
+        self.assertEqual(lazy.my_bonk.message, u'Wait.')
+        self.assertEqual(serialize(lazy, self.factory), data)
+
+    def test_modified_fields(self):
+        hm = make_objects()[1]
+        lazy = self._lazy(hm)
+        lazy.bonks[u'nothing'].append(Bonk(type=5))
+        lazy.big = None
+        hm.bonks[u'nothing'].append(Bonk(type=5))
+        hm.big = None
+        data = serialize(lazy, self.factory)
+        self.assertEqual(deserialize(HolyMoley(), data, self.factory), hm)
+        self.assertEqual(data, serialize(hm, self.factory))
+        self.assertRaises(AttributeError, setattr, lazy, 'no_such_field', 1)
+
+    def test_unknown_fields_preserved(self):
+        ext = Extended(type=1, message=u'unseen', extra=[1, 2, 3])
+        lazy = deserialize_lazy(Bonk, serialize(ext, self.factory), self.factory)
+        self.assertEqual(lazy.materialize(), Bonk(type=1, message=u'unseen'))
+        lazy.type = 2
+        ext.type = 2
+        self.assertEqual(deserialize(Extended(), serialize(lazy, self.factory), self.factory), ext)
+
+    def test_bool_fields(self):
+        ooe = OneOfEach(im_true=True, im_false=False, integer32=1)
+        lazy = self._lazy(ooe)
+        lazy.integer32 = 2
+        ooe.integer32 = 2
+        self.assertEqual(serialize(lazy, self.factory), serialize(ooe, self.factory))
+        self.assertIs(lazy.im_true, True)
+        self.assertIs(lazy.im_false, False)
+
+    def test_other_encoding(self):
+        rs = make_objects()[2]
+        json = TJSONProtocolFactory()
+        self.assertEqual(serialize(self._lazy(rs), json), serialize(rs, json))
+
+    def test_nested_struct_spec(self):
+        lazy = self._lazy(Nesting(my_bonk=Bonk(type=1), my_ooe=OneOfEach(integer64=64)))
+        self.assertEqual(lazy.my_ooe.integer64, 64)
+        self.assertIsInstance(lazy.my_bonk, Bonk)
+
+    def test_truncated(self):
+        data = serialize(RandomStuff(a=1, myintlist=[1, 2, 3]), self.factory)
+        self.assertRaises(Exception, TLazyStruct, RandomStuff, data[:-3], self.factory)
+
+    def test_json_is_rejected(self):
+        data = serialize(Bonk(type=1), TJSONProtocolFactory())
+        self.assertRaises(TypeError, TLazyStruct, Bonk, data, TJSONProtocolFactory())
+
+
+class TestLazyBinary(LazyMixin, unittest.TestCase):
+    factory = TBinaryProtocolFactory()
+
+
+class TestLazyCompact(LazyMixin, unittest.TestCase):
+    factory = TCompactProtocolFactory()
+
+
+class TestLazyBinaryAccelerated(LazyMixin, unittest.TestCase):
+    factory = TBinaryProtocolAcceleratedFactory()
+
+
+class TestLazyCompactAccelerated(LazyMixin, unittest.TestCase):
+    factory = TCompactProtocolAcceleratedFactory()
+
+
+if __name__ == '__main__':
+    unittest.main()
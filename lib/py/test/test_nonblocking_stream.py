@@ -0,0 +1,128 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import threading
+import unittest
+
+import _import_local_thrift  # noqa
+from _test_types import NumericLists
+from thrift.Thrift import TMessageType, TSizedIterable
+from thrift.protocol.TBinaryProtocol import (TBinaryProtocolAcceleratedFactory,
+                                             TBinaryProtocolFactory)
+from thrift.protocol.TCompactProtocol import (TCompactProtocolAcceleratedFactory,
+                                              TCompactProtocolFactory)
+from thrift.server.TNonblockingServer import TNonblockingServer
+from thrift.transport import TSocket, TTransport
+
+
+class EchoProcessor(object):
+    """Replies to each message with the NumericLists it carries."""
+
+    def process(self, iprot, oprot):
+        (name, _, seqid) = iprot.readMessageBegin()
+        obj = NumericLists()
+        obj.read(iprot)
+        iprot.readMessageEnd()
+        oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+        obj.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+
+class NonblockingStreamMixin(object):
+    """Writes messages with TSizedIterable fields to a TNonblockingServer,
+    which takes each frame for a whole message."""
+
+    n = 5000
+
+    @classmethod
+    def setUpClass(cls):
+        lsocket = TSocket.TServerSocket(host='127.0.0.1', port=0)
+        cls.server = TNonblockingServer(EchoProcessor(), lsocket, cls.factory, threads=2)
+        cls.server.prepare()
+        cls.port = lsocket.handle.getsockname()[1]
+        cls.thread = threading.Thread(target=cls.server.serve)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join()
+        cls.server.close()
+
+    def _connect(self):
+        trans = TTransport.TFramedTransport(TSocket.TSocket('127.0.0.1', self.port))
+        trans.open()
+        self.addCleanup(trans.close)
+        return self.factory.getProtocol(trans)
+
+    def _send(self, prot, obj, seqid):
+        prot.writeMessageBegin('echo', TMessageType.CALL, seqid)
+        obj.write(prot)
+        prot.writeMessageEnd()
+        prot.trans.flush()
+
+    def _receive(self, prot, seqid):
+        self.assertEqual(prot.readMessageBegin(), ('echo', TMessageType.REPLY, seqid))
+        obj = NumericLists()
+        obj.read(prot)
+        prot.readMessageEnd()
+        return obj
+
+    def test_roundtrip(self):
+        n = self.n
+        prot = self._connect()
+        for seqid in range(3):
+            obj = NumericLists(ints=TSizedIterable(n, iter(range(n))),
+                               longs=TSizedIterable(2, iter([seqid, -seqid])))
+            self._send(prot, obj, seqid)
+            reply = self._receive(prot, seqid)
+            self.assertEqual(list(reply.ints), list(range(n)))
+            self.assertEqual(list(reply.longs), [seqid, -seqid])
+
+    def test_chunks_refused(self):
+        n = self.n
+        prot = self._connect()
+        obj = NumericLists(ints=TSizedIterable(n, iter(range(n)), chunk_size=100))
+        self.assertRaises(TTransport.TTransportException, self._send, prot, obj, 1)
+        # Nothing reached the server, which still serves whole frames.
+        prot = self._connect()
+        self._send(prot, NumericLists(ints=[1, 2, 3]), 2)
+        self.assertEqual(list(self._receive(prot, 2).ints), [1, 2, 3])
+
+
+class TestNonblockingBinary(NonblockingStreamMixin, unittest.TestCase):
+    factory = TBinaryProtocolFactory()
+
+
+class TestNonblockingBinaryAccelerated(NonblockingStreamMixin, unittest.TestCase):
+    factory = TBinaryProtocolAcceleratedFactory(fallback=False)
+
+
+class TestNonblockingCompact(NonblockingStreamMixin, unittest.TestCase):
+    factory = TCompactProtocolFactory()
+
+
+class TestNonblockingCompactAccelerated(NonblockingStreamMixin, unittest.TestCase):
+    factory = TCompactProtocolAcceleratedFactory(fallback=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
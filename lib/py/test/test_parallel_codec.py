@@ -0,0 +1,120 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import _import_local_thrift  # noqa
+from _test_types import Bonk, Empty, FrozenReordered, Reordered, Wrapper
+from test_codec import make_objects
+from thrift.TParallelCodec import TParallelCodec
+from thrift.TRecordFile import TRecordWriter
+from thrift.TSerialization import serialize_many
+from thrift.protocol.TBinaryProtocol import (TBinaryProtocolAcceleratedFactory,
+                                             TBinaryProtocolFactory)
+from thrift.protocol.TCompactProtocol import (TCompactProtocolAcceleratedFactory,
+                                              TCompactProtocolFactory)
+
+
+class ParallelCodecMixin(object):
+    @classmethod
+    def setUpClass(cls):
+        cls.codec = TParallelCodec(cls.factory, processes=2, chunk_size=7)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.codec.close()
+
+    def _bonks(self, n):
+        return [Bonk(type=i, message=u'x' * (i % 50)) for i in range(n)]
+
+    def test_serialize_many(self):
+        objs = make_objects() * 5
+        self.assertEqual(self.codec.serialize_many(objs), serialize_many(objs, self.factory))
+        self.assertEqual(self.codec.serialize_many([]), [])
+
+    def test_deserialize_many(self):
+        for n in (0, 1, 7, 50):
+            objs = self._bonks(n)
+            data = serialize_many(objs, self.factory)
+            self.assertEqual(self.codec.deserialize_many(Bonk, data), objs)
+            self.assertEqual(self.codec.deserialize_many(Bonk, iter(data)), objs)
+        frozen = [Wrapper(foo=Empty()), Wrapper()] * 5
+        data = serialize_many(frozen, self.factory)
+        self.assertEqual(self.codec.deserialize_many(Wrapper, data), frozen)
+
+    def test_out_of_order_fields(self):
+        objs = [Reordered(name=u'n%d' % i, id=i) for i in range(10)]
+        data = serialize_many(objs, self.factory)
+        result = self.codec.deserialize_many(Reordered, data)
+        self.assertEqual(result, objs)
+        self.assertEqual((result[3].name, result[3].id), (u'n3', 3))
+        frozen = [FrozenReordered(name=u'n%d' % i, id=i) for i in range(10)]
+        self.assertEqual(self.codec.serialize_many(frozen), data)
+        self.assertEqual(self.codec.deserialize_many(FrozenReordered, data), frozen)
+
+    def test_errors(self):
+        data = serialize_many(self._bonks(20), self.factory)
+        data[10] = data[10][:-1]
+        self.assertRaises(Exception, self.codec.deserialize_many, Bonk, data)
+        self.assertRaises(Exception, self.codec.serialize_many, self._bonks(10) + [object()])
+        # The pool stays usable.
+        self.assertEqual(self.codec.serialize_many(self._bonks(3)),
+                         serialize_many(self._bonks(3), self.factory))
+
+    def test_read_records(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            objs = self._bonks(30)
+            for index in (False, True):
+                path = os.path.join(tmp, 'records%d' % index)
+                with TRecordWriter(path, self.factory, block_size=4, index=index) as writer:
+                    for obj in objs:
+                        writer.write(obj)
+                self.assertEqual(self.codec.read_records(path, Bonk), objs)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_arguments(self):
+        self.assertRaises(ValueError, TParallelCodec, self.factory, chunk_size=0)
+
+
+class TestParallelBinary(ParallelCodecMixin, unittest.TestCase):
+    factory = TBinaryProtocolFactory()
+
+
+class TestParallelBinaryAccelerated(ParallelCodecMixin, unittest.TestCase):
+    factory = TBinaryProtocolAcceleratedFactory(fallback=False)
+
+
+class TestParallelCompact(ParallelCodecMixin, unittest.TestCase):
+    factory = TCompactProtocolFactory()
+
+
+class TestParallelCompactAccelerated(ParallelCodecMixin, unittest.TestCase):
+    factory = TCompactProtocolAcceleratedFactory(fallback=False)
+
+    def test_binary_views(self):
+        self.assertRaises(ValueError, TParallelCodec,
+                          TCompactProtocolAcceleratedFactory(binary_views=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import _import_local_thrift  # noqa
+from _test_types import Bonk, Empty, Wrapper
+from test_codec import make_objects
+from thrift.TRecordFile import TRecordReader, TRecordWriter
+from thrift.TSerialization import serialize
+from thrift.protocol.TBinaryProtocol import (TBinaryProtocolAcceleratedFactory,
+                                             TBinaryProtocolFactory)
+from thrift.protocol.TCompactProtocol import (TCompactProtocolAcceleratedFactory,
+                                              TCompactProtocolFactory)
+from thrift.protocol.TProtocol import TProtocolException
+from thrift.transport.TTransport import TTransportException
+
+
+class RecordFileMixin(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'records')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, objs, **kwargs):
+        with TRecordWriter(self.path, self.factory, **kwargs) as writer:
+            for obj in objs:
+                writer.write(obj)
+        self.assertEqual(len(writer), len(objs))
+
+    def _bonks(self, n):
+        return [Bonk(type=i, message=u'x' * (i % 300)) for i in range(n)]
+
+    def test_roundtrip(self):
+        objs = make_objects()
+        for varint_lengths in (False, True):
+            for block_size in (None, 1, 4):
+                for index in (False, True):
+                    self._write(objs, varint_lengths=varint_lengths, block_size=block_size,
+                                index=index)
+                    self.assertEqual(os.path.exists(self.path + '.idx'), index)
+                    with TRecordReader(self.path, objs[0].__class__, self.factory) as reader:
+                        self.assertEqual(len(reader), len(objs))
+                        records = list(reader.records())
+                        self.assertEqual([bytes(r) for r in records],
+                                         [serialize(obj, self.factory) for obj in objs])
+                        self.assertTrue(all(isinstance(r, memoryview) for r in records))
+                        del records
+                    for n, obj in enumerate(objs):
+                        with TRecordReader(self.path, obj.__class__, self.factory) as reader:
+                            self.assertEqual(reader[n], obj)
+                            self.assertEqual(reader[n - len(objs)], obj)
+                    if index:
+                        os.remove(self.path + '.idx')
+
+    def test_rewrite_without_index(self):
+        self._write(self._bonks(10), index=True)
+        objs = self._bonks(20)[10:]
+        self._write(objs)
+        self.assertFalse(os.path.exists(self.path + '.idx'))
+        with TRecordReader(self.path, Bonk, self.factory) as reader:
+            self.assertEqual(len(reader), len(objs))
+            self.assertEqual([reader[n] for n in range(len(objs))], objs)
+
+    def test_stale_index(self):
+        objs = self._bonks(10)
+        self._write(objs, block_size=4, index=True)
+        shutil.copy(self.path + '.idx', self.path + '.old')
+        # Different records, but as many of them
+        objs = self._bonks(30)[20:]
+        self._write(objs, varint_lengths=True)
+        for index in (b'', b'\0' * 8, b'TRIX' + b'\0' * 16, b'\0' * 64):
+            with open(self.path + '.idx', 'wb') as f:
+                f.write(index)
+            with TRecordReader(self.path, Bonk, self.factory) as reader:
+                self.assertEqual(len(reader), len(objs))
+                self.assertEqual(reader[-1], objs[-1])
+        shutil.copy(self.path + '.old', self.path + '.idx')
+        with TRecordReader(self.path, Bonk, self.factory) as reader:
+            self.assertEqual([reader[n] for n in range(len(objs))], objs)
+
+    def test_iterate_and_random_access(self):
+        objs = self._bonks(1000)
+        self._write(objs, varint_lengths=True, block_size=64, index=True)
+        with TRecordReader(self.path, Bonk, self.factory) as reader:
+            self.assertEqual(list(reader), objs)
+            self.assertEqual([reader[n] for n in (999, 0, 500, 63, 64)],
+                             [objs[n] for n in (999, 0, 500, 63, 64)])
+            self.assertRaises(IndexError, reader.record, 1000)
+
+    def test_frozen_records(self):
+        objs = [Wrapper(foo=Empty()), Wrapper()]
+        self._write(objs)
+        with TRecordReader(self.path, Wrapper, self.factory) as reader:
+            self.assertEqual(list(reader), objs)
+            self.assertEqual(reader[1], objs[1])
+
+    def test_checksum_mismatch(self):
+        objs = self._bonks(100)
+        self._write(objs, block_size=16, index=True)
+        with open(self.path, 'r+b') as f:
+            f.seek(-40, os.SEEK_END)
+            byte = f.read(1)
+            f.seek(-40, os.SEEK_END)
+            f.write(b'y' if byte != b'y' else b'z')
+        with TRecordReader(self.path, Bonk, self.factory) as reader:
+            self.assertRaises(TProtocolException, list, reader)
+            self.assertEqual(reader[0], objs[0])
+            self.assertRaises(TProtocolException, reader.record, 99)
+        with TRecordReader(self.path, Bonk, self.factory, verify=False) as reader:
+            self.assertEqual(len(list(reader.records())), 100)
+
+    def test_truncated(self):
+        self._write(self._bonks(10))
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with TRecordReader(self.path, Bonk, self.factory) as reader:
+            self.assertRaises(TTransportException, list, reader)
+        with open(self.path, 'wb') as f:
+            f.write(b'TRAC\x01\x00\x00\x00\x00\x00')
+        self.assertRaises(TProtocolException, TRecordReader, self.path, Bonk, self.factory)
+        for header in (b'', b'TRAC\x01'):
+            with open(self.path, 'wb') as f:
+                f.write(header)
+            self.assertRaises(TTransportException, TRecordReader, self.path, Bonk, self.factory)
+
+
+class TestBinary(RecordFileMixin, unittest.TestCase):
+    factory = TBinaryProtocolFactory()
+
+
+class TestBinaryAccelerated(RecordFileMixin, unittest.TestCase):
+    factory = TBinaryProtocolAcceleratedFactory()
+
+
+class TestCompact(RecordFileMixin, unittest.TestCase):
+    factory = TCompactProtocolFactory()
+
+
+class TestCompactAccelerated(RecordFileMixin, unittest.TestCase):
+    factory = TCompactProtocolAcceleratedFactory()
+
+
+if __name__ == '__main__':
+    unittest.main()
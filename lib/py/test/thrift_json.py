@@ -17,11 +17,13 @@
 # under the License.
 #
 
+import io
 import sys
 import unittest
 
 import _import_local_thrift  # noqa
 from thrift.protocol.TJSONProtocol import TJSONProtocol
+from thrift.protocol.TProtocol import TProtocolException
 from thrift.transport import TTransport
 
 #
@@ -46,5 +48,37 @@ class TestJSONString(unittest.TestCase):
             unicode_text = unicode_text.encode('utf8')
         self.assertEqual(protocol.readString(), unicode_text)
 
+    def _transports(self, data):
+        # Buffered and unbuffered transports, and buffers small enough to split escapes and UTF-8
+        # sequences across refills.
+        yield TTransport.TMemoryBuffer(data)
+        yield TTransport.TFileObjectTransport(io.BytesIO(data))
+        for size in (1, 2, 3, 7):
+            yield TTransport.TBufferedTransport(TTransport.TMemoryBuffer(data), size)
+
+    def test_strings_and_numbers(self):
+        text = u'plain \u00e9t\u00e9 \U0001D4AB "q" \\ /\n\t end'
+        json = (b'[1,"list",2,7,"plain \xc3\xa9t\\u00e9 \xf0\x9d\x92\xab \\"q\\" '
+                b'\\\\ \\/\\n\\t end",-12345678901,"",1.5e-3]tail')
+        if sys.version_info[0] == 2:
+            text = text.encode('utf8')
+        for trans in self._transports(json):
+            protocol = TJSONProtocol(trans)
+            self.assertEqual(protocol.readMessageBegin(), ('list', 2, 7))
+            self.assertEqual(protocol.readString(), text)
+            self.assertEqual(protocol.readI64(), -12345678901)
+            self.assertEqual(protocol.readString(), u'')
+            self.assertEqual(protocol.readDouble(), 1.5e-3)
+            protocol.readMessageEnd()
+            self.assertEqual(trans.readAll(4), b'tail')
+
+    def test_bad_strings(self):
+        for json in (b'"\\ud835x"', b'"\\ud835\\ud835"', b'"\\udcab"', b'"\\q"'):
+            for trans in self._transports(json):
+                self.assertRaises(TProtocolException, TJSONProtocol(trans).readString)
+        for trans in self._transports(b'"unterminated'):
+            self.assertRaises(EOFError, TJSONProtocol(trans).readString)
+
+
 if __name__ == '__main__':
     unittest.main()